@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
+
 import pytest
 
 
@@ -14,3 +16,27 @@ def clear_typed_config_caches():
     get_sandbox_config.cache_clear()
     get_model_config.cache_clear()
     get_agent_config.cache_clear()
+
+
+@pytest.fixture
+def query_budget():
+    """``with query_budget(4): ...`` fails the test if the block issues more statements.
+
+    ``max_repeats`` additionally bounds how often one statement fingerprint
+    may run, which is what an N+1 looks like regardless of table size.
+    """
+
+    from yudai.utils.query_stats import install_query_tracking, track_queries
+
+    install_query_tracking()
+
+    @contextmanager
+    def budget(max_queries: int, *, max_repeats: int | None = None):
+        with track_queries("test") as stats:
+            yield stats
+        if stats.count > max_queries:
+            pytest.fail(f"query budget of {max_queries} exceeded: {stats.describe()}")
+        if max_repeats is not None and stats.max_repeats > max_repeats:
+            pytest.fail(f"a statement repeated more than {max_repeats} times: {stats.describe()}")
+
+    return budget
@@ -0,0 +1,206 @@
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.realtime import agent_daemon  # noqa: E402
+from yudai.realtime.agent_daemon import (  # noqa: E402
+    AGENT_DAEMON_CLIENT_ENV,
+    AGENT_DAEMON_SOCKET_ENV,
+    agent_runner_shell_lines,
+)
+
+FAKE_MINI = """
+import os
+import sys
+import time
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["sleep"]:
+        with open(args[2], "w") as fh:
+            fh.write(str(os.getpid()))
+        time.sleep(float(args[1]))
+        return 0
+    print(f"cwd={os.getcwd()} token={os.environ.get('JOB_TOKEN')} args={' '.join(args)}")
+    print("to-stderr", file=sys.stderr)
+    sys.exit(int(os.environ.get("JOB_EXIT", "0")))
+"""
+
+CLIENT_PATH = str(Path(agent_daemon.__file__).resolve())
+
+
+@pytest.fixture()
+def daemon_socket():
+    root = Path(tempfile.mkdtemp(prefix="yad"))
+    (root / "fake_mini.py").write_text(FAKE_MINI, encoding="utf-8")
+    socket_path = root / "agent.sock"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "yudai.realtime.agent_daemon",
+            "serve",
+            "--socket",
+            str(socket_path),
+            "--program",
+            "mini=fake_mini:main",
+        ],
+        cwd=BACKEND_ROOT,
+        env={**os.environ, "PYTHONPATH": f"{root}{os.pathsep}{BACKEND_ROOT}"},
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while not socket_path.exists():
+            assert process.poll() is None, "agent daemon exited during start-up"
+            assert time.monotonic() < deadline, "agent daemon did not start"
+            time.sleep(0.05)
+        yield str(socket_path)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(root, ignore_errors=True)
+    assert not socket_path.exists()
+
+
+def _run_client(socket_path, *argv, env=None, cwd=None):
+    return subprocess.run(
+        [sys.executable, "-I", CLIENT_PATH, "run", "--socket", socket_path, "--", *argv],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+        cwd=cwd,
+        timeout=30,
+    )
+
+
+def test_daemon_runs_jobs_with_caller_stdio_env_and_exit_code(daemon_socket, tmp_path):
+    completed = _run_client(
+        daemon_socket,
+        "mini",
+        "-t",
+        "fix it",
+        env={"JOB_TOKEN": "abc", "JOB_EXIT": "3"},
+        cwd=tmp_path,
+    )
+
+    assert completed.returncode == 3
+    assert completed.stdout.strip() == f"cwd={tmp_path} token=abc args=-t fix it"
+    assert "to-stderr" in completed.stderr
+
+    marker = tmp_path / "unavailable"
+    rejected = subprocess.run(
+        [sys.executable, "-I", CLIENT_PATH, "run", "--socket", daemon_socket,
+         "--unavailable-marker", str(marker), "--", "not-mini"],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    assert rejected.returncode == agent_daemon.DAEMON_UNAVAILABLE_EXIT_CODE
+    assert "not-mini" in marker.read_text()
+
+
+def test_run_mini_shell_helper_falls_back_without_daemon(daemon_socket, tmp_path):
+    script = "\n".join(
+        [
+            f'python_bin="{sys.executable}"',
+            *agent_runner_shell_lines(),
+            "set +e",
+            'run_mini "$@"',
+        ]
+    )
+    base_env = {"JOB_TOKEN": "shell", AGENT_DAEMON_CLIENT_ENV: CLIENT_PATH}
+
+    via_daemon = subprocess.run(
+        ["bash", "-c", script, "run", "mini", "hello"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **base_env, AGENT_DAEMON_SOCKET_ENV: daemon_socket},
+        cwd=tmp_path,
+        timeout=30,
+    )
+    assert via_daemon.returncode == 0
+    assert "token=shell args=hello" in via_daemon.stdout
+
+    exits_tempfail = subprocess.run(
+        ["bash", "-c", script, "run", "mini", "once"],
+        capture_output=True,
+        text=True,
+        env={
+            **os.environ,
+            **base_env,
+            AGENT_DAEMON_SOCKET_ENV: daemon_socket,
+            "JOB_EXIT": str(agent_daemon.DAEMON_UNAVAILABLE_EXIT_CODE),
+        },
+        cwd=tmp_path,
+        timeout=30,
+    )
+    assert exits_tempfail.returncode == agent_daemon.DAEMON_UNAVAILABLE_EXIT_CODE
+    assert exits_tempfail.stdout.count("args=once") == 1
+
+    rejected = subprocess.run(
+        ["bash", "-c", script, "run", "echo", "rejected"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **base_env, AGENT_DAEMON_SOCKET_ENV: daemon_socket},
+        timeout=30,
+    )
+    assert rejected.returncode == 0
+    assert rejected.stdout == "rejected\n"
+
+    direct = subprocess.run(
+        ["bash", "-c", script, "run", "echo", "direct"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **base_env, AGENT_DAEMON_SOCKET_ENV: str(tmp_path / "missing.sock")},
+        timeout=30,
+    )
+    assert direct.returncode == 0
+    assert direct.stdout == "direct\n"
+
+
+def test_daemon_runs_jobs_concurrently_and_stops_abandoned_ones(daemon_socket, tmp_path):
+    started = time.monotonic()
+    clients = [
+        subprocess.Popen(
+            [sys.executable, "-I", CLIENT_PATH, "run", "--socket", daemon_socket, "--",
+             "mini", "sleep", "1", str(tmp_path / f"job{index}.pid")],
+        )
+        for index in range(2)
+    ]
+    assert [client.wait(timeout=30) for client in clients] == [0, 0]
+    assert time.monotonic() - started < 1.9
+
+    pid_file = tmp_path / "abandoned.pid"
+    client = subprocess.Popen(
+        [sys.executable, "-I", CLIENT_PATH, "run", "--socket", daemon_socket, "--",
+         "mini", "sleep", "30", str(pid_file)],
+    )
+    deadline = time.monotonic() + 10
+    while not pid_file.exists() or not pid_file.read_text():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    job_pid = int(pid_file.read_text())
+    client.kill()
+    client.wait(timeout=10)
+
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            os.kill(job_pid, 0)
+        except ProcessLookupError:
+            break
+        assert time.monotonic() < deadline, "abandoned agent job was not stopped"
+        time.sleep(0.05)
@@ -0,0 +1,230 @@
+import asyncio
+import os
+from pathlib import Path
+import socket
+import sys
+
+from fastapi.testclient import TestClient
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/browser-service-tests.db")
+
+from yudai.config import get_sandbox_config  # noqa: E402
+from yudai.realtime.browser_service import BrowserPool, DevServerSupervisor  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_dev_server_supervisor_reuses_until_watched_files_change(tmp_path):
+    (tmp_path / "package.json").write_text('{"scripts": {"dev": "serve"}}\n', encoding="utf-8")
+    port = _free_port()
+    command = f"{sys.executable} -m http.server {port} --bind 127.0.0.1"
+
+    async def _scenario():
+        supervisor = DevServerSupervisor(ready_timeout_seconds=20)
+        try:
+            started = await supervisor.ensure(workspace=str(tmp_path), command=command, port=port)
+            reused = await supervisor.ensure(workspace=str(tmp_path), command=command, port=port)
+            # Source edits are left to the dev server's own reload.
+            (tmp_path / "index.html").write_text("<h1>changed</h1>", encoding="utf-8")
+            reused_again = await supervisor.ensure(workspace=str(tmp_path), command=command, port=port)
+
+            package_json = tmp_path / "package.json"
+            package_json.write_text('{"scripts": {"dev": "serve --open"}}\n', encoding="utf-8")
+            os.utime(package_json, ns=(package_json.stat().st_atime_ns, package_json.stat().st_mtime_ns + 10**9))
+            restarted = await supervisor.ensure(workspace=str(tmp_path), command=command, port=port)
+            assert supervisor._locks == {}
+            return started, reused, reused_again, restarted
+        finally:
+            await supervisor.shutdown()
+
+    started, reused, reused_again, restarted = asyncio.run(_scenario())
+
+    assert started["status"] == "started"
+    assert (reused["status"], reused["pid"]) == ("reused", started["pid"])
+    assert (reused_again["status"], reused_again["reuse_count"]) == ("reused", 2)
+    assert restarted["status"] == "restarted"
+    assert restarted["reason"] == "watched files changed"
+    assert restarted["pid"] != started["pid"]
+
+
+def test_dev_server_start_in_one_workspace_does_not_block_another(tmp_path):
+    slow_workspace = tmp_path / "slow"
+    fast_workspace = tmp_path / "fast"
+    slow_workspace.mkdir()
+    fast_workspace.mkdir()
+    port = _free_port()
+    command = f"{sys.executable} -m http.server {port} --bind 127.0.0.1"
+
+    async def _scenario():
+        supervisor = DevServerSupervisor(ready_timeout_seconds=20)
+        slow = asyncio.create_task(
+            supervisor.ensure(workspace=str(slow_workspace), command="sleep 30", port=_free_port())
+        )
+        try:
+            await asyncio.sleep(0.2)
+            return await asyncio.wait_for(
+                supervisor.ensure(workspace=str(fast_workspace), command=command, port=port),
+                timeout=10,
+            )
+        finally:
+            slow.cancel()
+            await asyncio.gather(slow, return_exceptions=True)
+            await supervisor.shutdown()
+
+    fast = asyncio.run(_scenario())
+
+    assert fast["status"] == "started"
+
+
+def test_browser_endpoints_report_unavailable_browser_and_failed_dev_server(tmp_path, monkeypatch):
+    from yudai.run_sandbox_server import app
+
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    monkeypatch.setattr(sys.modules["yudai.realtime.browser_service"], "_browser_service_singleton", None)
+    monkeypatch.setitem(sys.modules, "playwright", None)
+    monkeypatch.setenv("REALTIME_WORKSPACE_PATH", str(tmp_path))
+    get_sandbox_config.cache_clear()
+    client = TestClient(app)
+
+    capture = client.post(
+        "/internal/browser/capture",
+        json={"url": "http://127.0.0.1:5173/", "screenshot_path": "shot.png", "workspace": str(tmp_path)},
+    )
+    assert capture.status_code == 503
+
+    failed = client.post(
+        "/internal/browser/dev-server",
+        json={"command": "echo boom; exit 3", "port": _free_port(), "workspace": str(tmp_path)},
+    )
+    assert failed.status_code == 502
+    assert "boom" in failed.json()["detail"]
+
+
+class _DevServerBroker:
+    def __init__(self):
+        self.calls = []
+
+    async def ensure_browser_dev_server(self, db, *, session, command, port, workspace=None, **kwargs):
+        self.calls.append((command, port, workspace))
+        return {"status": "reused", "command": command, "port": port, "url": f"http://127.0.0.1:{port}"}
+
+
+def test_browser_check_reuses_previous_dev_server():
+    from yudai.realtime.mode_orchestrator import SessionExecutionOrchestrator
+
+    broker = _DevServerBroker()
+    orchestrator = SessionExecutionOrchestrator(broker=broker, lifecycle=object(), ws_hub=object(), session_locks=object())
+    session = type("Session", (), {"session_id": "s", "mode_metadata": {}})()
+
+    assert asyncio.run(orchestrator._reuse_browser_dev_server(None, session=session, workspace="/workspace/repo")) is None
+
+    session.mode_metadata = {
+        "browser_check": {"route": "http://127.0.0.1:5173/settings", "dev_server_command": "npm run dev", "dev_server_port": None}
+    }
+    parser = orchestrator._new_browser_check_parser()
+    parser.feed_text('{"mode": "browser_check", "route": "http://127.0.0.1:5173/settings", "dev_server_command": "npm run dev"}\n')
+    summary_fields = orchestrator._browser_check_fields_from_parser(parser)
+    assert summary_fields["dev_server_port"] == 5173
+    session.mode_metadata["browser_check"]["dev_server_port"] = summary_fields["dev_server_port"]
+
+    dev_server = asyncio.run(orchestrator._reuse_browser_dev_server(None, session=session, workspace="/workspace/repo"))
+    assert broker.calls == [("npm run dev", 5173, "/workspace/repo")]
+    assert dev_server["route"] == "http://127.0.0.1:5173/settings"
+
+
+class _FakePage:
+    def __init__(self):
+        self.calls = []
+        self.listeners = {}
+
+    def is_closed(self):
+        return False
+
+    def on(self, event, handler):
+        self.listeners[event] = handler
+
+    def remove_listener(self, event, handler):
+        assert self.listeners.pop(event) is handler
+
+    async def goto(self, url, **kwargs):
+        self.calls.append(("goto", url))
+        return type("Response", (), {"status": 200})() if url != "about:blank" else None
+
+    async def screenshot(self, *, path, full_page):
+        Path(path).write_bytes(b"\x89PNG")
+
+    async def title(self):
+        return "Preview"
+
+    async def evaluate(self, script):
+        self.calls.append(("evaluate", script))
+
+    async def set_viewport_size(self, size):
+        self.calls.append(("viewport", size))
+
+
+class _FakeContext:
+    def __init__(self):
+        self.page = _FakePage()
+        self.cookies_cleared = 0
+        self.closed = False
+
+    async def new_page(self):
+        return self.page
+
+    async def clear_cookies(self):
+        self.cookies_cleared += 1
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeBrowser:
+    def __init__(self):
+        self.contexts = []
+
+    def is_connected(self):
+        return True
+
+    async def new_context(self, **kwargs):
+        self.contexts.append(_FakeContext())
+        return self.contexts[-1]
+
+
+def test_browser_pool_reuses_page_and_resets_it_between_captures(tmp_path):
+    pool = BrowserPool(size=1)
+    browser = _FakeBrowser()
+    pool._browser = browser
+
+    async def _scenario():
+        first = await pool.capture(url="http://127.0.0.1:5173/", screenshot_path=str(tmp_path / "one.png"))
+        second = await pool.capture(
+            url="http://127.0.0.1:5173/about", screenshot_path=str(tmp_path / "two.png"), viewport=(800, 600)
+        )
+        return first, second
+
+    first, second = asyncio.run(_scenario())
+
+    assert (first["page_reused"], second["page_reused"]) == (False, True)
+    assert len(browser.contexts) == 1
+    context = browser.contexts[0]
+    assert context.cookies_cleared == 2
+    assert [call[0] for call in context.page.calls] == [
+        "goto",
+        "evaluate",
+        "goto",
+        "viewport",
+        "goto",
+        "evaluate",
+        "goto",
+    ]
+    assert context.page.calls[2] == ("goto", "about:blank")
+    assert context.page.listeners == {}
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/code-index-tests.db")
+
+from yudai.daifuUserAgent.context_probe import ContextProbeService, ProbeRequest  # noqa: E402
+from yudai.daifuUserAgent.probe_cache import ProbeCache  # noqa: E402
+from yudai.daifuUserAgent.probe_fast_path import IndexLookup, classify_probe_query  # noqa: E402
+from yudai.realtime.code_index import CodeIndex  # noqa: E402
+
+
+def _workspace(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "app" / "api").mkdir(parents=True)
+    (repo / "web" / "src").mkdir(parents=True)
+    (repo / "app" / "scheduler.py").write_text(
+        "MAX_SLOTS = 4\n\n\nclass JobScheduler:\n    async def acquire(self):\n        return MAX_SLOTS\n",
+        encoding="utf-8",
+    )
+    (repo / "app" / "api" / "routes.py").write_text(
+        "from fastapi import APIRouter\n"
+        "from ..scheduler import JobScheduler\n\n"
+        "router = APIRouter()\n\n\n"
+        '@router.get("/jobs")\n'
+        "def list_jobs():\n"
+        "    return JobScheduler()\n",
+        encoding="utf-8",
+    )
+    (repo / "web" / "src" / "client.ts").write_text(
+        "import { request } from './http';\n"
+        "export async function fetchJobs(): Promise<string[]> {\n"
+        "  return request('/jobs');\n"
+        "}\n",
+        encoding="utf-8",
+    )
+    subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+    return repo
+
+
+def test_code_index_answers_lookups_and_refreshes_incrementally(tmp_path):
+    repo = _workspace(tmp_path)
+    index = CodeIndex(str(repo))
+    assert index.refresh()
+
+    definition = index.query("definition", "JobScheduler.acquire")
+    assert [(m["path"], m["line"], m["symbol_kind"]) for m in definition["matches"]] == [
+        ("app/scheduler.py", 5, "function")
+    ]
+    importers = index.query("importers", "app/scheduler.py")
+    assert [m["path"] for m in importers["matches"]] == ["app/api/routes.py"]
+    routes = index.query("routes")
+    assert [m["text"] for m in routes["matches"]] == ["GET /jobs"]
+    references = index.query("references", "JobScheduler")
+    assert {m["path"] for m in references["matches"]} == {"app/api/routes.py", "app/scheduler.py"}
+    assert index.query("definition", "fetchJobs")["matches"][0]["path"] == "web/src/client.ts"
+
+    generation = index.generation
+    assert index.refresh()
+    assert index.generation == generation
+
+    (repo / "app" / "api" / "routes.py").unlink()
+    (repo / "app" / "workers.py").write_text("def run_worker():\n    pass\n", encoding="utf-8")
+    assert index.refresh()
+    assert index.generation == generation + 1
+    assert index.query("routes")["matches"] == []
+    assert index.query("definition", "run_worker")["matches"][0]["path"] == "app/workers.py"
+
+
+def test_sandbox_index_endpoint_queries_workspace(tmp_path, monkeypatch):
+    from yudai.run_sandbox_server import app
+
+    from yudai.config import get_sandbox_config
+
+    repo = _workspace(tmp_path)
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    monkeypatch.setenv("REALTIME_WORKSPACE_PATH", str(tmp_path))
+    get_sandbox_config.cache_clear()
+    client = TestClient(app)
+    response = client.post(
+        "/internal/index/query",
+        json={"kind": "definition", "term": "list_jobs", "workspace": str(repo)},
+    )
+    assert response.status_code == 200
+    assert response.json()["matches"][0]["path"] == "app/api/routes.py"
+
+    missing = client.post(
+        "/internal/index/query",
+        json={"kind": "routes", "workspace": str(tmp_path / "absent")},
+    )
+    assert missing.status_code == 404
+
+
+class _IndexBroker:
+    def __init__(self, matches):
+        self.matches = matches
+        self.commands = 0
+
+    async def query_code_index(self, db, *, session, kind, term, **kwargs):
+        return {"kind": kind, "term": term, "matches": self.matches, "truncated": False}
+
+    async def run_command(self, db, *, session, command, **kwargs):
+        self.commands += 1
+        return {"exit_code": 1, "stdout": "", "stderr": "agent unavailable"}
+
+
+def test_probe_fast_path_answers_lookups_without_the_agent(monkeypatch):
+    monkeypatch.setattr(ContextProbeService, "has_active_sandbox", staticmethod(lambda db, session: True))
+    session = type("Session", (), {"runtime_workspace_path": None, "session_id": "s"})()
+    broker = _IndexBroker([{"path": "app/scheduler.py", "line": 4, "symbol": "JobScheduler", "symbol_kind": "class"}])
+    service = ContextProbeService(broker, cache=ProbeCache(ttl_seconds=0, max_entries=0))
+
+    result = asyncio.run(
+        service.run_probe(None, session=session, probe=ProbeRequest("probe_1", "Where is `JobScheduler` defined?"))
+    )
+
+    assert broker.commands == 0
+    assert result.from_index and result.status == "completed"
+    assert result.files == ["app/scheduler.py"]
+    assert "app/scheduler.py:4" in result.output_text
+    assert "code index" in ContextProbeService.format_as_context([result])
+    assert classify_probe_query("Which files import sandbox_scheduler?") == IndexLookup("importers", "sandbox_scheduler")
+    assert classify_probe_query("Where is the auth logic handled?") is None
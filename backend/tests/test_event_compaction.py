@@ -0,0 +1,191 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/event-compaction-tests.db")
+
+from yudai.models import (  # noqa: E402
+    AgentExecution,
+    Base,
+    ChatSession,
+    SandboxExecutionEvent,
+    SandboxExecutionEventSegment,
+    SandboxExecutionRun,
+    User,
+)
+from yudai.realtime.event_compaction import (  # noqa: E402
+    SEQUENCE_INDEX_STRIDE,
+    compact_finished_runs,
+    compact_run_events,
+    iter_segment_events,
+)
+from yudai.utils import utc_now  # noqa: E402
+
+
+def _seed(db, *, completed: bool, events: int) -> ChatSession:
+    user = User(github_username="compact", github_user_id="9301", email="compact@example.com")
+    db.add(user)
+    db.flush()
+    session = ChatSession(
+        user_id=user.id,
+        session_id="session_compaction",
+        title="Compaction",
+        repo_owner="octocat",
+        repo_name="yudaiv3",
+        repo_branch="main",
+        is_active=True,
+        total_messages=0,
+        total_tokens=0,
+    )
+    db.add(session)
+    db.flush()
+    db.add(AgentExecution(id="exec_compact", session_id=session.id, mode="coder", status="running"))
+    now = utc_now()
+    db.add(
+        SandboxExecutionRun(
+            controller_job_id="ctrljob_compact",
+            sandbox_job_id="sbjob_compact",
+            session_id=session.id,
+            mode_execution_id="exec_compact",
+            status="complete" if completed else "running",
+            started_at=now - timedelta(minutes=5),
+            completed_at=now - timedelta(minutes=1) if completed else None,
+        )
+    )
+    for sequence in range(1, events + 1):
+        db.add(
+            SandboxExecutionEvent(
+                controller_job_id="ctrljob_compact",
+                sandbox_job_id="sbjob_compact",
+                session_id=session.id,
+                mode_execution_id="exec_compact",
+                sequence=sequence,
+                stream="sandbox",
+                event="heartbeat" if sequence % 10 == 0 else "stdout",
+                data=None if sequence % 10 == 0 else f"line {sequence}\n",
+                event_metadata={"exit_code": None, "pid": 42, "command": None},
+            )
+        )
+    db.commit()
+    return session
+
+
+def _session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'compaction.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def test_compaction_folds_finished_job_into_one_segment_without_heartbeats(tmp_path):
+    db = _session_factory(tmp_path)()
+    try:
+        _seed(db, completed=True, events=700)
+
+        assert compact_finished_runs(db, grace_seconds=30) == 1
+        assert compact_finished_runs(db, grace_seconds=30) == 0
+
+        assert db.query(SandboxExecutionEvent).count() == 0
+        segment = db.query(SandboxExecutionEventSegment).one()
+        assert (segment.first_sequence, segment.last_sequence) == (1, 699)
+        assert (segment.event_count, segment.dropped_count) == (630, 70)
+        assert len(segment.payload) < segment.raw_bytes / 4
+        assert len(segment.sequence_index) == -(-630 // SEQUENCE_INDEX_STRIDE)
+
+        events = list(iter_segment_events(segment))
+        assert [event.sequence for event in events] == [n for n in range(1, 700) if n % 10]
+        assert events[0].data == "line 1\n"
+        assert events[0].event_metadata == {"exit_code": None, "pid": 42, "command": None}
+        assert events[0].created_at is not None
+
+        tail = list(iter_segment_events(segment, after_sequence=600))
+        assert [event.sequence for event in tail] == [n for n in range(601, 700) if n % 10]
+
+        newest = list(iter_segment_events(segment, last=300))
+        assert [event.sequence for event in newest] == [n for n in range(1, 700) if n % 10][-300:]
+        assert [event.sequence for event in iter_segment_events(segment, after_sequence=650, last=300)] == [
+            n for n in range(651, 700) if n % 10
+        ]
+    finally:
+        db.close()
+
+
+def test_compaction_skips_running_jobs_and_recent_completions(tmp_path):
+    db = _session_factory(tmp_path)()
+    try:
+        _seed(db, completed=False, events=5)
+        assert compact_finished_runs(db, grace_seconds=0) == 0
+
+        run = db.query(SandboxExecutionRun).one()
+        run.completed_at = utc_now()
+        db.commit()
+        assert compact_finished_runs(db, grace_seconds=600) == 0
+        assert db.query(SandboxExecutionEvent).count() == 5
+    finally:
+        db.close()
+
+
+def test_late_rows_fold_into_a_new_segment_without_redelivered_sequences(tmp_path):
+    db = _session_factory(tmp_path)()
+    try:
+        session = _seed(db, completed=True, events=5)
+        assert compact_finished_runs(db, grace_seconds=30) == 1
+
+        for sequence in (1, 6, 7):
+            db.add(
+                SandboxExecutionEvent(
+                    controller_job_id="ctrljob_compact",
+                    sandbox_job_id="sbjob_compact",
+                    session_id=session.id,
+                    mode_execution_id="exec_compact",
+                    sequence=sequence,
+                    stream="sandbox",
+                    event="stdout",
+                    data=f"late {sequence}\n",
+                )
+            )
+        db.commit()
+
+        assert compact_finished_runs(db, grace_seconds=30) == 1
+        assert db.query(SandboxExecutionEvent).count() == 0
+        segments = db.query(SandboxExecutionEventSegment).order_by(SandboxExecutionEventSegment.first_sequence).all()
+        assert [(segment.first_sequence, segment.last_sequence) for segment in segments] == [(1, 5), (6, 7)]
+        assert [event.data for event in iter_segment_events(segments[0])][0] == "line 1\n"
+
+        db.add(
+            SandboxExecutionEvent(
+                controller_job_id="ctrljob_compact",
+                sandbox_job_id="sbjob_compact",
+                session_id=session.id,
+                mode_execution_id="exec_compact",
+                sequence=6,
+                stream="sandbox",
+                event="stdout",
+                data="late 6\n",
+            )
+        )
+        db.commit()
+        assert compact_run_events(db, "ctrljob_compact")
+        assert db.query(SandboxExecutionEvent).count() == 0
+        assert db.query(SandboxExecutionEventSegment).count() == 2
+    finally:
+        db.close()
+
+
+def test_lost_compaction_race_is_not_counted(tmp_path, monkeypatch):
+    from yudai.realtime import event_compaction
+
+    db = _session_factory(tmp_path)()
+    try:
+        _seed(db, completed=True, events=5)
+        monkeypatch.setattr(event_compaction, "compact_run_events", lambda db, job_id: False)
+        assert compact_finished_runs(db, grace_seconds=30) == 0
+    finally:
+        db.close()
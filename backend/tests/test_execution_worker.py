@@ -74,7 +74,9 @@ def test_worker_claims_one_queued_execution_once(tmp_path, monkeypatch):
         assert claimed is not None
         assert claimed.id == "exec_worker_claim"
         assert claimed.status == "running"
-        assert claimed.execution_metadata["claimed_at"]
+        assert claimed.claimed_at is not None
+        assert claimed.claimed_by == worker.worker_id
+        assert claimed.lease_id
 
         db.expire_all()
         session_row = db.query(ChatSession).filter(ChatSession.id == session.id).one()
@@ -228,3 +230,147 @@ def test_worker_run_once_dispatches_claimed_pipeline(tmp_path, monkeypatch):
     assert captured["execution_id"] == "exec_worker_run"
     assert captured["objective"] == "Fix auth race"
     assert captured["max_modes"] == 1
+
+
+def test_worker_batch_heartbeat_cancels_execution_with_lost_lease(tmp_path, monkeypatch):
+    db_path = tmp_path / "worker-heartbeat.db"
+    engine = create_engine(f"sqlite:///{db_path}")
+    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(execution_worker_module, "SessionLocal", SessionLocal)
+
+    db = SessionLocal()
+    try:
+        user = User(
+            github_username="worker-heartbeat",
+            github_user_id="9105",
+            email="worker-heartbeat@example.com",
+            display_name="Worker Heartbeat Test",
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        session = ChatSession(
+            user_id=user.id,
+            session_id="session_worker_heartbeat",
+            title="Worker Heartbeat",
+            repo_owner="octocat",
+            repo_name="yudaiv3",
+            repo_branch="main",
+            is_active=True,
+            total_messages=0,
+            total_tokens=0,
+            mode_metadata={},
+        )
+        db.add(session)
+        db.flush()
+        db.add(
+            AgentExecution(
+                id="exec_worker_heartbeat",
+                session_id=session.id,
+                mode="architect",
+                status=SessionModeStatus.QUEUED.value,
+                execution_plan=["Run Architect"],
+                execution_metadata={"user_id": user.id, "objective": "Fix login"},
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    worker = ExecutionWorker()
+    worker.heartbeat_seconds = 0.05
+    observed = {}
+
+    class DummyOrchestrator:
+        async def run_full_pipeline(self, **kwargs):
+            check = SessionLocal()
+            try:
+                lease = check.query(AgentExecutionLease).one()
+                observed["renewed"] = worker.heartbeat_leases([lease.lease_id, "lease_missing"])
+                lease.released_at = utc_now()
+                lease.release_reason = "expired"
+                check.commit()
+            finally:
+                check.close()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                observed["cancelled"] = True
+                raise
+
+    monkeypatch.setattr(
+        execution_worker_module,
+        "get_session_execution_orchestrator",
+        lambda: DummyOrchestrator(),
+    )
+
+    claimed_id = asyncio.run(asyncio.wait_for(worker.run_once(), timeout=2))
+
+    assert claimed_id == "exec_worker_heartbeat"
+    assert len(observed["renewed"]) == 1
+    assert observed["cancelled"] is True
+    assert worker._held_leases == {}
+
+
+def test_requeue_expired_leases_loads_executions_in_one_query(tmp_path, monkeypatch, query_budget):
+    engine = create_engine(f"sqlite:///{tmp_path / 'worker-requeue-batch.db'}")
+    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(execution_worker_module, "SessionLocal", SessionLocal)
+
+    db = SessionLocal()
+    try:
+        user = User(github_username="requeue", github_user_id="9106", email="requeue@example.com")
+        db.add(user)
+        db.flush()
+        now = utc_now()
+        for index in range(4):
+            session = ChatSession(
+                user_id=user.id,
+                session_id=f"session_requeue_{index}",
+                title="Requeue",
+                repo_owner="octocat",
+                repo_name="yudaiv3",
+                repo_branch="main",
+                is_active=True,
+                total_messages=0,
+                total_tokens=0,
+                mode_metadata={"active_execution": {"execution_id": f"exec_requeue_{index}", "status": "running"}},
+            )
+            db.add(session)
+            db.flush()
+            db.add(
+                AgentExecution(
+                    id=f"exec_requeue_{index}",
+                    session_id=session.id,
+                    mode="architect",
+                    status=SessionModeStatus.RUNNING.value,
+                    execution_metadata={"user_id": user.id},
+                )
+            )
+            db.add(
+                AgentExecutionLease(
+                    lease_id=f"lease_requeue_{index}",
+                    execution_id=f"exec_requeue_{index}",
+                    worker_id="old-worker",
+                    lease_token="token",
+                    attempt=1,
+                    acquired_at=now - timedelta(minutes=10),
+                    heartbeat_at=now - timedelta(minutes=10),
+                    expires_at=now - timedelta(minutes=5),
+                )
+            )
+        db.commit()
+        db.expire_all()
+
+        with query_budget(5, max_repeats=1):
+            ExecutionWorker()._requeue_expired_leases(db)
+
+        db.expire_all()
+        statuses = {row.status for row in db.query(AgentExecution).all()}
+        assert statuses == {SessionModeStatus.QUEUED.value}
+        sessions = db.query(ChatSession).all()
+        assert all(row.mode_metadata["active_execution"]["status"] == "queued" for row in sessions)
+    finally:
+        db.close()
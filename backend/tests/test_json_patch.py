@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/json-patch-tests.db")
+
+from yudai.db.json_patch import patch_json, patch_json_rows  # noqa: E402
+from yudai.models import Base, ChatSession, User  # noqa: E402
+
+
+def _session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'json-patch.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    db = factory()
+    user = User(github_username="patch", github_user_id="9401", email="patch@example.com")
+    db.add(user)
+    db.flush()
+    for index in range(2):
+        db.add(
+            ChatSession(
+                user_id=user.id,
+                session_id=f"session_patch_{index}",
+                title="Patch",
+                repo_owner="octocat",
+                repo_name="yudaiv3",
+                repo_branch="main",
+                is_active=True,
+                total_messages=0,
+                total_tokens=0,
+                mode_metadata={"active_execution": {"execution_id": "exec_1", "status": "queued"}, "notes": [1]},
+            )
+        )
+    db.commit()
+    db.close()
+    return factory
+
+
+def test_concurrent_patches_to_different_keys_are_both_kept(tmp_path):
+    factory = _session_factory(tmp_path)
+    first, second = factory(), factory()
+    try:
+        stale = second.query(ChatSession).filter(ChatSession.session_id == "session_patch_0").one()
+        fresh = first.query(ChatSession).filter(ChatSession.session_id == "session_patch_0").one()
+
+        patch_json(fresh, "mode_metadata", {"cancel_requested": True}, path="active_execution")
+        first.commit()
+        patch_json(stale, "mode_metadata", {"status": "running"}, path="active_execution")
+        patch_json(stale, "mode_metadata", {"contract_version": 2}, path="workflow_contracts", remove=["missing"])
+        patch_json(stale, "mode_metadata", remove=["notes"])
+        assert stale not in second.dirty
+        second.commit()
+
+        reader = factory()
+        stored = reader.query(ChatSession).filter(ChatSession.session_id == "session_patch_0").one().mode_metadata
+        reader.close()
+        assert stored == {
+            "active_execution": {"execution_id": "exec_1", "status": "running", "cancel_requested": True},
+            "workflow_contracts": {"contract_version": 2},
+        }
+    finally:
+        first.close()
+        second.close()
+
+
+def test_patch_json_rows_updates_many_rows_and_columns_in_one_statement(tmp_path):
+    factory = _session_factory(tmp_path)
+    db = factory()
+    try:
+        sessions = db.query(ChatSession).order_by(ChatSession.id).all()
+        patch_json_rows(sessions, "mode_metadata", {"status": "queued"}, path="active_execution", values={"mode_status": "queued"})
+        db.commit()
+
+        db.expire_all()
+        for session in db.query(ChatSession):
+            assert session.mode_status == "queued"
+            assert session.mode_metadata["active_execution"] == {"execution_id": "exec_1", "status": "queued"}
+            assert session.mode_metadata["notes"] == [1]
+    finally:
+        db.close()
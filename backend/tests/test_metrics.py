@@ -0,0 +1,127 @@
+import asyncio
+import os
+from pathlib import Path
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine, text
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/metrics-tests.db")
+
+from yudai.utils.metrics import (  # noqa: E402
+    DB_QUERY_SECONDS,
+    HTTP_REQUEST_SECONDS,
+    MetricsMiddleware,
+    MetricsRegistry,
+    metrics_authorized,
+    router as metrics_router,
+)
+from yudai.utils.query_stats import instrument_engine  # noqa: E402
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    latency = registry.histogram("t_latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    jobs = registry.counter("t_jobs", "Jobs.", ("kind",))
+    latency.labels('/a/"{id}"').observe(0.05)
+    latency.labels('/a/"{id}"').observe(0.5)
+    latency.labels('/a/"{id}"').observe(5)
+    jobs.labels("probe").inc(3)
+
+    rendered = registry.render()
+
+    assert "# TYPE t_latency_seconds histogram" in rendered
+    assert 't_latency_seconds_bucket{route="/a/\\"{id}\\"",le="0.1"} 1' in rendered
+    assert 't_latency_seconds_bucket{route="/a/\\"{id}\\"",le="1"} 2' in rendered
+    assert 't_latency_seconds_bucket{route="/a/\\"{id}\\"",le="+Inf"} 3' in rendered
+    assert 't_latency_seconds_count{route="/a/\\"{id}\\""} 3' in rendered
+    assert 't_jobs_total{kind="probe"} 3' in rendered
+    assert metrics_authorized(None, None)
+    assert not metrics_authorized("Bearer nope", "secret")
+    assert metrics_authorized("Bearer secret", "secret")
+
+
+def test_metric_base_is_abstract_and_router_awaits_refreshers(monkeypatch):
+    from yudai.utils import metrics as metrics_module
+
+    with pytest.raises(TypeError):
+        metrics_module._Metric("t_abstract", "Abstract.")
+
+    registry = MetricsRegistry()
+    gauge = registry.gauge("t_refreshed", "Set by a refresher.")
+
+    async def _refresh():
+        gauge.set(7)
+
+    async def _broken():
+        raise RuntimeError("database unreachable")
+
+    registry.add_refresher("gauge", _refresh)
+    registry.add_refresher("broken", _broken)
+    monkeypatch.setattr(metrics_module, "REGISTRY", registry)
+    monkeypatch.delenv("YUDAI_METRICS_TOKEN", raising=False)
+    app = FastAPI()
+    app.include_router(metrics_router)
+
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert "t_refreshed 7" in response.text
+
+
+def test_middleware_labels_route_templates_and_engine_times_statements():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: str):
+        return {"id": item_id}
+
+    client = TestClient(MetricsMiddleware(app, service="unit"))
+    before = HTTP_REQUEST_SECONDS.labels("unit", "GET", "/items/{item_id}", 200).count
+    for item_id in ("a", "b", "c"):
+        assert client.get(f"/items/{item_id}").status_code == 200
+    assert client.get("/nowhere").status_code == 404
+
+    assert HTTP_REQUEST_SECONDS.labels("unit", "GET", "/items/{item_id}", 200).count == before + 3
+    assert HTTP_REQUEST_SECONDS.labels("unit", "GET", "<unmatched>", 404).count >= 1
+
+    engine = create_engine("sqlite:///:memory:")
+    instrument_engine(engine)
+    instrument_engine(engine)
+    selects = DB_QUERY_SECONDS.labels("SELECT").count
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert DB_QUERY_SECONDS.labels("SELECT").count == selects + 1
+
+
+def test_sandbox_metrics_endpoint_reports_scheduler_state(monkeypatch):
+    import yudai.realtime.sandbox_scheduler as scheduler_module
+    from yudai.run_sandbox_server import app
+
+    monkeypatch.delenv("YUDAI_METRICS_TOKEN", raising=False)
+    monkeypatch.setattr(scheduler_module, "_sandbox_job_scheduler_singleton", None)
+    scheduler = scheduler_module.get_sandbox_job_scheduler()
+
+    async def _hold_slot():
+        return await scheduler.acquire(scheduler_module.JOB_CLASS_PROBE)
+
+    asyncio.run(_hold_slot())
+    client = TestClient(app)
+    client.get("/healthz")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'yudai_sandbox_jobs_running{job_class="probe"} 1' in response.text
+    assert 'yudai_http_request_duration_seconds_count{service="sandbox",method="GET",route="/healthz",status="200"}' in response.text
+
+    monkeypatch.setenv("YUDAI_METRICS_TOKEN", "scrape-token")
+    scheduler_module.get_sandbox_config.cache_clear()
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-token"}).status_code == 200
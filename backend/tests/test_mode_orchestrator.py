@@ -405,7 +405,9 @@ def test_browser_check_mocked_broker_success_persists_artifact_and_context(tmp_p
             return db.query(Sandbox).filter(Sandbox.id == sandbox_id).one()
 
     class DummyBroker:
-        async def run_command(self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None):
+        async def run_command(
+            self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None, job_class="agent"
+        ):
             if on_event:
                 await on_event(
                     {
@@ -446,7 +448,7 @@ def test_browser_check_mocked_broker_success_persists_artifact_and_context(tmp_p
     async def _healthy(*_args, **_kwargs):
         return None
 
-    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_healthcheck", _healthy)
+    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_ready", _healthy)
     db = SessionLocal()
     try:
         user = User(
@@ -562,7 +564,9 @@ def test_browser_check_mocked_broker_failure_does_not_terminate_sandbox(tmp_path
             return db.query(Sandbox).filter(Sandbox.id == sandbox_id).one()
 
     class DummyBroker:
-        async def run_command(self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None):
+        async def run_command(
+            self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None, job_class="agent"
+        ):
             return {
                 "sandbox_id": "sbx_browser_failure",
                 "exit_code": 7,
@@ -574,7 +578,7 @@ def test_browser_check_mocked_broker_failure_does_not_terminate_sandbox(tmp_path
     async def _healthy(*_args, **_kwargs):
         return None
 
-    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_healthcheck", _healthy)
+    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_ready", _healthy)
     db = SessionLocal()
     try:
         user = User(
@@ -774,13 +778,15 @@ class ContractBroker:
     def __init__(self, *, architect_ready=True):
         self.architect_ready = architect_ready
         self.mode_calls = []
-        self.summary_commands = 0
+        self.summary_writes = []
 
-    async def run_command(self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None):
-        if "summary_path" in command:
-            self.summary_commands += 1
-            return {"sandbox_id": "sbx_contract", "exit_code": 0, "stdout": "", "stderr": "", "duration_ms": 1}
+    async def write_file(self, db, *, session, path, data, workspace=None, timeout_seconds=30.0):
+        self.summary_writes.append((path, json.loads(data)))
+        return {"path": path, "bytes": len(data), "sha256": ""}
 
+    async def run_command(
+        self, db, *, session, command, cwd=None, env=None, timeout_seconds=1800, on_event=None, job_class="agent"
+    ):
         if 'mode_name="architect"' in command:
             self.mode_calls.append("architect")
             payload = {
@@ -857,7 +863,7 @@ def test_architect_completion_creates_tester_stage_gate(tmp_path, monkeypatch):
     async def _healthy(*_args, **_kwargs):
         return None
 
-    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_healthcheck", _healthy)
+    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_ready", _healthy)
 
     db = SessionLocal()
     try:
@@ -902,7 +908,10 @@ def test_architect_completion_creates_tester_stage_gate(tmp_path, monkeypatch):
         active_execution = (session_row.mode_metadata or {})["active_execution"]
 
         assert broker.mode_calls == ["architect"]
-        assert broker.summary_commands == 1
+        assert len(broker.summary_writes) == 1
+        summary_path, summary = broker.summary_writes[0]
+        assert summary_path.endswith(f"/.yudai/executions/{payload['execution_id']}/architect/summary.json")
+        assert summary["mode"] == "architect"
         assert session_row.current_mode == "tester"
         assert session_row.mode_status == "waiting_for_input"
         assert session_row.architect_completed_at is not None
@@ -944,7 +953,7 @@ def test_architect_questions_pause_pipeline_and_resume_same_mode(tmp_path, monke
     async def _healthy(*_args, **_kwargs):
         return None
 
-    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_healthcheck", _healthy)
+    monkeypatch.setattr(mode_orchestrator_module, "wait_for_sandbox_ready", _healthy)
 
     db = SessionLocal()
     try:
@@ -0,0 +1,98 @@
+from pathlib import Path
+import os
+import sys
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.realtime.output_capture import BoundedOutputCapture  # noqa: E402
+
+
+def test_output_capture_stays_in_memory_under_limit(tmp_path):
+    capture = BoundedOutputCapture("stdout", memory_limit_bytes=64, spill_root=str(tmp_path))
+    capture.write("hello ")
+    capture.write(b"world")
+
+    assert capture.text() == "hello world"
+    assert capture.read_range(6, 5).data == "world"
+    assert not capture.spilled
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_output_capture_keeps_head_and_tail_and_serves_ranges_from_disk(tmp_path):
+    capture = BoundedOutputCapture(
+        "stdout",
+        memory_limit_bytes=20,
+        spill_root=str(tmp_path),
+        spill_segment_bytes=16,
+        max_spill_segments=100,
+    )
+    payload = "".join(f"{index:03d}," for index in range(50))
+    for start in range(0, len(payload), 7):
+        capture.write(payload[start : start + 7])
+
+    assert capture.spilled
+    assert capture.total_bytes == len(payload)
+    text = capture.text()
+    assert text.startswith(payload[:10])
+    assert text.endswith(payload[-10:])
+    assert "output truncated" in text
+    assert capture.read_range(40, 24).data == payload[40:64]
+    assert capture.read_range(5, 30).data == payload[5:35]
+    assert capture.tail_text(12) == payload[-12:]
+    assert len(capture.spill_paths) > 1
+
+    spill_paths = capture.spill_paths
+    capture.close()
+    assert not any(os.path.exists(path) for path in spill_paths)
+    assert capture.text().endswith(payload[-10:])
+
+
+def test_output_capture_rotates_spill_segments(tmp_path):
+    capture = BoundedOutputCapture(
+        "stderr",
+        memory_limit_bytes=8,
+        spill_root=str(tmp_path),
+        spill_segment_bytes=10,
+        max_spill_segments=2,
+    )
+    capture.write("a" * 50)
+
+    assert len(list(tmp_path.iterdir())) == 2
+    assert capture.read_range(0, 4).data == "aaaa"
+    assert capture.read_range(30, 10).data == "a" * 10
+
+    clipped = capture.read_range(10, 10)
+    assert clipped.data == ""
+    assert clipped.truncated
+    assert clipped.offset == 30
+
+    partial = capture.read_range(2, 40)
+    assert partial.offset == 2
+    assert partial.data == "aa"
+    resumed = capture.read_range(partial.offset + len(partial.data), 40)
+    assert resumed.truncated
+    assert resumed.offset == 30
+    assert resumed.data == "a" * 14
+    capture.close()
+
+
+def test_output_capture_keeps_one_spill_handle_until_finished(tmp_path):
+    capture = BoundedOutputCapture(
+        "stdout",
+        memory_limit_bytes=8,
+        spill_root=str(tmp_path),
+        spill_segment_bytes=1024,
+    )
+    capture.write("x" * 16)
+    handle = capture._handle
+    capture.write("y" * 16)
+
+    assert handle is not None and capture._handle is handle
+    assert capture.read_range(16, 16).data == "y" * 16
+
+    capture.finish()
+    assert handle.closed
+    assert capture.read_range(0, 4).data == "xxxx"
+    capture.close()
@@ -0,0 +1,65 @@
+import importlib.util
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+SCRIPT_PATH = BACKEND_ROOT.parent / "scripts" / "perf_benchmark.py"
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+
+def _load_script():
+    spec = importlib.util.spec_from_file_location("perf_benchmark", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_percentiles_and_baseline_comparison():
+    perf = _load_script()
+    values = [float(v) for v in range(1, 101)]
+    assert (perf.percentile(values, 50), perf.percentile(values, 95), perf.percentile(values, 99)) == (50.0, 95.0, 99.0)
+    assert perf.percentile([], 95) == 0.0
+
+    current = {"scenarios": {"event_replay": {"execution_event_replay": {"p95_ms": 30.0}}}}
+    baseline = {"scenarios": {"event_replay": {"execution_event_replay": {"p95_ms": 20.0}}}}
+    (row,) = perf.compare_reports(current, baseline)
+    assert row["p95_change_pct"] == 50.0
+
+
+def test_benchmark_runs_end_to_end_against_local_fakes(tmp_path):
+    output = tmp_path / "report.json"
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'perf.db'}"}
+    result = subprocess.run(
+        [
+            sys.executable,
+            str(SCRIPT_PATH),
+            "--scenarios=chat_turn,sandbox_callbacks,ws_fanout,event_replay",
+            "--concurrency=2",
+            "--requests=3",
+            "--chat-turns=2",
+            "--llm-tokens=5",
+            "--llm-first-token-latency-ms=1",
+            "--callback-jobs=2",
+            "--stdout-bytes=4096",
+            "--chunk-bytes=2048",
+            "--ws-clients=2",
+            "--ws-events=5",
+            f"--work-dir={tmp_path / 'work'}",
+            f"--output={output}",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    scenarios = json.loads(output.read_text(encoding="utf-8"))["scenarios"]
+    assert scenarios["chat_turn"]["chat_first_chunk"]["count"] == 2
+    assert scenarios["sandbox_callbacks"]["sandbox_event_callback"]["total_bytes"] == 2 * 4096
+    assert scenarios["ws_fanout"]["ws_delivery"]["count"] == 2 * 5
+    assert scenarios["event_replay"]["execution_event_replay"]["errors"] == 0
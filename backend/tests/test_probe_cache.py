@@ -0,0 +1,159 @@
+import asyncio
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/probe-cache-tests.db")
+
+from yudai.daifuUserAgent.context_probe import (  # noqa: E402
+    ContextProbeService,
+    ProbeRequest,
+)
+from yudai.daifuUserAgent.probe_cache import (  # noqa: E402
+    TREE_STATE_MARKER,
+    ProbeCache,
+    ProbeTreeState,
+    build_tree_state_command,
+    parse_tree_state,
+)
+from yudai.models import Base, ChatSession, ProbeCacheEntry, User  # noqa: E402
+
+
+class _FakeBroker:
+    def __init__(self):
+        self.tree_hash = "a" * 64
+        self.probe_runs = 0
+
+    async def run_command(self, db, *, session, command, **kwargs):
+        if TREE_STATE_MARKER in command:
+            return {"exit_code": 0, "stdout": f"{TREE_STATE_MARKER} {'1' * 40} {self.tree_hash}\n"}
+        self.probe_runs += 1
+        return {
+            "exit_code": 0,
+            "stdout": "Auth lives in backend/auth/auth_routes.py:10\n",
+            "stderr": "",
+            "duration_ms": 45000,
+        }
+
+
+def _probe_db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'probe-cache.db'}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    user = User(
+        github_username="cache-user",
+        github_user_id="82001",
+        email="cache@example.com",
+        display_name="Cache User",
+    )
+    db.add(user)
+    db.commit()
+    session = ChatSession(
+        user_id=user.id,
+        session_id="session_probe_cache",
+        title="Probe Cache",
+        repo_owner="Octocat",
+        repo_name="YudaiV3",
+        is_active=True,
+        total_messages=0,
+        total_tokens=0,
+        mode_metadata={},
+    )
+    db.add(session)
+    db.commit()
+    return db, session
+
+
+def test_probe_cache_serves_repeat_queries_until_tree_changes(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSWEA_MODEL_NAME", "openrouter/x-ai/grok-4-fast")
+    monkeypatch.setattr(ContextProbeService, "has_active_sandbox", staticmethod(lambda db, session: True))
+    db, session = _probe_db(tmp_path)
+    broker = _FakeBroker()
+    service = ContextProbeService(broker, cache=ProbeCache(ttl_seconds=3600, max_entries=10))
+    try:
+        first = asyncio.run(
+            service.run_probe(db, session=session, probe=ProbeRequest("probe_1", "Where is auth?"))
+        )
+        second = asyncio.run(
+            service.run_probe(db, session=session, probe=ProbeRequest("probe_2", "  where is AUTH "))
+        )
+
+        assert broker.probe_runs == 1
+        assert not first.cached
+        assert second.cached
+        assert second.probe_id == "probe_2"
+        assert second.output_text == first.output_text
+        assert second.files == ["backend/auth/auth_routes.py"]
+        assert second.duration_ms < 1000
+        assert "(cached answer" in ContextProbeService.format_as_context([second])
+
+        broker.tree_hash = "b" * 64
+        third = asyncio.run(
+            service.run_probe(db, session=session, probe=ProbeRequest("probe_3", "Where is auth?"))
+        )
+        assert broker.probe_runs == 2
+        assert not third.cached
+        assert {entry.tree_hash for entry in db.query(ProbeCacheEntry).all()} == {"b" * 64}
+    finally:
+        db.close()
+
+
+def test_probe_cache_evicts_least_recently_used_entries(tmp_path):
+    db, session = _probe_db(tmp_path)
+    cache = ProbeCache(ttl_seconds=3600, max_entries=2)
+    state = ProbeTreeState(head_sha="1" * 40, tree_hash="c" * 64)
+    result = {"status": "completed", "output_text": "answer", "summary": None, "files": []}
+    try:
+        cache.put(db, repo_key="octocat/yudaiv3", state=state, query="one", result=result)
+        cache.put(db, repo_key="octocat/yudaiv3", state=state, query="two", result=result)
+        assert cache.get(db, repo_key="octocat/yudaiv3", state=state, query="one") is not None
+        cache.put(db, repo_key="octocat/yudaiv3", state=state, query="three", result=result)
+
+        assert cache.get(db, repo_key="octocat/yudaiv3", state=state, query="two") is None
+        assert cache.get(db, repo_key="octocat/yudaiv3", state=state, query="one") is not None
+        assert db.query(ProbeCacheEntry).count() == 2
+    finally:
+        db.close()
+
+
+def test_tree_state_command_ignores_probe_outputs_and_tracks_edits(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    env = {
+        **os.environ,
+        "GIT_AUTHOR_NAME": "t",
+        "GIT_AUTHOR_EMAIL": "t@example.com",
+        "GIT_COMMITTER_NAME": "t",
+        "GIT_COMMITTER_EMAIL": "t@example.com",
+    }
+    subprocess.run(["git", "init", "-q"], cwd=repo, check=True, env=env)
+    (repo / "app.py").write_text("print('hi')\n", encoding="utf-8")
+    subprocess.run(["git", "add", "app.py"], cwd=repo, check=True, env=env)
+    subprocess.run(["git", "commit", "-qm", "init"], cwd=repo, check=True, env=env)
+
+    def state():
+        completed = subprocess.run(
+            ["bash", "-c", build_tree_state_command(str(repo))],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return parse_tree_state(completed.stdout)
+
+    clean = state()
+    (repo / ".yudai" / "probes").mkdir(parents=True)
+    (repo / ".yudai" / "probes" / "probe.md").write_text("output", encoding="utf-8")
+    assert state() == clean
+
+    (repo / "app.py").write_text("print('changed')\n", encoding="utf-8")
+    dirty = state()
+    assert dirty.head_sha == clean.head_sha
+    assert dirty.tree_hash != clean.tree_hash
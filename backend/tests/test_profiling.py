@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/profiling-tests.db")
+
+from yudai.config import get_sandbox_config  # noqa: E402
+from yudai.utils.profiling import (  # noqa: E402
+    LoopLagMonitor,
+    ProfilerBusy,
+    ProfilingMiddleware,
+    SamplingProfiler,
+    capture_profile,
+    router as profiling_router,
+)
+
+
+def _busy_wait(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(200))
+
+
+def test_sampling_profiler_writes_speedscope_and_collapsed_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_wait, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        profiler = SamplingProfiler(interval_seconds=0.002, thread_ids=[worker.ident]).start()
+        time.sleep(0.1)
+        profile = profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    assert list(profile.samples) == [worker.ident]
+    assert profile.sample_count > 5
+
+    speedscope = json.loads(profile.write(tmp_path / "p.speedscope.json").read_text())
+    frame_names = {frame["name"] for frame in speedscope["shared"]["frames"]}
+    assert "_busy_wait" in frame_names
+    assert speedscope["profiles"][0]["type"] == "sampled"
+    assert len(speedscope["profiles"][0]["samples"]) == len(speedscope["profiles"][0]["weights"])
+
+    collapsed = profile.write(tmp_path / "p.collapsed.txt", fmt="collapsed").read_text()
+    assert all(line.startswith(f"busy-worker ({worker.ident});") for line in collapsed.splitlines())
+    assert "_busy_wait (" in collapsed
+
+
+def test_capture_profile_uses_single_slot(tmp_path, monkeypatch):
+    monkeypatch.setenv("YUDAI_PROFILING_DIR", str(tmp_path))
+    monkeypatch.setenv("YUDAI_PROFILING_INTERVAL_MS", "2")
+    get_sandbox_config.cache_clear()
+
+    results = []
+    errors = []
+
+    def run():
+        try:
+            results.append(capture_profile(0.2, service="test"))
+        except ProfilerBusy as exc:
+            errors.append(exc)
+
+    first = threading.Thread(target=run)
+    first.start()
+    time.sleep(0.05)
+    run()
+    first.join()
+
+    assert len(results) == 1 and len(errors) == 1
+    path, profile = results[0]
+    assert path.parent == tmp_path and path.name.startswith("test-")
+    assert profile.sample_count > 0
+
+
+def test_profiling_middleware_requires_token(tmp_path, monkeypatch):
+    monkeypatch.setenv("YUDAI_PROFILING_ENABLED", "true")
+    monkeypatch.setenv("YUDAI_PROFILING_TOKEN", "secret")
+    monkeypatch.setenv("YUDAI_PROFILING_DIR", str(tmp_path))
+    get_sandbox_config.cache_clear()
+
+    app = FastAPI()
+
+    @app.get("/slow")
+    async def slow():
+        time.sleep(0.02)
+        return {"ok": True}
+
+    client = TestClient(ProfilingMiddleware(app, service="controller"))
+
+    plain = client.get("/slow", headers={"X-Yudai-Profile": "wrong"})
+    profiled = client.get("/slow", headers={"X-Yudai-Profile": "secret"})
+
+    assert "x-yudai-profile-path" not in plain.headers
+    written = tmp_path / profiled.headers["x-yudai-profile-path"]
+    assert json.loads(written.read_text())["profiles"]
+
+
+def test_profile_router_names_capture_after_serving_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("YUDAI_PROFILING_ENABLED", "true")
+    monkeypatch.setenv("YUDAI_PROFILING_TOKEN", "secret")
+    monkeypatch.setenv("YUDAI_PROFILING_DIR", str(tmp_path))
+    monkeypatch.setenv("YUDAI_PROFILING_INTERVAL_MS", "2")
+    get_sandbox_config.cache_clear()
+
+    app = FastAPI()
+    app.include_router(profiling_router)
+    client = TestClient(ProfilingMiddleware(app, service="sandbox"))
+
+    assert client.post("/debug/profile?seconds=0.1").status_code == 401
+    assert client.post("/debug/profile?seconds=0.1&format=svg", headers={"X-Yudai-Profile": "secret"}).status_code == 400
+    response = client.post("/debug/profile?seconds=0.1", headers={"X-Yudai-Profile": "secret"})
+
+    assert response.status_code == 200
+    assert Path(response.json()["path"]).name.startswith("sandbox-")
+
+
+def test_loop_lag_monitor_logs_blocking_stack(caplog):
+    def block_the_loop():
+        time.sleep(0.25)
+
+    async def run():
+        monitor = LoopLagMonitor(asyncio.get_running_loop(), threshold_seconds=0.05, service="test").start()
+        await asyncio.sleep(0.05)
+        block_the_loop()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+        return monitor
+
+    with caplog.at_level(logging.WARNING, logger="yudai.utils.profiling"):
+        monitor = asyncio.run(run())
+
+    assert monitor.stalls == 1
+    blocked = [record.getMessage() for record in caplog.records if "blocked for" in record.getMessage()]
+    assert blocked and "block_the_loop" in blocked[0]
+    assert any("recovered after" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,81 @@
+from pathlib import Path
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.utils.query_stats import (  # noqa: E402
+    QUERIES_PER_SCOPE,
+    QueryStatsMiddleware,
+    fingerprint,
+    install_query_tracking,
+    instrument_engine,
+    track_queries,
+)
+from yudai.utils.metrics import DB_QUERY_SECONDS  # noqa: E402
+
+
+def test_fingerprint_collapses_whitespace_and_in_lists():
+    assert fingerprint("SELECT a\n  FROM t WHERE id IN (?, ?,?)") == "SELECT a FROM t WHERE id IN (?...)"
+    assert fingerprint("SELECT a FROM t WHERE id IN (%(id_1)s, %(id_2)s)") == "SELECT a FROM t WHERE id IN (?...)"
+    assert fingerprint("SELECT a FROM t WHERE id = ?") == "SELECT a FROM t WHERE id = ?"
+
+
+def test_nested_scopes_count_toward_outer_scope():
+    install_query_tracking()
+    engine = create_engine("sqlite:///:memory:")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        with track_queries("outer") as outer:
+            conn.execute(text("SELECT 1"))
+            with track_queries("inner") as inner:
+                for value in range(3):
+                    conn.execute(text("SELECT :value"), {"value": value})
+
+    assert inner.count == 3
+    assert inner.repeated() == [("SELECT ?", 3)]
+    assert outer.count == 4
+    assert outer.max_repeats == 3
+
+
+def test_one_timing_feeds_scope_and_histogram():
+    engine = create_engine("sqlite:///:memory:")
+    instrument_engine(engine)
+    instrument_engine(engine)
+    selects = DB_QUERY_SECONDS.labels("SELECT").count
+    with engine.connect() as conn:
+        with track_queries("both") as stats:
+            conn.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 2"))
+        assert conn.info["yudai_query_stats_starts"] == []
+
+    assert stats.count == 1
+    assert DB_QUERY_SECONDS.labels("SELECT").count == selects + 2
+    assert len(list(engine.dispatch.before_cursor_execute)) == 1
+
+
+def test_middleware_counts_sync_handler_queries_and_exposes_headers(monkeypatch):
+    monkeypatch.setenv("YUDAI_QUERY_STATS_HEADERS", "true")
+    install_query_tracking()
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    app = FastAPI()
+
+    @app.get("/items/{count}")
+    def items(count: int):
+        with engine.connect() as conn:
+            return [conn.execute(text("SELECT :n"), {"n": n}).scalar() for n in range(count)]
+
+    client = TestClient(QueryStatsMiddleware(app, service="test"))
+    response = client.get("/items/4")
+
+    assert response.json() == [0, 1, 2, 3]
+    assert response.headers["x-db-query-count"] == "4"
+    assert response.headers["x-db-query-max-repeats"] == "4"
+    assert float(response.headers["x-db-query-time-ms"]) >= 0
+    assert sum(QUERIES_PER_SCOPE.labels("test", "GET /items/{count}")._counts) >= 1
@@ -14,9 +14,11 @@ Covers functionality that moved between files:
 from __future__ import annotations
 
 import asyncio
+import json
 import os
 from pathlib import Path
 import sys
+import time
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -77,7 +79,7 @@ def test_modal_registry_get_modal_registry_singleton():
 # SessionWebSocketHub (now in ws_protocol)
 # ---------------------------------------------------------------------------
 
-from yudai.realtime.ws_protocol import SessionWebSocketHub, get_ws_hub, WSMessageType  # noqa: E402
+from yudai.realtime.ws_protocol import WS_SLOW_CONSUMER_CLOSE_CODE, SessionWebSocketHub, get_ws_hub, WSMessageType  # noqa: E402
 
 
 def _run(coro):
@@ -89,9 +91,13 @@ def test_ws_hub_register_and_send_to_session():
     mock_ws = AsyncMock()
     mock_ws.send_text = AsyncMock()
 
-    _run(hub.register("sess_abc", mock_ws))
-    count = _run(hub.send_to_session("sess_abc", WSMessageType.HEARTBEAT, {}))
-    assert count == 1
+    async def _scenario():
+        await hub.register("sess_abc", mock_ws)
+        count = await hub.send_to_session("sess_abc", WSMessageType.HEARTBEAT, {})
+        await hub.drain("sess_abc")
+        return count
+
+    assert _run(_scenario()) == 1
     mock_ws.send_text.assert_awaited_once()
 
 
@@ -116,12 +122,107 @@ def test_ws_hub_stale_socket_pruned_on_send():
     broken_ws = AsyncMock()
     broken_ws.send_text.side_effect = RuntimeError("connection closed")
 
-    _run(hub.register("sess_stale", broken_ws))
-    count = _run(hub.send_to_session("sess_stale", WSMessageType.HEARTBEAT, {}))
-    assert count == 0
+    async def _scenario():
+        await hub.register("sess_stale", broken_ws)
+        # Sends are queued; the failure surfaces on the socket's writer task.
+        count = await hub.send_to_session("sess_stale", WSMessageType.HEARTBEAT, {})
+        await hub.drain("sess_stale")
+        return count, await hub.send_to_session("sess_stale", WSMessageType.HEARTBEAT, {})
+
+    count, count2 = _run(_scenario())
+    assert count == 1
     # Session bucket should be cleaned up
-    count2 = _run(hub.send_to_session("sess_stale", WSMessageType.HEARTBEAT, {}))
     assert count2 == 0
+    assert hub.metrics()["send_failures"] == 1
+
+
+def test_ws_hub_slow_socket_does_not_block_other_tabs_or_producers():
+    hub = SessionWebSocketHub(queue_limit=16, send_timeout_seconds=5.0)
+    fast_sent = []
+    release = asyncio.Event()
+
+    class FastSocket:
+        async def send_text(self, text):
+            fast_sent.append(json.loads(text))
+
+    class StuckSocket:
+        def __init__(self):
+            self.closed = []
+
+        async def send_text(self, text):
+            await release.wait()
+
+        async def close(self, code=None, reason=None):
+            self.closed.append(code)
+
+    fast, stuck = FastSocket(), StuckSocket()
+
+    async def _scenario():
+        await hub.register("sess_tabs", fast)
+        await hub.register("sess_tabs", stuck)
+        started = time.monotonic()
+        await hub.send_to_session("sess_tabs", WSMessageType.STATUS, {"status": "running"})
+        await asyncio.sleep(0)
+        for index in range(50):
+            await hub.send_to_session(
+                "sess_tabs",
+                WSMessageType.SANDBOX_STREAM,
+                {"stream": "sandbox", "event": "stdout", "data": f"line {index}\n", "execution_id": "exec_1"},
+            )
+            await hub.send_to_session("sess_tabs", WSMessageType.HEARTBEAT, {})
+            await asyncio.sleep(0)
+        for index in range(30):
+            await hub.send_to_session("sess_tabs", WSMessageType.MODE_EVENT, {"mode": "coder", "state": str(index)})
+            await asyncio.sleep(0)
+        elapsed = time.monotonic() - started
+        await hub.drain("sess_tabs")
+        await asyncio.sleep(0)
+        return elapsed
+
+    elapsed = _run(_scenario())
+
+    assert elapsed < 0.5
+    stream_text = "".join(m["payload"]["data"] for m in fast_sent if m["type"] == "sandbox_stream")
+    assert stream_text == "".join(f"line {index}\n" for index in range(50))
+    assert [m["payload"]["state"] for m in fast_sent if m["type"] == "mode_event"] == [str(i) for i in range(30)]
+    assert stuck.closed == [WS_SLOW_CONSUMER_CLOSE_CODE]
+    metrics = hub.metrics()
+    assert metrics["slow_consumers_disconnected"] == 1
+    assert metrics["sockets"] == 1
+    assert metrics["heartbeats_dropped"] > 0
+
+
+def test_ws_hub_keeps_mode_streams_apart_and_drains_when_idle():
+    hub = SessionWebSocketHub(send_timeout_seconds=5.0)
+    sent = []
+    release = asyncio.Event()
+
+    class GatedSocket:
+        async def send_text(self, text):
+            await release.wait()
+            sent.append(json.loads(text))
+
+    async def _scenario():
+        await hub.register("sess_modes", GatedSocket())
+        for mode, data in (("architect", "a1"), ("architect", "a2"), ("coder", "c1"), ("coder", "c2")):
+            await hub.send_to_session(
+                "sess_modes",
+                WSMessageType.SANDBOX_STREAM,
+                {"stream": "sandbox", "event": "stdout", "data": data, "execution_id": "exec_1", "mode": mode},
+            )
+            await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hub.drain("sess_modes"), timeout=0.2)
+        release.set()
+        await asyncio.wait_for(hub.drain("sess_modes"), timeout=1.0)
+
+    _run(_scenario())
+
+    assert [(m["payload"]["mode"], m["payload"]["data"]) for m in sent] == [
+        ("architect", "a1"),
+        ("architect", "a2"),
+        ("coder", "c1c2"),
+    ]
 
 
 def test_get_ws_hub_singleton():
@@ -3,11 +3,12 @@ import json
 import os
 from pathlib import Path
 import sys
+import time
 import types
 
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 # Ensure backend imports resolve in tests.
@@ -32,8 +33,9 @@ _install_import_stubs()
 
 from yudai.config.realtime_flags import RealtimeFeatureFlags  # noqa: E402
 from yudai.config import get_sandbox_config  # noqa: E402
-from yudai.models import AgentExecution, AuthToken, Base, ChatSession, SandboxExecutionEvent, SandboxExecutionRun, User  # noqa: E402
+from yudai.models import AgentExecution, AuthToken, Base, ChatSession, Sandbox, SandboxExecutionEvent, SandboxExecutionRun, User  # noqa: E402
 from yudai.realtime.cache_store import SessionCacheStore  # noqa: E402
+from yudai.realtime.callback_store import clear_execution_routes  # noqa: E402
 from yudai.realtime.controller_routes import (  # noqa: E402
     SandboxEventRequest,
     SandboxCompletionRequest,
@@ -43,11 +45,16 @@ from yudai.realtime.controller_routes import (  # noqa: E402
     get_runtime_for_session,
     get_sandbox,
     record_sandbox_event,
+    record_sandbox_ready,
     resolve_tunnel,
     unified_session_websocket,
 )
 from yudai.realtime.lifecycle import RealtimeLifecycleService  # noqa: E402
 import yudai.realtime.lifecycle as lifecycle_module  # noqa: E402
+import yudai.realtime.modal_sandbox as modal_sandbox_module  # noqa: E402
+import yudai.realtime.runtime_directory as runtime_directory_module  # noqa: E402
+import yudai.realtime.sandbox_readiness as readiness_module  # noqa: E402
+from yudai.realtime.sandbox_readiness import READY_SIGNATURE_HEADER, READY_TIMESTAMP_HEADER, sign_ready_payload  # noqa: E402
 from yudai.realtime.schemas import RuntimeEnsureRequest  # noqa: E402
 
 
@@ -60,6 +67,7 @@ def db_and_user(tmp_path, monkeypatch):
     engine = create_engine("sqlite:///:memory:")
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
     Base.metadata.create_all(engine)
+    clear_execution_routes()
 
     db = SessionLocal()
     user = User(
@@ -105,6 +113,7 @@ def db_and_user(tmp_path, monkeypatch):
         ),
     )
     lifecycle_module._service_singleton = service
+    monkeypatch.setattr(runtime_directory_module, "_runtime_directory_singleton", None)
 
     try:
         yield db, user, session
@@ -257,9 +266,11 @@ def test_sandbox_completion_callback_validates_secret_and_is_idempotent(db_and_u
 
     db.expire_all()
     updated = db.query(AgentExecution).filter(AgentExecution.id == execution.id).one()
-    completion = updated.execution_metadata["sandbox_completion"]
-    assert completion["exit_code"] == 0
-    assert completion["parsed_payload"]["issue_number"] == 42
+    assert "sandbox_completion" not in updated.execution_metadata
+    run = db.query(SandboxExecutionRun).filter(SandboxExecutionRun.mode_execution_id == execution.id).one()
+    assert run.exit_code == 0
+    assert run.stdout_tail.startswith('{"status":"complete"')
+    assert run.parsed_payload["issue_number"] == 42
 
     duplicate = complete_sandbox_execution(
         mode_execution_id=execution.id,
@@ -270,7 +281,7 @@ def test_sandbox_completion_callback_validates_secret_and_is_idempotent(db_and_u
     assert duplicate["status"] == "duplicate"
 
 
-def test_sandbox_callbacks_persist_run_and_events(db_and_user, monkeypatch):
+def test_sandbox_callbacks_persist_run_and_events(db_and_user, monkeypatch, query_budget):
     db, user, session = db_and_user
     monkeypatch.setenv("CONTROLLER_CALLBACK_SECRET", "callback-secret")
     get_sandbox_config.cache_clear()
@@ -296,13 +307,17 @@ def test_sandbox_callbacks_persist_run_and_events(db_and_user, monkeypatch):
         event="stdout",
         data="hello",
     )
-    accepted = asyncio.run(
-        record_sandbox_event(
-            request=event_request,
-            db=db,
-            x_controller_callback_secret="callback-secret",
+    db.expire_all()
+    # Route lookup on the first callback, then the run upsert and event insert
+    # (a single statement on Postgres).
+    with query_budget(3, max_repeats=1):
+        accepted = asyncio.run(
+            record_sandbox_event(
+                request=event_request,
+                db=db,
+                x_controller_callback_secret="callback-secret",
+            )
         )
-    )
     assert accepted["status"] == "accepted"
 
     completion_request = SandboxCompletionRequest(
@@ -332,6 +347,32 @@ def test_sandbox_callbacks_persist_run_and_events(db_and_user, monkeypatch):
     assert event.sequence == 1
     assert event.data == "hello"
 
+    # A replayed chunk after completion is a no-op and does not reopen the run.
+    with query_budget(2):
+        replayed = asyncio.run(
+            record_sandbox_event(
+                request=event_request,
+                db=db,
+                x_controller_callback_secret="callback-secret",
+            )
+        )
+    assert replayed["status"] == "duplicate"
+    db.expire_all()
+    assert db.query(SandboxExecutionEvent).filter(SandboxExecutionEvent.controller_job_id == "ctrljob_durable").count() == 1
+    run = db.query(SandboxExecutionRun).filter(SandboxExecutionRun.controller_job_id == "ctrljob_durable").one()
+    assert run.status == "complete"
+    assert run.last_sequence == 2
+
+    # Once compacted, the segment keeps deduping the chunk its row no longer can.
+    from yudai.realtime.event_compaction import compact_run_events
+
+    assert compact_run_events(db, "ctrljob_durable")
+    replayed = asyncio.run(
+        record_sandbox_event(request=event_request, db=db, x_controller_callback_secret="callback-secret")
+    )
+    assert replayed["status"] == "duplicate"
+    assert db.query(SandboxExecutionEvent).filter(SandboxExecutionEvent.controller_job_id == "ctrljob_durable").count() == 0
+
 
 def test_terminated_sandbox_returns_hard_error(db_and_user):
     db, user, session = db_and_user
@@ -484,3 +525,191 @@ def test_unified_websocket_accepts_valid_internal_identity(
     sent_types = [json.loads(message).get("type") for message in websocket.sent]
     assert "status" in sent_types
     assert "mode_event" in sent_types
+
+
+def _raw_request(body: bytes, headers: dict) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+    }
+    return Request(scope, receive)
+
+
+def test_sandbox_ready_callback_is_signed_and_wakes_waiters(db_and_user, monkeypatch):
+    db, user, session = db_and_user
+    monkeypatch.setenv("CONTROLLER_CALLBACK_SECRET", "callback-secret")
+    get_sandbox_config.cache_clear()
+    readiness_module._sandbox_readiness_singleton = None
+
+    runtime = asyncio.run(
+        ensure_runtime_for_session(
+            session_id=session.session_id,
+            request=RuntimeEnsureRequest(
+                org="yudai",
+                repo_owner="octocat",
+                repo_name="yudaiv3",
+                environment="main",
+                repo_branch="main",
+                repo_url="file:///tmp/unused",
+            ),
+            db=db,
+            current_user=user,
+        ),
+    )
+    sandbox_id = runtime.sandbox_id
+    body = json.dumps({"capabilities": {"file_api": True}}).encode("utf-8")
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(
+            record_sandbox_ready(
+                sandbox_id=sandbox_id,
+                request=_raw_request(body, {READY_TIMESTAMP_HEADER: str(int(time.time())), READY_SIGNATURE_HEADER: "bad"}),
+                db=db,
+            )
+        )
+    assert exc_info.value.status_code == 401
+
+    async def _scenario():
+        registry = readiness_module.get_sandbox_readiness()
+        waiter = asyncio.ensure_future(registry.wait(sandbox_id))
+        await asyncio.sleep(0)
+        timestamp = str(int(time.time()))
+        signature = sign_ready_payload("callback-secret", sandbox_id=sandbox_id, timestamp=timestamp, body=body)
+        await record_sandbox_ready(
+            sandbox_id=sandbox_id,
+            request=_raw_request(body, {READY_TIMESTAMP_HEADER: timestamp, READY_SIGNATURE_HEADER: signature}),
+            db=db,
+        )
+        return await asyncio.wait_for(waiter, timeout=1)
+
+    try:
+        assert asyncio.run(_scenario()) == {"file_api": True}
+        db.expire_all()
+        sandbox = db.query(Sandbox).filter(Sandbox.id == sandbox_id).one()
+        assert sandbox.lifecycle_metadata["capabilities"] == {"file_api": True}
+        assert readiness_module.heartbeat_proves_liveness(sandbox)
+    finally:
+        readiness_module._sandbox_readiness_singleton = None
+        get_sandbox_config.cache_clear()
+
+
+class _FakeModalSandbox:
+    created = 0
+
+    def __init__(self, sandbox_db_id):
+        type(self).created += 1
+        self.modal_sandbox_id = f"modal-{type(self).created}"
+        self.tunnel_url = f"https://{sandbox_db_id}.modal.test"
+        self.terminated = False
+
+    @classmethod
+    async def create(cls, *, sandbox_db_id, **_):
+        await asyncio.sleep(0.05)
+        return cls(sandbox_db_id)
+
+    async def terminate(self):
+        self.terminated = True
+
+
+def test_concurrent_runtime_ensures_share_one_provisioning(db_and_user, monkeypatch):
+    db, user, session = db_and_user
+    service = lifecycle_module._service_singleton
+    registry = modal_sandbox_module.ModalSandboxRegistry()
+    _FakeModalSandbox.created = 0
+    monkeypatch.setattr(lifecycle_module, "RealtimeModalSandbox", _FakeModalSandbox)
+    monkeypatch.setattr(lifecycle_module, "get_modal_registry", lambda: registry)
+    monkeypatch.setattr(
+        lifecycle_module,
+        "get_realtime_feature_flags",
+        lambda: RealtimeFeatureFlags(
+            controller_split_enabled=True,
+            controller_broker_enabled=False,
+            sandbox_internal_exec_enabled=True,
+            mode_orchestrator_enabled=True,
+            ws_chat_enabled=False,
+            modal_provisioning_enabled=True,
+            ws_unified_enabled=False,
+            contract_version="test",
+        ),
+    )
+
+    async def _ensure():
+        return await service.create_runtime_for_session(
+            db,
+            session=session,
+            user_id=user.id,
+            org="yudai",
+            repo_owner="octocat",
+            repo_name="yudaiv3",
+            environment="main",
+            repo_branch="main",
+            repo_url="file:///tmp/unused",
+        )
+
+    async def _scenario():
+        return await asyncio.gather(*(_ensure() for _ in range(5)))
+
+    envelopes = asyncio.run(_scenario())
+
+    assert _FakeModalSandbox.created == 1
+    assert {envelope.sandbox.id for envelope in envelopes} == {envelopes[0].sandbox.id}
+    assert {envelope.runtime.runtime_id for envelope in envelopes} == {envelopes[0].runtime.runtime_id}
+    assert service.provisioning_stats["modal_provisions"] == 1
+    assert service.provisioning_stats["coalesced_requests"] == 4
+
+    async def _double_provision():
+        first = _FakeModalSandbox("sbx_dup")
+        await registry.register("sbx_dup", first)
+        await registry.register("sbx_dup", _FakeModalSandbox("sbx_dup"))
+        await asyncio.sleep(0)
+        return first
+
+    orphan = asyncio.run(_double_provision())
+    assert orphan.terminated
+    assert registry.orphans_reaped == 1
+
+    async def _reprovision():
+        current = await registry.get("sbx_dup")
+        await registry.register("sbx_dup", _FakeModalSandbox("sbx_dup"), replaces=current.modal_sandbox_id)
+        await asyncio.sleep(0)
+        return current
+
+    replaced = asyncio.run(_reprovision())
+    assert replaced.terminated
+    assert registry.orphans_reaped == 1
+
+
+def test_broker_resolves_runtime_from_directory_until_terminated(db_and_user):
+    db, user, session = db_and_user
+    service = lifecycle_module._service_singleton
+    envelope = asyncio.run(
+        service.create_runtime_for_session(
+            db,
+            session=session,
+            user_id=user.id,
+            org="yudai",
+            repo_owner="octocat",
+            repo_name="yudaiv3",
+            environment="main",
+            repo_branch="main",
+            repo_url="file:///tmp/unused",
+        )
+    )
+    broker = lifecycle_module.SandboxExecBroker(lifecycle=service)
+
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    for _ in range(3):
+        assert broker._resolve_runtime(db, session) == (envelope.sandbox.id, envelope.sandbox.tunnel_url)
+    assert statements == []
+
+    service.terminate_sandbox(db, sandbox_id=envelope.sandbox.id, reason="test")
+    db.commit()
+    with pytest.raises(HTTPException) as exc_info:
+        broker._resolve_runtime(db, session)
+    assert exc_info.value.detail["code"] == "TUNNEL_TERMINATED"
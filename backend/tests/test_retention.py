@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+import sys
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/retention-tests.db")
+
+from yudai.db.retention import (  # noqa: E402
+    RetentionPolicy,
+    archive_root,
+    drop_expired_partitions,
+    enforce_retention,
+    month_partition,
+    partition_upper_bound,
+    prune_batches,
+    retention_policies,
+)
+from yudai.models import Base, SessionAuditEvent  # noqa: E402
+from yudai.utils import utc_now  # noqa: E402
+
+
+def _engine_with_audit_rows(tmp_path, *, old: int, recent: int):
+    engine = create_engine(f"sqlite:///{tmp_path / 'retention.db'}")
+    Base.metadata.create_all(engine)
+    now = utc_now()
+    with Session(engine) as db:
+        for index in range(old + recent):
+            age = timedelta(days=40 if index < old else 1)
+            db.add(
+                SessionAuditEvent(
+                    event_id=f"evt_{index}",
+                    event_name="sandbox_created",
+                    event_payload={"index": index},
+                    created_at=now - age,
+                )
+            )
+        db.commit()
+    return engine
+
+
+def _archived_rows(root: Path, table_name: str):
+    rows = []
+    for path in sorted((root / table_name).rglob("*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as handle:
+            rows.extend(json.loads(line) for line in handle)
+    return rows
+
+
+def test_prune_batches_archives_then_deletes_only_expired_rows(tmp_path):
+    engine = _engine_with_audit_rows(tmp_path, old=7, recent=3)
+    root = tmp_path / "archive"
+    policy = RetentionPolicy("session_audit_events", retention_days=30)
+
+    assert prune_batches(engine, policy, batch_size=3, root=root) == 7
+
+    archived = _archived_rows(root, "session_audit_events")
+    assert sorted(row["event_id"] for row in archived) == [f"evt_{n}" for n in range(7)]
+    assert sorted(row["event_payload"]["index"] for row in archived) == list(range(7))
+    assert len(list(root.rglob("*.jsonl.gz"))) == 3
+    assert not list(root.rglob("*.partial"))
+    with Session(engine) as db:
+        assert sorted(row.event_id for row in db.query(SessionAuditEvent)) == ["evt_7", "evt_8", "evt_9"]
+
+
+def test_prune_batches_stops_after_max_batches(tmp_path):
+    engine = _engine_with_audit_rows(tmp_path, old=5, recent=0)
+    policy = RetentionPolicy("session_audit_events", retention_days=30)
+
+    assert prune_batches(engine, policy, batch_size=2, max_batches=2, root=tmp_path / "archive") == 4
+    with Session(engine) as db:
+        assert db.query(SessionAuditEvent).count() == 1
+
+
+def test_zero_day_policies_are_skipped(monkeypatch, tmp_path):
+    monkeypatch.setenv("YUDAI_AUDIT_EVENT_RETENTION_DAYS", "0")
+    monkeypatch.setenv("YUDAI_RETENTION_ARCHIVE_ROOT", str(tmp_path / "archive"))
+    engine = _engine_with_audit_rows(tmp_path, old=2, recent=0)
+
+    assert "session_audit_events" not in {policy.table for policy in retention_policies()}
+    assert "session_audit_events" not in enforce_retention(engine)
+    with Session(engine) as db:
+        assert db.query(SessionAuditEvent).count() == 2
+
+
+def test_retention_is_off_until_configured(monkeypatch, tmp_path):
+    for name in (
+        "SANDBOX_EVENT_RETENTION_DAYS",
+        "YUDAI_AUDIT_EVENT_RETENTION_DAYS",
+        "YUDAI_DECISION_STEP_RETENTION_DAYS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("YUDAI_RETENTION_ARCHIVE_ROOT", str(tmp_path / "archive"))
+    engine = _engine_with_audit_rows(tmp_path, old=2, recent=0)
+
+    assert archive_root() == tmp_path / "archive"
+    assert retention_policies() == []
+    assert enforce_retention(engine) == {}
+    assert not (tmp_path / "archive").exists()
+    with Session(engine) as db:
+        assert db.query(SessionAuditEvent).count() == 2
+
+
+def test_partition_helpers():
+    assert month_partition("session_audit_events", date(2026, 12, 17)) == (
+        "session_audit_events_p202612",
+        date(2026, 12, 1),
+        date(2027, 1, 1),
+    )
+    assert partition_upper_bound("FOR VALUES FROM ('2026-01-01') TO ('2026-02-01')") == datetime(
+        2026, 2, 1, tzinfo=timezone.utc
+    )
+    assert partition_upper_bound(
+        "FOR VALUES FROM ('2026-01-01 00:00:00+00') TO ('2026-02-01 00:00:00+00')"
+    ) == datetime(2026, 2, 1, tzinfo=timezone.utc)
+    assert partition_upper_bound("DEFAULT") is None
+
+
+def test_expired_partition_is_archived_before_it_is_detached(tmp_path, monkeypatch):
+    from yudai.db import retention
+
+    engine = _engine_with_audit_rows(tmp_path, old=3, recent=0)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "session_audit_events_p202501" AS SELECT * FROM session_audit_events'))
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    monkeypatch.setattr(retention, "ensure_future_partitions", lambda conn, table_name, *, now: None)
+    monkeypatch.setattr(
+        retention,
+        "_list_partitions",
+        lambda conn, table_name: [("session_audit_events_p202501", datetime(2025, 2, 1, tzinfo=timezone.utc))],
+    )
+
+    def failing_archive(table_name, rows, *, root):
+        raise OSError("archive volume full")
+
+    monkeypatch.setattr(retention, "write_archive", failing_archive)
+    with pytest.raises(OSError):
+        drop_expired_partitions(engine, RetentionPolicy("session_audit_events", 30), root=tmp_path)
+
+    assert not any("DETACH" in statement or "DROP" in statement for statement in statements)
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM "session_audit_events_p202501"')).scalar() == 3
@@ -236,3 +236,23 @@ def test_run_controller_adds_cors_headers_on_unhandled_500(monkeypatch):
 
     assert response_start["status"] == 500
     assert headers[b"access-control-allow-origin"] == b"https://www.yudai.app"
+
+
+def test_run_controller_metrics_report_route_latency(monkeypatch):
+    _install_import_stubs()
+    monkeypatch.delenv("YUDAI_METRICS_TOKEN", raising=False)
+    import importlib
+
+    run_controller = importlib.import_module("yudai.run_controller")
+
+    asyncio.run(_asgi_get(run_controller.app, "/health", origin="https://yudai.app"))
+    messages, raised = asyncio.run(_asgi_get(run_controller.app, "/metrics", origin="https://yudai.app"))
+
+    assert raised is None
+    response_start = next(message for message in messages if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    assert response_start["status"] == 200
+    assert (
+        b'yudai_http_request_duration_seconds_count{service="controller",method="GET",route="/health",status="200"}'
+        in body
+    )
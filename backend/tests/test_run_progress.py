@@ -0,0 +1,220 @@
+import asyncio
+import os
+from pathlib import Path
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/run-progress-tests.db")
+
+import yudai.realtime.callback_store as callback_store  # noqa: E402
+from yudai.models import AgentExecution, Base, ChatSession, SandboxExecutionEvent, SandboxExecutionRun, User  # noqa: E402
+from yudai.realtime.callback_store import (  # noqa: E402
+    RunProgressTracker,
+    clear_execution_routes,
+    lookup_execution_route,
+    maintain_run_progress,
+    record_callback_completion,
+    record_callback_event,
+    run_progress_view,
+)
+
+
+@pytest.fixture
+def tracked_db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'progress.db'}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    user = User(github_username="progress", github_user_id="9501", email="progress@example.com")
+    db.add(user)
+    db.flush()
+    session = ChatSession(
+        user_id=user.id,
+        session_id="session_progress",
+        title="Progress",
+        repo_owner="octocat",
+        repo_name="yudaiv3",
+        repo_branch="main",
+        is_active=True,
+        total_messages=0,
+        total_tokens=0,
+    )
+    db.add(session)
+    db.flush()
+    db.add(AgentExecution(id="exec_progress", session_id=session.id, mode="coder", status="running"))
+    db.commit()
+
+    tracker = RunProgressTracker()
+    tracker.active = True
+    monkeypatch.setattr(callback_store, "_run_progress_singleton", tracker)
+    clear_execution_routes()
+    try:
+        yield db, tracker, lookup_execution_route(db, "exec_progress")
+    finally:
+        db.close()
+
+
+def _event(db, route, sequence):
+    record_callback_event(
+        db,
+        route,
+        controller_job_id="ctrljob_progress",
+        sandbox_job_id="sbjob_progress",
+        attempt=1,
+        status_value="running",
+        sequence=sequence,
+        stream="sandbox",
+        event="stdout",
+        data=f"line {sequence}",
+        event_metadata={},
+    )
+
+
+def _run(db):
+    db.expire_all()
+    return db.query(SandboxExecutionRun).filter(SandboxExecutionRun.controller_job_id == "ctrljob_progress").one()
+
+
+def test_progress_is_buffered_after_first_write_and_flushed_in_bulk(tracked_db, query_budget):
+    db, tracker, route = tracked_db
+
+    _event(db, route, 1)
+    assert _run(db).last_sequence == 1
+
+    with query_budget(1):
+        _event(db, route, 2)
+    _event(db, route, 3)
+    assert db.query(SandboxExecutionEvent).count() == 3
+    run = _run(db)
+    assert run.last_sequence == 1
+    assert run_progress_view(run)["last_sequence"] == 3
+
+    assert tracker.flush(db) == 1
+    assert tracker.flush(db) == 0
+    assert _run(db).last_sequence == 3
+
+
+def test_completion_writes_through_and_wins_over_buffered_progress(tracked_db):
+    db, tracker, route = tracked_db
+    _event(db, route, 1)
+    _event(db, route, 2)
+    stale = tracker.get("ctrljob_progress")
+
+    assert record_callback_completion(
+        db,
+        route,
+        controller_job_id="ctrljob_progress",
+        sandbox_job_id="sbjob_progress",
+        attempt=1,
+        status_value="complete",
+        sequence=3,
+        exit_code=0,
+        duration_ms=5,
+        stdout="done",
+        stderr="",
+        parsed_payload=None,
+    )
+    assert tracker.get("ctrljob_progress") is None
+
+    # Progress buffered before the completion must not reopen the run.
+    tracker._progress[stale.controller_job_id] = stale
+    tracker._dirty.add(stale.controller_job_id)
+    tracker.flush(db)
+    run = _run(db)
+    assert (run.status, run.last_sequence) == ("complete", 3)
+    assert run_progress_view(run)["status"] == "complete"
+
+
+def test_tracker_is_write_through_while_no_flusher_runs(tracked_db, monkeypatch):
+    db, tracker, route = tracked_db
+    tracker.active = False
+    _event(db, route, 1)
+    _event(db, route, 2)
+    assert _run(db).last_sequence == 2
+    assert tracker.get("ctrljob_progress") is None
+
+    monkeypatch.setenv("SANDBOX_RUN_PROGRESS_FLUSH_MS", "0")
+    asyncio.run(maintain_run_progress())
+    assert tracker.active is False
+
+
+def test_failed_flush_keeps_idle_progress_for_the_next_flush(tracked_db, monkeypatch):
+    db, tracker, route = tracked_db
+    _event(db, route, 1)
+    _event(db, route, 2)
+    tracker._progress["ctrljob_progress"].heartbeat_at -= callback_store._PROGRESS_IDLE_AFTER * 2
+
+    real_execute = db.execute
+
+    def failing_execute(statement, *args, **kwargs):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(db, "execute", failing_execute)
+    with pytest.raises(RuntimeError):
+        tracker.flush(db)
+    monkeypatch.setattr(db, "execute", real_execute)
+
+    assert tracker.get("ctrljob_progress") is not None
+    assert tracker.flush(db) == 1
+    assert _run(db).last_sequence == 2
+    assert tracker.get("ctrljob_progress") is None
+
+
+def test_shutdown_flush_runs_off_the_event_loop(monkeypatch):
+    import threading
+
+    monkeypatch.setenv("SANDBOX_RUN_PROGRESS_FLUSH_MS", "60000")
+    tracker = RunProgressTracker()
+    monkeypatch.setattr(callback_store, "_run_progress_singleton", tracker)
+    flush_threads = []
+    monkeypatch.setattr(
+        callback_store, "_flush_run_progress", lambda tracker: flush_threads.append(threading.current_thread())
+    )
+
+    async def run_and_stop():
+        task = asyncio.create_task(maintain_run_progress())
+        await asyncio.sleep(0)
+        assert tracker.active
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run_and_stop())
+    assert tracker.active is False
+    assert len(flush_threads) == 1
+    assert flush_threads[0] is not threading.main_thread()
+
+
+def test_redelivered_chunk_after_compaction_is_not_stored_again(tracked_db):
+    from yudai.realtime.event_compaction import compact_run_events
+
+    db, tracker, route = tracked_db
+    _event(db, route, 1)
+    _event(db, route, 2)
+    record_callback_completion(
+        db,
+        route,
+        controller_job_id="ctrljob_progress",
+        sandbox_job_id="sbjob_progress",
+        attempt=1,
+        status_value="complete",
+        sequence=3,
+        exit_code=0,
+        duration_ms=5,
+        stdout="done",
+        stderr="",
+        parsed_payload=None,
+    )
+    assert compact_run_events(db, "ctrljob_progress")
+    assert db.query(SandboxExecutionEvent).count() == 0
+
+    _event(db, route, 2)
+    assert db.query(SandboxExecutionEvent).count() == 0
+    _event(db, route, 4)
+    assert [row.sequence for row in db.query(SandboxExecutionEvent)] == [4]
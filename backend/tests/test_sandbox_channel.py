@@ -0,0 +1,212 @@
+import asyncio
+import json
+from pathlib import Path
+import sys
+
+import websockets
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.config import get_sandbox_config  # noqa: E402
+from yudai.realtime import sandbox_routes, sandbox_transport  # noqa: E402
+from yudai.realtime.output_capture import BoundedOutputCapture  # noqa: E402
+from yudai.realtime.sandbox_scheduler import SandboxJobScheduler  # noqa: E402
+from yudai.realtime.sandbox_transport import SandboxControlChannel  # noqa: E402
+
+
+def _mux_client(monkeypatch):
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    get_sandbox_config.cache_clear()
+    app = FastAPI()
+    app.include_router(sandbox_routes.router)
+    return TestClient(app)
+
+
+def _receive_until_exit(websocket, job_id):
+    events = []
+    while True:
+        message = json.loads(websocket.receive_text())
+        payload = message.get("payload", {})
+        if payload.get("job_id") != job_id:
+            continue
+        events.append(payload)
+        if payload.get("event") == "exit":
+            return events
+
+
+def test_mux_channel_runs_tagged_jobs_and_resumes_after_reconnect(tmp_path, monkeypatch):
+    with _mux_client(monkeypatch) as client:
+        _run_resume_scenario(client, tmp_path)
+
+
+def _run_resume_scenario(client, tmp_path):
+    with client.websocket_connect("/internal/ws/mux") as websocket:
+        websocket.send_text(
+            json.dumps(
+                {
+                    "type": "exec.start",
+                    "payload": {
+                        "job_id": "job_one",
+                        "command": "printf 'one\\n'; sleep 0.3; printf 'two\\n'",
+                        "cwd": str(tmp_path),
+                    },
+                }
+            )
+        )
+        first_seen = 0
+        while first_seen == 0:
+            payload = json.loads(websocket.receive_text()).get("payload", {})
+            if payload.get("job_id") == "job_one" and payload.get("event") == "stdout":
+                first_seen = payload["sequence"]
+
+    with client.websocket_connect("/internal/ws/mux") as websocket:
+        websocket.send_text(
+            json.dumps(
+                {"type": "exec.resume", "payload": {"job_id": "job_one", "after_sequence": first_seen}}
+            )
+        )
+        events = _receive_until_exit(websocket, "job_one")
+        websocket.send_text(
+            json.dumps(
+                {"type": "exec.ack", "payload": {"job_id": "job_one", "sequence": events[-1]["sequence"]}}
+            )
+        )
+
+    assert all(event["sequence"] > first_seen for event in events)
+    assert "two" in "".join(event.get("data", "") for event in events if event["event"] == "stdout")
+    assert events[-1]["exit_code"] == 0
+
+
+def test_control_channel_dedupes_replayed_events_after_reconnect(monkeypatch):
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    get_sandbox_config.cache_clear()
+    connections = []
+
+    def _event(job_id, sequence, event, **extra):
+        return json.dumps(
+            {
+                "type": "sandbox_stream",
+                "payload": {"job_id": job_id, "sequence": sequence, "event": event, **extra},
+            }
+        )
+
+    async def handler(websocket):
+        connections.append(websocket)
+        message = json.loads(await websocket.recv())
+        job_id = message["payload"]["job_id"]
+        if message["type"] == "exec.start":
+            await websocket.send(_event(job_id, 1, "stdout", data="a"))
+            await websocket.close()
+            return
+        assert message["type"] == "exec.resume"
+        assert message["payload"]["after_sequence"] == 1
+        await websocket.send(_event(job_id, 1, "stdout", data="a"))
+        await websocket.send(_event(job_id, 2, "stdout", data="b"))
+        await websocket.send(_event(job_id, 3, "exit", exit_code=0))
+        async for _ in websocket:
+            pass
+
+    async def main():
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            channel = SandboxControlChannel(f"http://127.0.0.1:{port}")
+            try:
+                return await asyncio.wait_for(
+                    channel.run_command(session_public_id="session_mux", command="true"),
+                    timeout=10,
+                )
+            finally:
+                await channel.close()
+
+    result = asyncio.run(main())
+
+    assert result.stdout == "ab"
+    assert result.exit_code == 0
+    assert len(connections) == 2
+
+
+def test_control_channel_removes_spilled_output_before_returning(tmp_path, monkeypatch):
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    get_sandbox_config.cache_clear()
+    captures = []
+
+    def _spilling_capture(name):
+        captures.append(BoundedOutputCapture(name, memory_limit_bytes=8, spill_root=str(tmp_path)))
+        return captures[-1]
+
+    monkeypatch.setattr(sandbox_transport, "BoundedOutputCapture", _spilling_capture)
+
+    async def handler(websocket):
+        job_id = json.loads(await websocket.recv())["payload"]["job_id"]
+        for sequence, event, extra in ((1, "stdout", {"data": "x" * 64}), (2, "exit", {"exit_code": 0})):
+            await websocket.send(
+                json.dumps({"type": "sandbox_stream", "payload": {"job_id": job_id, "sequence": sequence, "event": event, **extra}})
+            )
+        async for _ in websocket:
+            pass
+
+    async def main():
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            channel = SandboxControlChannel(f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+            try:
+                return await asyncio.wait_for(channel.run_command(session_public_id="session_mux", command="true"), timeout=10)
+            finally:
+                await channel.close()
+
+    result = asyncio.run(main())
+
+    assert result.exit_code == 0
+    assert "output truncated" in result.stdout
+    assert captures[0].spilled
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_exec_socket_queues_second_agent_command_for_same_session(tmp_path, monkeypatch):
+    scheduler = SandboxJobScheduler(slots={"agent": 1, "probe": 1}, recheck_seconds=0.05)
+    monkeypatch.setattr(sandbox_routes, "get_sandbox_job_scheduler", lambda: scheduler)
+
+    def _start(websocket, command, job_class):
+        websocket.receive_text()
+        websocket.send_text(
+            json.dumps(
+                {
+                    "type": "exec.start",
+                    "payload": {"command": command, "cwd": str(tmp_path), "job_class": job_class},
+                }
+            )
+        )
+
+    def _events_until_exit(websocket):
+        events = []
+        while not events or events[-1].get("event") != "exit":
+            events.append(json.loads(websocket.receive_text()).get("payload", {}))
+        return events
+
+    with _mux_client(monkeypatch) as client:
+        with client.websocket_connect("/internal/sessions/session_sched/ws/exec") as coder:
+            _start(coder, "sleep 0.4; printf coder", "agent")
+            assert json.loads(coder.receive_text())["payload"]["event"] == "start"
+
+            with client.websocket_connect("/internal/sessions/session_sched/ws/exec") as probe:
+                _start(probe, "printf probe", "probe")
+                probe_events = _events_until_exit(probe)
+
+            with client.websocket_connect("/internal/sessions/session_sched/ws/exec") as second:
+                _start(second, "printf second", "agent")
+                second_events = _events_until_exit(second)
+
+            coder_events = _events_until_exit(coder)
+
+    assert [event["event"] for event in probe_events][0] == "start"
+    assert second_events[0] == {
+        "stream": "sandbox",
+        "event": "queued",
+        "queue_position": 1,
+        "job_class": "agent",
+    }
+    assert "second" in "".join(event.get("data", "") for event in second_events)
+    assert coder_events[-1]["exit_code"] == 0
@@ -0,0 +1,123 @@
+import asyncio
+import io
+import os
+from pathlib import Path
+import sys
+import tarfile
+
+from fastapi.testclient import TestClient
+import httpx
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/sandbox-files-tests.db")
+
+from yudai.realtime import cache_store as cache_store_module  # noqa: E402
+from yudai.realtime.cache_store import SandboxArtifactStore, download_sandbox_artifact_bundle  # noqa: E402
+
+
+def _client(monkeypatch, root):
+    from yudai.config import get_sandbox_config
+    from yudai.run_sandbox_server import app
+
+    monkeypatch.delenv("CONTROLLER_INTERNAL_WS_SECRET", raising=False)
+    monkeypatch.setenv("REALTIME_WORKSPACE_PATH", str(root))
+    get_sandbox_config.cache_clear()
+    return TestClient(app)
+
+
+def test_file_endpoints_write_read_stat_and_glob(tmp_path, monkeypatch):
+    client = _client(monkeypatch, tmp_path)
+    workspace = str(tmp_path)
+
+    written = client.put(
+        "/internal/files/write",
+        params={"path": ".yudai/executions/exec_1/coder/summary.json", "workspace": workspace},
+        content=b'{"status": "complete"}\n',
+    )
+    assert written.status_code == 200
+    assert written.json()["bytes"] == 23
+    assert (tmp_path / ".yudai/executions/exec_1/coder/summary.json").read_bytes() == b'{"status": "complete"}\n'
+    assert not [name for name in os.listdir(tmp_path / ".yudai/executions/exec_1/coder") if name.endswith(".tmp")]
+
+    ranged = client.get(
+        "/internal/files/read",
+        params={"path": ".yudai/executions/exec_1/coder/summary.json", "offset": 2, "length": 6, "workspace": workspace},
+    )
+    assert ranged.status_code == 200
+    assert ranged.content == b'status'
+    assert ranged.headers["X-File-Size"] == "23"
+
+    stat = client.get("/internal/files/stat", params={"path": ".yudai", "workspace": workspace}).json()
+    assert stat["exists"] and stat["type"] == "directory"
+    assert client.get("/internal/files/stat", params={"path": "absent.md", "workspace": workspace}).json()["exists"] is False
+
+    globbed = client.get("/internal/files/glob", params={"pattern": "**/*.json", "workspace": workspace}).json()
+    assert globbed["matches"] == [".yudai/executions/exec_1/coder/summary.json"]
+
+    missing = client.get("/internal/files/read", params={"path": "absent.md", "workspace": workspace})
+    assert missing.status_code == 404
+    escaped = client.get("/internal/files/read", params={"path": "../../etc/passwd", "workspace": workspace})
+    assert escaped.status_code == 400
+    escaped_write = client.put("/internal/files/write", params={"path": "/etc/yudai", "workspace": workspace}, content=b"x")
+    assert escaped_write.status_code == 400
+
+
+def test_caller_workspace_outside_configured_roots_is_refused(tmp_path, monkeypatch):
+    client = _client(monkeypatch, tmp_path / "workspace")
+
+    read = client.get("/internal/files/read", params={"path": "/etc/passwd", "workspace": "/"})
+    assert read.status_code == 400
+    assert "outside the sandbox roots" in read.json()["detail"]
+    relative = client.get("/internal/files/read", params={"path": "etc/passwd", "workspace": "/"})
+    assert relative.status_code == 400
+    written = client.put("/internal/files/write", params={"path": "/tmp/yudai-escape", "workspace": "/"}, content=b"x")
+    assert written.status_code == 400
+    assert client.get("/internal/files/glob", params={"pattern": "*", "workspace": "/etc"}).status_code == 400
+    archive = client.post(
+        "/internal/files/archive",
+        json={"source_paths": ["/etc/passwd"], "archive_prefix": "escape", "workspace": "/"},
+    )
+    assert archive.status_code == 400
+
+
+def test_artifact_bundle_downloads_through_archive_endpoint(tmp_path, monkeypatch):
+    client = _client(monkeypatch, tmp_path)
+    workspace = tmp_path / "workspace"
+    (workspace / ".yudai").mkdir(parents=True)
+    (workspace / ".yudai" / "report.md").write_text("report\n", encoding="utf-8")
+    (workspace / "screenshot.png").write_bytes(b"\x89PNG")
+
+    response = client.post(
+        "/internal/files/archive",
+        json={"source_paths": [".yudai", "screenshot.png", "missing.txt"], "archive_prefix": "browser_check", "workspace": str(workspace)},
+    )
+    assert response.status_code == 200
+    with tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz") as archive:
+        names = sorted(archive.getnames())
+    assert names == ["browser_check/.yudai", "browser_check/.yudai/report.md", "browser_check/screenshot.png"]
+
+    original_client = httpx.AsyncClient
+
+    def _asgi_client(*args, **kwargs):
+        kwargs["transport"] = httpx.ASGITransport(app=client.app)
+        return original_client(*args, **kwargs)
+
+    monkeypatch.setattr(cache_store_module.SandboxFileClient, "_client", lambda self: _asgi_client(timeout=5))
+    store = SandboxArtifactStore(root=str(tmp_path / "artifacts"))
+    bundle = asyncio.run(
+        download_sandbox_artifact_bundle(
+            tunnel_url="http://sandbox",
+            session_public_id="session_files",
+            store=store,
+            workflow_name="browser_check",
+            archive_name="bundle.tar.gz",
+            source_paths=[".yudai", "screenshot.png"],
+            env={"WORKSPACE_PATH": str(workspace)},
+        )
+    )
+    assert bundle.byte_size > 0
+    with tarfile.open(bundle.bundle_path, mode="r:gz") as archive:
+        assert "browser_check/.yudai/report.md" in archive.getnames()
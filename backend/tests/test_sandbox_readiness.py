@@ -0,0 +1,80 @@
+import asyncio
+from datetime import timedelta
+import os
+from pathlib import Path
+import socket
+import sys
+import types
+
+import httpx
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/sandbox-readiness-tests.db")
+
+import yudai.realtime.sandbox_readiness as readiness_module  # noqa: E402
+from yudai.realtime.sandbox_readiness import heartbeat_proves_liveness, wait_for_sandbox_ready  # noqa: E402
+from yudai.utils import utc_now  # noqa: E402
+
+
+def _closed_tunnel_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def _sandbox(sandbox_id, **overrides):
+    values = {"id": sandbox_id, "lifecycle_metadata": {}, "last_heartbeat_at": None}
+    values.update(overrides)
+    return types.SimpleNamespace(**values)
+
+
+def test_ready_callback_resolves_wait_without_polling_grid(monkeypatch):
+    monkeypatch.setattr(readiness_module, "_sandbox_readiness_singleton", None)
+    # Provisioning stamps last_heartbeat_at; without a ready report it proves nothing.
+    sandbox = _sandbox("sbx_boot", last_heartbeat_at=utc_now())
+    assert not heartbeat_proves_liveness(sandbox)
+    healthz_hits = []
+
+    def _healthz(request):
+        # The sandbox reports ready while it still answers 503 to the probe.
+        healthz_hits.append(request.url.path)
+        readiness_module.get_sandbox_readiness().mark_ready("sbx_boot", {"file_api": True})
+        return httpx.Response(503)
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        readiness_module.httpx,
+        "AsyncClient",
+        lambda **kwargs: real_client(transport=httpx.MockTransport(_healthz), **kwargs),
+    )
+
+    how = asyncio.run(wait_for_sandbox_ready(sandbox, "http://sandbox", timeout_seconds=5))
+    assert how == "callback"
+    assert healthz_hits == ["/healthz"]
+
+    assert asyncio.run(wait_for_sandbox_ready(sandbox, _closed_tunnel_url(), timeout_seconds=0.1)) == "heartbeat"
+
+
+def test_recent_heartbeat_after_ready_skips_the_wait(monkeypatch):
+    monkeypatch.setattr(readiness_module, "_sandbox_readiness_singleton", None)
+    ready = {"ready_at": utc_now().isoformat()}
+
+    assert heartbeat_proves_liveness(_sandbox("sbx_a", lifecycle_metadata=ready, last_heartbeat_at=utc_now()))
+    assert not heartbeat_proves_liveness(
+        _sandbox("sbx_b", lifecycle_metadata=ready, last_heartbeat_at=utc_now() - timedelta(minutes=5))
+    )
+    assert not heartbeat_proves_liveness(
+        _sandbox("sbx_c", lifecycle_metadata={**ready, "last_probe_healthy": False}, last_heartbeat_at=utc_now())
+    )
+
+    stale = _sandbox("sbx_d")
+    try:
+        asyncio.run(wait_for_sandbox_ready(stale, _closed_tunnel_url(), timeout_seconds=0.2))
+    except RuntimeError as exc:
+        assert "sbx_d" in str(exc)
+    else:  # pragma: no cover - assertion path
+        raise AssertionError("expected a readiness timeout")
+    assert "sbx_d" not in readiness_module.get_sandbox_readiness()._entries
@@ -0,0 +1,125 @@
+import asyncio
+from pathlib import Path
+import sys
+
+import pytest
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.realtime.sandbox_scheduler import (  # noqa: E402
+    ResourceSnapshot,
+    SandboxJobScheduler,
+    SchedulerQueueFull,
+    read_resource_snapshot,
+)
+
+
+def test_scheduler_queues_fifo_and_reports_positions():
+    async def main():
+        scheduler = SandboxJobScheduler(slots={"probe": 1}, recheck_seconds=0.05)
+        order = []
+        positions = {"second": [], "third": []}
+
+        async def run(label):
+            async def on_queued(position):
+                positions[label].append(position)
+
+            async with scheduler.slot("probe", on_queued=on_queued if label in positions else None):
+                order.append(label)
+                await asyncio.sleep(0.05)
+
+        first = asyncio.create_task(run("first"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(run("second"))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(run("third"))
+        await asyncio.gather(first, second, third)
+        await asyncio.sleep(0)
+        return order, positions, scheduler.stats()
+
+    order, positions, stats = asyncio.run(main())
+
+    assert order == ["first", "second", "third"]
+    assert positions == {"second": [1], "third": [2, 1]}
+    assert stats["probe"] == {"slots": 1, "running": 0, "queued": 0}
+
+
+def test_scheduler_overlaps_probes_with_agent_and_serializes_agent_per_session():
+    async def main():
+        scheduler = SandboxJobScheduler(slots={"agent": 2, "probe": 1}, recheck_seconds=0.05)
+        coder = await scheduler.acquire("agent", exclusive_key="s1:agent")
+        probe = await asyncio.wait_for(scheduler.acquire("probe"), timeout=1)
+        other_session = await asyncio.wait_for(
+            scheduler.acquire("agent", exclusive_key="s2:agent"), timeout=1
+        )
+        await other_session.release()
+
+        same_session = asyncio.create_task(scheduler.acquire("agent", exclusive_key="s1:agent"))
+        await asyncio.sleep(0.1)
+        blocked = not same_session.done()
+        await coder.release()
+        follow_up = await asyncio.wait_for(same_session, timeout=1)
+        await follow_up.release()
+        await probe.release()
+        return blocked
+
+    assert asyncio.run(main()) is True
+
+
+def test_scheduler_admission_waits_for_resources_only_when_busy():
+    snapshots = [ResourceSnapshot(memory_available_bytes=10)]
+
+    async def main():
+        scheduler = SandboxJobScheduler(
+            slots={"probe": 4},
+            min_free_memory_bytes=100,
+            recheck_seconds=0.02,
+            resource_reader=lambda: snapshots[-1],
+        )
+        first = await asyncio.wait_for(scheduler.acquire("probe"), timeout=1)
+        second = asyncio.create_task(scheduler.acquire("probe"))
+        await asyncio.sleep(0.1)
+        waiting = not second.done()
+        snapshots.append(ResourceSnapshot(memory_available_bytes=1000))
+        granted = await asyncio.wait_for(second, timeout=1)
+        await granted.release()
+        await first.release()
+        return waiting
+
+    assert asyncio.run(main()) is True
+
+
+def test_scheduler_rejects_when_queue_is_full():
+    async def main():
+        scheduler = SandboxJobScheduler(slots={"file_op": 1}, max_queue=1)
+        held = await scheduler.acquire("file_op")
+        waiter = asyncio.create_task(scheduler.acquire("file_op"))
+        await asyncio.sleep(0)
+        assert scheduler.queue_full("file_op")
+        with pytest.raises(SchedulerQueueFull):
+            await scheduler.acquire("file_op")
+        await held.release()
+        await (await waiter).release()
+
+    asyncio.run(main())
+
+
+def test_read_resource_snapshot_prefers_cgroup_limits(tmp_path):
+    cgroup = tmp_path / "cgroup"
+    proc = tmp_path / "proc"
+    cgroup.mkdir()
+    proc.mkdir()
+    (cgroup / "memory.max").write_text("1000\n")
+    (cgroup / "memory.current").write_text("400\n")
+    (cgroup / "cpu.max").write_text("200000 100000\n")
+    (proc / "meminfo").write_text("MemTotal: 99 kB\nMemAvailable: 50 kB\n")
+    (proc / "loadavg").write_text("3.00 1.00 0.50 1/100 42\n")
+
+    snapshot = read_resource_snapshot(cgroup_root=str(cgroup), proc_root=str(proc))
+    assert snapshot == ResourceSnapshot(memory_available_bytes=600, load_per_cpu=1.5)
+
+    (cgroup / "memory.max").write_text("max\n")
+    snapshot = read_resource_snapshot(cgroup_root=str(cgroup), proc_root=str(proc))
+    assert snapshot.memory_available_bytes == 50 * 1024
@@ -0,0 +1,135 @@
+import asyncio
+import os
+from pathlib import Path
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/session-lock-tests.db")
+
+from yudai.models import Base, SessionExecutionFence, User  # noqa: E402
+from yudai.realtime.session_lock import (  # noqa: E402
+    SessionExecutionLockManager,
+    SessionLockLostError,
+)
+
+
+def _session_factory(tmp_path, name):
+    engine = create_engine(f"sqlite:///{tmp_path / name}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def test_session_lock_serializes_holders_and_evicts_idle_entries(tmp_path):
+    SessionLocal = _session_factory(tmp_path, "session-lock-serialize.db")
+    manager = SessionExecutionLockManager()
+    order = []
+
+    async def hold(label):
+        db = SessionLocal()
+        try:
+            async with manager.hold(db, "session_lock") as handle:
+                order.append((label, "start", handle.fencing_token))
+                await asyncio.sleep(0.01)
+                order.append((label, "end", handle.fencing_token))
+        finally:
+            db.close()
+
+    async def main():
+        await asyncio.gather(hold("first"), hold("second"))
+
+    asyncio.run(main())
+
+    assert [entry[1] for entry in order] == ["start", "end", "start", "end"]
+    assert sorted({entry[2] for entry in order}) == [1, 2]
+    assert manager._local_locks == {}
+
+
+def test_session_lock_rejects_writes_from_superseded_holder(tmp_path):
+    SessionLocal = _session_factory(tmp_path, "session-lock-fence.db")
+    manager = SessionExecutionLockManager()
+
+    async def main():
+        db = SessionLocal()
+        try:
+            async with manager.hold(db, "session_fence") as handle:
+                assert handle.fencing_token == 1
+                other = SessionLocal()
+                try:
+                    fence = other.query(SessionExecutionFence).one()
+                    fence.fencing_token = 2
+                    other.commit()
+                finally:
+                    other.close()
+
+                db.add(
+                    User(
+                        github_username="fenced",
+                        github_user_id="9201",
+                        email="fenced@example.com",
+                        display_name="Fenced Writer",
+                    )
+                )
+                with pytest.raises(SessionLockLostError):
+                    db.flush()
+                db.rollback()
+        finally:
+            db.close()
+
+    asyncio.run(main())
+
+    check = SessionLocal()
+    try:
+        assert check.query(User).count() == 0
+    finally:
+        check.close()
+
+
+def test_attached_helper_session_is_fenced_after_release(tmp_path):
+    SessionLocal = _session_factory(tmp_path, "session-lock-helper.db")
+    manager = SessionExecutionLockManager()
+
+    async def hold_once():
+        db = SessionLocal()
+        try:
+            async with manager.hold(db, "session_helper") as handle:
+                return handle
+        finally:
+            db.close()
+
+    def write_user(handle, index):
+        helper = SessionLocal()
+        handle.attach(helper)
+        try:
+            helper.add(
+                User(
+                    github_username=f"helper{index}",
+                    github_user_id=f"93{index:02d}",
+                    email=f"helper{index}@example.com",
+                    display_name="Helper Writer",
+                )
+            )
+            helper.commit()
+        finally:
+            helper.close()
+
+    first = asyncio.run(hold_once())
+    write_user(first, 1)
+
+    second = asyncio.run(hold_once())
+    assert second.fencing_token == first.fencing_token + 1
+    with pytest.raises(SessionLockLostError, match="superseded by 2"):
+        write_user(first, 2)
+    write_user(second, 3)
+
+    check = SessionLocal()
+    try:
+        assert sorted(user.github_username for user in check.query(User)) == ["helper1", "helper3"]
+    finally:
+        check.close()
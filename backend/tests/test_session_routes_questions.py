@@ -49,6 +49,7 @@ _install_import_stubs()
 from yudai.config.realtime_flags import RealtimeFeatureFlags  # noqa: E402
 from yudai.daifuUserAgent import session_routes  # noqa: E402
 from yudai.models import (  # noqa: E402
+    AgentExecution,
     Base,
     ChatMessage,
     ChatSession,
@@ -1347,3 +1348,158 @@ def test_answer_tester_stage_gate_runs_only_tester(db_and_user, monkeypatch):
             "objective": objective,
         }
     ]
+
+
+def test_execution_trace_serves_pipeline_tree_and_mode_subtree(db_and_user):
+    db, user, session = db_and_user
+    from yudai.utils.tracing import span, start_trace, summarize_trace
+
+    with start_trace("pipeline", execution_id="pipe-1") as root:
+        with span("mode.architect", mode_execution_id="mode-1"):
+            with span("sandbox.command"):
+                pass
+        with span("pipeline.complete"):
+            pass
+    db.add_all(
+        [
+            AgentExecution(
+                id="pipe-1",
+                session_id=session.id,
+                mode="pipeline",
+                execution_metadata={"trace": summarize_trace(root)},
+            ),
+            AgentExecution(
+                id="mode-1",
+                session_id=session.id,
+                mode="architect",
+                execution_metadata={"pipeline_execution_id": "pipe-1"},
+            ),
+        ]
+    )
+    db.commit()
+
+    pipeline_trace = asyncio.run(
+        session_routes.get_session_execution_trace(
+            session_id=session.session_id, execution_id="pipe-1", db=db, current_user=user
+        )
+    )
+    mode_trace = asyncio.run(
+        session_routes.get_session_execution_trace(
+            session_id=session.session_id, execution_id="mode-1", db=db, current_user=user
+        )
+    )
+
+    assert pipeline_trace.trace_id == root.trace_id
+    assert [child.name for child in pipeline_trace.root.children] == ["mode.architect", "pipeline.complete"]
+    assert set(pipeline_trace.phases) == {"mode.architect", "sandbox.command", "pipeline.complete"}
+    assert mode_trace.root.name == "mode.architect"
+    assert [child.name for child in mode_trace.root.children] == ["sandbox.command"]
+    assert set(mode_trace.phases) == {"sandbox.command"}
+
+    with pytest.raises(session_routes.HTTPException) as missing:
+        asyncio.run(
+            session_routes.get_session_execution_trace(
+                session_id=session.session_id, execution_id="nope", db=db, current_user=user
+            )
+        )
+    assert missing.value.status_code == 404
+
+
+def test_execution_events_replay_reads_compacted_segments(db_and_user):
+    db, user, session = db_and_user
+    from yudai.models import SandboxExecutionEvent, SandboxExecutionRun
+    from yudai.realtime.event_compaction import compact_run_events
+
+    db.add(AgentExecution(id="mode-replay", session_id=session.id, mode="coder", status="complete"))
+    db.add(
+        SandboxExecutionRun(
+            controller_job_id="ctrljob_replay",
+            sandbox_job_id="sbjob_replay",
+            session_id=session.id,
+            mode_execution_id="mode-replay",
+            status="complete",
+            started_at=session_routes.utc_now(),
+        )
+    )
+    for sequence, event in enumerate(["stdout", "heartbeat", "stdout", "exit"], start=1):
+        db.add(
+            SandboxExecutionEvent(
+                controller_job_id="ctrljob_replay",
+                sandbox_job_id="sbjob_replay",
+                session_id=session.id,
+                mode_execution_id="mode-replay",
+                sequence=sequence,
+                stream="sandbox",
+                event=event,
+                data=f"chunk {sequence}" if event == "stdout" else None,
+            )
+        )
+    db.commit()
+    compact_run_events(db, "ctrljob_replay")
+
+    events = asyncio.run(
+        session_routes.get_session_execution_events(
+            session_id=session.session_id, limit=500, db=db, current_user=user
+        )
+    )
+
+    streamed = [event for event in events if event.type == "sandbox_stream"]
+    assert [event.sequence for event in streamed] == [1, 3, 4]
+    assert streamed[0].payload["data"] == "chunk 1"
+    assert streamed[-1].payload["event"] == "exit"
+
+
+def test_execution_events_replay_keeps_newest_sandbox_events_across_segments(db_and_user):
+    db, user, session = db_and_user
+    from datetime import timedelta
+
+    from yudai.models import SandboxExecutionEvent, SandboxExecutionRun
+    from yudai.realtime.event_compaction import compact_run_events
+
+    start = session_routes.utc_now() - timedelta(hours=1)
+    db.add(
+        AgentExecution(id="mode-bounded", session_id=session.id, mode="coder", status="complete", created_at=start)
+    )
+    for job, offset in (("ctrljob_old", 0), ("ctrljob_new", 600), ("ctrljob_live", 1200)):
+        db.add(
+            SandboxExecutionRun(
+                controller_job_id=job,
+                sandbox_job_id=job.replace("ctrl", "sb"),
+                session_id=session.id,
+                mode_execution_id="mode-bounded",
+                status="complete",
+                started_at=start,
+            )
+        )
+        for sequence in range(1, 301 if job != "ctrljob_live" else 3):
+            db.add(
+                SandboxExecutionEvent(
+                    controller_job_id=job,
+                    sandbox_job_id=job.replace("ctrl", "sb"),
+                    session_id=session.id,
+                    mode_execution_id="mode-bounded",
+                    sequence=sequence,
+                    stream="sandbox",
+                    event="stdout",
+                    data=f"{job} {sequence}",
+                    created_at=start + timedelta(seconds=offset + sequence),
+                )
+            )
+    db.commit()
+    compact_run_events(db, "ctrljob_old")
+    compact_run_events(db, "ctrljob_new")
+
+    events = asyncio.run(
+        session_routes.get_session_execution_events(
+            session_id=session.session_id, limit=5, db=db, current_user=user
+        )
+    )
+
+    assert [event.type for event in events] == ["sandbox_stream"] * 5
+    assert [(event.payload["controller_job_id"], event.sequence) for event in events] == [
+        ("ctrljob_new", 298),
+        ("ctrljob_new", 299),
+        ("ctrljob_new", 300),
+        ("ctrljob_live", 1),
+        ("ctrljob_live", 2),
+    ]
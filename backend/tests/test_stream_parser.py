@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+import re
+import sys
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from yudai.realtime.mode_contracts import (  # noqa: E402
+    CHANGED_FILES_END,
+    CHANGED_FILES_START,
+    parse_changed_files_block,
+    select_mode_contract,
+)
+from yudai.realtime.stream_parser import StreamingOutputParser  # noqa: E402
+
+
+def _chunks(text, size):
+    return [text[index : index + size] for index in range(0, len(text), size)]
+
+
+def test_streaming_parser_matches_full_text_contract_and_changed_files():
+    contract = {
+        "mode": "tester",
+        "test_branch": "yudai/tests-175",
+        "tests_changed": ["backend/tests/test_mode_orchestrator.py"],
+        "expected_failures": [],
+    }
+    stdout = (
+        "running tester\n"
+        f"{CHANGED_FILES_START}\n"
+        '["./backend/tests/test_mode_orchestrator.py"]\n'
+        f"{CHANGED_FILES_END}\n"
+        + json.dumps({"mode": "architect", "issue_number": 1})
+        + "\n"
+        + json.dumps(contract)
+    )
+    parser = StreamingOutputParser(markers=((CHANGED_FILES_START, CHANGED_FILES_END),))
+    for chunk in _chunks(stdout, 7):
+        parser.feed_event({"type": "sandbox_stream", "payload": {"event": "stdout", "data": chunk}})
+    parser.feed_event({"type": "sandbox_stream", "payload": {"event": "stderr", "data": "warning\n"}})
+    assert not parser.completed
+    parser.feed_event({"type": "sandbox_stream", "payload": {"event": "exit", "exit_code": 0}})
+
+    assert parser.completed
+    assert select_mode_contract("tester", parser.json_objects())["test_branch"] == "yudai/tests-175"
+    assert parse_changed_files_block(parser.block(CHANGED_FILES_START)) == [
+        "backend/tests/test_mode_orchestrator.py"
+    ]
+
+
+def test_streaming_parser_keeps_bounded_json_and_first_pattern_match():
+    parser = StreamingOutputParser(
+        patterns={"pr_url": re.compile(r"https://github\.com/\S+/pull/(\d+)")},
+        max_json_objects=2,
+    )
+    parser.feed_text(
+        stdout="".join(json.dumps({"index": index}) + "\n" for index in range(5))
+        + "opened https://github.com/o/r/pull/7\nagain https://github.com/o/r/pull/8",
+        stderr='{"index": "stderr"}',
+    )
+
+    assert [item["index"] for item in parser.json_objects()] == ["stderr", 4, 3]
+    assert parser.first_match("pr_url").group(1) == "7"
+    assert parser.last_json(lambda item: item["index"] == 3) == {"index": 3}
+
+
+def test_streaming_parser_marker_on_shared_line_and_unterminated_block():
+    parser = StreamingOutputParser(markers=(("<<S>>", "<<E>>"), ("<<P>>", "<<Q>>")))
+    parser.feed_text(stdout="noise <<S>>inline body<<E>> tail\n<<P>>\nnever closed\n")
+
+    assert parser.block("<<S>>") == "inline body"
+    assert parser.block("<<P>>") is None
@@ -0,0 +1,135 @@
+import asyncio
+import os
+from pathlib import Path
+import sys
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///tmp/tracing-tests.db")
+
+from yudai.utils.tracing import (  # noqa: E402
+    TracingMiddleware,
+    build_span_tree,
+    current_span,
+    merge_trace_summaries,
+    parse_traceparent,
+    span,
+    start_trace,
+    summarize_trace,
+    trace_headers,
+    traced,
+)
+
+REMOTE_TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_parse_traceparent_accepts_w3c_and_rejects_invalid_ids():
+    assert parse_traceparent(REMOTE_TRACEPARENT) == (
+        "4bf92f3577b34da6a3ce929d0e0e4736",
+        "00f067aa0ba902b7",
+    )
+    assert parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent(None) is None
+
+
+def test_spans_nest_across_awaits_and_tasks_and_summarize():
+    @traced("step")
+    async def step(delay: float) -> str:
+        await asyncio.sleep(delay)
+        return trace_headers()["traceparent"]
+
+    async def run():
+        with start_trace("pipeline", traceparent=REMOTE_TRACEPARENT, execution_id="exec-1") as root:
+            with span("mode.plan", mode_execution_id="mode-1"):
+                header = await step(0)
+                await asyncio.gather(asyncio.create_task(step(0.01)), step(0))
+            with span("mode.code"):
+                try:
+                    with span("sandbox.command"):
+                        raise RuntimeError("exit 1")
+                except RuntimeError:
+                    pass
+        return root, header
+
+    root, header = asyncio.run(run())
+
+    assert current_span() is None
+    assert trace_headers() == {}
+    assert root.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert root.parent_span_id == "00f067aa0ba902b7"
+    assert header.startswith(f"00-{root.trace_id}-")
+
+    summary = summarize_trace(root)
+    assert summary["trace_id"] == root.trace_id
+    assert set(summary["phases"]) == {"mode.plan", "step", "mode.code", "sandbox.command"}
+    assert summary["phases"]["step"] >= 10
+
+    tree = build_span_tree(summary)
+    assert tree["name"] == "pipeline"
+    assert [child["name"] for child in tree["children"]] == ["mode.plan", "mode.code"]
+    plan, code = tree["children"]
+    assert plan["attributes"] == {"mode_execution_id": "mode-1"}
+    assert [child["name"] for child in plan["children"]] == ["step", "step", "step"]
+    assert code["children"][0]["status"] == "error"
+    assert code["children"][0]["error"] == "exit 1"
+
+
+def test_resumed_run_is_merged_into_stored_trace():
+    def run(mode_execution_id):
+        with start_trace("pipeline", execution_id="exec-1") as root:
+            with span("mode", mode_execution_id=mode_execution_id):
+                pass
+        return summarize_trace(root)
+
+    first = run("mode-architect")
+    resumed = run("mode-coder")
+
+    assert merge_trace_summaries(None, first) is first
+    merged = merge_trace_summaries(first, resumed)
+
+    assert (merged["trace_id"], merged["root_span_id"], merged["runs"]) == (first["trace_id"], first["root_span_id"], 2)
+    assert merged["phases"]["mode"] == first["phases"]["mode"] + resumed["phases"]["mode"]
+    assert "pipeline.resume" in merged["phases"]
+    tree = build_span_tree(merged)
+    assert [child["name"] for child in tree["children"]] == ["mode", "pipeline.resume"]
+    assert tree["children"][1]["children"][0]["attributes"] == {"mode_execution_id": "mode-coder"}
+    assert tree["children"][0]["attributes"] == {"mode_execution_id": "mode-architect"}
+
+    third = merge_trace_summaries(merged, run("mode-tester"))
+    assert third["runs"] == 3
+    assert len(build_span_tree(third)["children"]) == 3
+
+
+def test_span_helpers_are_noops_outside_a_trace():
+    @traced("idle")
+    async def idle() -> int:
+        return 7
+
+    with span("orphan") as orphan:
+        assert orphan is None
+    assert asyncio.run(idle()) == 7
+    assert current_span() is None
+
+
+def test_tracing_middleware_continues_remote_trace_only_with_header():
+    app = FastAPI()
+    seen = []
+
+    @app.get("/work/{item}")
+    async def work(item: str, request: Request):
+        active = current_span()
+        seen.append(active.trace_id if active is not None else None)
+        return {"item": item}
+
+    client = TestClient(TracingMiddleware(app, service="sandbox"))
+
+    assert client.get("/work/a").status_code == 200
+    assert client.get("/work/b", headers={"traceparent": REMOTE_TRACEPARENT}).status_code == 200
+
+    assert seen == [None, "4bf92f3577b34da6a3ce929d0e0e4736"]
@@ -48,6 +48,9 @@ class AgentConfig:
     coder: AgentModeConfig
     probe_timeout_seconds: int
     summary_write_timeout_seconds: int
+    probe_cache_ttl_seconds: int
+    probe_cache_max_entries: int
+    probe_index_timeout_seconds: int
 
     @classmethod
     def from_env(cls) -> "AgentConfig":
@@ -72,6 +75,10 @@ class AgentConfig:
             ),
             probe_timeout_seconds=_int("PROBE_TIMEOUT_SECONDS", 60),
             summary_write_timeout_seconds=_int("SUMMARY_WRITE_TIMEOUT_SECONDS", 120),
+            probe_cache_ttl_seconds=_int("PROBE_CACHE_TTL_SECONDS", 6 * 3600),
+            probe_cache_max_entries=_int("PROBE_CACHE_MAX_ENTRIES", 500, minimum=0),
+            # 0 disables answering lookup-style probes from the sandbox code index.
+            probe_index_timeout_seconds=_int("PROBE_INDEX_TIMEOUT_SECONDS", 5, minimum=0),
         )
 
     def for_mode(self, mode: str) -> AgentModeConfig:
@@ -5,6 +5,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from functools import lru_cache
 import os
+import tempfile
 from typing import Literal
 
 TRUE_VALUES = {"1", "true", "yes", "on", "enabled"}
@@ -105,6 +106,49 @@ class SandboxConfig:
     cache_root: str
     artifact_root: str
     command_timeout_seconds: int
+    control_channel_enabled: bool
+    output_memory_limit_bytes: int
+    output_spill_root: str
+    output_spill_segment_bytes: int
+    output_spill_max_segments: int
+    scheduler_agent_slots: int
+    scheduler_probe_slots: int
+    scheduler_file_op_slots: int
+    scheduler_max_queue: int
+    scheduler_min_free_memory_mb: int
+    scheduler_max_load_per_cpu: float
+    agent_daemon_enabled: bool
+    agent_daemon_socket: str
+    code_index_enabled: bool
+    code_index_refresh_seconds: int
+    code_index_query_max_age_seconds: float
+    browser_service_enabled: bool
+    browser_pool_size: int
+    dev_server_ready_timeout_seconds: int
+    runtime_directory_ttl_seconds: int
+    ws_send_queue_limit: int
+    ws_send_timeout_seconds: float
+    ws_coalesce_max_bytes: int
+    metrics_enabled: bool
+    metrics_token: str | None
+    profiling_enabled: bool
+    profiling_token: str | None
+    profiling_dir: str
+    profiling_interval_ms: int
+    profiling_max_seconds: int
+    loop_lag_threshold_ms: int
+    query_stats_headers: bool
+    query_budget_warn: int
+    query_repeat_warn: int
+    event_compaction_interval_seconds: int
+    event_compaction_grace_seconds: int
+    sandbox_event_retention_days: int
+    audit_event_retention_days: int
+    decision_step_retention_days: int
+    retention_batch_size: int
+    retention_interval_seconds: int
+    retention_archive_root: str
+    run_progress_flush_ms: int
     env_passthrough_keys: tuple[str, ...]
     env_passthrough_values: tuple[tuple[str, str], ...]
 
@@ -164,6 +208,61 @@ class SandboxConfig:
             cache_root=_str("SANDBOX_CACHE_ROOT", "/home/yudai/.cache"),
             artifact_root=_str("SANDBOX_ARTIFACT_ROOT", "/data/sandbox_artifacts"),
             command_timeout_seconds=_int("SANDBOX_COMMAND_TIMEOUT_SECONDS", 1800),
+            control_channel_enabled=_bool("SANDBOX_CONTROL_CHANNEL_ENABLED", True),
+            output_memory_limit_bytes=_int("SANDBOX_OUTPUT_MEMORY_LIMIT_BYTES", 1_048_576, minimum=1024),
+            output_spill_root=_str(
+                "SANDBOX_OUTPUT_SPILL_ROOT",
+                os.path.join(tempfile.gettempdir(), "yudai-output"),
+            ),
+            output_spill_segment_bytes=_int("SANDBOX_OUTPUT_SPILL_SEGMENT_BYTES", 64 * 1_048_576, minimum=1024),
+            output_spill_max_segments=_int("SANDBOX_OUTPUT_SPILL_MAX_SEGMENTS", 8),
+            scheduler_agent_slots=_int("SANDBOX_SCHEDULER_AGENT_SLOTS", 1),
+            scheduler_probe_slots=_int("SANDBOX_SCHEDULER_PROBE_SLOTS", 3),
+            scheduler_file_op_slots=_int("SANDBOX_SCHEDULER_FILE_OP_SLOTS", 4),
+            scheduler_max_queue=_int("SANDBOX_SCHEDULER_MAX_QUEUE", 32, minimum=0),
+            scheduler_min_free_memory_mb=_int("SANDBOX_SCHEDULER_MIN_FREE_MEMORY_MB", 256, minimum=0),
+            scheduler_max_load_per_cpu=_float("SANDBOX_SCHEDULER_MAX_LOAD_PER_CPU", 4.0),
+            agent_daemon_enabled=_bool("SANDBOX_AGENT_DAEMON_ENABLED", True),
+            agent_daemon_socket=_str(
+                "SANDBOX_AGENT_DAEMON_SOCKET",
+                os.path.join(tempfile.gettempdir(), "yudai-agent-daemon.sock"),
+            ),
+            code_index_enabled=_bool("SANDBOX_CODE_INDEX_ENABLED", True),
+            code_index_refresh_seconds=_int("SANDBOX_CODE_INDEX_REFRESH_SECONDS", 30),
+            code_index_query_max_age_seconds=_float("SANDBOX_CODE_INDEX_QUERY_MAX_AGE_SECONDS", 2.0),
+            browser_service_enabled=_bool("SANDBOX_BROWSER_SERVICE_ENABLED", True),
+            browser_pool_size=_int("SANDBOX_BROWSER_POOL_SIZE", 2),
+            dev_server_ready_timeout_seconds=_int("SANDBOX_DEV_SERVER_READY_TIMEOUT_SECONDS", 120),
+            runtime_directory_ttl_seconds=_int("SANDBOX_RUNTIME_DIRECTORY_TTL_SECONDS", 300, minimum=0),
+            ws_send_queue_limit=_int("REALTIME_WS_SEND_QUEUE_LIMIT", 512, minimum=8),
+            ws_send_timeout_seconds=_float("REALTIME_WS_SEND_TIMEOUT_SECONDS", 10.0),
+            ws_coalesce_max_bytes=_int("REALTIME_WS_COALESCE_MAX_BYTES", 65_536, minimum=1024),
+            metrics_enabled=_bool("YUDAI_METRICS_ENABLED", True),
+            metrics_token=_optional_str("YUDAI_METRICS_TOKEN"),
+            profiling_enabled=_bool("YUDAI_PROFILING_ENABLED", False),
+            profiling_token=_optional_str("YUDAI_PROFILING_TOKEN"),
+            profiling_dir=_str(
+                "YUDAI_PROFILING_DIR",
+                os.path.join(tempfile.gettempdir(), "yudai-profiles"),
+            ),
+            profiling_interval_ms=_int("YUDAI_PROFILING_INTERVAL_MS", 5),
+            profiling_max_seconds=_int("YUDAI_PROFILING_MAX_SECONDS", 120),
+            loop_lag_threshold_ms=_int("YUDAI_LOOP_LAG_THRESHOLD_MS", 0, minimum=0),
+            query_stats_headers=_bool("YUDAI_QUERY_STATS_HEADERS", False),
+            query_budget_warn=_int("YUDAI_QUERY_BUDGET_WARN", 50),
+            query_repeat_warn=_int("YUDAI_QUERY_REPEAT_WARN", 10, minimum=2),
+            event_compaction_interval_seconds=_int("SANDBOX_EVENT_COMPACTION_INTERVAL_SECONDS", 60, minimum=0),
+            event_compaction_grace_seconds=_int("SANDBOX_EVENT_COMPACTION_GRACE_SECONDS", 120, minimum=0),
+            sandbox_event_retention_days=_int("SANDBOX_EVENT_RETENTION_DAYS", 0, minimum=0),
+            audit_event_retention_days=_int("YUDAI_AUDIT_EVENT_RETENTION_DAYS", 0, minimum=0),
+            decision_step_retention_days=_int("YUDAI_DECISION_STEP_RETENTION_DAYS", 0, minimum=0),
+            retention_batch_size=_int("YUDAI_RETENTION_BATCH_SIZE", 1000),
+            retention_interval_seconds=_int("YUDAI_RETENTION_INTERVAL_SECONDS", 3600, minimum=0),
+            retention_archive_root=_str(
+                "YUDAI_RETENTION_ARCHIVE_ROOT",
+                os.path.join(tempfile.gettempdir(), "yudai-archive"),
+            ),
+            run_progress_flush_ms=_int("SANDBOX_RUN_PROGRESS_FLUSH_MS", 1000, minimum=0),
             env_passthrough_keys=env_passthrough_keys,
             env_passthrough_values=env_passthrough_values,
         )
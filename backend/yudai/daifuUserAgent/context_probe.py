@@ -3,10 +3,9 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import re
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from typing import Any, Dict, List, Optional
 
 from fastapi import HTTPException
@@ -20,13 +19,25 @@ from yudai.models import (
     UserQuestion,
     UserQuestionStatus,
 )
+from yudai.realtime.agent_daemon import agent_runner_shell_lines
 from yudai.realtime.lifecycle import SandboxExecBroker
 from yudai.realtime.modal_sandbox import (
     SANDBOX_MSWEA_CONFIG_ROOT,
     SANDBOX_WORKSPACE_PATH,
 )
+from yudai.realtime.sandbox_scheduler import JOB_CLASS_FILE_OP, JOB_CLASS_PROBE
+from yudai.realtime.stream_parser import StreamingOutputParser
 from sqlalchemy.orm import Session
 
+from .probe_fast_path import classify_probe_query, format_index_answer
+from .probe_cache import (
+    ProbeCache,
+    ProbeTreeState,
+    build_tree_state_command,
+    get_probe_cache,
+    parse_tree_state,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,6 +57,8 @@ class ProbeResult:
     duration_ms: int
     query: Optional[str] = None
     error: Optional[str] = None
+    cached: bool = False
+    from_index: bool = False
 
 
 class ContextProbeService:
@@ -53,14 +66,14 @@ class ContextProbeService:
 
     PROBE_CONFIG_PATH = f"{SANDBOX_MSWEA_CONFIG_ROOT}/probe/config.yaml"
     PROBE_TIMEOUT_SECONDS = 60
-    OUTPUT_BEGIN = "__YUDAI_PROBE_OUTPUT_BEGIN__"
-    OUTPUT_END = "__YUDAI_PROBE_OUTPUT_END__"
     MAX_CONTEXT_CHARS_PER_PROBE = 6000
     MAX_PROBE_TASK_CHARS = 12000
     MAX_PROBE_CONVERSATION_CHARS = 7000
+    TREE_STATE_TIMEOUT_SECONDS = 20
 
-    def __init__(self, broker: SandboxExecBroker):
+    def __init__(self, broker: SandboxExecBroker, cache: Optional[ProbeCache] = None):
         self.broker = broker
+        self.cache = cache or get_probe_cache()
 
     async def run_probe(
         self,
@@ -71,6 +84,90 @@ class ContextProbeService:
     ) -> ProbeResult:
         """Run a single mini Architect probe with a natural-language query."""
 
+        tree_state = None
+        if self.has_active_sandbox(db, session):
+            indexed = await self._answer_from_index(db, session=session, probe=probe)
+            if indexed is not None:
+                return indexed
+            tree_state = await self.resolve_tree_state(db, session=session)
+        return await self._run_probe(db, session=session, probe=probe, tree_state=tree_state)
+
+    async def _answer_from_index(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        probe: ProbeRequest,
+    ) -> Optional[ProbeResult]:
+        """Answer lookup-style questions from the sandbox code index, if possible."""
+
+        timeout_seconds = get_agent_config().probe_index_timeout_seconds
+        lookup = classify_probe_query(probe.query)
+        if lookup is None or timeout_seconds <= 0:
+            return None
+        started = asyncio.get_running_loop().time()
+        try:
+            payload = await self.broker.query_code_index(
+                db,
+                session=session,
+                kind=lookup.kind,
+                term=lookup.term,
+                workspace=session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH,
+                timeout_seconds=timeout_seconds,
+            )
+        except Exception:
+            logger.debug("Code index lookup failed for %s; using the probe agent", probe.probe_id, exc_info=True)
+            return None
+        answer = format_index_answer(lookup, payload)
+        if answer is None:
+            return None
+        output_text, files = answer
+        return ProbeResult(
+            probe_id=probe.probe_id,
+            query=probe.query,
+            status="completed",
+            output_text=output_text,
+            summary=None,
+            files=files,
+            duration_ms=int((asyncio.get_running_loop().time() - started) * 1000),
+            from_index=True,
+        )
+
+    async def resolve_tree_state(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+    ) -> Optional[ProbeTreeState]:
+        """Read the workspace ``HEAD`` and dirty-tree hash used as the cache key."""
+
+        if not self.cache.enabled or not self.cache.repo_key(session):
+            return None
+        workspace = session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH
+        try:
+            result = await self.broker.run_command(
+                db,
+                session=session,
+                command=build_tree_state_command(workspace),
+                cwd=workspace,
+                timeout_seconds=self.TREE_STATE_TIMEOUT_SECONDS,
+                job_class=JOB_CLASS_FILE_OP,
+            )
+        except Exception:
+            logger.debug("Failed to resolve tree state for %s", session.session_id, exc_info=True)
+            return None
+        if int(result.get("exit_code") or 0) != 0:
+            return None
+        return parse_tree_state(str(result.get("stdout") or ""))
+
+    async def _run_probe(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        probe: ProbeRequest,
+        tree_state: Optional[ProbeTreeState],
+    ) -> ProbeResult:
         started = asyncio.get_running_loop().time()
         if not self.has_active_sandbox(db, session):
             return ProbeResult(
@@ -84,6 +181,11 @@ class ContextProbeService:
                 error="No active sandbox runtime is available for this session.",
             )
 
+        cached = self._cached_result(db, session=session, probe=probe, tree_state=tree_state)
+        if cached is not None:
+            cached.duration_ms = int((asyncio.get_running_loop().time() - started) * 1000)
+            return cached
+
         workspace = session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH
         output_path = f"{workspace}/.yudai/probes/{probe.probe_id}.md"
         task_text = self._build_probe_task(db, session=session, query=probe.query)
@@ -104,6 +206,11 @@ class ContextProbeService:
 
         env.update(dict(get_sandbox_config().env_passthrough_values))
 
+        parser = StreamingOutputParser()
+
+        async def _collect_output(event: Dict[str, Any]) -> None:
+            parser.feed_event(event)
+
         try:
             result = await self.broker.run_command(
                 db,
@@ -112,6 +219,8 @@ class ContextProbeService:
                 cwd=workspace,
                 env=env,
                 timeout_seconds=get_agent_config().probe_timeout_seconds,
+                on_event=_collect_output,
+                job_class=JOB_CLASS_PROBE,
             )
         except HTTPException as exc:
             status = "no_sandbox" if exc.status_code in {404, 409, 410, 503} else "error"
@@ -124,11 +233,14 @@ class ContextProbeService:
         stdout = str(result.get("stdout") or "")
         stderr = str(result.get("stderr") or "")
         combined = f"{stdout}\n{stderr}".strip()
-        output_text = self._extract_marked_output(stdout).strip()
+        if not parser.completed:
+            parser.reset()
+            parser.feed_text(stdout, stderr)
+        output_text = await self._read_probe_output(db, session=session, path=output_path, workspace=workspace)
         if not output_text:
             output_text = combined
 
-        parsed = self._parse_json_summary(combined)
+        parsed = parser.last_json() or {}
         summary = parsed.get("summary") if isinstance(parsed.get("summary"), str) else None
         files = self._coerce_files(parsed.get("files"))
 
@@ -136,7 +248,7 @@ class ContextProbeService:
         if not files:
             files = self._extract_file_paths(output_text)
 
-        return ProbeResult(
+        probe_result = ProbeResult(
             probe_id=probe.probe_id,
             query=probe.query,
             status=status,
@@ -146,6 +258,84 @@ class ContextProbeService:
             duration_ms=int(result.get("duration_ms") or 0),
             error=None if status == "completed" else stderr or stdout,
         )
+        if status == "completed":
+            self._store_result(db, session=session, result=probe_result, tree_state=tree_state)
+        return probe_result
+
+    async def _read_probe_output(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        path: str,
+        workspace: str,
+    ) -> str:
+        """Fetch the probe's markdown answer through the sandbox file API.
+
+        Any failure returns an empty string so the caller falls back to the
+        streamed command output.
+        """
+        try:
+            data = await self.broker.read_file(db, session=session, path=path, workspace=workspace)
+        except FileNotFoundError:
+            return ""
+        except Exception as exc:
+            logger.debug("Probe output read failed for %s: %s", path, exc)
+            return ""
+        return data.decode("utf-8", errors="replace").strip()
+
+    def _cached_result(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        probe: ProbeRequest,
+        tree_state: Optional[ProbeTreeState],
+    ) -> Optional[ProbeResult]:
+        repo_key = self.cache.repo_key(session)
+        if tree_state is None or not repo_key:
+            return None
+        try:
+            payload = self.cache.get(db, repo_key=repo_key, state=tree_state, query=probe.query)
+        except Exception:
+            db.rollback()
+            logger.warning("Probe cache lookup failed for %s", probe.probe_id, exc_info=True)
+            return None
+        if payload is None:
+            return None
+        return ProbeResult(
+            probe_id=probe.probe_id,
+            query=probe.query,
+            status=str(payload.get("status") or "completed"),
+            output_text=str(payload.get("output_text") or ""),
+            summary=payload.get("summary") if isinstance(payload.get("summary"), str) else None,
+            files=self._coerce_files(payload.get("files")),
+            duration_ms=0,
+            cached=True,
+        )
+
+    def _store_result(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        result: ProbeResult,
+        tree_state: Optional[ProbeTreeState],
+    ) -> None:
+        repo_key = self.cache.repo_key(session)
+        if tree_state is None or not repo_key or not result.query:
+            return
+        try:
+            self.cache.put(
+                db,
+                repo_key=repo_key,
+                state=tree_state,
+                query=result.query,
+                result=asdict(result),
+            )
+        except Exception:
+            db.rollback()
+            logger.warning("Probe cache store failed for %s", result.probe_id, exc_info=True)
 
     async def run_probes_parallel(
         self,
@@ -156,11 +346,28 @@ class ContextProbeService:
     ) -> List[ProbeResult]:
         """Run up to three probes concurrently and normalize failures."""
 
-        tasks = [self.run_probe(db, session=session, probe=p) for p in probes[:3]]
-        raw_results = await asyncio.gather(*tasks, return_exceptions=True)
+        probes = probes[:3]
+        answered: List[Optional[ProbeResult]] = [None] * len(probes)
+        tree_state = None
+        if self.has_active_sandbox(db, session):
+            answered = list(
+                await asyncio.gather(
+                    *(self._answer_from_index(db, session=session, probe=p) for p in probes)
+                )
+            )
+            if any(result is None for result in answered):
+                tree_state = await self.resolve_tree_state(db, session=session)
+        pending = [index for index, result in enumerate(answered) if result is None]
+        tasks = [
+            self._run_probe(db, session=session, probe=probes[index], tree_state=tree_state)
+            for index in pending
+        ]
+        raw_results: List[Any] = list(answered)
+        for index, result in zip(pending, await asyncio.gather(*tasks, return_exceptions=True)):
+            raw_results[index] = result
 
         results: List[ProbeResult] = []
-        for probe, result in zip(probes[:3], raw_results):
+        for probe, result in zip(probes, raw_results):
             if isinstance(result, ProbeResult):
                 results.append(result)
             else:
@@ -354,9 +561,14 @@ class ContextProbeService:
                 body += "\n\n[truncated]"
 
             query = result.query or result.probe_id
+            status = result.status
+            if result.cached:
+                status += " (cached answer for the same repository tree)"
+            elif result.from_index:
+                status += " (answered from the sandbox code index)"
             section_lines = [
                 f'## Query: "{query}"',
-                f"Status: {result.status}",
+                f"Status: {status}",
                 "",
                 body,
             ]
@@ -457,15 +669,11 @@ class ContextProbeService:
             'printf "[probe:%s] running:" "$probe_id"',
             'printf " %q" "${cmd[@]}"',
             'printf "\\n"',
+            *agent_runner_shell_lines(),
             'set +e',
-            '"${cmd[@]}"',
+            'run_mini "${cmd[@]}"',
             'exit_code=$?',
             'set -e',
-            f'printf "\\n{self.OUTPUT_BEGIN}\\n"',
-            'if [ -f "$probe_output" ]; then',
-            '  cat "$probe_output"',
-            'fi',
-            f'printf "\\n{self.OUTPUT_END}\\n"',
             'exit "$exit_code"',
         ]
         return "\n".join(command_lines)
@@ -489,29 +697,6 @@ class ContextProbeService:
             error=error,
         )
 
-    @classmethod
-    def _extract_marked_output(cls, stdout: str) -> str:
-        pattern = re.compile(
-            rf"{re.escape(cls.OUTPUT_BEGIN)}\n?(?P<body>.*?){re.escape(cls.OUTPUT_END)}",
-            re.DOTALL,
-        )
-        match = pattern.search(stdout or "")
-        return match.group("body") if match else ""
-
-    @staticmethod
-    def _parse_json_summary(output_text: str) -> Dict[str, Any]:
-        for line in reversed((output_text or "").splitlines()):
-            raw = line.strip()
-            if not raw.startswith("{") or not raw.endswith("}"):
-                continue
-            try:
-                payload = json.loads(raw)
-            except json.JSONDecodeError:
-                continue
-            if isinstance(payload, dict):
-                return payload
-        return {}
-
     @staticmethod
     def _coerce_files(value: Any) -> List[str]:
         if not isinstance(value, list):
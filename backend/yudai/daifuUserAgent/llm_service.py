@@ -13,11 +13,20 @@ from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import httpx
 from fastapi import HTTPException, status
 from yudai.config import get_model_config
+from yudai.utils.metrics import LLM_FIRST_TOKEN_SECONDS, LLM_REQUEST_SECONDS
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
 
+def _record_llm_request(model: str, *, streaming: bool, outcome: str, request_start: float) -> None:
+    # request_start stays 0 when the call failed before reaching the network.
+    if request_start:
+        LLM_REQUEST_SECONDS.labels(model, "true" if streaming else "false", outcome).observe(
+            time.time() - request_start
+        )
+
+
 @dataclass
 class DaifuParsedResponse:
     text: str = ""
@@ -526,11 +535,13 @@ class LLMService:
 
             processing_time = (time.time() - request_start) * 1000
             logger.info(f"LLM response generated in {processing_time:.2f}ms")
+            _record_llm_request(model, streaming=False, outcome="ok", request_start=request_start)
             return reply
 
         except httpx.TimeoutException as e:
             processing_time = (time.time() - request_start) * 1000
             logger.error(f"LLM request timeout after {processing_time:.2f}ms: {e}")
+            _record_llm_request(model, streaming=False, outcome="timeout", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_504_GATEWAY_TIMEOUT,
                 detail="LLM request timed out",
@@ -541,6 +552,7 @@ class LLMService:
             logger.error(
                 f"LLM HTTP error after {processing_time:.2f}ms: {e.response.status_code if e.response else 'unknown'} {content}"
             )
+            _record_llm_request(model, streaming=False, outcome="http_error", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail=f"LLM HTTP error: {content}",
@@ -550,6 +562,7 @@ class LLMService:
             logger.exception(
                 f"LLM processing failed after {processing_time:.2f}ms: {str(e)}"
             )
+            _record_llm_request(model, streaming=False, outcome="error", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"LLM call failed: {str(e)}",
@@ -575,6 +588,7 @@ class LLMService:
         max_tokens = max_tokens or model_config.max_tokens
         timeout = timeout or model_config.timeout_seconds
         request_start: float = 0.0
+        first_token_seen = False
 
         try:
             api_key = LLMService.get_api_key()
@@ -626,14 +640,19 @@ class LLMService:
                         delta = choices[0].get("delta") or {}
                         chunk = delta.get("content")
                         if isinstance(chunk, str) and chunk:
+                            if not first_token_seen:
+                                first_token_seen = True
+                                LLM_FIRST_TOKEN_SECONDS.labels(model).observe(time.time() - request_start)
                             yield chunk
 
             processing_time = (time.time() - request_start) * 1000
             logger.info("LLM response streamed in %.2fms", processing_time)
+            _record_llm_request(model, streaming=True, outcome="ok", request_start=request_start)
 
         except httpx.TimeoutException as e:
             processing_time = (time.time() - request_start) * 1000
             logger.error("LLM stream timeout after %.2fms: %s", processing_time, e)
+            _record_llm_request(model, streaming=True, outcome="timeout", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_504_GATEWAY_TIMEOUT,
                 detail="LLM request timed out",
@@ -647,6 +666,7 @@ class LLMService:
                 e.response.status_code if e.response else "unknown",
                 content,
             )
+            _record_llm_request(model, streaming=True, outcome="http_error", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail=f"LLM HTTP error: {content}",
@@ -654,6 +674,7 @@ class LLMService:
         except Exception as e:
             processing_time = (time.time() - request_start) * 1000
             logger.exception("LLM streaming failed after %.2fms: %s", processing_time, e)
+            _record_llm_request(model, streaming=True, outcome="error", request_start=request_start)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"LLM stream failed: {str(e)}",
@@ -0,0 +1,210 @@
+"""Controller-side cache of context-probe answers keyed by repository tree state."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from yudai.config import get_agent_config
+from yudai.models import ChatSession, ProbeCacheEntry
+from yudai.utils import ensure_utc, utc_now
+
+logger = logging.getLogger(__name__)
+
+TREE_STATE_MARKER = "__YUDAI_TREE_STATE__"
+_TREE_STATE_RE = re.compile(
+    rf"{TREE_STATE_MARKER} (?P<head>[0-9a-f]{{7,64}}) (?P<tree>[0-9a-f]{{64}})"
+)
+_CACHED_FIELDS = ("status", "output_text", "summary", "files")
+CLEAN_TREE_HASH = hashlib.sha256(b"").hexdigest()
+
+
+@dataclass(frozen=True)
+class ProbeTreeState:
+    """Workspace ``HEAD`` plus a hash of every uncommitted change."""
+
+    head_sha: str
+    tree_hash: str
+
+
+def build_tree_state_command(workspace: str) -> str:
+    """Bash snippet printing the workspace tree state; ``.yudai`` is excluded
+    so probe output files never invalidate the cache they feed."""
+
+    pathspec = "-- . ':(exclude).yudai'"
+    return "\n".join(
+        [
+            "set -uo pipefail",
+            f'cd "{workspace}" || exit 3',
+            "git rev-parse --is-inside-work-tree >/dev/null 2>&1 || exit 3",
+            "head_sha=$(git rev-parse HEAD 2>/dev/null) || exit 3",
+            "tree_hash=$({",
+            f"  git status --porcelain=v1 --untracked-files=all {pathspec} 2>/dev/null",
+            f"  git diff HEAD --binary {pathspec} 2>/dev/null",
+            f"  git ls-files -z --others --exclude-standard {pathspec} 2>/dev/null"
+            " | xargs -0 -r sha256sum 2>/dev/null",
+            "} | sha256sum | cut -d' ' -f1)",
+            f'printf "{TREE_STATE_MARKER} %s %s\\n" "$head_sha" "$tree_hash"',
+        ]
+    )
+
+
+def parse_tree_state(output: str) -> Optional[ProbeTreeState]:
+    match = _TREE_STATE_RE.search(output or "")
+    if match is None:
+        return None
+    return ProbeTreeState(head_sha=match.group("head"), tree_hash=match.group("tree"))
+
+
+class ProbeCache:
+    """Persistent probe answer store with TTL expiry and LRU eviction.
+
+    Entries are keyed by repository, tree state and normalized query, so any
+    commit or edit in the workspace produces a different key. When a new
+    dirty state is stored, entries for older dirty states of the same
+    ``HEAD`` are dropped since those trees are unlikely to come back; the
+    clean-tree entries for that ``HEAD`` are kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        config = get_agent_config()
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.probe_cache_ttl_seconds
+        self.max_entries = max_entries if max_entries is not None else config.probe_cache_max_entries
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join((query or "").lower().split()).rstrip(" ?.!")
+
+    @staticmethod
+    def repo_key(session: ChatSession) -> Optional[str]:
+        if session.repo_owner and session.repo_name:
+            return f"{session.repo_owner}/{session.repo_name}".lower()
+        repo_url = (session.repo_url or "").strip().lower()
+        if repo_url.endswith(".git"):
+            repo_url = repo_url[:-4]
+        return repo_url or None
+
+    @classmethod
+    def cache_key(cls, repo_key: str, state: ProbeTreeState, query: str) -> str:
+        material = "\0".join(
+            [repo_key, state.head_sha, state.tree_hash, cls.normalize_query(query)]
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(
+        self,
+        db: Session,
+        *,
+        repo_key: str,
+        state: ProbeTreeState,
+        query: str,
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached result fields for this probe, or ``None`` on a miss."""
+
+        if not self.enabled:
+            return None
+        entry = db.get(ProbeCacheEntry, self.cache_key(repo_key, state, query))
+        if entry is None:
+            return None
+        now = utc_now()
+        if ensure_utc(entry.expires_at) <= now:
+            db.delete(entry)
+            db.commit()
+            return None
+        entry.last_used_at = now
+        entry.hit_count = (entry.hit_count or 0) + 1
+        payload = dict(entry.result or {})
+        db.commit()
+        return payload
+
+    def put(
+        self,
+        db: Session,
+        *,
+        repo_key: str,
+        state: ProbeTreeState,
+        query: str,
+        result: Dict[str, Any],
+    ) -> None:
+        if not self.enabled:
+            return
+        now = utc_now()
+        key = self.cache_key(repo_key, state, query)
+        payload = {name: result.get(name) for name in _CACHED_FIELDS}
+        entry = db.get(ProbeCacheEntry, key)
+        if entry is None:
+            entry = ProbeCacheEntry(
+                cache_key=key,
+                repo_key=repo_key,
+                head_sha=state.head_sha,
+                tree_hash=state.tree_hash,
+                query_text=self.normalize_query(query),
+                hit_count=0,
+                created_at=now,
+            )
+            db.add(entry)
+        entry.result = payload
+        entry.last_used_at = now
+        entry.expires_at = now + timedelta(seconds=self.ttl_seconds)
+        db.flush()
+        self._evict(db, repo_key=repo_key, state=state)
+        db.commit()
+
+    def _evict(self, db: Session, *, repo_key: str, state: ProbeTreeState) -> None:
+        db.execute(
+            delete(ProbeCacheEntry)
+            .where(
+                ProbeCacheEntry.repo_key == repo_key,
+                ProbeCacheEntry.head_sha == state.head_sha,
+                ProbeCacheEntry.tree_hash != state.tree_hash,
+                ProbeCacheEntry.tree_hash != CLEAN_TREE_HASH,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            delete(ProbeCacheEntry)
+            .where(ProbeCacheEntry.expires_at <= utc_now())
+            .execution_options(synchronize_session=False)
+        )
+        overflow_keys = (
+            db.execute(
+                select(ProbeCacheEntry.cache_key)
+                .order_by(ProbeCacheEntry.last_used_at.desc())
+                .offset(self.max_entries)
+            )
+            .scalars()
+            .all()
+        )
+        if overflow_keys:
+            db.execute(
+                delete(ProbeCacheEntry)
+                .where(ProbeCacheEntry.cache_key.in_(overflow_keys))
+                .execution_options(synchronize_session=False)
+            )
+            logger.debug("Evicted %d probe cache entries", len(overflow_keys))
+
+
+_probe_cache_singleton: Optional[ProbeCache] = None
+
+
+def get_probe_cache() -> ProbeCache:
+    global _probe_cache_singleton
+    if _probe_cache_singleton is None:
+        _probe_cache_singleton = ProbeCache()
+    return _probe_cache_singleton
@@ -0,0 +1,118 @@
+"""Answer lookup-style probe questions from the sandbox code index.
+
+Questions such as "where is ``build_envelope`` defined" or "which files
+import ``sandbox_scheduler``" only need a symbol or import table, so they are
+classified here and sent to the sandbox index instead of starting an agent.
+Anything that does not match a narrow pattern, or returns no hits, goes
+through the regular probe agent.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class IndexLookup:
+    kind: str
+    term: str
+
+
+_TERM = r"(?P<term>.+?)"
+_SYMBOL_NOUN = r"(?:(?:the\s+)?(?:function|method|class|type|interface|struct|enum|constant|symbol)\s+)?"
+_QUESTION_PATTERNS: Tuple[Tuple[str, str], ...] = (
+    (
+        "definition",
+        rf"^(?:where|in which file)\s+(?:is|are)\s+{_SYMBOL_NOUN}{_TERM}\s+(?:defined|declared|implemented)$",
+    ),
+    (
+        "definition",
+        rf"^(?:find|show|locate|where is)\s+(?:the\s+)?(?:definition|declaration)s?\s+(?:of|for)\s+"
+        rf"{_SYMBOL_NOUN}{_TERM}$",
+    ),
+    (
+        "definition",
+        rf"^(?:where|in which file)\s+is\s+(?:the\s+)?(?:function|method|class|type|interface|struct|enum)\s+{_TERM}$",
+    ),
+    ("importers", rf"^(?:which|what)\s+(?:files?|modules?)\s+(?:imports?|requires?)\s+{_TERM}$"),
+    ("importers", rf"^(?:who|what)\s+imports\s+{_TERM}$"),
+    (
+        "references",
+        rf"^(?:where|in which files?)\s+(?:is|are)\s+{_SYMBOL_NOUN}{_TERM}\s+(?:used|called|referenced)$",
+    ),
+    (
+        "references",
+        rf"^(?:find|show|list)\s+(?:all\s+)?(?:usages|uses|references|callers)\s+(?:of|to)\s+{_SYMBOL_NOUN}{_TERM}$",
+    ),
+    ("files", rf"^(?:list|show|find)\s+(?:all\s+)?(?:the\s+)?files\s+(?:named|called|matching)\s+{_TERM}$"),
+)
+_COMPILED_PATTERNS = tuple((kind, re.compile(pattern, re.IGNORECASE)) for kind, pattern in _QUESTION_PATTERNS)
+_ROUTES_RE = re.compile(
+    r"^(?:list|show|what are)\s+(?:all\s+)?(?:of\s+)?(?:the\s+)?(?:api\s+|http\s+)?(?:routes|endpoints)"
+    r"(?:\s+(?:in|of)\s+(?:the\s+|this\s+)?(?:repo|repository|project|app|application|backend|server))?$",
+    re.IGNORECASE,
+)
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_$@][\w$@./:-]*$")
+
+
+def _clean_term(raw: str) -> Optional[str]:
+    term = raw.strip().strip("`'\"").strip()
+    if term.endswith("()"):
+        term = term[:-2]
+    if not term or len(term) > 200 or not _IDENTIFIER_RE.match(term):
+        return None
+    return term
+
+
+def classify_probe_query(query: str) -> Optional[IndexLookup]:
+    """Map a probe question to an index lookup, or ``None`` for agent probes."""
+
+    normalized = " ".join((query or "").split()).rstrip(" ?.!")
+    if not normalized:
+        return None
+    if _ROUTES_RE.match(normalized):
+        return IndexLookup(kind="routes", term="")
+    for kind, pattern in _COMPILED_PATTERNS:
+        match = pattern.match(normalized)
+        if match is None:
+            continue
+        term = _clean_term(match.group("term"))
+        if term is None:
+            return None
+        return IndexLookup(kind=kind, term=term)
+    return None
+
+
+_HEADINGS = {
+    "definition": "Definitions of `{term}`",
+    "references": "References to `{term}`",
+    "importers": "Files importing `{term}`",
+    "routes": "HTTP routes",
+    "files": "Files matching `{term}`",
+    "search": "Matches for `{term}`",
+}
+
+
+def format_index_answer(lookup: IndexLookup, payload: Dict[str, Any]) -> Optional[Tuple[str, List[str]]]:
+    """Render index matches as probe output text plus the referenced files."""
+
+    matches = [match for match in payload.get("matches") or [] if isinstance(match, dict) and match.get("path")]
+    if not matches:
+        return None
+    lines = [_HEADINGS.get(lookup.kind, "Matches").format(term=lookup.term) + " (from the code index):"]
+    files: List[str] = []
+    for match in matches:
+        path = str(match["path"])
+        location = f"{path}:{match['line']}" if match.get("line") else path
+        if match.get("symbol"):
+            detail = f"{match.get('symbol_kind') or 'symbol'} {match['symbol']}"
+        else:
+            detail = str(match.get("text") or "").strip()
+        lines.append(f"- {location}" + (f" — {detail}" if detail else ""))
+        if path not in files:
+            files.append(path)
+    if payload.get("truncated"):
+        lines.append("- … more matches omitted")
+    return "\n".join(lines), files
@@ -62,6 +62,8 @@ CRITICAL ISSUES:
 
 """
 
+import heapq
+import itertools
 import json
 import logging
 
@@ -74,6 +76,8 @@ from yudai.auth.github_oauth import get_current_user
 from yudai.config.realtime_flags import get_realtime_feature_flags
 from yudai.db.database import get_db
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from yudai.realtime.callback_store import run_progress_view
+from yudai.realtime.event_compaction import ReplayEvent, iter_segment_events
 from yudai.realtime.lifecycle import get_realtime_lifecycle_service
 from yudai.realtime.mode_orchestrator import (
     ExecutionConflictError,
@@ -94,6 +98,7 @@ from yudai.models import (
     ChatSession,
     ContextCard,
     SandboxExecutionEvent,
+    SandboxExecutionEventSegment,
     SandboxExecutionRun,
     SessionArtifact,
     SessionMode,
@@ -125,6 +130,7 @@ from yudai.types import (
     ExecutionResponse,
     ExecutionStatusResponse,
     ExecutionTraceEventResponse,
+    ExecutionTraceResponse,
     FrontendBrowserCheckToolRequest,
     GitHubBranchResponse,
     GitHubIssueResponse,
@@ -142,9 +148,10 @@ from yudai.types import (
     UserQuestionResponse,
 )
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
 from yudai.utils import utc_now
+from yudai.utils.tracing import build_span_tree
 
 from .mode_tools import get_daifu_issue_tool_service, get_daifu_mode_tool_service
 from .session_service import MemoryService, SessionService
@@ -2111,6 +2118,51 @@ def _execution_trace_event(
     )
 
 
+def _replay_key(event: ReplayEvent, now: datetime) -> tuple:
+    # Same ordering the response is sorted by once events become trace events.
+    return (event.created_at or now, event.sequence, f"sandbox:{event.controller_job_id}:{event.sequence}")
+
+
+def _newest_sandbox_events(db: Session, session_pk: int, limit: int) -> List[ReplayEvent]:
+    """Stream a session's sandbox events and keep only the newest ``limit``.
+
+    Only those can survive the replay's final ``[-limit:]`` cut. Each segment
+    is decoded from the tail its sequence index points at, and segments that
+    ended before everything already kept are not decoded at all.
+    """
+
+    now = utc_now()
+    order = itertools.count()
+    newest: List[tuple] = []
+
+    def keep(event: ReplayEvent) -> None:
+        item = (_replay_key(event, now), next(order), event)
+        if len(newest) < limit:
+            heapq.heappush(newest, item)
+        elif item[0] > newest[0][0]:
+            heapq.heapreplace(newest, item)
+
+    segments = (
+        db.query(SandboxExecutionEventSegment)
+        .filter(SandboxExecutionEventSegment.session_id == session_pk)
+        .order_by(SandboxExecutionEventSegment.last_event_at.desc(), SandboxExecutionEventSegment.id.desc())
+        .yield_per(16)
+    )
+    for segment in segments:
+        if len(newest) >= limit and segment.last_event_at is not None and segment.last_event_at < newest[0][0][0]:
+            continue
+        for event in iter_segment_events(segment, last=limit):
+            keep(event)
+    rows = (
+        db.query(SandboxExecutionEvent)
+        .filter(SandboxExecutionEvent.session_id == session_pk)
+        .yield_per(500)
+    )
+    for row in rows:
+        keep(ReplayEvent.from_row(row))
+    return [event for _key, _order, event in sorted(newest)]
+
+
 @router.get(
     "/sessions/{session_id}/execution/events",
     response_model=List[ExecutionTraceEventResponse],
@@ -2195,16 +2247,7 @@ async def get_session_execution_events(
                 )
             )
 
-    sandbox_events = (
-        db.query(SandboxExecutionEvent)
-        .filter(SandboxExecutionEvent.session_id == db_session.id)
-        .order_by(
-            SandboxExecutionEvent.created_at.asc(),
-            SandboxExecutionEvent.controller_job_id.asc(),
-            SandboxExecutionEvent.sequence.asc(),
-        )
-        .all()
-    )
+    sandbox_events = _newest_sandbox_events(db, db_session.id, limit)
     for event in sandbox_events:
         metadata = event.event_metadata if isinstance(event.event_metadata, dict) else {}
         trace_events.append(
@@ -2236,6 +2279,7 @@ async def get_session_execution_events(
         .all()
     )
     for run in sandbox_runs:
+        progress = run_progress_view(run)
         trace_events.append(
             _execution_trace_event(
                 event_id=f"sandbox_run:{run.id}",
@@ -2247,7 +2291,8 @@ async def get_session_execution_events(
                 payload={
                     "controller_job_id": run.controller_job_id,
                     "sandbox_job_id": run.sandbox_job_id,
-                    "status": run.status,
+                    "status": progress["status"],
+                    "last_sequence": progress["last_sequence"],
                     "command": run.command,
                     "cwd": run.cwd,
                     "exit_code": run.exit_code,
@@ -2337,6 +2382,83 @@ async def get_session_execution_events(
     )[-limit:]
 
 
+def _find_span(node: Dict[str, Any], attribute: str, value: str) -> Optional[Dict[str, Any]]:
+    if (node.get("attributes") or {}).get(attribute) == value:
+        return node
+    for child in node.get("children") or []:
+        match = _find_span(child, attribute, value)
+        if match is not None:
+            return match
+    return None
+
+
+@router.get(
+    "/sessions/{session_id}/execution/{execution_id}/trace",
+    response_model=ExecutionTraceResponse,
+)
+async def get_session_execution_trace(
+    session_id: str,
+    execution_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Return the persisted span tree for a pipeline or one of its modes."""
+    db_session = SessionService.ensure_owned_session(db, current_user.id, session_id)
+    execution = (
+        db.query(AgentExecution)
+        .filter(
+            AgentExecution.id == execution_id,
+            AgentExecution.session_id == db_session.id,
+        )
+        .first()
+    )
+    if execution is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Execution not found")
+
+    metadata = execution.execution_metadata if isinstance(execution.execution_metadata, dict) else {}
+    summary = metadata.get("trace")
+    root = build_span_tree(summary) if isinstance(summary, dict) else None
+    if root is None and metadata.get("pipeline_execution_id"):
+        # Mode executions share the pipeline's trace; serve their own subtree.
+        pipeline = (
+            db.query(AgentExecution)
+            .filter(
+                AgentExecution.id == str(metadata["pipeline_execution_id"]),
+                AgentExecution.session_id == db_session.id,
+            )
+            .first()
+        )
+        pipeline_metadata = (
+            pipeline.execution_metadata
+            if pipeline is not None and isinstance(pipeline.execution_metadata, dict)
+            else {}
+        )
+        summary = pipeline_metadata.get("trace")
+        pipeline_root = build_span_tree(summary) if isinstance(summary, dict) else None
+        if pipeline_root is not None:
+            root = _find_span(pipeline_root, "mode_execution_id", execution.id)
+    if root is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No trace recorded for this execution",
+        )
+
+    phases: Dict[str, int] = {}
+    pending = list(root["children"])
+    while pending:
+        node = pending.pop()
+        phases[node["name"]] = phases.get(node["name"], 0) + int(node.get("duration_ms") or 0)
+        pending.extend(node["children"])
+    return ExecutionTraceResponse(
+        execution_id=execution.id,
+        trace_id=summary["trace_id"],
+        duration_ms=int(root.get("duration_ms") or 0),
+        phases=phases,
+        dropped_spans=int(summary.get("dropped_spans") or 0),
+        root=root,
+    )
+
+
 async def _emit_stop_summary(
     db: Session,
     *,
@@ -2904,6 +3026,7 @@ async def get_session_trajectories(
         # Get all solves for this session
         solves = (
             db.query(Solve)
+            .options(selectinload(Solve.runs))
             .filter(
                 Solve.session_id == db_session.id,
                 Solve.user_id == current_user.id,
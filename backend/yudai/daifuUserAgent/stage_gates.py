@@ -6,8 +6,8 @@ import uuid
 from typing import Any, Dict, Optional
 
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
 
+from yudai.db.json_patch import patch_json
 from yudai.models import ChatSession, SessionMode, SessionModeStatus, UserQuestion, UserQuestionStatus
 from yudai.utils import utc_now
 
@@ -261,19 +261,19 @@ def ensure_stage_gate_question(
 
 
 def clear_stage_gate_metadata(session: ChatSession) -> None:
-    metadata = dict(session.mode_metadata or {})
-    for key in (
-        "pending_daifu_tool",
-        "pending_stage_tool_objective",
-        "pending_stage_tool_issue_url",
-        "pending_stage_tool_issue_number",
-        "pending_stage_gate_question_id",
-        "pending_stage_gate",
-        "approved_stage_tool",
-    ):
-        metadata.pop(key, None)
-    session.mode_metadata = metadata
-    flag_modified(session, "mode_metadata")
+    patch_json(
+        session,
+        "mode_metadata",
+        remove=(
+            "pending_daifu_tool",
+            "pending_stage_tool_objective",
+            "pending_stage_tool_issue_url",
+            "pending_stage_tool_issue_number",
+            "pending_stage_gate_question_id",
+            "pending_stage_gate",
+            "approved_stage_tool",
+        ),
+    )
 
 
 def approve_stage_tool(
@@ -283,18 +283,21 @@ def approve_stage_tool(
     tool_name: str,
     objective: str,
 ) -> None:
-    metadata = dict(session.mode_metadata or {})
-    metadata["approved_stage_tool"] = {
-        "question_id": question.question_id,
-        "tool_name": tool_name,
-        "objective": objective,
-        "approved_at": utc_now().isoformat(),
-    }
-    metadata["pending_resume_objective"] = objective
-    metadata["pending_daifu_tool"] = tool_name
-    metadata["pending_stage_tool_objective"] = objective
-    session.mode_metadata = metadata
-    flag_modified(session, "mode_metadata")
+    patch_json(
+        session,
+        "mode_metadata",
+        {
+            "approved_stage_tool": {
+                "question_id": question.question_id,
+                "tool_name": tool_name,
+                "objective": objective,
+                "approved_at": utc_now().isoformat(),
+            },
+            "pending_resume_objective": objective,
+            "pending_daifu_tool": tool_name,
+            "pending_stage_tool_objective": objective,
+        },
+    )
 
 
 def _record_stage_gate_metadata(
@@ -304,15 +307,16 @@ def _record_stage_gate_metadata(
     objective: str,
     pending_tool: str,
 ) -> None:
-    metadata = dict(session.mode_metadata or {})
     pending_question_ids = [
         str(item)
-        for item in (metadata.get("pending_question_ids") or [])
+        for item in ((session.mode_metadata or {}).get("pending_question_ids") or [])
         if str(item).strip()
     ]
     if question.question_id not in pending_question_ids:
         pending_question_ids.append(question.question_id)
-    metadata.update(
+    patch_json(
+        session,
+        "mode_metadata",
         {
             "pending_question_ids": pending_question_ids,
             "pending_daifu_tool": pending_tool,
@@ -321,11 +325,9 @@ def _record_stage_gate_metadata(
             "pending_stage_gate": (
                 question.question_metadata if isinstance(question.question_metadata, dict) else {}
             ),
-        }
+        },
     )
-    session.mode_metadata = metadata
     session.mode_status = SessionModeStatus.WAITING_FOR_INPUT.value
     session.current_mode = mode_for_stage_tool(pending_tool) or session.current_mode
     session.mode_updated_at = utc_now()
     session.last_activity = utc_now()
-    flag_modified(session, "mode_metadata")
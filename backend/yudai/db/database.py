@@ -13,7 +13,9 @@ from yudai.models import Base
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
+from yudai.config import get_sandbox_config
 from yudai.utils import utc_now
+from yudai.utils.query_stats import install_query_tracking, instrument_engine
 
 # Database URL from environment variables.
 # The controller must always provide an explicit DATABASE_URL. The sandbox
@@ -32,6 +34,9 @@ engine = create_engine(
     pool_timeout=30,
     echo=bool(os.getenv("DB_ECHO", "false").lower() == "true"),
 )
+if get_sandbox_config().metrics_enabled:
+    instrument_engine(engine)
+install_query_tracking()
 
 
 # Create session maker
@@ -65,6 +70,22 @@ def _apply_schema_compatibility_migrations() -> None:
                 END IF;
             END $$;
         """))
+        # Lease state moved out of agent_executions.execution_metadata.
+        conn.execute(text("""
+            ALTER TABLE agent_executions
+                ADD COLUMN IF NOT EXISTS lease_id VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255),
+                ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITH TIME ZONE
+        """))
+        # Redundant sandbox_execution_events indexes that slowed every callback insert.
+        for index_name in (
+            "ix_sandbox_execution_events_controller_job_id",
+            "ix_sandbox_execution_events_sandbox_job_id",
+            "ix_sandbox_execution_events_mode_execution_id",
+            "idx_sandbox_events_controller_job_id",
+            "idx_sandbox_events_sandbox_job_id",
+        ):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
 
 
 def get_db():
@@ -505,6 +505,9 @@ def create_tables_standalone(engine):
             output_summary JSONB,
             error_message TEXT,
             execution_metadata JSONB,
+            lease_id VARCHAR(64),
+            claimed_by VARCHAR(255),
+            claimed_at TIMESTAMP WITH TIME ZONE,
             started_at TIMESTAMP WITH TIME ZONE,
             completed_at TIMESTAMP WITH TIME ZONE,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -526,6 +529,28 @@ def create_tables_standalone(engine):
         )
         """,
         """
+        CREATE TABLE IF NOT EXISTS session_execution_fences (
+            session_key VARCHAR(255) PRIMARY KEY,
+            fencing_token INTEGER NOT NULL DEFAULT 0,
+            holder_id VARCHAR(255),
+            acquired_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS probe_cache_entries (
+            cache_key VARCHAR(64) PRIMARY KEY,
+            repo_key VARCHAR(512) NOT NULL,
+            head_sha VARCHAR(64) NOT NULL,
+            tree_hash VARCHAR(64) NOT NULL,
+            query_text TEXT NOT NULL,
+            result JSON NOT NULL,
+            hit_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+            last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS sandbox_execution_runs (
             id SERIAL PRIMARY KEY,
             controller_job_id VARCHAR(64) NOT NULL UNIQUE,
@@ -569,6 +594,27 @@ def create_tables_standalone(engine):
         )
         """,
         """
+        CREATE TABLE IF NOT EXISTS sandbox_execution_event_segments (
+            id SERIAL PRIMARY KEY,
+            controller_job_id VARCHAR(64) NOT NULL,
+            sandbox_job_id VARCHAR(64) NOT NULL,
+            session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+            mode_execution_id VARCHAR(64) NOT NULL REFERENCES agent_executions(id) ON DELETE CASCADE,
+            first_sequence INTEGER NOT NULL,
+            last_sequence INTEGER NOT NULL,
+            event_count INTEGER NOT NULL,
+            dropped_count INTEGER NOT NULL DEFAULT 0,
+            codec VARCHAR(16) NOT NULL,
+            payload BYTEA NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            sequence_index JSONB,
+            first_event_at TIMESTAMP WITH TIME ZONE,
+            last_event_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            UNIQUE(controller_job_id, first_sequence)
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS agent_decision_steps (
             id VARCHAR(64) PRIMARY KEY,
             session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
@@ -719,16 +765,20 @@ def create_tables_standalone(engine):
         "CREATE INDEX IF NOT EXISTS idx_agent_execution_leases_execution_id ON agent_execution_leases(execution_id)",
         "CREATE INDEX IF NOT EXISTS idx_agent_execution_leases_worker_id ON agent_execution_leases(worker_id)",
         "CREATE INDEX IF NOT EXISTS idx_agent_execution_leases_expires_at ON agent_execution_leases(expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_probe_cache_repo_head ON probe_cache_entries(repo_key, head_sha)",
+        "CREATE INDEX IF NOT EXISTS idx_probe_cache_last_used ON probe_cache_entries(last_used_at)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_runs_session_id ON sandbox_execution_runs(session_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_runs_pipeline_execution_id ON sandbox_execution_runs(pipeline_execution_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_runs_mode_execution_id ON sandbox_execution_runs(mode_execution_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_runs_sandbox_job_id ON sandbox_execution_runs(sandbox_job_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_runs_status ON sandbox_execution_runs(status)",
-        "CREATE INDEX IF NOT EXISTS idx_sandbox_events_controller_job_id ON sandbox_execution_events(controller_job_id)",
-        "CREATE INDEX IF NOT EXISTS idx_sandbox_events_sandbox_job_id ON sandbox_execution_events(sandbox_job_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_events_session_id ON sandbox_execution_events(session_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_events_mode_execution_id ON sandbox_execution_events(mode_execution_id)",
         "CREATE INDEX IF NOT EXISTS idx_sandbox_events_created_at ON sandbox_execution_events(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_sandbox_event_segments_controller_job_id ON sandbox_execution_event_segments(controller_job_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sandbox_event_segments_session_id ON sandbox_execution_event_segments(session_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sandbox_event_segments_mode_execution_id ON sandbox_execution_event_segments(mode_execution_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sandbox_event_segments_created_at ON sandbox_execution_event_segments(created_at)",
         "CREATE INDEX IF NOT EXISTS idx_agent_decision_steps_session_id ON agent_decision_steps(session_id)",
         "CREATE INDEX IF NOT EXISTS idx_agent_decision_steps_pipeline_execution_id ON agent_decision_steps(pipeline_execution_id)",
         "CREATE INDEX IF NOT EXISTS idx_agent_decision_steps_status ON agent_decision_steps(status)",
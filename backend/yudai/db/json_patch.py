@@ -0,0 +1,166 @@
+"""Targeted writes to keys inside JSON columns.
+
+``ChatSession.mode_metadata`` and ``AgentExecution.execution_metadata`` hold
+many unrelated keys. Copying the document, changing one key and assigning it
+back with ``flag_modified`` rewrites every byte on each status change, and a
+concurrent writer's keys are lost when the stale copy lands. ``patch_json``
+instead issues one ``UPDATE`` that sets or removes only the named keys inside
+the database, then mirrors the change onto the loaded object without marking
+the attribute dirty, so the next flush does not write the document again.
+
+Postgres uses ``jsonb`` operators (the columns may be ``json`` or ``jsonb``
+depending on how the table was created; the result is assignment-cast back).
+SQLite uses ``json_set``/``json_remove``. Objects that are not persistent yet,
+or other dialects, fall back to the whole-document rewrite.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence
+
+from sqlalchemy import Text, and_, case, cast, func, inspect, literal, or_
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+
+
+def _merged_value(
+    current: Any,
+    updates: Mapping[str, Any],
+    path: Optional[str],
+    remove: Iterable[str],
+) -> Dict[str, Any]:
+    document = copy.copy(current) if isinstance(current, dict) else {}
+    if path is None:
+        target = document
+    else:
+        nested = document.get(path)
+        target = dict(nested) if isinstance(nested, dict) else {}
+        document[path] = target
+    target.update(updates)
+    for key in remove:
+        target.pop(key, None)
+    return document
+
+
+def _postgres_expression(column: Any, updates: Mapping[str, Any], path: Optional[str], remove: Iterable[str]) -> Any:
+    empty = cast(literal("{}"), JSONB)
+
+    def as_object(value: Any) -> Any:
+        return case((func.jsonb_typeof(value) == "object", value), else_=empty)
+
+    document = as_object(cast(column, JSONB))
+    target = document if path is None else as_object(document.op("->")(literal(path)))
+    if updates:
+        target = target.op("||")(cast(literal(json.dumps(dict(updates))), JSONB))
+    for key in remove:
+        target = target.op("-")(literal(key))
+    if path is None:
+        return target
+    return func.jsonb_set(document, cast(literal("{" + path + "}"), ARRAY(Text)), target, True)
+
+
+def _sqlite_path(*keys: str) -> str:
+    return "$" + "".join('."' + key.replace('"', '\\"') + '"' for key in keys)
+
+
+def _sqlite_expression(column: Any, updates: Mapping[str, Any], path: Optional[str], remove: Iterable[str]) -> Any:
+    document = case((func.json_type(column) == "object", column), else_=literal("{}"))
+    prefix = () if path is None else (path,)
+    if path is not None:
+        container = _sqlite_path(path)
+        nested = case(
+            (func.json_type(document, container) == "object", func.json_extract(document, container)),
+            else_=literal("{}"),
+        )
+        document = func.json_set(document, container, func.json(nested))
+    if updates:
+        arguments = []
+        for key, value in updates.items():
+            arguments.extend([_sqlite_path(*prefix, key), func.json(literal(json.dumps(value)))])
+        document = func.json_set(document, *arguments)
+    removals = [_sqlite_path(*prefix, key) for key in remove]
+    if removals:
+        document = func.json_remove(document, *removals)
+    return document
+
+
+_EXPRESSIONS = {
+    "postgresql": _postgres_expression,
+    "sqlite": _sqlite_expression,
+}
+
+
+def patch_json_rows(
+    rows: Sequence[Any],
+    column: str,
+    updates: Optional[Mapping[str, Any]] = None,
+    *,
+    path: Optional[str] = None,
+    remove: Iterable[str] = (),
+    values: Optional[Mapping[str, Any]] = None,
+) -> None:
+    """Apply the same patch to several rows of one model in a single ``UPDATE``.
+
+    ``values`` sets plain columns in the same statement, so a status change
+    plus its JSON detail is one write. Runs inside the rows' transaction; the
+    caller still commits.
+    """
+
+    rows = list(rows)
+    if not rows:
+        return
+    updates = dict(updates or {})
+    remove = [key for key in remove if key not in updates]
+    values = dict(values or {})
+    merged = [_merged_value(getattr(row, column), updates, path, remove) for row in rows]
+    db = object_session(rows[0])
+    build = _EXPRESSIONS.get(db.get_bind().dialect.name) if db is not None else None
+    if build is None or not all(inspect(row).persistent for row in rows):
+        for row, document in zip(rows, merged):
+            setattr(row, column, document)
+            flag_modified(row, column)
+            for key, value in values.items():
+                setattr(row, key, value)
+        return
+
+    # Pending whole-document writes to these rows must land before the patch.
+    db.flush()
+    mapper = inspect(rows[0]).mapper
+    table = mapper.local_table
+    primary_key = mapper.primary_key
+    identities = [mapper.primary_key_from_instance(row) for row in rows]
+    if len(primary_key) == 1:
+        criteria = primary_key[0].in_([identity[0] for identity in identities])
+    else:
+        criteria = or_(*(and_(*(key == value for key, value in zip(primary_key, identity))) for identity in identities))
+    db.execute(
+        table.update()
+        .where(criteria)
+        .values({column: build(table.c[column], updates, path, remove), **values})
+    )
+    for row, document in zip(rows, merged):
+        set_committed_value(row, column, document)
+        for key, value in values.items():
+            set_committed_value(row, key, value)
+
+
+def patch_json(
+    row: Any,
+    column: str,
+    updates: Optional[Mapping[str, Any]] = None,
+    *,
+    path: Optional[str] = None,
+    remove: Iterable[str] = (),
+) -> Dict[str, Any]:
+    """Set ``updates`` and drop ``remove`` keys in ``row.<column>``, or in its ``path`` sub-object.
+
+    Runs inside the row's current transaction; the caller still commits.
+    Returns the new document as seen by this process.
+    """
+
+    if updates or remove:
+        patch_json_rows([row], column, updates, path=path, remove=remove)
+    return getattr(row, column) or {}
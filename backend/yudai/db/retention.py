@@ -0,0 +1,289 @@
+"""Retention for the append-only event and audit tables.
+
+``sandbox_execution_events`` (and its compacted segments),
+``session_audit_events`` and ``agent_decision_steps`` only grow. The pruner
+keeps each table to a configured number of days, always archiving rows to
+gzip JSON lines under ``<retention_archive_root>/<table>/YYYY/MM/DD/`` before
+they are removed. Every table defaults to 0 days, which keeps rows forever;
+operators opt in per table.
+
+How rows are removed depends on the table:
+
+* Plain tables (SQLite, and Postgres tables created by ``create_all``) are
+  pruned in primary-key-ordered batches of ``retention_batch_size``, one
+  short transaction per batch. No lock is held for longer than one batch,
+  so callback inserts are never stuck behind a long delete.
+* Postgres tables an operator has converted to range partitions on
+  ``created_at`` are managed per month. Partitions for the coming months are
+  created ahead of time. A partition whose whole range is past retention is
+  archived, then detached and dropped in one transaction, so old history
+  costs nothing on insert.
+
+Tables are not converted automatically. A partitioned table's unique
+constraints must include the partition key, which would weaken the
+``(controller_job_id, sequence)`` and ``idempotency_key`` dedupe these
+tables rely on. Converting is an operator decision made per deployment.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import uuid
+
+from sqlalchemy import column, select, table, text
+from sqlalchemy.engine import Connection, Engine
+
+from yudai.config import get_sandbox_config
+from yudai.models import Base
+from yudai.utils import utc_now
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCHES_PER_RUN = 20
+PARTITION_MONTHS_AHEAD = 2
+_PARTITION_UPPER_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    table: str
+    retention_days: int
+
+
+def retention_policies() -> List[RetentionPolicy]:
+    """Configured policies; a retention of 0 days keeps the table forever."""
+
+    config = get_sandbox_config()
+    policies = [
+        RetentionPolicy("sandbox_execution_events", config.sandbox_event_retention_days),
+        RetentionPolicy("sandbox_execution_event_segments", config.sandbox_event_retention_days),
+        RetentionPolicy("session_audit_events", config.audit_event_retention_days),
+        RetentionPolicy("agent_decision_steps", config.decision_step_retention_days),
+    ]
+    return [policy for policy in policies if policy.retention_days > 0]
+
+
+def archive_root() -> Path:
+    return Path(get_sandbox_config().retention_archive_root)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"base64": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def write_archive(table_name: str, rows: Sequence[Dict[str, Any]], *, root: Path) -> Path:
+    """Write ``rows`` as gzip JSON lines and fsync before the caller deletes them."""
+
+    day = utc_now()
+    directory = root / table_name / f"{day:%Y}" / f"{day:%m}" / f"{day:%d}"
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{table_name}-{day:%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+    partial = path.with_suffix(".partial")
+    with open(partial, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            for row in rows:
+                archive.write(json.dumps({key: _jsonable(value) for key, value in row.items()}).encode("utf-8"))
+                archive.write(b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    partial.replace(path)
+    return path
+
+
+def prune_batches(
+    engine: Engine,
+    policy: RetentionPolicy,
+    *,
+    now: Optional[datetime] = None,
+    batch_size: Optional[int] = None,
+    max_batches: int = MAX_BATCHES_PER_RUN,
+    root: Optional[Path] = None,
+) -> int:
+    """Archive and delete rows older than the policy, one bounded batch per transaction."""
+
+    target = Base.metadata.tables[policy.table]
+    primary_key = list(target.primary_key.columns)[0]
+    cutoff = (now or utc_now()) - timedelta(days=policy.retention_days)
+    batch_size = batch_size or get_sandbox_config().retention_batch_size
+    root = root or archive_root()
+    removed = 0
+    for _ in range(max_batches):
+        with engine.begin() as conn:
+            query = select(target).where(target.c.created_at < cutoff).order_by(primary_key).limit(batch_size)
+            if conn.dialect.name != "sqlite":
+                # Concurrent pruners take disjoint batches instead of archiving rows twice.
+                query = query.with_for_update(skip_locked=True)
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+            if not rows:
+                break
+            write_archive(policy.table, rows, root=root)
+            conn.execute(target.delete().where(primary_key.in_([row[primary_key.name] for row in rows])))
+        removed += len(rows)
+        if len(rows) < batch_size:
+            break
+    return removed
+
+
+def _is_partitioned(conn: Connection, table_name: str) -> bool:
+    return bool(
+        conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+                "WHERE c.relname = :table"
+            ),
+            {"table": table_name},
+        ).first()
+    )
+
+
+def partition_upper_bound(bound_expression: str) -> Optional[datetime]:
+    """Parse the exclusive upper bound from ``pg_get_expr(relpartbound, oid)``."""
+
+    match = _PARTITION_UPPER_RE.search(bound_expression or "")
+    if match is None:
+        return None
+    try:
+        upper = datetime.fromisoformat(match.group(1).replace(" ", "T"))
+    except ValueError:
+        return None
+    return upper if upper.tzinfo is not None else upper.replace(tzinfo=timezone.utc)
+
+
+def month_partition(table_name: str, month_start: date) -> Tuple[str, date, date]:
+    """Name and ``[start, end)`` range of the monthly partition containing ``month_start``."""
+
+    start = month_start.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return f"{table_name}_p{start:%Y%m}", start, end
+
+
+def _list_partitions(conn: Connection, table_name: str) -> List[Tuple[str, Optional[datetime]]]:
+    rows = conn.execute(
+        text(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class parent ON parent.oid = i.inhparent "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table_name},
+    )
+    return [(name, partition_upper_bound(bound)) for name, bound in rows]
+
+
+def ensure_future_partitions(conn: Connection, table_name: str, *, now: datetime) -> None:
+    month = now.date().replace(day=1)
+    for _ in range(PARTITION_MONTHS_AHEAD + 1):
+        name, start, end = month_partition(table_name, month)
+        conn.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        )
+        month = end
+
+
+def drop_expired_partitions(
+    engine: Engine,
+    policy: RetentionPolicy,
+    *,
+    now: Optional[datetime] = None,
+    root: Optional[Path] = None,
+) -> List[str]:
+    """Archive, then detach and drop, partitions entirely older than the policy."""
+
+    now = now or utc_now()
+    cutoff = now - timedelta(days=policy.retention_days)
+    batch_size = get_sandbox_config().retention_batch_size
+    root = root or archive_root()
+    parent = Base.metadata.tables[policy.table]
+    primary_key = list(parent.primary_key.columns)[0]
+    try:
+        with engine.begin() as conn:
+            ensure_future_partitions(conn, policy.table, now=now)
+    except Exception:
+        # An operator-made partition overlapping ours must not block pruning.
+        logger.warning("could not create upcoming partitions for %s", policy.table, exc_info=True)
+    with engine.connect() as conn:
+        expired = [
+            name
+            for name, upper in _list_partitions(conn, policy.table)
+            if upper is not None and upper <= cutoff
+        ]
+    dropped = []
+    for name in expired:
+        # Archive while the partition is still attached: its range is past
+        # retention, so nothing new lands in it, and a failed archive leaves
+        # the rows where the next pass will find them again.
+        child = table(name, *(column(item.name) for item in parent.columns))
+        child_key = child.c[primary_key.name]
+        last_key = None
+        with engine.connect() as conn:
+            while True:
+                query = select(child).order_by(child_key).limit(batch_size)
+                if last_key is not None:
+                    query = query.where(child_key > last_key)
+                rows = [dict(row._mapping) for row in conn.execute(query)]
+                if not rows:
+                    break
+                write_archive(policy.table, rows, root=root)
+                last_key = rows[-1][primary_key.name]
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{policy.table}" DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        dropped.append(name)
+    return dropped
+
+
+def enforce_retention(engine: Engine, *, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Apply every configured policy once; returns rows (or partitions) removed per table."""
+
+    results: Dict[str, int] = {}
+    for policy in retention_policies():
+        try:
+            if engine.dialect.name == "postgresql":
+                with engine.connect() as conn:
+                    partitioned = _is_partitioned(conn, policy.table)
+                if partitioned:
+                    results[policy.table] = len(drop_expired_partitions(engine, policy, now=now))
+                    continue
+            results[policy.table] = prune_batches(engine, policy, now=now)
+        except Exception:
+            logger.warning("retention pass failed for %s", policy.table, exc_info=True)
+    return results
+
+
+async def maintain_retention() -> None:
+    """Run ``enforce_retention`` periodically; disabled when the interval is 0."""
+
+    interval = get_sandbox_config().retention_interval_seconds
+    if interval <= 0:
+        return
+    from yudai.db.database import engine
+
+    while True:
+        try:
+            results = await asyncio.to_thread(enforce_retention, engine)
+            if any(results.values()):
+                logger.info("retention removed %s", results)
+        except Exception:
+            logger.warning("retention pass failed", exc_info=True)
+        await asyncio.sleep(interval)
@@ -41,6 +41,7 @@ from sqlalchemy import (
     ForeignKey,
     Index,
     Integer,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
@@ -1203,6 +1204,12 @@ class AgentExecution(Base):
     execution_metadata: Mapped[Optional[Dict[str, Any]]] = mapped_column(
         JSON_TYPE, nullable=True
     )
+    # Current worker lease; the full history lives in agent_execution_leases.
+    lease_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    claimed_by: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
     started_at: Mapped[Optional[datetime]] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
@@ -1238,6 +1245,42 @@ class AgentExecutionLease(Base):
     release_reason: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
 
+class SessionExecutionFence(Base):
+    """Monotonic fencing token for the per-session execution lock."""
+
+    __tablename__ = "session_execution_fences"
+
+    session_key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fencing_token: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    holder_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    acquired_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class ProbeCacheEntry(Base):
+    """Cached context-probe answer for one repository tree state and query."""
+
+    __tablename__ = "probe_cache_entries"
+    __table_args__ = (
+        Index("idx_probe_cache_repo_head", "repo_key", "head_sha"),
+        Index("idx_probe_cache_last_used", "last_used_at"),
+    )
+
+    cache_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    repo_key: Mapped[str] = mapped_column(String(512), nullable=False)
+    head_sha: Mapped[str] = mapped_column(String(64), nullable=False)
+    tree_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    query_text: Mapped[str] = mapped_column(Text, nullable=False)
+    result: Mapped[Dict[str, Any]] = mapped_column(JSON_TYPE, nullable=False)
+    hit_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    last_used_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
 class SandboxExecutionRun(Base):
     """Controller-side durable record for one sandbox background command."""
 
@@ -1280,6 +1323,8 @@ class SandboxExecutionRun(Base):
 class SandboxExecutionEvent(Base):
     """Durable sandbox stream event for reconnect and recovery."""
 
+    # Every index here is paid for on each callback insert: job lookups use the
+    # unique key's prefix, and sandbox_job_id is never queried on its own.
     __tablename__ = "sandbox_execution_events"
     __table_args__ = (
         UniqueConstraint("controller_job_id", "sequence", name="uq_sandbox_execution_events_job_sequence"),
@@ -1287,13 +1332,13 @@ class SandboxExecutionEvent(Base):
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    controller_job_id: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
-    sandbox_job_id: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    controller_job_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    sandbox_job_id: Mapped[str] = mapped_column(String(64), nullable=False)
     session_id: Mapped[int] = mapped_column(
         ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True
     )
     mode_execution_id: Mapped[str] = mapped_column(
-        ForeignKey("agent_executions.id", ondelete="CASCADE"), nullable=False, index=True
+        ForeignKey("agent_executions.id", ondelete="CASCADE"), nullable=False
     )
     sequence: Mapped[int] = mapped_column(Integer, nullable=False)
     stream: Mapped[str] = mapped_column(String(32), nullable=False, default="sandbox")
@@ -1303,6 +1348,46 @@ class SandboxExecutionEvent(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
 
 
+class SandboxExecutionEventSegment(Base):
+    """Compressed, heartbeat-free stream events of a finished sandbox job.
+
+    ``payload`` is JSON lines, one event per line, compressed with ``codec``.
+    ``sequence_index`` holds sparse ``[sequence, byte_offset]`` pairs into the
+    decompressed payload so replays can skip to a sequence without parsing
+    the events before it.
+    """
+
+    __tablename__ = "sandbox_execution_event_segments"
+    __table_args__ = (
+        UniqueConstraint(
+            "controller_job_id",
+            "first_sequence",
+            name="uq_sandbox_event_segments_job_first_sequence",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    controller_job_id: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    sandbox_job_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    session_id: Mapped[int] = mapped_column(
+        ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    mode_execution_id: Mapped[str] = mapped_column(
+        ForeignKey("agent_executions.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    first_sequence: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_sequence: Mapped[int] = mapped_column(Integer, nullable=False)
+    event_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    dropped_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    codec: Mapped[str] = mapped_column(String(16), nullable=False)
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    raw_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    sequence_index: Mapped[Optional[List[List[int]]]] = mapped_column(JSON_TYPE, nullable=True)
+    first_event_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_event_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
 class AgentDecisionStep(Base):
     """Worker-side planner decision after a sandbox result."""
 
@@ -1887,6 +1972,26 @@ class ExecutionTraceEventResponse(BaseModel):
     sequence: int = 0
 
 
+class ExecutionSpanResponse(BaseModel):
+    id: str
+    name: str
+    start_ms: int = 0
+    duration_ms: int = 0
+    status: str = "ok"
+    attributes: Dict[str, Any] = Field(default_factory=dict)
+    error: Optional[str] = None
+    children: List["ExecutionSpanResponse"] = Field(default_factory=list)
+
+
+class ExecutionTraceResponse(BaseModel):
+    execution_id: str
+    trace_id: str
+    duration_ms: int = 0
+    phases: Dict[str, int] = Field(default_factory=dict)
+    dropped_spans: int = 0
+    root: ExecutionSpanResponse
+
+
 # ============================================================================
 # AUTHENTICATION MODELS (Essential Only)
 # ============================================================================
@@ -0,0 +1,478 @@
+"""Resident fork-server for the ``mini`` agent CLI inside the sandbox.
+
+Running ``mini`` straight from bash pays for interpreter start-up plus the
+heavy ``minisweagent``/LLM client imports on every mode, probe and browser
+check. The daemon imports the CLI once at sandbox start and forks a child per
+job, so each run starts from an already warm interpreter. The client passes
+its stdin/stdout/stderr over the unix socket; the agent writes straight into
+the caller's pipes, so the generated scripts keep their tee, exit-code and
+contract handling unchanged.
+
+Only the standard library is imported here: the bash scripts run this file
+directly as the client (``python -I agent_daemon.py run -- mini ...``) and
+fall back to executing ``mini`` themselves when the daemon is unavailable.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, NoReturn, Optional, Sequence
+
+AGENT_DAEMON_SOCKET_ENV = "YUDAI_AGENT_DAEMON_SOCKET"
+AGENT_DAEMON_CLIENT_ENV = "YUDAI_AGENT_DAEMON_CLIENT"
+SANDBOX_AGENT_DAEMON_CLIENT_PATH = "/app/backend/yudai/realtime/agent_daemon.py"
+DEFAULT_PROGRAM = "mini"
+# EX_TEMPFAIL: the job never started. The agent may exit with any code,
+# including this one, so callers learn about a fallback from the
+# ``--unavailable-marker`` file rather than from the status.
+DAEMON_UNAVAILABLE_EXIT_CODE = 75
+# EX_CONFIG: the agent CLI cannot be imported, restarting will not help.
+DAEMON_MISCONFIGURED_EXIT_CODE = 78
+
+_HEADER = struct.Struct("!I")
+_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+_REQUEST_TIMEOUT_SECONDS = 5.0
+_KILL_GRACE_SECONDS = 5.0
+_POLL_SECONDS = 0.2
+
+AgentProgram = Callable[[], Any]
+
+
+def default_socket_path() -> str:
+    return os.environ.get(AGENT_DAEMON_SOCKET_ENV) or os.path.join(
+        tempfile.gettempdir(), "yudai-agent-daemon.sock"
+    )
+
+
+def agent_runner_shell_lines() -> List[str]:
+    """Bash ``run_mini`` function: try the daemon, fall back to a direct exec.
+
+    Callers replace ``"${cmd[@]}"`` with ``run_mini "${cmd[@]}"``; it expects
+    ``$python_bin`` to be set and must be called with ``set +e``. The command
+    only runs directly when the client wrote the unavailable marker, so an
+    agent that exits with ``DAEMON_UNAVAILABLE_EXIT_CODE`` is not run twice.
+    """
+
+    return [
+        "run_mini() {",
+        f'  local daemon_socket="${{{AGENT_DAEMON_SOCKET_ENV}:-}}"',
+        f'  local daemon_client="${{{AGENT_DAEMON_CLIENT_ENV}:-{SANDBOX_AGENT_DAEMON_CLIENT_PATH}}}"',
+        '  local daemon_marker=""',
+        '  if [ -n "$daemon_socket" ] && [ -S "$daemon_socket" ] && [ -f "$daemon_client" ]; then',
+        '    daemon_marker="$(mktemp 2>/dev/null)" || daemon_marker=""',
+        "  fi",
+        '  if [ -n "$daemon_marker" ]; then',
+        '    "$python_bin" -I "$daemon_client" run --socket "$daemon_socket" --unavailable-marker "$daemon_marker" -- "$@"',
+        "    local daemon_status=$?",
+        '    if [ ! -s "$daemon_marker" ]; then rm -f "$daemon_marker"; return "$daemon_status"; fi',
+        '    rm -f "$daemon_marker"',
+        "  fi",
+        '  "$@"',
+        "}",
+    ]
+
+
+def load_program(spec: str) -> AgentProgram:
+    """Resolve ``module:attr`` or the name of an installed console script."""
+
+    if ":" in spec:
+        module_name, _, attr = spec.partition(":")
+        target: Any = importlib.import_module(module_name)
+        for part in attr.split("."):
+            target = getattr(target, part)
+        return target
+    # Imported lazily: it is slow to load and the client never needs it.
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group="console_scripts", name=spec):
+        return entry_point.load()
+    raise LookupError(f"No console script named {spec!r}")
+
+
+def _exit_code(value: Any) -> int:
+    # Same conventions as the interpreter applies to ``SystemExit``.
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value & 0xFF
+    print(value, file=sys.stderr)
+    return 1
+
+
+def _send_message(conn: socket.socket, message: Dict[str, Any]) -> None:
+    try:
+        conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
+    except OSError:
+        pass
+
+
+@dataclass
+class _Job:
+    pid: int
+    conn: Optional[socket.socket]
+    kill_deadline: Optional[float] = None
+
+
+class AgentDaemon:
+    """Accept jobs on a unix socket and run each in a forked, preloaded child.
+
+    The loop is single threaded so forking is safe; ``SIGCHLD`` wakes the
+    selector through a socketpair and children are reaped with ``WNOHANG``.
+    When a client disconnects before its job finishes (the mode was
+    cancelled), the job's process group is terminated, then killed after a
+    grace period.
+    """
+
+    def __init__(self, socket_path: str, programs: Dict[str, AgentProgram]) -> None:
+        self.socket_path = socket_path
+        self.programs = dict(programs)
+        self._jobs: Dict[int, _Job] = {}
+        self._stopping = False
+        self._listener: Optional[socket.socket] = None
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wakeup: Optional[tuple[socket.socket, socket.socket]] = None
+
+    def stop(self, *_args: Any) -> None:
+        self._stopping = True
+
+    def serve_forever(self) -> None:
+        self._listener = self._bind()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ, None)
+        self._wakeup = socket.socketpair()
+        for end in self._wakeup:
+            end.setblocking(False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ, self._wakeup)
+        signal.set_wakeup_fd(self._wakeup[1].fileno(), warn_on_full_buffer=False)
+        signal.signal(signal.SIGCHLD, lambda *_args: None)
+        print(
+            f"[agent-daemon] serving {', '.join(sorted(self.programs))} on {self.socket_path}",
+            flush=True,
+        )
+        try:
+            while not self._stopping:
+                for key, _events in self._selector.select(timeout=_POLL_SECONDS):
+                    if key.data is None:
+                        self._accept()
+                    elif key.data is self._wakeup:
+                        self._drain_wakeup()
+                    else:
+                        self._client_readable(key.data)
+                self._reap()
+        finally:
+            self._shutdown()
+
+    def _drain_wakeup(self) -> None:
+        assert self._wakeup is not None
+        try:
+            while self._wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _bind(self) -> socket.socket:
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        # Bind under a temporary name and rename into place, so clients never
+        # see a socket file that is not accepting connections yet.
+        staging_path = f"{self.socket_path}.{os.getpid()}"
+        for path in (staging_path, self.socket_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(staging_path)
+        os.chmod(staging_path, 0o600)
+        listener.listen(64)
+        os.rename(staging_path, self.socket_path)
+        return listener
+
+    def _accept(self) -> None:
+        assert self._listener is not None and self._selector is not None
+        try:
+            conn, _addr = self._listener.accept()
+        except OSError:
+            return
+        fds: List[int] = []
+        try:
+            conn.settimeout(_REQUEST_TIMEOUT_SECONDS)
+            request, fds = self._read_request(conn)
+            argv = [str(arg) for arg in request.get("argv") or []]
+            if not argv or argv[0] not in self.programs:
+                raise ValueError(f"Unsupported agent program: {argv[:1]}")
+            pid = os.fork()
+            if pid == 0:
+                self._run_child(self.programs[argv[0]], argv, request, fds)
+        except (OSError, ValueError) as exc:
+            _send_message(conn, {"error": str(exc)})
+            conn.close()
+            return
+        finally:
+            for fd in fds:
+                os.close(fd)
+        job = _Job(pid=pid, conn=conn)
+        self._jobs[pid] = job
+        _send_message(conn, {"pid": pid})
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, job)
+
+    @staticmethod
+    def _read_request(conn: socket.socket) -> tuple[Dict[str, Any], List[int]]:
+        header, fds, _flags, _addr = socket.recv_fds(conn, _HEADER.size, 3)
+        if len(header) != _HEADER.size or len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            raise ValueError("Malformed agent daemon request header")
+        (length,) = _HEADER.unpack(header)
+        try:
+            if length > _MAX_REQUEST_BYTES:
+                raise ValueError("Agent daemon request is too large")
+            chunks: List[bytes] = []
+            remaining = length
+            while remaining:
+                chunk = conn.recv(min(remaining, 65536))
+                if not chunk:
+                    raise ValueError("Agent daemon request was truncated")
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            request = json.loads(b"".join(chunks).decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("Agent daemon request must be a JSON object")
+        except (OSError, ValueError):
+            for fd in fds:
+                os.close(fd)
+            raise
+        return request, list(fds)
+
+    def _run_child(
+        self,
+        program: AgentProgram,
+        argv: List[str],
+        request: Dict[str, Any],
+        fds: Sequence[int],
+    ) -> NoReturn:
+        code = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for end in self._wakeup or ():
+                end.close()
+            if self._listener is not None:
+                self._listener.close()
+            for job in self._jobs.values():
+                if job.conn is not None:
+                    job.conn.close()
+            os.setsid()
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+            for fd in fds:
+                if fd > 2:
+                    os.close(fd)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", buffering=1, closefd=False, errors="backslashreplace")
+            sys.stderr = open(2, "w", buffering=1, closefd=False, errors="backslashreplace")
+            os.environ.clear()
+            os.environ.update({str(k): str(v) for k, v in (request.get("env") or {}).items()})
+            os.chdir(str(request.get("cwd") or "/"))
+            sys.argv = argv
+            code = _exit_code(program())
+        except SystemExit as exc:
+            code = _exit_code(exc.code)
+        except KeyboardInterrupt:
+            code = 128 + signal.SIGINT
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except Exception:
+                    pass
+            os._exit(code)
+
+    def _client_readable(self, job: _Job) -> None:
+        assert job.conn is not None
+        try:
+            data = job.conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            return
+        # The caller went away (cancelled mode); stop the agent it started.
+        self._drop_connection(job)
+        self._signal_job(job, signal.SIGTERM)
+        job.kill_deadline = time.monotonic() + _KILL_GRACE_SECONDS
+
+    def _drop_connection(self, job: _Job) -> None:
+        if job.conn is None:
+            return
+        if self._selector is not None:
+            try:
+                self._selector.unregister(job.conn)
+            except (KeyError, ValueError):
+                pass
+        job.conn.close()
+        job.conn = None
+
+    @staticmethod
+    def _signal_job(job: _Job, signum: int) -> None:
+        try:
+            os.killpg(job.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _reap(self) -> None:
+        while self._jobs:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            job = self._jobs.pop(pid, None)
+            if job is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code < 0:
+                code = 128 - code
+            if job.conn is not None:
+                job.conn.setblocking(True)
+                _send_message(job.conn, {"exit_code": code})
+                self._drop_connection(job)
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.kill_deadline is not None and job.kill_deadline <= now:
+                self._signal_job(job, signal.SIGKILL)
+                job.kill_deadline = None
+
+    def _shutdown(self) -> None:
+        for job in list(self._jobs.values()):
+            self._drop_connection(job)
+            self._signal_job(job, signal.SIGTERM)
+        signal.set_wakeup_fd(-1)
+        for end in self._wakeup or ():
+            end.close()
+        if self._listener is not None:
+            self._listener.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def _mark_unavailable(marker: Optional[str], reason: str) -> int:
+    if marker:
+        try:
+            with open(marker, "w", encoding="utf-8") as handle:
+                handle.write(reason + "\n")
+        except OSError:
+            pass
+    return DAEMON_UNAVAILABLE_EXIT_CODE
+
+
+def run_client(socket_path: str, argv: Sequence[str], *, unavailable_marker: Optional[str] = None) -> int:
+    """Run ``argv`` through the daemon with this process's stdio and environment.
+
+    When the job could not be handed over, the reason is written to
+    ``unavailable_marker`` (if given) and ``DAEMON_UNAVAILABLE_EXIT_CODE`` is
+    returned, so the caller can execute the command itself. Once the daemon
+    accepted the job the marker is left untouched and the agent's own exit
+    code is returned.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        payload = json.dumps(
+            {"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+        ).encode("utf-8")
+        socket.send_fds(sock, [_HEADER.pack(len(payload))], [0, 1, 2])
+        sock.sendall(payload)
+        reader = sock.makefile("rb")
+        accepted = json.loads(reader.readline() or b"null")
+    except (OSError, ValueError) as exc:
+        print(f"[agent-daemon] unavailable, running directly: {exc}", file=sys.stderr)
+        sock.close()
+        return _mark_unavailable(unavailable_marker, str(exc))
+    if not isinstance(accepted, dict) or "pid" not in accepted:
+        reason = accepted.get("error") if isinstance(accepted, dict) else "no response"
+        print(f"[agent-daemon] rejected job, running directly: {reason}", file=sys.stderr)
+        sock.close()
+        return _mark_unavailable(unavailable_marker, str(reason))
+    try:
+        for line in reader:
+            message = json.loads(line)
+            if isinstance(message, dict) and "exit_code" in message:
+                return int(message["exit_code"])
+    except (OSError, ValueError):
+        pass
+    finally:
+        sock.close()
+    print("[agent-daemon] daemon exited before the job finished", file=sys.stderr)
+    return 1
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="agent_daemon")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    serve = subcommands.add_parser("serve", help="preload the agent CLI and accept jobs")
+    serve.add_argument("--socket", default=None)
+    serve.add_argument(
+        "--program",
+        action="append",
+        default=None,
+        help="NAME or NAME=module:attr; defaults to the installed mini console script",
+    )
+    run = subcommands.add_parser("run", help="run a command through the daemon")
+    run.add_argument("--socket", default=None)
+    run.add_argument(
+        "--unavailable-marker",
+        default=None,
+        help="file to write the reason to when the daemon cannot take the job",
+    )
+    run.add_argument("argv", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    socket_path = args.socket or default_socket_path()
+
+    if args.command == "run":
+        command = list(args.argv)
+        if command[:1] == ["--"]:
+            command = command[1:]
+        if not command:
+            parser.error("run requires a command")
+        return run_client(socket_path, command, unavailable_marker=args.unavailable_marker)
+
+    programs: Dict[str, AgentProgram] = {}
+    for spec in args.program or [DEFAULT_PROGRAM]:
+        name, _, target = spec.partition("=")
+        try:
+            programs[name] = load_program(target or name)
+        except Exception as exc:
+            print(f"[agent-daemon] cannot preload {spec}: {exc}", file=sys.stderr, flush=True)
+            return DAEMON_MISCONFIGURED_EXIT_CODE
+    daemon = AgentDaemon(socket_path, programs)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,558 @@
+"""Long-lived browser and dev-server service for browser checks.
+
+Launching Chromium and starting the frontend dev server dominate a browser
+check's runtime, so the sandbox server keeps both alive between checks:
+
+* ``DevServerSupervisor`` keeps one dev server per workspace running between
+  checks and restarts it only when the command, port or a watched setup file
+  (``package.json``, lockfiles, bundler config, ``.env``) changes. Source edits
+  are left to the dev server's own reload.
+* ``BrowserPool`` keeps one Chromium process with a small pool of browser
+  contexts whose pages are reused across captures. Each sandbox serves a
+  single session, so reuse never crosses sessions; cookies and web storage
+  are still cleared and the page is parked on ``about:blank`` between checks
+  so one check's state does not change the next one's screenshot.
+
+The browser-check agent drives the service through this file's CLI
+(``python3 "$YUDAI_BROWSER_CLIENT" dev-server|capture``), which posts to
+``/internal/browser/*`` on the sandbox server. Module-level imports are stdlib
+only so the CLI can run under ``python -I``; Playwright is imported lazily.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import urllib.error
+import urllib.request
+
+BROWSER_SERVICE_URL_ENV = "YUDAI_BROWSER_SERVICE_URL"
+BROWSER_CLIENT_ENV = "YUDAI_BROWSER_CLIENT"
+SERVICE_UNAVAILABLE_EXIT_CODE = 75
+
+WATCHED_SETUP_PATTERNS: Tuple[str, ...] = (
+    "package.json",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "pnpm-lock.yaml",
+    "yarn.lock",
+    "bun.lock",
+    "bun.lockb",
+    ".npmrc",
+    ".env",
+    ".env.*",
+    "tsconfig*.json",
+    "vite.config.*",
+    "next.config.*",
+    "nuxt.config.*",
+    "svelte.config.*",
+    "astro.config.*",
+    "webpack.config.*",
+    "postcss.config.*",
+    "tailwind.config.*",
+)
+_LOG_TAIL_BYTES = 4000
+_CLEAR_WEB_STORAGE = "() => { try { localStorage.clear(); sessionStorage.clear(); } catch (error) {} }"
+_STOP_GRACE_SECONDS = 5.0
+
+
+class BrowserServiceUnavailable(RuntimeError):
+    """Raised when Playwright or Chromium cannot be started in this sandbox."""
+
+
+class DevServerError(RuntimeError):
+    """Raised when a dev server exits or never opens its port."""
+
+
+def watched_setup_fingerprint(cwd: str) -> Tuple[Tuple[str, int, int], ...]:
+    root = Path(cwd)
+    entries = set()
+    for pattern in WATCHED_SETUP_PATTERNS:
+        for path in root.glob(pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.add((path.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(entries))
+
+
+async def _port_open(port: int, host: str = "127.0.0.1") -> bool:
+    try:
+        _reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=1.0)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+def _log_tail(path: Path) -> str:
+    try:
+        with path.open("rb") as handle:
+            handle.seek(max(0, path.stat().st_size - _LOG_TAIL_BYTES))
+            return handle.read().decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
+@dataclass
+class _ManagedDevServer:
+    command: str
+    port: int
+    cwd: str
+    fingerprint: Tuple[Tuple[str, int, int], ...]
+    process: asyncio.subprocess.Process
+    log_path: Path
+    started_at: float = field(default_factory=time.time)
+    reuse_count: int = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    def describe(self, status: str, reason: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "status": status,
+            "reason": reason,
+            "command": self.command,
+            "port": self.port,
+            "cwd": self.cwd,
+            "url": f"http://127.0.0.1:{self.port}",
+            "pid": self.process.pid,
+            "log_path": str(self.log_path),
+            "reuse_count": self.reuse_count,
+        }
+
+
+@dataclass
+class _WorkspaceLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+class DevServerSupervisor:
+    """Keeps one dev server per workspace running between browser checks."""
+
+    def __init__(self, *, ready_timeout_seconds: float = 120.0) -> None:
+        self.ready_timeout_seconds = ready_timeout_seconds
+        self._servers: Dict[str, _ManagedDevServer] = {}
+        # Per workspace, so one slow dev-server start does not hold up checks
+        # in other workspaces. Entries live only while a check uses them.
+        self._locks: Dict[str, _WorkspaceLock] = {}
+
+    @asynccontextmanager
+    async def _workspace_lock(self, workspace: str) -> AsyncIterator[None]:
+        entry = self._locks.setdefault(workspace, _WorkspaceLock())
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[workspace]
+
+    async def ensure(self, *, workspace: str, command: str, port: int, cwd: Optional[str] = None) -> Dict[str, Any]:
+        cwd = cwd or workspace
+        async with self._workspace_lock(workspace):
+            fingerprint = await asyncio.to_thread(watched_setup_fingerprint, cwd)
+            server = self._servers.get(workspace)
+            if server is not None:
+                reason = self._restart_reason(server, command=command, port=port, cwd=cwd, fingerprint=fingerprint)
+                if reason is None and await _port_open(port):
+                    server.reuse_count += 1
+                    return server.describe("reused")
+                await self._stop(server)
+                del self._servers[workspace]
+                server = await self._start(command=command, port=port, cwd=cwd, fingerprint=fingerprint)
+                self._servers[workspace] = server
+                return server.describe("restarted", reason or "port closed")
+            if await _port_open(port):
+                # Started outside the supervisor (for example by an older
+                # check); use it as-is rather than fighting over the port.
+                return {
+                    "status": "external",
+                    "reason": "port already in use by an unmanaged process",
+                    "command": command,
+                    "port": port,
+                    "cwd": cwd,
+                    "url": f"http://127.0.0.1:{port}",
+                    "pid": None,
+                    "log_path": None,
+                    "reuse_count": 0,
+                }
+            server = await self._start(command=command, port=port, cwd=cwd, fingerprint=fingerprint)
+            self._servers[workspace] = server
+            return server.describe("started")
+
+    @staticmethod
+    def _restart_reason(
+        server: _ManagedDevServer,
+        *,
+        command: str,
+        port: int,
+        cwd: str,
+        fingerprint: Tuple[Tuple[str, int, int], ...],
+    ) -> Optional[str]:
+        if not server.alive:
+            return f"exited with {server.process.returncode}"
+        if (server.command, server.port, server.cwd) != (command, port, cwd):
+            return "command changed"
+        if server.fingerprint != fingerprint:
+            return "watched files changed"
+        return None
+
+    async def _start(
+        self,
+        *,
+        command: str,
+        port: int,
+        cwd: str,
+        fingerprint: Tuple[Tuple[str, int, int], ...],
+    ) -> _ManagedDevServer:
+        log_dir = Path(cwd) / ".yudai" / "dev-server"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log_path = log_dir / f"{port}.log"
+        env = os.environ.copy()
+        # The sandbox server's own PORT must not leak into the dev server.
+        env["PORT"] = str(port)
+        env.setdefault("BROWSER", "none")
+        with log_path.open("ab") as log_handle:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                cwd=cwd,
+                env=env,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=log_handle,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+            )
+        server = _ManagedDevServer(
+            command=command,
+            port=port,
+            cwd=cwd,
+            fingerprint=fingerprint,
+            process=process,
+            log_path=log_path,
+        )
+        deadline = time.monotonic() + self.ready_timeout_seconds
+        try:
+            while not await _port_open(port):
+                if not server.alive:
+                    raise DevServerError(
+                        f"Dev server exited with {process.returncode} before opening port {port}:\n"
+                        f"{_log_tail(log_path)}"
+                    )
+                if time.monotonic() >= deadline:
+                    raise DevServerError(f"Dev server did not open port {port} in time:\n{_log_tail(log_path)}")
+                await asyncio.sleep(0.25)
+        except BaseException:
+            # Also covers a cancelled check, which would otherwise orphan the process.
+            await asyncio.shield(self._stop(server))
+            raise
+        return server
+
+    @staticmethod
+    async def _stop(server: _ManagedDevServer) -> None:
+        if not server.alive:
+            return
+        try:
+            os.killpg(server.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(server.process.wait(), timeout=_STOP_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(server.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await server.process.wait()
+
+    async def shutdown(self) -> None:
+        servers = list(self._servers.values())
+        self._servers.clear()
+        for server in servers:
+            await self._stop(server)
+
+
+@dataclass
+class _PooledPage:
+    browser: Any
+    context: Any
+    page: Any
+    viewport: Tuple[int, int]
+    uses: int = 0
+
+
+class BrowserPool:
+    """One Chromium process with reusable contexts and pages."""
+
+    def __init__(self, *, size: int = 2) -> None:
+        self.size = max(1, size)
+        self.launches = 0
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._lock = asyncio.Lock()
+        self._playwright: Any = None
+        self._browser: Any = None
+        self._idle: List[_PooledPage] = []
+
+    async def _ensure_browser(self) -> Any:
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            await self._close_browser()
+            try:
+                from playwright.async_api import async_playwright
+            except ImportError as exc:
+                raise BrowserServiceUnavailable("playwright is not installed in this sandbox") from exc
+            try:
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch()
+            except Exception as exc:
+                await self._close_browser()
+                raise BrowserServiceUnavailable(f"Chromium failed to launch: {exc}") from exc
+            self.launches += 1
+            return self._browser
+
+    async def _acquire(self, viewport: Tuple[int, int]) -> _PooledPage:
+        browser = await self._ensure_browser()
+        while self._idle:
+            pooled = self._idle.pop()
+            if pooled.browser is browser and not pooled.page.is_closed():
+                if pooled.viewport != viewport:
+                    await pooled.page.set_viewport_size({"width": viewport[0], "height": viewport[1]})
+                    pooled.viewport = viewport
+                pooled.uses += 1
+                return pooled
+            await _close_quietly(pooled.context)
+        context = await browser.new_context(viewport={"width": viewport[0], "height": viewport[1]})
+        page = await context.new_page()
+        return _PooledPage(browser=browser, context=context, page=page, viewport=viewport, uses=1)
+
+    async def _release(self, pooled: _PooledPage, *, healthy: bool) -> None:
+        if healthy and len(self._idle) < self.size and not pooled.page.is_closed():
+            try:
+                # Storage belongs to the checked origin, so clear it before leaving the page.
+                await pooled.page.evaluate(_CLEAR_WEB_STORAGE)
+                await pooled.context.clear_cookies()
+                await pooled.page.goto("about:blank")
+            except Exception:
+                pass
+            else:
+                self._idle.append(pooled)
+                return
+        await _close_quietly(pooled.context)
+
+    async def capture(
+        self,
+        *,
+        url: str,
+        screenshot_path: str,
+        viewport: Tuple[int, int] = (1440, 1000),
+        full_page: bool = True,
+        wait_until: str = "networkidle",
+        timeout_seconds: float = 30.0,
+    ) -> Dict[str, Any]:
+        started = time.monotonic()
+        console_messages: List[Dict[str, str]] = []
+        failed_requests: List[Dict[str, Any]] = []
+
+        def _on_console(message: Any) -> None:
+            if message.type in {"warning", "error"}:
+                console_messages.append({"type": message.type, "text": message.text[:500]})
+
+        def _on_request_failed(request: Any) -> None:
+            failed_requests.append({"url": request.url, "error": request.failure or "failed"})
+
+        def _on_response(response: Any) -> None:
+            if response.status >= 400:
+                failed_requests.append({"url": response.url, "status": response.status})
+
+        async with self._semaphore:
+            launches_before = self.launches
+            pooled = await self._acquire(viewport)
+            page = pooled.page
+            page.on("console", _on_console)
+            page.on("requestfailed", _on_request_failed)
+            page.on("response", _on_response)
+            healthy = False
+            try:
+                response = await page.goto(url, wait_until=wait_until, timeout=timeout_seconds * 1000)
+                Path(screenshot_path).parent.mkdir(parents=True, exist_ok=True)
+                await page.screenshot(path=screenshot_path, full_page=full_page)
+                title = await page.title()
+                healthy = True
+            finally:
+                page.remove_listener("console", _on_console)
+                page.remove_listener("requestfailed", _on_request_failed)
+                page.remove_listener("response", _on_response)
+                await self._release(pooled, healthy=healthy)
+
+        return {
+            "url": url,
+            "status_code": response.status if response is not None else None,
+            "title": title,
+            "screenshot_path": screenshot_path,
+            "viewport": {"width": viewport[0], "height": viewport[1]},
+            "console_messages": console_messages,
+            "console_warning_count": len(console_messages),
+            "failed_requests": failed_requests,
+            "failed_request_count": len(failed_requests),
+            "browser_reused": self.launches == launches_before,
+            "page_reused": pooled.uses > 1,
+            "duration_ms": int((time.monotonic() - started) * 1000),
+        }
+
+    async def _close_browser(self) -> None:
+        for pooled in self._idle:
+            await _close_quietly(pooled.context)
+        self._idle.clear()
+        if self._browser is not None:
+            await _close_quietly(self._browser)
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    async def shutdown(self) -> None:
+        async with self._lock:
+            await self._close_browser()
+
+
+async def _close_quietly(resource: Any) -> None:
+    try:
+        await resource.close()
+    except Exception:
+        pass
+
+
+class BrowserService:
+    def __init__(self, *, pool_size: int = 2, ready_timeout_seconds: float = 120.0) -> None:
+        self.browser = BrowserPool(size=pool_size)
+        self.dev_servers = DevServerSupervisor(ready_timeout_seconds=ready_timeout_seconds)
+
+    async def shutdown(self) -> None:
+        await self.dev_servers.shutdown()
+        await self.browser.shutdown()
+
+
+_browser_service_singleton: Optional[BrowserService] = None
+
+
+def get_browser_service() -> BrowserService:
+    global _browser_service_singleton
+    if _browser_service_singleton is None:
+        from yudai.config import get_sandbox_config
+
+        config = get_sandbox_config()
+        _browser_service_singleton = BrowserService(
+            pool_size=config.browser_pool_size,
+            ready_timeout_seconds=config.dev_server_ready_timeout_seconds,
+        )
+    return _browser_service_singleton
+
+
+# ---------------------------------------------------------------------------
+# Agent-facing CLI
+# ---------------------------------------------------------------------------
+
+
+def _post(path: str, body: Dict[str, Any], *, timeout: float) -> Tuple[int, Dict[str, Any]]:
+    base_url = os.environ.get(BROWSER_SERVICE_URL_ENV, "").rstrip("/")
+    if not base_url:
+        raise ConnectionError(f"{BROWSER_SERVICE_URL_ENV} is not set")
+    headers = {"Content-Type": "application/json"}
+    secret = os.environ.get("CONTROLLER_INTERNAL_WS_SECRET")
+    if secret:
+        headers["X-Controller-Internal-Secret"] = secret
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=json.dumps(body).encode("utf-8"),
+        headers=headers,
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as exc:
+        try:
+            payload = json.loads(exc.read() or b"{}")
+        except ValueError:
+            payload = {"detail": str(exc)}
+        return exc.code, payload
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Drive the sandbox browser service")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dev_server = commands.add_parser("dev-server", help="start or reuse the workspace dev server")
+    dev_server.add_argument("--command", dest="dev_command", required=True)
+    dev_server.add_argument("--port", type=int, required=True)
+    dev_server.add_argument("--cwd")
+    dev_server.add_argument("--workspace", default=os.environ.get("WORKSPACE_PATH"))
+
+    capture = commands.add_parser("capture", help="open a URL in the pooled browser and save a screenshot")
+    capture.add_argument("--url", required=True)
+    capture.add_argument("--screenshot", default=os.environ.get("BROWSER_CHECK_SCREENSHOT_PATH"))
+    capture.add_argument("--width", type=int, default=1440)
+    capture.add_argument("--height", type=int, default=1000)
+    capture.add_argument("--viewport-only", action="store_true")
+    capture.add_argument("--wait-until", default="networkidle", choices=("load", "domcontentloaded", "networkidle"))
+    capture.add_argument("--timeout", type=float, default=30.0)
+    capture.add_argument("--workspace", default=os.environ.get("WORKSPACE_PATH"))
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "dev-server":
+            status, payload = _post(
+                "/internal/browser/dev-server",
+                {"command": args.dev_command, "port": args.port, "cwd": args.cwd, "workspace": args.workspace},
+                timeout=600,
+            )
+        else:
+            if not args.screenshot:
+                parser.error("--screenshot is required when BROWSER_CHECK_SCREENSHOT_PATH is unset")
+            status, payload = _post(
+                "/internal/browser/capture",
+                {
+                    "url": args.url,
+                    "screenshot_path": args.screenshot,
+                    "viewport_width": args.width,
+                    "viewport_height": args.height,
+                    "full_page": not args.viewport_only,
+                    "wait_until": args.wait_until,
+                    "timeout_seconds": args.timeout,
+                    "workspace": args.workspace,
+                },
+                timeout=args.timeout + 60,
+            )
+    except (ConnectionError, OSError) as exc:
+        print(f"browser service unreachable: {exc}", file=sys.stderr)
+        return SERVICE_UNAVAILABLE_EXIT_CODE
+
+    print(json.dumps(payload, ensure_ascii=True))
+    if status == 503:
+        return SERVICE_UNAVAILABLE_EXIT_CODE
+    return 0 if status < 400 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
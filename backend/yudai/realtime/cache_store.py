@@ -12,8 +12,12 @@ from pathlib import Path
 import tarfile
 from typing import Any, Dict, Iterable, Optional
 
+import httpx
+
 from yudai.config import get_sandbox_config
 
+from .sandbox_files import SandboxFileClient
+
 
 def _utc_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
@@ -430,13 +434,74 @@ async def download_sandbox_artifact_bundle(
     cwd: Optional[str] = None,
     env: Optional[Dict[str, str]] = None,
 ) -> DownloadedArtifactBundle:
-    from .sandbox_transport import run_sandbox_command  # local import to avoid circular dependency
-
     bundle_dir = store.bundle_dir(session_public_id, workflow_name)
     bundle_path = bundle_dir / archive_name
     metadata_path = bundle_dir / f"{bundle_path.stem}.metadata.json"
     source_paths_list = [str(item) for item in source_paths]
 
+    workspace = (env or {}).get("WORKSPACE_PATH") or cwd
+    try:
+        await SandboxFileClient(tunnel_url, timeout_seconds=timeout_seconds).download_archive(
+            source_paths_list,
+            archive_prefix=workflow_name,
+            destination=bundle_path,
+            workspace=workspace,
+        )
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code not in {404, 405}:
+            raise RuntimeError(f"Sandbox artifact download failed: {exc}") from exc
+        # Sandboxes started before the file API existed: export through a shell script.
+        await _download_artifact_bundle_via_exec(
+            tunnel_url=tunnel_url,
+            session_public_id=session_public_id,
+            bundle_path=bundle_path,
+            workflow_name=workflow_name,
+            source_paths=source_paths_list,
+            timeout_seconds=timeout_seconds,
+            cwd=cwd,
+            env=env,
+        )
+    except httpx.HTTPError as exc:
+        raise RuntimeError(f"Sandbox artifact download failed: {exc}") from exc
+
+    if not bundle_path.exists() or bundle_path.stat().st_size == 0:
+        raise RuntimeError("Downloaded sandbox artifact bundle is empty")
+    if not await asyncio.to_thread(_is_readable_archive, bundle_path):
+        raise RuntimeError("Downloaded sandbox artifact bundle is not a valid tar.gz archive")
+
+    checksum = await asyncio.to_thread(_sha256_artifact_file, bundle_path)
+    metadata = {
+        "session_public_id": session_public_id,
+        "workflow_name": workflow_name,
+        "bundle_path": str(bundle_path),
+        "checksum_sha256": checksum,
+        "byte_size": bundle_path.stat().st_size,
+        "source_paths": source_paths_list,
+    }
+    metadata_path.write_text(json.dumps(metadata, ensure_ascii=True, indent=2) + "\n", encoding="utf-8")
+
+    return DownloadedArtifactBundle(
+        bundle_path=str(bundle_path),
+        metadata_path=str(metadata_path),
+        checksum_sha256=checksum,
+        byte_size=bundle_path.stat().st_size,
+        source_paths=source_paths_list,
+    )
+
+
+async def _download_artifact_bundle_via_exec(
+    *,
+    tunnel_url: str,
+    session_public_id: str,
+    bundle_path: Path,
+    workflow_name: str,
+    source_paths: list[str],
+    timeout_seconds: int,
+    cwd: Optional[str],
+    env: Optional[Dict[str, str]],
+) -> None:
+    from .sandbox_transport import run_sandbox_command  # local import to avoid circular dependency
+
     stream_started = False
     stream_finished = False
     line_buffer = ""
@@ -471,7 +536,7 @@ async def download_sandbox_artifact_bundle(
             tunnel_url=tunnel_url,
             session_public_id=session_public_id,
             command=build_artifact_archive_command(
-                source_paths=source_paths_list,
+                source_paths=source_paths,
                 archive_prefix=workflow_name,
             ),
             cwd=cwd,
@@ -494,27 +559,16 @@ async def download_sandbox_artifact_bundle(
         )
     if not stream_started or not stream_finished:
         raise RuntimeError("Sandbox artifact stream markers were not observed during download")
-    if not bundle_path.exists() or bundle_path.stat().st_size == 0:
-        raise RuntimeError("Downloaded sandbox artifact bundle is empty")
 
-    checksum = await asyncio.to_thread(_sha256_artifact_file, bundle_path)
-    metadata = {
-        "session_public_id": session_public_id,
-        "workflow_name": workflow_name,
-        "bundle_path": str(bundle_path),
-        "checksum_sha256": checksum,
-        "byte_size": bundle_path.stat().st_size,
-        "source_paths": source_paths_list,
-    }
-    metadata_path.write_text(json.dumps(metadata, ensure_ascii=True, indent=2) + "\n", encoding="utf-8")
 
-    return DownloadedArtifactBundle(
-        bundle_path=str(bundle_path),
-        metadata_path=str(metadata_path),
-        checksum_sha256=checksum,
-        byte_size=bundle_path.stat().st_size,
-        source_paths=source_paths_list,
-    )
+def _is_readable_archive(path: Path) -> bool:
+    try:
+        with tarfile.open(path, mode="r:gz") as archive:
+            for _member in archive:
+                pass
+    except (tarfile.TarError, OSError, EOFError):
+        return False
+    return True
 
 
 def _sha256_artifact_file(path: Path) -> str:
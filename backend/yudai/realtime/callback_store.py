@@ -0,0 +1,500 @@
+"""Conflict-free persistence for sandbox progress and completion callbacks.
+
+The sandbox posts one callback per output chunk, and retries the ones that
+time out, so the same ``(controller_job_id, sequence)`` may arrive more than
+once and from several controllers at a time. Instead of SELECT-then-INSERT and
+rolling back on ``IntegrityError``, each callback is written as an upsert:
+
+* the run row is ``INSERT ... ON CONFLICT (controller_job_id) DO UPDATE``,
+  advancing ``last_sequence``/``heartbeat_at`` atomically;
+* the event row is ``INSERT ... ON CONFLICT (controller_job_id, sequence) DO
+  NOTHING``, so a replayed chunk is a no-op rather than an error. Once a job
+  is compacted its rows are gone from that key, so the same statement also
+  skips any sequence an event segment of the job already covers.
+
+On Postgres both are one statement (the run upsert runs as a data-modifying
+CTE). SQLite, used in development and tests, issues them back to back.
+
+The session and pipeline a mode execution belongs to never change, so they
+come from ``lookup_execution_route``, a small in-process cache that only
+queries on the first callback of each execution.
+
+While the controller runs ``maintain_run_progress``, progress on a run this
+process has already written is write-behind: ``RunProgressTracker`` keeps the
+latest status, heartbeat and sequence in memory and flushes dirty runs in one
+batch every ``run_progress_flush_ms``. Such a callback only inserts its event.
+The first callback for a job, and every completion, still write through, so a
+run's existence and its terminal state never depend on the flusher.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, case, func, literal, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from yudai.config import get_sandbox_config
+from yudai.models import (
+    AgentExecution,
+    ChatSession,
+    SandboxExecutionEvent,
+    SandboxExecutionEventSegment,
+    SandboxExecutionRun,
+)
+from yudai.utils import utc_now
+
+logger = logging.getLogger(__name__)
+
+_ROUTE_LIMIT = 2048
+_ROUTES: "OrderedDict[str, ExecutionRoute]" = OrderedDict()
+_ROUTES_LOCK = threading.Lock()
+
+_RUNS = SandboxExecutionRun.__table__
+_EVENTS = SandboxExecutionEvent.__table__
+_SEGMENTS = SandboxExecutionEventSegment.__table__
+# Runs that stop reporting without completing are forgotten after this long.
+_PROGRESS_IDLE_AFTER = timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class ExecutionRoute:
+    """Immutable routing facts for one mode execution."""
+
+    mode_execution_id: str
+    session_id: int
+    session_public_id: str
+    mode: Optional[str]
+    pipeline_execution_id: Optional[str]
+
+
+def lookup_execution_route(db: Session, mode_execution_id: str) -> Optional[ExecutionRoute]:
+    """Return the execution's session and pipeline, querying only on a cache miss."""
+
+    with _ROUTES_LOCK:
+        route = _ROUTES.get(mode_execution_id)
+        if route is not None:
+            _ROUTES.move_to_end(mode_execution_id)
+            return route
+    row = (
+        db.query(
+            AgentExecution.mode,
+            AgentExecution.execution_metadata,
+            ChatSession.id,
+            ChatSession.session_id,
+        )
+        .join(ChatSession, ChatSession.id == AgentExecution.session_id)
+        .filter(AgentExecution.id == mode_execution_id)
+        .first()
+    )
+    if row is None:
+        return None
+    mode, metadata, session_id, session_public_id = row
+    pipeline_execution_id = metadata.get("pipeline_execution_id") if isinstance(metadata, dict) else None
+    route = ExecutionRoute(
+        mode_execution_id=mode_execution_id,
+        session_id=session_id,
+        session_public_id=session_public_id,
+        mode=mode,
+        pipeline_execution_id=pipeline_execution_id,
+    )
+    with _ROUTES_LOCK:
+        _ROUTES[mode_execution_id] = route
+        while len(_ROUTES) > _ROUTE_LIMIT:
+            _ROUTES.popitem(last=False)
+    return route
+
+
+def clear_execution_routes() -> None:
+    with _ROUTES_LOCK:
+        _ROUTES.clear()
+
+
+@dataclass
+class RunProgress:
+    """Latest non-terminal progress of one sandbox run, possibly not yet flushed."""
+
+    controller_job_id: str
+    sandbox_job_id: Optional[str]
+    status: str
+    heartbeat_at: datetime
+    last_sequence: int
+
+
+class RunProgressTracker:
+    """In-memory write-behind table of running ``SandboxExecutionRun`` progress.
+
+    Only jobs whose run row this process has written are tracked, and only
+    while ``active`` (a flusher is running); otherwise ``record`` returns
+    ``False`` and the caller writes through.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self._lock = threading.Lock()
+        self._progress: Dict[str, RunProgress] = {}
+        self._dirty: Set[str] = set()
+
+    def track(self, controller_job_id: str, *, sandbox_job_id: Optional[str], status: str, sequence: int) -> None:
+        """Start tracking a job whose run row was just written through."""
+
+        if not self.active:
+            return
+        with self._lock:
+            current = self._progress.get(controller_job_id)
+            self._progress[controller_job_id] = RunProgress(
+                controller_job_id=controller_job_id,
+                sandbox_job_id=sandbox_job_id or (current.sandbox_job_id if current else None),
+                status=status,
+                heartbeat_at=utc_now(),
+                last_sequence=max(sequence, current.last_sequence if current else 0),
+            )
+
+    def record(self, controller_job_id: str, *, sandbox_job_id: str, status: str, sequence: Optional[int]) -> bool:
+        """Update a tracked job in memory; ``False`` means the caller must write through."""
+
+        if not self.active:
+            return False
+        with self._lock:
+            progress = self._progress.get(controller_job_id)
+            if progress is None:
+                return False
+            progress.sandbox_job_id = progress.sandbox_job_id or sandbox_job_id
+            progress.status = status
+            progress.heartbeat_at = utc_now()
+            progress.last_sequence = max(progress.last_sequence, int(sequence or 0))
+            self._dirty.add(controller_job_id)
+        return True
+
+    def finish(self, controller_job_id: str) -> None:
+        """Forget a job whose terminal state was written through."""
+
+        with self._lock:
+            self._progress.pop(controller_job_id, None)
+            self._dirty.discard(controller_job_id)
+
+    def get(self, controller_job_id: str) -> Optional[RunProgress]:
+        with self._lock:
+            progress = self._progress.get(controller_job_id)
+            return replace(progress) if progress is not None else None
+
+    def flush(self, db: Session) -> int:
+        """Persist every dirty run in one batched ``UPDATE``; returns how many were written."""
+
+        with self._lock:
+            pending: List[RunProgress] = [
+                replace(self._progress[job_id]) for job_id in self._dirty if job_id in self._progress
+            ]
+            self._dirty.clear()
+        if not pending:
+            self._evict_idle()
+            return 0
+        dialect = _dialect(db)
+        statement = (
+            update(_RUNS)
+            .where(_RUNS.c.controller_job_id == bindparam("b_controller_job_id"))
+            .values(
+                sandbox_job_id=func.coalesce(_RUNS.c.sandbox_job_id, bindparam("b_sandbox_job_id")),
+                # A completion written through meanwhile wins over buffered progress.
+                status=case((_RUNS.c.completed_at.is_(None), bindparam("b_status")), else_=_RUNS.c.status),
+                heartbeat_at=bindparam("b_heartbeat_at"),
+                last_sequence=_greatest(dialect, _RUNS.c.last_sequence, bindparam("b_last_sequence")),
+            )
+        )
+        try:
+            db.execute(
+                statement,
+                [
+                    {
+                        "b_controller_job_id": item.controller_job_id,
+                        "b_sandbox_job_id": item.sandbox_job_id,
+                        "b_status": item.status,
+                        "b_heartbeat_at": item.heartbeat_at,
+                        "b_last_sequence": item.last_sequence,
+                    }
+                    for item in pending
+                ],
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty.update(item.controller_job_id for item in pending if item.controller_job_id in self._progress)
+            raise
+        self._evict_idle()
+        return len(pending)
+
+    def _evict_idle(self) -> None:
+        # Only after a flush succeeded: an entry dropped earlier could not be
+        # marked dirty again if the UPDATE failed, and its progress would be lost.
+        idle_before = utc_now() - _PROGRESS_IDLE_AFTER
+        with self._lock:
+            for job_id in [
+                job_id
+                for job_id, item in self._progress.items()
+                if item.heartbeat_at < idle_before and job_id not in self._dirty
+            ]:
+                del self._progress[job_id]
+
+
+def run_progress_view(run: SandboxExecutionRun) -> Dict[str, Any]:
+    """``status``/``heartbeat_at``/``last_sequence`` for ``run``, preferring unflushed progress.
+
+    A completed row is authoritative: terminal states are always written through.
+    """
+
+    progress = get_run_progress_tracker().get(run.controller_job_id) if run.completed_at is None else None
+    if progress is None:
+        return {"status": run.status, "heartbeat_at": run.heartbeat_at, "last_sequence": run.last_sequence}
+    return {
+        "status": progress.status,
+        "heartbeat_at": progress.heartbeat_at,
+        "last_sequence": max(progress.last_sequence, run.last_sequence or 0),
+    }
+
+
+_run_progress_singleton: Optional[RunProgressTracker] = None
+
+
+def get_run_progress_tracker() -> RunProgressTracker:
+    global _run_progress_singleton
+    if _run_progress_singleton is None:
+        _run_progress_singleton = RunProgressTracker()
+    return _run_progress_singleton
+
+
+def _dialect(db: Session) -> Any:
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        return postgresql
+    if name == "sqlite":
+        return sqlite
+    raise RuntimeError(f"sandbox callbacks need INSERT ... ON CONFLICT support; {name} is not supported")
+
+
+def _greatest(dialect: Any, left: Any, right: Any) -> Any:
+    return func.greatest(left, right) if dialect is postgresql else func.max(left, right)
+
+
+def _run_values(
+    route: ExecutionRoute,
+    *,
+    controller_job_id: str,
+    sandbox_job_id: str,
+    attempt: int,
+    status_value: str,
+    sequence: Optional[int],
+) -> Dict[str, Any]:
+    now = utc_now()
+    return {
+        "controller_job_id": controller_job_id,
+        "sandbox_job_id": sandbox_job_id,
+        "session_id": route.session_id,
+        "pipeline_execution_id": route.pipeline_execution_id,
+        "mode_execution_id": route.mode_execution_id,
+        "mode": route.mode,
+        "attempt": max(1, int(attempt or 1)),
+        "status": status_value,
+        "started_at": now,
+        "heartbeat_at": now,
+        "last_sequence": int(sequence or 0),
+    }
+
+
+def record_callback_event(
+    db: Session,
+    route: ExecutionRoute,
+    *,
+    controller_job_id: str,
+    sandbox_job_id: str,
+    attempt: int,
+    status_value: str,
+    sequence: Optional[int],
+    stream: str,
+    event: str,
+    data: Optional[str],
+    event_metadata: Dict[str, Any],
+) -> bool:
+    """Advance the run and store the event. Commits.
+
+    Returns ``False`` for a replayed sequence, which stores nothing and should
+    not be broadcast again.
+    """
+
+    dialect = _dialect(db)
+    tracker = get_run_progress_tracker()
+    buffered = tracker.record(
+        controller_job_id,
+        sandbox_job_id=sandbox_job_id,
+        status=status_value,
+        sequence=sequence,
+    )
+    if buffered and sequence is None:
+        return True
+    run_insert = dialect.insert(_RUNS).values(
+        **_run_values(
+            route,
+            controller_job_id=controller_job_id,
+            sandbox_job_id=sandbox_job_id,
+            attempt=attempt,
+            status_value=status_value,
+            sequence=sequence,
+        )
+    )
+    excluded = run_insert.excluded
+    run_upsert = run_insert.on_conflict_do_update(
+        index_elements=[_RUNS.c.controller_job_id],
+        set_={
+            "sandbox_job_id": func.coalesce(_RUNS.c.sandbox_job_id, excluded.sandbox_job_id),
+            # A late chunk must not move a completed run back to running.
+            "status": case((_RUNS.c.completed_at.is_(None), excluded.status), else_=_RUNS.c.status),
+            "heartbeat_at": excluded.heartbeat_at,
+            "last_sequence": _greatest(dialect, _RUNS.c.last_sequence, excluded.last_sequence),
+            "updated_at": func.now(),
+        },
+    )
+    if sequence is None:
+        db.execute(run_upsert)
+        db.commit()
+        tracker.track(controller_job_id, sandbox_job_id=sandbox_job_id, status=status_value, sequence=0)
+        return True
+
+    event_values = {
+        "controller_job_id": controller_job_id,
+        "sandbox_job_id": sandbox_job_id,
+        "session_id": route.session_id,
+        "mode_execution_id": route.mode_execution_id,
+        "sequence": sequence,
+        "stream": stream,
+        "event": event,
+        "data": data,
+        "event_metadata": event_metadata,
+    }
+    compacted = (
+        select(_SEGMENTS.c.id)
+        .where(_SEGMENTS.c.controller_job_id == controller_job_id, _SEGMENTS.c.last_sequence >= sequence)
+        .exists()
+    )
+    event_insert = (
+        dialect.insert(_EVENTS)
+        .from_select(
+            list(event_values),
+            select(*(literal(value, _EVENTS.c[name].type) for name, value in event_values.items())).where(~compacted),
+        )
+        .on_conflict_do_nothing(index_elements=[_EVENTS.c.controller_job_id, _EVENTS.c.sequence])
+    )
+    if buffered:
+        stored = db.execute(event_insert).rowcount
+    elif dialect is postgresql:
+        stored = db.execute(event_insert.add_cte(run_upsert.returning(_RUNS.c.id).cte("run_upsert"))).rowcount
+    else:
+        db.execute(run_upsert)
+        stored = db.execute(event_insert).rowcount
+    db.commit()
+    if not buffered:
+        tracker.track(controller_job_id, sandbox_job_id=sandbox_job_id, status=status_value, sequence=sequence)
+    return stored > 0
+
+
+def record_callback_completion(
+    db: Session,
+    route: ExecutionRoute,
+    *,
+    controller_job_id: str,
+    sandbox_job_id: str,
+    attempt: int,
+    status_value: str,
+    sequence: Optional[int],
+    exit_code: Optional[int],
+    duration_ms: int,
+    stdout: str,
+    stderr: str,
+    parsed_payload: Optional[Dict[str, Any]],
+) -> bool:
+    """Mark the run complete in one upsert. Returns ``False`` for a duplicate completion. Commits."""
+
+    dialect = _dialect(db)
+    now = utc_now()
+    values = _run_values(
+        route,
+        controller_job_id=controller_job_id,
+        sandbox_job_id=sandbox_job_id,
+        attempt=attempt,
+        status_value=status_value,
+        sequence=sequence,
+    )
+    values.update(
+        completed_at=now,
+        exit_code=exit_code,
+        duration_ms=duration_ms,
+        stdout_tail=stdout,
+        stderr_tail=stderr,
+        parsed_payload=parsed_payload,
+    )
+    run_insert = dialect.insert(_RUNS).values(**values)
+    excluded = run_insert.excluded
+    statement = run_insert.on_conflict_do_update(
+        index_elements=[_RUNS.c.controller_job_id],
+        set_={
+            "sandbox_job_id": func.coalesce(_RUNS.c.sandbox_job_id, excluded.sandbox_job_id),
+            "status": excluded.status,
+            "heartbeat_at": excluded.heartbeat_at,
+            "completed_at": excluded.completed_at,
+            "exit_code": excluded.exit_code,
+            "duration_ms": excluded.duration_ms,
+            "stdout_tail": excluded.stdout_tail,
+            "stderr_tail": excluded.stderr_tail,
+            "parsed_payload": excluded.parsed_payload,
+            "last_sequence": _greatest(dialect, _RUNS.c.last_sequence, excluded.last_sequence),
+            "updated_at": func.now(),
+        },
+        where=or_(
+            _RUNS.c.completed_at.is_(None),
+            _RUNS.c.sandbox_job_id.is_distinct_from(excluded.sandbox_job_id),
+        ),
+    ).returning(_RUNS.c.id)
+    applied = db.execute(statement).first() is not None
+    db.commit()
+    get_run_progress_tracker().finish(controller_job_id)
+    return applied
+
+
+def _flush_run_progress(tracker: RunProgressTracker) -> int:
+    from yudai.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return tracker.flush(db)
+    finally:
+        db.close()
+
+
+async def maintain_run_progress() -> None:
+    """Enable write-behind run progress and flush it periodically; disabled when the interval is 0."""
+
+    interval_ms = get_sandbox_config().run_progress_flush_ms
+    if interval_ms <= 0:
+        return
+    tracker = get_run_progress_tracker()
+    tracker.active = True
+    try:
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            try:
+                await asyncio.to_thread(_flush_run_progress, tracker)
+            except Exception:
+                logger.warning("failed to flush sandbox run progress", exc_info=True)
+    finally:
+        # New callbacks write through from here on; persist what is buffered.
+        tracker.active = False
+        try:
+            await asyncio.to_thread(_flush_run_progress, tracker)
+        except Exception:
+            logger.warning("failed to flush sandbox run progress on shutdown", exc_info=True)
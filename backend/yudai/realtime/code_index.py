@@ -0,0 +1,457 @@
+"""Incrementally maintained code index of the sandbox workspace.
+
+The sandbox server keeps a file list plus per-file symbol definitions,
+import edges and HTTP route declarations for the workspace, so common probe
+lookups ("where is X defined", "which files import Y", "list routes") can be
+answered in milliseconds instead of through an agent run. Symbols come from
+per-language regular expressions; free-text and reference lookups go through
+ripgrep when it is installed. Refreshes only re-read files whose mtime or
+size changed since the previous pass.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_QUERY_KINDS: tuple[str, ...] = (
+    "definition",
+    "references",
+    "importers",
+    "routes",
+    "files",
+    "search",
+)
+INDEX_QUERY_KIND_PATTERN = "^(" + "|".join(INDEX_QUERY_KINDS) + ")$"
+
+_MAX_FILE_BYTES = 1_048_576
+_MAX_FILES = 50_000
+_SEARCH_TIMEOUT_SECONDS = 10
+_EXCLUDED_DIRS = {".git", ".yudai", "node_modules", "__pycache__", ".venv", "venv", "dist", "build"}
+
+
+@dataclass(frozen=True)
+class IndexedSymbol:
+    name: str
+    kind: str
+    line: int
+
+
+@dataclass(frozen=True)
+class IndexedRoute:
+    method: str
+    path: str
+    line: int
+
+
+@dataclass
+class IndexedFile:
+    signature: Tuple[int, int]
+    symbols: List[IndexedSymbol] = field(default_factory=list)
+    imports: List[Tuple[str, int]] = field(default_factory=list)
+    routes: List[IndexedRoute] = field(default_factory=list)
+
+
+_SymbolPattern = Tuple[str, "re.Pattern[str]"]
+
+_PYTHON_SYMBOLS: List[_SymbolPattern] = [
+    ("function", re.compile(r"^\s*(?:async\s+)?def\s+([A-Za-z_]\w*)")),
+    ("class", re.compile(r"^\s*class\s+([A-Za-z_]\w*)")),
+    ("constant", re.compile(r"^([A-Z][A-Z0-9_]*)\s*(?::[^=]+)?=(?!=)")),
+]
+_JS_SYMBOLS: List[_SymbolPattern] = [
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)")),
+    ("class", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)")),
+    ("interface", re.compile(r"^\s*(?:export\s+)?interface\s+([A-Za-z_$][\w$]*)")),
+    ("type", re.compile(r"^\s*(?:export\s+)?type\s+([A-Za-z_$][\w$]*)\s*(?:<[^=]*>)?\s*=")),
+    ("enum", re.compile(r"^\s*(?:export\s+)?(?:const\s+)?enum\s+([A-Za-z_$][\w$]*)")),
+    ("variable", re.compile(r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=")),
+]
+_GO_SYMBOLS: List[_SymbolPattern] = [
+    ("function", re.compile(r"^func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)")),
+    ("type", re.compile(r"^type\s+([A-Za-z_]\w*)")),
+]
+_RUST_SYMBOLS: List[_SymbolPattern] = [
+    ("function", re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+([A-Za-z_]\w*)")),
+    ("type", re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|type)\s+([A-Za-z_]\w*)")),
+]
+_RUBY_SYMBOLS: List[_SymbolPattern] = [
+    ("function", re.compile(r"^\s*def\s+(?:self\.)?([A-Za-z_]\w*[?!]?)")),
+    ("class", re.compile(r"^\s*(?:class|module)\s+([A-Z]\w*)")),
+]
+
+_SYMBOL_PATTERNS: Dict[str, List[_SymbolPattern]] = {
+    ".py": _PYTHON_SYMBOLS,
+    ".js": _JS_SYMBOLS,
+    ".jsx": _JS_SYMBOLS,
+    ".mjs": _JS_SYMBOLS,
+    ".cjs": _JS_SYMBOLS,
+    ".ts": _JS_SYMBOLS,
+    ".tsx": _JS_SYMBOLS,
+    ".go": _GO_SYMBOLS,
+    ".rs": _RUST_SYMBOLS,
+    ".rb": _RUBY_SYMBOLS,
+}
+
+_PYTHON_IMPORT_RE = re.compile(r"^\s*(?:from\s+(\.*[\w.]*)\s+import\b|import\s+([\w.]+(?:\s*,\s*[\w.]+)*))")
+_JS_IMPORT_RE = re.compile(
+    r"""(?:\bfrom\s*|\bimport\s*\(?\s*|\brequire\s*\(\s*)['"]([^'"]+)['"]"""
+)
+_RUST_IMPORT_RE = re.compile(r"^\s*(?:pub\s+)?use\s+([\w:]+)")
+_PYTHON_ROUTE_RE = re.compile(
+    r"""^\s*@\w+(?:\.\w+)*\.(get|post|put|patch|delete|head|options|websocket|route|api_route)\(\s*[rf]?['"]([^'"]*)['"]""",
+    re.IGNORECASE,
+)
+_JS_ROUTE_RE = re.compile(
+    r"""\b(?:app|router|server|api)\.(get|post|put|patch|delete|all)\(\s*['"`]([^'"`]+)['"`]"""
+)
+
+
+def _module_segments(value: str) -> List[str]:
+    """Split an import spec or path into comparable segments.
+
+    ``yudai.realtime.code_index``, ``./code_index`` and
+    ``yudai/realtime/code_index.py`` all end in ``code_index``.
+    """
+
+    text = value.strip().strip("'\"`")
+    text = re.sub(r"\.(?:py|pyi|js|jsx|mjs|cjs|ts|tsx|go|rs|rb)$", "", text)
+    return [segment for segment in re.split(r"[./\\:]+", text) if segment and segment != "@"]
+
+
+def _resolve_import(importer: str, spec: str) -> str:
+    """Rewrite relative imports as repository paths so ``..scheduler`` in
+    ``app/api/routes.py`` matches a query for ``app/scheduler.py``."""
+
+    directory = os.path.dirname(importer)
+    if spec.startswith("."):
+        if spec.startswith(("./", "../")):
+            return os.path.normpath(os.path.join(directory, spec))
+        dots = len(spec) - len(spec.lstrip("."))
+        for _ in range(dots - 1):
+            directory = os.path.dirname(directory)
+        remainder = spec[dots:].replace(".", "/")
+        return "/".join(part for part in (directory, remainder) if part)
+    return spec
+
+
+def extract_file_entries(path: str, text: str) -> IndexedFile:
+    """Parse one file's symbols, imports and routes; signature is filled in by the caller."""
+
+    extension = os.path.splitext(path)[1].lower()
+    symbol_patterns = _SYMBOL_PATTERNS.get(extension, [])
+    entry = IndexedFile(signature=(0, 0))
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        for kind, pattern in symbol_patterns:
+            match = pattern.match(line)
+            if match:
+                entry.symbols.append(IndexedSymbol(name=match.group(1), kind=kind, line=line_number))
+                break
+        if extension == ".py":
+            match = _PYTHON_IMPORT_RE.match(line)
+            if match:
+                specs = [match.group(1)] if match.group(1) is not None else match.group(2).split(",")
+                entry.imports.extend(
+                    (_resolve_import(path, spec.strip()), line_number) for spec in specs if spec.strip()
+                )
+            route = _PYTHON_ROUTE_RE.match(line)
+            if route:
+                entry.routes.append(
+                    IndexedRoute(method=route.group(1).upper(), path=route.group(2), line=line_number)
+                )
+        elif symbol_patterns is _JS_SYMBOLS:
+            entry.imports.extend(
+                (_resolve_import(path, spec), line_number) for spec in _JS_IMPORT_RE.findall(line)
+            )
+            route = _JS_ROUTE_RE.search(line)
+            if route:
+                entry.routes.append(
+                    IndexedRoute(method=route.group(1).upper(), path=route.group(2), line=line_number)
+                )
+        elif extension == ".rs":
+            match = _RUST_IMPORT_RE.match(line)
+            if match:
+                entry.imports.append((match.group(1), line_number))
+    return entry
+
+
+class CodeIndex:
+    """In-memory index over one workspace, refreshed incrementally.
+
+    Refreshes parse changed files outside the lock and swap the results in,
+    so the server can refresh on a worker thread while requests keep reading
+    the previous snapshot.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.generation = 0
+        self.refreshed_at: Optional[float] = None
+        self._files: Dict[str, IndexedFile] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def file_count(self) -> int:
+        return len(self._files)
+
+    def ensure_fresh(self, max_age_seconds: float) -> bool:
+        """Refresh when the last pass is older than ``max_age_seconds``."""
+
+        if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < max_age_seconds:
+            return True
+        return self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read changed files; returns ``False`` when the workspace is missing."""
+
+        if not os.path.isdir(self.root):
+            with self._lock:
+                self._files.clear()
+                self.refreshed_at = None
+            return False
+        paths = self._list_files()
+        with self._lock:
+            signatures = {path: entry.signature for path, entry in self._files.items()}
+        # Parse outside the lock so queries keep answering from the previous
+        # snapshot during a large first pass.
+        updates: Dict[str, Optional[IndexedFile]] = {}
+        for relative_path in paths:
+            absolute = os.path.join(self.root, relative_path)
+            try:
+                stat = os.stat(absolute)
+            except OSError:
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signatures.pop(relative_path, None) == signature:
+                continue
+            entry = self._parse(absolute, relative_path, stat.st_size)
+            entry.signature = signature
+            updates[relative_path] = entry
+        updates.update({removed: None for removed in signatures})
+        with self._lock:
+            for relative_path, entry in updates.items():
+                if entry is None:
+                    self._files.pop(relative_path, None)
+                else:
+                    self._files[relative_path] = entry
+            if updates:
+                self.generation += 1
+            self.refreshed_at = time.monotonic()
+            file_count = len(self._files)
+        if updates:
+            logger.debug(
+                "Code index refreshed root=%s updated=%d files=%d",
+                self.root,
+                len(updates),
+                file_count,
+            )
+        return True
+
+    def query(self, kind: str, term: str = "", *, limit: int = 20) -> Dict[str, Any]:
+        term = (term or "").strip()
+        if kind not in INDEX_QUERY_KINDS:
+            raise ValueError(f"Unknown code index query kind: {kind}")
+        if kind != "routes" and not term:
+            raise ValueError(f"Code index query {kind!r} requires a term")
+        handler = getattr(self, f"_query_{kind}")
+        matches: List[Dict[str, Any]] = handler(term, limit + 1)
+        return {
+            "kind": kind,
+            "term": term,
+            "matches": matches[:limit],
+            "truncated": len(matches) > limit,
+            "files_indexed": self.file_count,
+            "generation": self.generation,
+        }
+
+    def _query_definition(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        # ``Class.method`` looks up ``method``; qualified names are common in questions.
+        name = re.split(r"[.:]+", term)[-1] or term
+        matches: List[Dict[str, Any]] = []
+        with self._lock:
+            for path in sorted(self._files):
+                for symbol in self._files[path].symbols:
+                    if symbol.name == name:
+                        matches.append(
+                            {"path": path, "line": symbol.line, "symbol": symbol.name, "symbol_kind": symbol.kind}
+                        )
+                        if len(matches) >= limit:
+                            return matches
+        return matches
+
+    def _query_importers(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        wanted = _module_segments(term)
+        if not wanted:
+            return []
+        matches: List[Dict[str, Any]] = []
+        with self._lock:
+            for path in sorted(self._files):
+                for spec, line in self._files[path].imports:
+                    segments = _module_segments(spec)
+                    if len(segments) >= len(wanted) and segments[-len(wanted):] == wanted:
+                        matches.append({"path": path, "line": line, "text": spec})
+                        break
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def _query_routes(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        matches: List[Dict[str, Any]] = []
+        with self._lock:
+            for path in sorted(self._files):
+                for route in self._files[path].routes:
+                    if term and term not in route.path:
+                        continue
+                    matches.append(
+                        {"path": path, "line": route.line, "text": f"{route.method} {route.path}"}
+                    )
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+    def _query_files(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        needle = term.lower()
+        with self._lock:
+            paths = sorted(self._files)
+        hits = [path for path in paths if needle in os.path.basename(path).lower()]
+        hits.extend(path for path in paths if needle in path.lower() and path not in hits)
+        return [{"path": path} for path in hits[:limit]]
+
+    def _query_references(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        return self._search(term, limit, whole_word=True)
+
+    def _query_search(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        return self._search(term, limit, whole_word=False)
+
+    def _search(self, term: str, limit: int, *, whole_word: bool) -> List[Dict[str, Any]]:
+        rg_path = shutil.which("rg")
+        if rg_path:
+            return self._search_ripgrep(rg_path, term, limit, whole_word=whole_word)
+        pattern = re.compile((r"\b%s\b" if whole_word else "%s") % re.escape(term))
+        with self._lock:
+            paths = sorted(self._files)
+        matches: List[Dict[str, Any]] = []
+        for path in paths:
+            try:
+                with open(os.path.join(self.root, path), "r", encoding="utf-8", errors="ignore") as handle:
+                    for line_number, line in enumerate(handle, start=1):
+                        if pattern.search(line):
+                            matches.append({"path": path, "line": line_number, "text": line.strip()[:300]})
+                            if len(matches) >= limit:
+                                return matches
+            except OSError:
+                continue
+        return matches
+
+    def _search_ripgrep(self, rg_path: str, term: str, limit: int, *, whole_word: bool) -> List[Dict[str, Any]]:
+        command = [
+            rg_path,
+            "--line-number",
+            "--no-heading",
+            "--color",
+            "never",
+            "--fixed-strings",
+            "--sort",
+            "path",
+            "--max-count",
+            "5",
+            "--max-filesize",
+            str(_MAX_FILE_BYTES),
+            "--glob",
+            "!.yudai",
+        ]
+        if whole_word:
+            command.append("--word-regexp")
+        command.extend(["--", term, "."])
+        try:
+            completed = subprocess.run(
+                command,
+                cwd=self.root,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=_SEARCH_TIMEOUT_SECONDS,
+                check=False,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            logger.warning("ripgrep search failed in %s", self.root, exc_info=True)
+            return []
+        matches: List[Dict[str, Any]] = []
+        for raw_line in completed.stdout.splitlines():
+            path, _, rest = raw_line.partition(":")
+            line_text, _, text = rest.partition(":")
+            if not line_text.isdigit():
+                continue
+            matches.append(
+                {"path": os.path.normpath(path), "line": int(line_text), "text": text.strip()[:300]}
+            )
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def _list_files(self) -> List[str]:
+        try:
+            completed = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                cwd=self.root,
+                capture_output=True,
+                timeout=_SEARCH_TIMEOUT_SECONDS,
+                check=False,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            completed = None
+        if completed is not None and completed.returncode == 0:
+            paths: Iterable[str] = (
+                raw.decode("utf-8", "surrogateescape") for raw in completed.stdout.split(b"\0") if raw
+            )
+        else:
+            paths = self._walk_files()
+        selected: List[str] = []
+        for path in paths:
+            if any(part in _EXCLUDED_DIRS for part in path.split("/")[:-1]):
+                continue
+            selected.append(path)
+            if len(selected) >= _MAX_FILES:
+                break
+        return selected
+
+    def _walk_files(self) -> Iterable[str]:
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(name for name in dirnames if name not in _EXCLUDED_DIRS)
+            for filename in sorted(filenames):
+                yield os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/")
+
+    @staticmethod
+    def _parse(absolute: str, relative_path: str, size: int) -> IndexedFile:
+        extension = os.path.splitext(relative_path)[1].lower()
+        if size > _MAX_FILE_BYTES or extension not in _SYMBOL_PATTERNS:
+            return IndexedFile(signature=(0, 0))
+        try:
+            with open(absolute, "r", encoding="utf-8", errors="ignore") as handle:
+                text = handle.read()
+        except OSError:
+            return IndexedFile(signature=(0, 0))
+        return extract_file_entries(relative_path, text)
+
+
+_code_indexes: Dict[str, CodeIndex] = {}
+_code_indexes_lock = threading.Lock()
+
+
+def get_code_index(root: str) -> CodeIndex:
+    normalized = os.path.abspath(root)
+    with _code_indexes_lock:
+        index = _code_indexes.get(normalized)
+        if index is None:
+            index = CodeIndex(normalized)
+            _code_indexes[normalized] = index
+        return index
@@ -11,20 +11,16 @@ from typing import Any, Dict, Optional
 from yudai.auth.github_oauth import get_current_user, validate_internal_middleware_user
 from yudai.config import get_sandbox_config
 from yudai.db.database import get_db
-from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, WebSocket, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, status
 from pydantic import BaseModel, Field
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.attributes import flag_modified
 from yudai.models import (
-    AgentExecution,
     AuthToken,
     ChatSession,
-    SandboxExecutionEvent,
-    SandboxExecutionRun,
+    SandboxStatus,
     SessionRuntime,
     User,
 )
-from yudai.utils import utc_now
+from yudai.utils.metrics import SANDBOX_COMMAND_SECONDS
 from yudai.types import (
     CleanupResponse,
     HeartbeatResponse,
@@ -36,8 +32,15 @@ from yudai.types import (
 )
 from sqlalchemy.orm import Session
 
+from .callback_store import lookup_execution_route, record_callback_completion, record_callback_event
 from .lifecycle import get_realtime_lifecycle_service
-from .ws_protocol import WSMessageType, build_envelope, get_ws_hub
+from .sandbox_readiness import (
+    READY_SIGNATURE_HEADER,
+    READY_TIMESTAMP_HEADER,
+    get_sandbox_readiness,
+    verify_ready_signature,
+)
+from .ws_protocol import WSMessageType, get_ws_hub
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +63,9 @@ class SandboxEventRequest(BaseModel):
     exit_code: Optional[int] = None
     pid: Optional[int] = None
     command: Optional[str] = None
+    job_class: Optional[str] = None
+    queue_position: Optional[int] = None
+    queued_ms: Optional[int] = None
 
 
 class SandboxCompletionRequest(BaseModel):
@@ -154,51 +160,6 @@ def _controller_job_id_for(mode_execution_id: str, sandbox_job_id: str) -> str:
     return f"ctrljob_legacy_{mode_execution_id}_{sandbox_job_id}"[:64]
 
 
-def _upsert_sandbox_run_for_callback(
-    db: Session,
-    *,
-    execution: AgentExecution,
-    session_public_id: str,
-    controller_job_id: str,
-    sandbox_job_id: str,
-    attempt: int,
-    status_value: str,
-    sequence: Optional[int],
-) -> Optional[SandboxExecutionRun]:
-    session_obj = execution.session
-    if not isinstance(session_obj, ChatSession):
-        return None
-    metadata = execution.execution_metadata if isinstance(execution.execution_metadata, dict) else {}
-    run = (
-        db.query(SandboxExecutionRun)
-        .filter(SandboxExecutionRun.controller_job_id == controller_job_id)
-        .first()
-    )
-    now = utc_now()
-    if run is None:
-        run = SandboxExecutionRun(
-            controller_job_id=controller_job_id,
-            sandbox_job_id=sandbox_job_id,
-            session_id=session_obj.id,
-            pipeline_execution_id=metadata.get("pipeline_execution_id"),
-            mode_execution_id=execution.id,
-            mode=execution.mode,
-            attempt=max(1, int(attempt or 1)),
-            status=status_value,
-            started_at=now,
-            heartbeat_at=now,
-            last_sequence=int(sequence or 0),
-        )
-        db.add(run)
-        db.flush()
-    else:
-        run.sandbox_job_id = run.sandbox_job_id or sandbox_job_id
-        run.status = status_value
-        run.heartbeat_at = now
-        run.last_sequence = max(run.last_sequence or 0, int(sequence or 0))
-    return run
-
-
 def _get_user_github_token(db: Session, user_id: int) -> Optional[str]:
     auth_token = (
         db.query(AuthToken)
@@ -357,6 +318,47 @@ def record_heartbeat(
     lifecycle = get_realtime_lifecycle_service()
     sandbox = lifecycle.record_heartbeat(db, sandbox_id)
     db.commit()
+    get_sandbox_readiness().mark_seen(sandbox.id)
+
+    return HeartbeatResponse(
+        sandbox_id=sandbox.id,
+        status=sandbox.status,
+        last_heartbeat_at=sandbox.last_heartbeat_at,
+    )
+
+
+@router.post(
+    "/controller/sandboxes/{sandbox_id}/ready",
+    response_model=HeartbeatResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def record_sandbox_ready(
+    sandbox_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+) -> HeartbeatResponse:
+    """Signed boot callback from the sandbox server; wakes anyone waiting on it."""
+    body = await request.body()
+    if not verify_ready_signature(
+        get_sandbox_config().controller_callback_secret,
+        sandbox_id=sandbox_id,
+        timestamp=request.headers.get(READY_TIMESTAMP_HEADER),
+        signature=request.headers.get(READY_SIGNATURE_HEADER),
+        body=body,
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized sandbox callback")
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ready payload") from exc
+    capabilities = payload.get("capabilities") if isinstance(payload, dict) else None
+    capabilities = capabilities if isinstance(capabilities, dict) else {}
+
+    lifecycle = get_realtime_lifecycle_service()
+    sandbox = lifecycle.record_ready(db, sandbox_id, capabilities)
+    db.commit()
+    if sandbox.status != SandboxStatus.TERMINATED.value:
+        get_sandbox_readiness().mark_ready(sandbox.id, capabilities)
 
     return HeartbeatResponse(
         sandbox_id=sandbox.id,
@@ -472,11 +474,7 @@ async def record_sandbox_event(
 ) -> Dict[str, str]:
     _validate_callback_secret(x_controller_callback_secret)
 
-    execution = (
-        db.query(AgentExecution)
-        .filter(AgentExecution.id == request.mode_execution_id)
-        .first()
-    )
+    route = lookup_execution_route(db, request.mode_execution_id)
     session_public_id = request.session_id
     mode = None
     pipeline_execution_id = None
@@ -484,46 +482,30 @@ async def record_sandbox_event(
         request.mode_execution_id,
         request.sandbox_job_id,
     )
-    if execution:
-        mode = execution.mode
-        if isinstance(execution.execution_metadata, dict):
-            pipeline_execution_id = execution.execution_metadata.get("pipeline_execution_id")
-        if execution.session and execution.session.session_id:
-            session_public_id = execution.session.session_id
-        run = _upsert_sandbox_run_for_callback(
+    if route is not None:
+        mode = route.mode
+        pipeline_execution_id = route.pipeline_execution_id
+        session_public_id = route.session_public_id
+        stored = record_callback_event(
             db,
-            execution=execution,
-            session_public_id=session_public_id,
+            route,
             controller_job_id=controller_job_id,
             sandbox_job_id=request.sandbox_job_id,
             attempt=request.attempt,
             status_value="running" if request.event != "exit" else "exiting",
             sequence=request.sequence,
+            stream=request.stream,
+            event=request.event,
+            data=_bounded_text(request.data, _CALLBACK_CHUNK_LIMIT) if request.data else None,
+            event_metadata={
+                "exit_code": request.exit_code,
+                "pid": request.pid,
+                "command": request.command,
+            },
         )
-        if run is not None and request.sequence is not None:
-            db.add(
-                SandboxExecutionEvent(
-                    controller_job_id=controller_job_id,
-                    sandbox_job_id=request.sandbox_job_id,
-                    session_id=run.session_id,
-                    mode_execution_id=request.mode_execution_id,
-                    sequence=request.sequence,
-                    stream=request.stream,
-                    event=request.event,
-                    data=_bounded_text(request.data, _CALLBACK_CHUNK_LIMIT) if request.data else None,
-                    event_metadata={
-                        "exit_code": request.exit_code,
-                        "pid": request.pid,
-                        "command": request.command,
-                    },
-                )
-            )
-            try:
-                db.commit()
-            except IntegrityError:
-                db.rollback()
-        else:
-            db.commit()
+        if not stored:
+            # Already stored (and broadcast) once, or folded into a segment.
+            return {"status": "duplicate"}
 
     payload: Dict[str, Any] = {
         "stream": request.stream,
@@ -547,6 +529,12 @@ async def record_sandbox_event(
         payload["pid"] = request.pid
     if request.command:
         payload["command"] = request.command
+    if request.job_class:
+        payload["job_class"] = request.job_class
+    if request.queue_position is not None:
+        payload["queue_position"] = request.queue_position
+    if request.queued_ms is not None:
+        payload["queued_ms"] = request.queued_ms
 
     await get_ws_hub().send_to_session(
         session_public_id,
@@ -573,12 +561,8 @@ def complete_sandbox_execution(
             detail="mode_execution_id mismatch",
         )
 
-    execution = (
-        db.query(AgentExecution)
-        .filter(AgentExecution.id == mode_execution_id)
-        .first()
-    )
-    if not execution:
+    route = lookup_execution_route(db, mode_execution_id)
+    if route is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Execution not found",
@@ -586,59 +570,28 @@ def complete_sandbox_execution(
 
     stdout = _bounded_text(request.stdout, _CALLBACK_OUTPUT_LIMIT)
     stderr = _bounded_text(request.stderr, _CALLBACK_OUTPUT_LIMIT)
-    parsed_payload = request.parsed_payload or _parse_completion_payload(stdout, stderr)
     controller_job_id = request.controller_job_id or _controller_job_id_for(
         mode_execution_id,
         request.sandbox_job_id,
     )
-
-    metadata = dict(execution.execution_metadata or {})
-    existing_completion = metadata.get("sandbox_completion")
-    if isinstance(existing_completion, dict) and existing_completion.get("sandbox_job_id") == request.sandbox_job_id:
-        return {"status": "duplicate", "sandbox_job_id": request.sandbox_job_id}
-
-    run = _upsert_sandbox_run_for_callback(
+    # Output and status live only on the run row; execution_metadata is not rewritten here.
+    applied = record_callback_completion(
         db,
-        execution=execution,
-        session_public_id=request.session_id,
+        route,
         controller_job_id=controller_job_id,
         sandbox_job_id=request.sandbox_job_id,
         attempt=request.attempt,
         status_value=request.status,
         sequence=request.sequence,
+        exit_code=request.exit_code,
+        duration_ms=request.duration_ms,
+        stdout=stdout,
+        stderr=stderr,
+        parsed_payload=request.parsed_payload or _parse_completion_payload(stdout, stderr),
     )
-    if run is not None:
-        if run.completed_at is not None and run.sandbox_job_id == request.sandbox_job_id:
-            return {"status": "duplicate", "sandbox_job_id": request.sandbox_job_id}
-        run.status = request.status
-        run.completed_at = utc_now()
-        run.exit_code = request.exit_code
-        run.duration_ms = request.duration_ms
-        run.stdout_tail = stdout
-        run.stderr_tail = stderr
-        run.parsed_payload = parsed_payload
-        run.last_sequence = max(run.last_sequence or 0, int(request.sequence or 0))
-        run.run_metadata = {
-            **(run.run_metadata or {}),
-            "completion_callback_at": utc_now().isoformat(),
-        }
-
-    metadata["sandbox_completion"] = {
-        "session_id": request.session_id,
-        "controller_job_id": controller_job_id,
-        "sandbox_job_id": request.sandbox_job_id,
-        "mode_execution_id": mode_execution_id,
-        "status": request.status,
-        "exit_code": request.exit_code,
-        "stdout": stdout,
-        "stderr": stderr,
-        "duration_ms": request.duration_ms,
-        "parsed_payload": parsed_payload,
-    }
-    metadata["sandbox_job_id"] = request.sandbox_job_id
-    execution.execution_metadata = metadata
-    flag_modified(execution, "execution_metadata")
-    db.commit()
+    if not applied:
+        return {"status": "duplicate", "sandbox_job_id": request.sandbox_job_id}
+    SANDBOX_COMMAND_SECONDS.labels(route.mode or "unknown").observe(request.duration_ms / 1000)
     return {"status": "accepted", "sandbox_job_id": request.sandbox_job_id}
 
 
@@ -676,20 +629,22 @@ async def unified_session_websocket(
     ws_hub = get_ws_hub()
     await ws_hub.register(session_id, websocket)
 
-    await websocket.send_text(
-        build_envelope(
-            WSMessageType.STATUS,
-            {"status": "connected", "session_id": session_id},
-        )
+    # Every frame goes through the hub's writer for this socket so direct
+    # replies stay ordered with broadcasts and never block on a slow client.
+    ws_hub.send_to_socket(
+        session_id,
+        websocket,
+        WSMessageType.STATUS,
+        {"status": "connected", "session_id": session_id},
     )
-    await websocket.send_text(
-        build_envelope(
-            WSMessageType.MODE_EVENT,
-            {
-                "mode": session_obj.current_mode,
-                "state": session_obj.mode_status,
-            },
-        )
+    ws_hub.send_to_socket(
+        session_id,
+        websocket,
+        WSMessageType.MODE_EVENT,
+        {
+            "mode": session_obj.current_mode,
+            "state": session_obj.mode_status,
+        },
     )
 
     shutdown = asyncio.Event()
@@ -698,9 +653,7 @@ async def unified_session_websocket(
             await asyncio.sleep(5)
             if shutdown.is_set():
                 return
-            try:
-                await websocket.send_text(build_envelope(WSMessageType.HEARTBEAT))
-            except Exception:
+            if not ws_hub.send_to_socket(session_id, websocket, WSMessageType.HEARTBEAT):
                 shutdown.set()
                 return
 
@@ -715,35 +668,35 @@ async def unified_session_websocket(
             try:
                 message = json.loads(raw)
             except json.JSONDecodeError:
-                await websocket.send_text(
-                    build_envelope(
-                        WSMessageType.ERROR,
-                        {"message": "Invalid JSON", "code": "WS_MESSAGE_PARSE_ERROR"},
-                    )
+                ws_hub.send_to_socket(
+                    session_id,
+                    websocket,
+                    WSMessageType.ERROR,
+                    {"message": "Invalid JSON", "code": "WS_MESSAGE_PARSE_ERROR"},
                 )
                 continue
 
             msg_type = message.get("type")
             if msg_type == WSMessageType.USER_RESPONSE.value:
-                await websocket.send_text(
-                    build_envelope(
-                        WSMessageType.STATUS,
-                        {"status": "received", "detail": "User response acknowledged"},
-                    )
+                ws_hub.send_to_socket(
+                    session_id,
+                    websocket,
+                    WSMessageType.STATUS,
+                    {"status": "received", "detail": "User response acknowledged"},
                 )
             else:
-                await websocket.send_text(
-                    build_envelope(
-                        WSMessageType.ERROR,
-                        {"message": f"Unknown message type: {msg_type}"},
-                    )
+                ws_hub.send_to_socket(
+                    session_id,
+                    websocket,
+                    WSMessageType.ERROR,
+                    {"message": f"Unknown message type: {msg_type}"},
                 )
 
     try:
         await asyncio.gather(heartbeat_loop(), receive_loop())
     finally:
         shutdown.set()
-        await ws_hub.unregister(session_id, websocket)
+        await ws_hub.unregister(session_id, websocket, flush_timeout_seconds=1.0)
         try:
             await websocket.close()
         except Exception:
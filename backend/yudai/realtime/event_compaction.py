@@ -0,0 +1,297 @@
+"""Fold finished sandbox jobs' stream events into compressed segments.
+
+Callbacks persist one ``SandboxExecutionEvent`` row per output chunk so a
+reconnecting client can replay a running job. Once the job's
+``SandboxExecutionRun`` has completed (plus a grace period for callbacks
+still in flight), those rows are only ever read back in order, so
+``compact_run_events`` rewrites them as one ``SandboxExecutionEventSegment``
+and deletes the originals in the same transaction. Heartbeats carry no data
+and are dropped.
+
+Replays read segments through ``iter_segment_events``, which yields the same
+shape as a live row, so callers merge both sources without caring which one
+an event came from. Two controllers compacting the same job race on the
+segment's unique ``(controller_job_id, first_sequence)`` key; the loser rolls
+back and leaves the winner's segment in place. Rows that arrive after a job
+was compacted are folded into a further segment, minus redelivered sequences
+the earlier segments already hold.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import gzip
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from yudai.config import get_sandbox_config
+from yudai.models import SandboxExecutionEvent, SandboxExecutionEventSegment, SandboxExecutionRun
+from yudai.utils import utc_now
+
+try:  # Optional: zstd compresses these logs smaller and faster than gzip.
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the deployment image
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DROPPED_EVENTS = frozenset({"heartbeat"})
+SEQUENCE_INDEX_STRIDE = 256
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+
+
+@dataclass(frozen=True)
+class ReplayEvent:
+    """One sandbox stream event, whether read from a live row or a segment."""
+
+    controller_job_id: str
+    sandbox_job_id: str
+    mode_execution_id: str
+    sequence: int
+    stream: str
+    event: str
+    data: Optional[str]
+    event_metadata: Optional[Dict[str, Any]]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, row: SandboxExecutionEvent) -> "ReplayEvent":
+        return cls(
+            controller_job_id=row.controller_job_id,
+            sandbox_job_id=row.sandbox_job_id,
+            mode_execution_id=row.mode_execution_id,
+            sequence=row.sequence,
+            stream=row.stream,
+            event=row.event,
+            data=row.data,
+            event_metadata=row.event_metadata,
+            created_at=row.created_at,
+        )
+
+
+def _compress(raw: bytes) -> tuple[str, bytes]:
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=6).compress(raw)
+    return CODEC_GZIP, gzip.compress(raw, compresslevel=6)
+
+
+def _decompress(codec: str, payload: bytes) -> bytes:
+    if codec == CODEC_GZIP:
+        return gzip.decompress(payload)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd event segments")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"unknown event segment codec {codec!r}")
+
+
+def _encode_line(row: SandboxExecutionEvent) -> bytes:
+    record = {
+        "q": row.sequence,
+        "s": row.stream,
+        "e": row.event,
+        "d": row.data,
+        "m": row.event_metadata,
+        # Keep the column's own tz-awareness so replays sort alongside live rows.
+        "t": row.created_at.isoformat() if row.created_at else None,
+    }
+    return json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def build_segment(rows: List[SandboxExecutionEvent]) -> Optional[SandboxExecutionEventSegment]:
+    """Encode ``rows`` (one job, ascending sequence) as a segment, or ``None`` if all were dropped."""
+
+    kept = [row for row in rows if row.event not in DROPPED_EVENTS]
+    if not kept:
+        return None
+    lines: List[bytes] = []
+    sequence_index: List[List[int]] = []
+    offset = 0
+    for position, row in enumerate(kept):
+        line = _encode_line(row)
+        if position % SEQUENCE_INDEX_STRIDE == 0:
+            sequence_index.append([row.sequence, offset])
+        lines.append(line)
+        offset += len(line)
+    raw = b"".join(lines)
+    codec, payload = _compress(raw)
+    first, last = kept[0], kept[-1]
+    return SandboxExecutionEventSegment(
+        controller_job_id=first.controller_job_id,
+        sandbox_job_id=first.sandbox_job_id,
+        session_id=first.session_id,
+        mode_execution_id=first.mode_execution_id,
+        first_sequence=first.sequence,
+        last_sequence=last.sequence,
+        event_count=len(kept),
+        dropped_count=len(rows) - len(kept),
+        codec=codec,
+        payload=payload,
+        raw_bytes=len(raw),
+        sequence_index=sequence_index,
+        first_event_at=first.created_at,
+        last_event_at=last.created_at,
+    )
+
+
+def iter_segment_events(
+    segment: SandboxExecutionEventSegment,
+    *,
+    after_sequence: Optional[int] = None,
+    last: Optional[int] = None,
+) -> Iterator[ReplayEvent]:
+    """Decode a segment lazily, starting at the first event after ``after_sequence``.
+
+    ``last`` keeps only the segment's final ``last`` events; the sparse index
+    jumps close to them so the lines before are neither split nor parsed.
+    """
+
+    raw = _decompress(segment.codec, segment.payload)
+    index = segment.sequence_index or []
+    entry = 0
+    if after_sequence is not None:
+        for position, (sequence, _offset) in enumerate(index):
+            if sequence > after_sequence:
+                break
+            entry = position
+    skip = 0
+    if last is not None:
+        target = max(segment.event_count - last, 0)
+        entry = max(entry, min(target // SEQUENCE_INDEX_STRIDE, len(index) - 1))
+        skip = max(target - entry * SEQUENCE_INDEX_STRIDE, 0)
+    start = index[entry][1] if index else 0
+    view = memoryview(raw)
+    while start < len(raw):
+        end = raw.find(b"\n", start)
+        if end < 0:
+            end = len(raw)
+        line_start, start = start, end + 1
+        if skip:
+            skip -= 1
+            continue
+        record = json.loads(bytes(view[line_start:end]))
+        if after_sequence is not None and record["q"] <= after_sequence:
+            continue
+        yield ReplayEvent(
+            controller_job_id=segment.controller_job_id,
+            sandbox_job_id=segment.sandbox_job_id,
+            mode_execution_id=segment.mode_execution_id,
+            sequence=record["q"],
+            stream=record["s"],
+            event=record["e"],
+            data=record.get("d"),
+            event_metadata=record.get("m"),
+            created_at=datetime.fromisoformat(record["t"]) if record.get("t") else None,
+        )
+
+
+def _folded_sequences(db: Session, controller_job_id: str) -> Set[int]:
+    segments = (
+        db.query(SandboxExecutionEventSegment)
+        .filter(SandboxExecutionEventSegment.controller_job_id == controller_job_id)
+        .all()
+    )
+    return {event.sequence for segment in segments for event in iter_segment_events(segment)}
+
+
+def compact_run_events(db: Session, controller_job_id: str) -> bool:
+    """Replace a job's event rows with one segment; commits.
+
+    Returns ``False`` when another controller compacted the job first.
+    """
+
+    rows = (
+        db.query(SandboxExecutionEvent)
+        .filter(SandboxExecutionEvent.controller_job_id == controller_job_id)
+        .order_by(SandboxExecutionEvent.sequence.asc())
+        .all()
+    )
+    if not rows:
+        return False
+    last_sequence = rows[-1].sequence
+    if db.query(SandboxExecutionEventSegment.id).filter(
+        SandboxExecutionEventSegment.controller_job_id == controller_job_id
+    ).first() is not None:
+        # A callback redelivered after an earlier pass lands as a new row, since
+        # the folded one no longer blocks its unique key. Live ingest ignores
+        # such repeats, and keeping them would collide with the segment that
+        # already starts at that sequence on every later pass.
+        folded = _folded_sequences(db, controller_job_id)
+        rows = [row for row in rows if row.sequence not in folded]
+    segment = build_segment(rows) if rows else None
+    if segment is not None:
+        db.add(segment)
+    db.query(SandboxExecutionEvent).filter(
+        SandboxExecutionEvent.controller_job_id == controller_job_id,
+        SandboxExecutionEvent.sequence <= last_sequence,
+    ).delete(synchronize_session=False)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        logger.info("event segment for %s was written concurrently; skipping", controller_job_id)
+        return False
+    return True
+
+
+def compact_finished_runs(db: Session, *, limit: int = 50, grace_seconds: Optional[int] = None) -> int:
+    """Compact up to ``limit`` completed jobs that still have raw event rows."""
+
+    if grace_seconds is None:
+        grace_seconds = get_sandbox_config().event_compaction_grace_seconds
+    cutoff = utc_now() - timedelta(seconds=grace_seconds)
+    job_ids = [
+        job_id
+        for (job_id,) in db.query(SandboxExecutionRun.controller_job_id)
+        .filter(
+            SandboxExecutionRun.completed_at.is_not(None),
+            SandboxExecutionRun.completed_at < cutoff,
+            db.query(SandboxExecutionEvent.id)
+            .filter(SandboxExecutionEvent.controller_job_id == SandboxExecutionRun.controller_job_id)
+            .exists(),
+        )
+        .order_by(SandboxExecutionRun.completed_at.asc())
+        .limit(limit)
+    ]
+    compacted = 0
+    for job_id in job_ids:
+        try:
+            if compact_run_events(db, job_id):
+                compacted += 1
+        except Exception:
+            db.rollback()
+            logger.warning("failed to compact sandbox events for %s", job_id, exc_info=True)
+    return compacted
+
+
+def _compact_once() -> int:
+    from yudai.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return compact_finished_runs(db)
+    finally:
+        db.close()
+
+
+async def maintain_event_compaction() -> None:
+    """Periodically compact finished jobs; disabled when the interval is 0."""
+
+    interval = get_sandbox_config().event_compaction_interval_seconds
+    if interval <= 0:
+        return
+    while True:
+        try:
+            compacted = await asyncio.to_thread(_compact_once)
+            if compacted:
+                logger.info("compacted sandbox events for %d finished jobs", compacted)
+        except Exception:
+            logger.warning("sandbox event compaction failed", exc_info=True)
+        await asyncio.sleep(interval)
@@ -7,13 +7,13 @@ import logging
 from typing import Any, Dict, Optional
 
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
 
 from yudai.daifuUserAgent.llm_service import LLMService
 from yudai.daifuUserAgent.message_persistence import (
     persist_ai_message,
     refresh_session_message_counts,
 )
+from yudai.db.json_patch import patch_json
 from yudai.models import AgentExecution, ChatMessage, ChatSession
 from yudai.utils import utc_now
 
@@ -38,8 +38,7 @@ class ExecutionFollowupService:
         detail: Optional[str] = None,
         pipeline_execution_id: Optional[str] = None,
     ) -> Optional[str]:
-        metadata = dict(execution.execution_metadata or {})
-        existing_message_id = metadata.get("followup_message_id")
+        existing_message_id = (execution.execution_metadata or {}).get("followup_message_id")
         if isinstance(existing_message_id, str) and existing_message_id:
             return existing_message_id
 
@@ -50,9 +49,7 @@ class ExecutionFollowupService:
             .first()
         )
         if existing_message:
-            metadata["followup_message_id"] = message_id
-            execution.execution_metadata = metadata
-            flag_modified(execution, "execution_metadata")
+            patch_json(execution, "execution_metadata", {"followup_message_id": message_id})
             db.commit()
             return message_id
 
@@ -84,10 +81,11 @@ class ExecutionFollowupService:
             context_card_ids=[],
             actions=None,
         )
-        metadata["followup_message_id"] = message_id
-        metadata["followup_generated_at"] = utc_now().isoformat()
-        execution.execution_metadata = metadata
-        flag_modified(execution, "execution_metadata")
+        patch_json(
+            execution,
+            "execution_metadata",
+            {"followup_message_id": message_id, "followup_generated_at": utc_now().isoformat()},
+        )
         refresh_session_message_counts(db, session)
         db.commit()
 
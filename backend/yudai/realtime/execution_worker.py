@@ -8,14 +8,17 @@ import os
 import signal
 import uuid
 from datetime import timedelta
-from typing import Optional
+from typing import Dict, Iterable, Optional, Set
 
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import update
+from sqlalchemy.orm import Session, joinedload
 
 from yudai.db.database import SessionLocal, init_db
+from yudai.db.json_patch import patch_json, patch_json_rows
 from yudai.models import AgentExecution, AgentExecutionLease, ChatSession, SessionModeStatus
 from yudai.utils import utc_now
+from yudai.utils.profiling import start_profiling_hooks
+from yudai.utils.query_stats import tracked_task
 
 from .mode_orchestrator import (
     BROWSER_CHECK_MODE,
@@ -32,6 +35,8 @@ class ExecutionWorker:
         self.worker_id = os.getenv("HOSTNAME") or f"backend-worker-{os.getpid()}"
         self.lease_seconds = int(os.getenv("EXECUTION_WORKER_LEASE_SECONDS", "120"))
         self.heartbeat_seconds = max(5, int(os.getenv("EXECUTION_WORKER_HEARTBEAT_SECONDS", "15")))
+        self._held_leases: Dict[str, asyncio.Task] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
 
     def stop(self) -> None:
         self._stop_event.set()
@@ -51,7 +56,8 @@ class ExecutionWorker:
     async def run_once(self) -> Optional[str]:
         db = SessionLocal()
         try:
-            execution = self.claim_next(db)
+            with tracked_task("claim_next", service="worker"):
+                execution = self.claim_next(db)
             if not execution:
                 return None
             execution_id = execution.id
@@ -71,44 +77,38 @@ class ExecutionWorker:
             max_modes_int = int(max_modes) if max_modes is not None else None
             sidecar = bool(metadata.get("sidecar")) or execution.mode == BROWSER_CHECK_MODE
             session_public_id = session.session_id
-            lease_id = str(metadata.get("lease_id") or "")
+            lease_id = execution.lease_id or ""
         finally:
             db.close()
 
         orchestrator = get_session_execution_orchestrator()
-        heartbeat_task = (
-            asyncio.create_task(self._heartbeat_lease(lease_id), name=f"execution-lease-{lease_id}")
-            if lease_id
-            else None
-        )
+        if sidecar:
+            run_coro = orchestrator.run_browser_check(
+                session_public_id=session_public_id,
+                user_id=user_id,
+                execution_id=execution_id,
+                objective=objective,
+            )
+        else:
+            run_coro = orchestrator.run_full_pipeline(
+                session_public_id=session_public_id,
+                user_id=user_id,
+                execution_id=execution_id,
+                objective=objective,
+                max_modes=max_modes_int,
+            )
+        run_task = asyncio.create_task(run_coro, name=f"execution-{execution_id}")
+        if lease_id:
+            self._hold_lease(lease_id, run_task)
         try:
-            if sidecar:
-                await orchestrator.run_browser_check(
-                    session_public_id=session_public_id,
-                    user_id=user_id,
-                    execution_id=execution_id,
-                    objective=objective,
-                )
-            else:
-                await orchestrator.run_full_pipeline(
-                    session_public_id=session_public_id,
-                    user_id=user_id,
-                    execution_id=execution_id,
-                    objective=objective,
-                    max_modes=max_modes_int,
-                )
+            await run_task
         except asyncio.CancelledError:
             logger.info("execution %s was cancelled while running", execution_id)
         except Exception:
             logger.exception("execution %s failed outside orchestrator handling", execution_id)
         finally:
-            if heartbeat_task is not None:
-                heartbeat_task.cancel()
-                try:
-                    await heartbeat_task
-                except asyncio.CancelledError:
-                    pass
             if lease_id:
+                self._held_leases.pop(lease_id, None)
                 self.release_lease(lease_id, reason="worker_finished")
         return execution_id
 
@@ -144,25 +144,23 @@ class ExecutionWorker:
         db.add(lease)
 
         execution.status = SessionModeStatus.RUNNING.value
-        metadata = dict(execution.execution_metadata or {})
-        metadata["claimed_at"] = now.isoformat()
-        metadata["claimed_by"] = self.worker_id
-        metadata["lease_id"] = lease.lease_id
-        metadata["lease_attempt"] = lease.attempt
-        execution.execution_metadata = metadata
-        flag_modified(execution, "execution_metadata")
+        execution.lease_id = lease.lease_id
+        execution.claimed_by = self.worker_id
+        execution.claimed_at = now
 
         session = execution.session
         if isinstance(session, ChatSession):
-            active_execution = dict((session.mode_metadata or {}).get("active_execution") or {})
+            active_execution = (session.mode_metadata or {}).get("active_execution") or {}
             if active_execution.get("execution_id") == execution.id:
-                active_execution["status"] = SessionModeStatus.RUNNING.value
-                active_execution["detail"] = "Execution worker claimed queued run"
-                session.mode_metadata = {
-                    **(session.mode_metadata or {}),
-                    "active_execution": active_execution,
-                }
-                flag_modified(session, "mode_metadata")
+                patch_json(
+                    session,
+                    "mode_metadata",
+                    {
+                        "status": SessionModeStatus.RUNNING.value,
+                        "detail": "Execution worker claimed queued run",
+                    },
+                    path="active_execution",
+                )
             session.mode_status = SessionModeStatus.RUNNING.value
             session.mode_updated_at = utc_now()
             session.last_activity = utc_now()
@@ -181,12 +179,17 @@ class ExecutionWorker:
             )
             .all()
         )
+        executions_by_id: Dict[str, AgentExecution] = {}
+        if expired_leases:
+            executions_by_id = {
+                execution.id: execution
+                for execution in db.query(AgentExecution)
+                .options(joinedload(AgentExecution.session))
+                .filter(AgentExecution.id.in_({lease.execution_id for lease in expired_leases}))
+            }
+        requeued_sessions = []
         for lease in expired_leases:
-            execution = (
-                db.query(AgentExecution)
-                .filter(AgentExecution.id == lease.execution_id)
-                .first()
-            )
+            execution = executions_by_id.get(lease.execution_id)
             lease.released_at = now
             lease.release_reason = "expired"
             if execution and execution.status in {
@@ -194,50 +197,88 @@ class ExecutionWorker:
                 SessionModeStatus.DECIDING.value,
                 SessionModeStatus.STALLED.value,
             }:
+                # The released lease row records when and why the run stalled.
                 execution.status = SessionModeStatus.QUEUED.value
-                metadata = dict(execution.execution_metadata or {})
-                metadata["stalled_at"] = now.isoformat()
-                metadata["stalled_lease_id"] = lease.lease_id
-                execution.execution_metadata = metadata
-                flag_modified(execution, "execution_metadata")
+                execution.lease_id = None
 
                 session = execution.session
                 if isinstance(session, ChatSession):
-                    active_execution = dict((session.mode_metadata or {}).get("active_execution") or {})
+                    active_execution = (session.mode_metadata or {}).get("active_execution") or {}
                     if active_execution.get("execution_id") == execution.id:
-                        active_execution["status"] = SessionModeStatus.QUEUED.value
-                        active_execution["detail"] = "Execution worker lease expired; run requeued"
-                        session.mode_metadata = {
-                            **(session.mode_metadata or {}),
-                            "active_execution": active_execution,
-                        }
-                        flag_modified(session, "mode_metadata")
-                    session.mode_status = SessionModeStatus.QUEUED.value
-                    session.mode_updated_at = now
+                        requeued_sessions.append(session)
+                    else:
+                        session.mode_status = SessionModeStatus.QUEUED.value
+                        session.mode_updated_at = now
+        patch_json_rows(
+            requeued_sessions,
+            "mode_metadata",
+            {
+                "status": SessionModeStatus.QUEUED.value,
+                "detail": "Execution worker lease expired; run requeued",
+            },
+            path="active_execution",
+            values={"mode_status": SessionModeStatus.QUEUED.value, "mode_updated_at": now},
+        )
         if expired_leases:
             db.commit()
 
-    async def _heartbeat_lease(self, lease_id: str) -> None:
-        while True:
+    def _hold_lease(self, lease_id: str, task: asyncio.Task) -> None:
+        self._held_leases[lease_id] = task
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(
+                self._heartbeat_loop(),
+                name=f"execution-lease-heartbeat-{self.worker_id}",
+            )
+
+    async def _heartbeat_loop(self) -> None:
+        """Extend every held lease once per interval and cancel runs whose lease was lost."""
+
+        while self._held_leases:
             await asyncio.sleep(self.heartbeat_seconds)
-            db = SessionLocal()
+            lease_ids = list(self._held_leases)
+            if not lease_ids:
+                return
             try:
-                lease = (
-                    db.query(AgentExecutionLease)
-                    .filter(
-                        AgentExecutionLease.lease_id == lease_id,
-                        AgentExecutionLease.released_at.is_(None),
-                    )
-                    .first()
+                renewed = self.heartbeat_leases(lease_ids)
+            except Exception:
+                logger.exception("failed to heartbeat %d execution leases", len(lease_ids))
+                continue
+            for lease_id in lease_ids:
+                if lease_id in renewed:
+                    continue
+                task = self._held_leases.pop(lease_id, None)
+                if task is not None and not task.done():
+                    logger.warning("lease %s was lost; cancelling its execution", lease_id)
+                    task.cancel()
+
+    def heartbeat_leases(self, lease_ids: Iterable[str]) -> Set[str]:
+        """Extend all live leases in one statement and return the ids that are still held."""
+
+        lease_ids = list(lease_ids)
+        if not lease_ids:
+            return set()
+        now = utc_now()
+        db = SessionLocal()
+        try:
+            statement = (
+                update(AgentExecutionLease)
+                .where(
+                    AgentExecutionLease.lease_id.in_(lease_ids),
+                    AgentExecutionLease.worker_id == self.worker_id,
+                    AgentExecutionLease.released_at.is_(None),
+                )
+                .values(
+                    heartbeat_at=now,
+                    expires_at=now + timedelta(seconds=self.lease_seconds),
                 )
-                if lease is None:
-                    return
-                now = utc_now()
-                lease.heartbeat_at = now
-                lease.expires_at = now + timedelta(seconds=self.lease_seconds)
-                db.commit()
-            finally:
-                db.close()
+                .returning(AgentExecutionLease.lease_id)
+                .execution_options(synchronize_session=False)
+            )
+            renewed = set(db.execute(statement).scalars().all())
+            db.commit()
+            return renewed
+        finally:
+            db.close()
 
     def release_lease(self, lease_id: str, *, reason: str) -> None:
         db = SessionLocal()
@@ -254,6 +295,11 @@ class ExecutionWorker:
                 return
             lease.released_at = utc_now()
             lease.release_reason = reason
+            db.execute(
+                update(AgentExecution)
+                .where(AgentExecution.id == lease.execution_id, AgentExecution.lease_id == lease_id)
+                .values(lease_id=None)
+            )
             db.commit()
         finally:
             db.close()
@@ -278,8 +324,12 @@ async def _main() -> None:
             loop.add_signal_handler(sig, worker.stop)
         except NotImplementedError:  # pragma: no cover - platform-specific
             pass
+    profiling_hooks = start_profiling_hooks("worker")
     logger.info("execution worker started")
-    await worker.run_forever()
+    try:
+        await worker.run_forever()
+    finally:
+        profiling_hooks.stop()
     logger.info("execution worker stopped")
 
 
@@ -4,19 +4,23 @@ from __future__ import annotations
 
 import asyncio
 import base64
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import timedelta
+import hashlib
 import logging
 from pathlib import Path
 import re
 import subprocess
 import time
-from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple
 import uuid
+import weakref
 
 from yudai.config import get_sandbox_config
-from yudai.config.realtime_identity import build_sandbox_identity
+from yudai.config.realtime_identity import SandboxIdentity, build_sandbox_identity
 from yudai.db.database import SessionLocal
+from yudai.db.json_patch import patch_json
 from yudai.models import (
     AgentExecution,
     ChatSession,
@@ -32,23 +36,32 @@ from yudai.models import (
     Solve,
     SolveRun,
 )
-from sqlalchemy import or_
+from sqlalchemy import or_, text
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.attributes import flag_modified
 
 from yudai.utils import utc_now
+from yudai.utils.tracing import set_attribute, trace_headers, traced
 
 from yudai.config.realtime_flags import get_realtime_feature_flags
 
 import httpx
 
 from .cache_store import SessionCacheStore
+from .callback_store import get_run_progress_tracker
 from .errors import RealtimeErrorCode, as_http_exception
 from .modal_sandbox import RealtimeModalSandbox, get_modal_registry
+from .sandbox_files import SandboxFileClient
+from .runtime_directory import RuntimeRoute, get_runtime_directory
+from .sandbox_readiness import get_sandbox_readiness
+from .sandbox_scheduler import JOB_CLASS_AGENT
 from .sandbox_transport import run_sandbox_command
 
 logger = logging.getLogger(__name__)
 
+_ADVISORY_LOCK_POLL_SECONDS = 0.25
+_ADVISORY_LOCK_TIMEOUT_SECONDS = 600.0
+
 
 @dataclass
 class RuntimeEnvelope:
@@ -68,6 +81,13 @@ class RealtimeLifecycleService:
         self.sandbox_manager = sandbox_manager or SandboxManager()
         self.cache_store = cache_store or SessionCacheStore()
         self.default_org = get_sandbox_config().default_org
+        self._provisioning_flights: Dict[Tuple[int, str], asyncio.Future[None]] = {}
+        self._identity_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.provisioning_stats: Dict[str, int] = {
+            "runtime_requests": 0,
+            "coalesced_requests": 0,
+            "modal_provisions": 0,
+        }
 
     # ---------------------------------------------------------------------
     # Sandbox + runtime provisioning
@@ -88,12 +108,124 @@ class RealtimeLifecycleService:
         github_token: Optional[str] = None,
         env_inputs: Optional[Dict[str, str]] = None,
     ) -> RuntimeEnvelope:
+        """Provision (or reuse) the sandbox and runtime for ``session``.
+
+        Concurrent calls for the same session and identity share one flight:
+        followers wait for the leader and then read back what it committed.
+        Different sessions on the same identity are serialized so the second
+        one reuses the sandbox instead of provisioning its own, and a
+        Postgres advisory lock extends that to other controller processes.
+        The leader commits before waking followers.
+        """
         identity = build_sandbox_identity(
             org=f"{org or self.default_org}-user-{user_id}",
             repo_owner=repo_owner,
             repo_name=repo_name,
             environment=environment or repo_branch or "main",
         )
+        self.provisioning_stats["runtime_requests"] += 1
+        flight_key = (session.id, identity.key)
+        while True:
+            inflight = self._provisioning_flights.get(flight_key)
+            if inflight is None:
+                break
+            self.provisioning_stats["coalesced_requests"] += 1
+            try:
+                await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leader was cancelled; take over its flight.
+                continue
+            envelope = self._load_runtime_envelope(db, session=session)
+            if envelope is not None:
+                return envelope
+
+        flight: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._provisioning_flights[flight_key] = flight
+        try:
+            lock = self._identity_locks.get(identity.key)
+            if lock is None:
+                lock = self._identity_locks[identity.key] = asyncio.Lock()
+            async with lock, self._advisory_provisioning_lock(db, identity.key):
+                envelope = await self._create_runtime_for_identity(
+                    db,
+                    session=session,
+                    user_id=user_id,
+                    identity=identity,
+                    repo_branch=repo_branch,
+                    repo_url=repo_url,
+                    github_token=github_token,
+                    env_inputs=env_inputs,
+                )
+                db.commit()
+            self._remember_route(envelope.sandbox, session_id=session.id)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as exc:
+            flight.set_exception(exc)
+            # Mark the exception retrieved when nobody was waiting on it.
+            flight.exception()
+            raise
+        else:
+            flight.set_result(None)
+        finally:
+            if self._provisioning_flights.get(flight_key) is flight:
+                del self._provisioning_flights[flight_key]
+        return envelope
+
+    def _load_runtime_envelope(self, db: Session, *, session: ChatSession) -> Optional[RuntimeEnvelope]:
+        runtime = (
+            db.query(SessionRuntime)
+            .populate_existing()
+            .filter(SessionRuntime.session_id == session.id)
+            .order_by(SessionRuntime.id.desc())
+            .first()
+        )
+        if runtime is None or not runtime.sandbox_id:
+            return None
+        sandbox = db.query(Sandbox).populate_existing().filter(Sandbox.id == runtime.sandbox_id).first()
+        if sandbox is None or sandbox.status == SandboxStatus.TERMINATED.value:
+            return None
+        return RuntimeEnvelope(sandbox=sandbox, runtime=runtime)
+
+    @asynccontextmanager
+    async def _advisory_provisioning_lock(self, db: Session, identity_key: str) -> AsyncIterator[None]:
+        """Hold a transaction-scoped Postgres advisory lock for ``identity_key``.
+
+        Polls ``pg_try_advisory_xact_lock`` rather than blocking so the event
+        loop stays free; the lock is released by the leader's commit. Other
+        databases (SQLite in tests and local runs) have a single process and
+        skip it.
+        """
+        if db.get_bind().dialect.name != "postgresql":
+            yield
+            return
+        digest = hashlib.sha256(f"sandbox-provision:{identity_key}".encode("utf-8")).digest()
+        lock_id = int.from_bytes(digest[:8], "big", signed=True)
+        deadline = time.monotonic() + _ADVISORY_LOCK_TIMEOUT_SECONDS
+        while not db.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": lock_id}).scalar():
+            if time.monotonic() >= deadline:
+                raise as_http_exception(
+                    RealtimeErrorCode.MODAL_PROVISION_FAILED,
+                    detail="Timed out waiting for another controller to finish provisioning this sandbox",
+                )
+            await asyncio.sleep(_ADVISORY_LOCK_POLL_SECONDS)
+        yield
+
+    async def _create_runtime_for_identity(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        user_id: int,
+        identity: SandboxIdentity,
+        repo_branch: Optional[str],
+        repo_url: Optional[str],
+        github_token: Optional[str],
+        env_inputs: Optional[Dict[str, str]],
+    ) -> RuntimeEnvelope:
 
         sandbox, reused_existing_sandbox = self._resolve_sandbox_for_identity(
             db,
@@ -130,6 +262,11 @@ class RealtimeLifecycleService:
                 or sandbox_status_before_start != SandboxStatus.RUNNING.value
             )
             if needs_modal_provision:
+                self.provisioning_stats["modal_provisions"] += 1
+                # A fresh boot must report ready again before heartbeats count.
+                get_sandbox_readiness().forget(sandbox.id)
+                get_runtime_directory().invalidate_sandbox(sandbox.id)
+                lifecycle_metadata.pop("ready_at", None)
                 modal_sb = await RealtimeModalSandbox.create(
                     sandbox_db_id=sandbox.id,
                     controller_base_url=sandbox_config.controller_base_url,
@@ -141,7 +278,7 @@ class RealtimeLifecycleService:
                     env_inputs=env_inputs or {},
                 )
                 sandbox.tunnel_url = modal_sb.tunnel_url
-                await get_modal_registry().register(sandbox.id, modal_sb)
+                await get_modal_registry().register(sandbox.id, modal_sb, replaces=existing_modal_sandbox_id)
                 lifecycle_metadata["modal_sandbox_id"] = modal_sb.modal_sandbox_id
         else:
             sandbox.tunnel_url = sandbox.tunnel_url or self.sandbox_manager.build_tunnel_url(sandbox.id)
@@ -321,9 +458,23 @@ class RealtimeLifecycleService:
         runtime.tunnel_expires_at = utc_now() + timedelta(
             seconds=sandbox.tunnel_token_ttl_seconds or 3600
         )
+        if runtime.session_id is not None:
+            self._remember_route(sandbox, session_id=runtime.session_id)
 
         return sandbox, runtime
 
+    def _remember_route(self, sandbox: Sandbox, *, session_id: int) -> Optional[RuntimeRoute]:
+        """Cache the tunnel route for ``session_id`` while its sandbox is running."""
+        if sandbox.status != SandboxStatus.RUNNING.value or not sandbox.tunnel_url:
+            return None
+        return get_runtime_directory().put(
+            session_id=session_id,
+            sandbox_id=sandbox.id,
+            tunnel_url=sandbox.tunnel_url,
+            status=sandbox.status,
+            token_ttl_seconds=sandbox.tunnel_token_ttl_seconds,
+        )
+
     def record_heartbeat(self, db: Session, sandbox_id: str) -> Sandbox:
         sandbox = self.get_sandbox_or_404(db, sandbox_id)
         sandbox.last_heartbeat_at = utc_now()
@@ -334,6 +485,18 @@ class RealtimeLifecycleService:
             sandbox.status = SandboxStatus.RUNNING.value
         return sandbox
 
+    def record_ready(self, db: Session, sandbox_id: str, capabilities: Dict[str, Any]) -> Sandbox:
+        sandbox = self.record_heartbeat(db, sandbox_id)
+        if sandbox.status == SandboxStatus.TERMINATED.value:
+            return sandbox
+        metadata = dict(sandbox.lifecycle_metadata or {})
+        metadata["ready_at"] = utc_now().isoformat()
+        metadata["capabilities"] = capabilities
+        metadata.pop("last_probe_healthy", None)
+        sandbox.lifecycle_metadata = metadata
+        flag_modified(sandbox, "lifecycle_metadata")
+        return sandbox
+
     def cleanup_stale_sandboxes(
         self,
         db: Session,
@@ -755,6 +918,8 @@ class RealtimeLifecycleService:
         sandbox.status = SandboxStatus.TERMINATED.value
         sandbox.terminated_at = utc_now()
         sandbox.active_session_id = None
+        get_sandbox_readiness().forget(sandbox.id)
+        get_runtime_directory().invalidate_sandbox(sandbox.id)
 
         flags = get_realtime_feature_flags()
         if flags.modal_provisioning_enabled:
@@ -1043,6 +1208,10 @@ class SandboxManager:
                     healthy = False
                     error_text = str(exc)
 
+                if not healthy:
+                    # Route the next dispatch through the database until the
+                    # sandbox proves itself again.
+                    get_runtime_directory().invalidate_sandbox(sandbox_id)
                 try:
                     await callback(sandbox_id, healthy, error_text)
                 except Exception as callback_error:  # pragma: no cover
@@ -1078,7 +1247,16 @@ class SandboxExecBroker:
     def __init__(self, lifecycle: Optional[RealtimeLifecycleService] = None) -> None:
         self.lifecycle = lifecycle or get_realtime_lifecycle_service()
 
-    def _resolve_runtime(self, db: Session, session: ChatSession) -> tuple[Sandbox, str]:
+    def _resolve_runtime(self, db: Session, session: ChatSession) -> tuple[str, str]:
+        """Return ``(sandbox_id, tunnel_url)`` for the session's runtime.
+
+        Served from the runtime directory when possible; the database is
+        only consulted on a miss, which also refills the directory.
+        """
+        route = get_runtime_directory().get(session.id)
+        if route is not None:
+            return route.sandbox_id, route.tunnel_url
+
         runtime = self.lifecycle._get_latest_runtime(db, session_id=session.id)
         if not runtime or not runtime.sandbox_id:
             raise as_http_exception(RealtimeErrorCode.TUNNEL_UNAVAILABLE)
@@ -1089,7 +1267,8 @@ class SandboxExecBroker:
         if not sandbox.tunnel_url:
             raise as_http_exception(RealtimeErrorCode.TUNNEL_UNAVAILABLE)
 
-        return sandbox, sandbox.tunnel_url
+        self.lifecycle._remember_route(sandbox, session_id=session.id)
+        return sandbox.id, sandbox.tunnel_url
 
     async def run_command(
         self,
@@ -1101,20 +1280,22 @@ class SandboxExecBroker:
         env: Optional[Dict[str, str]] = None,
         timeout_seconds: int = 1800,
         on_event: Optional[SandboxEventCallback] = None,
+        job_class: str = JOB_CLASS_AGENT,
     ) -> Dict[str, Any]:
-        sandbox, tunnel_url = self._resolve_runtime(db, session)
+        sandbox_id, tunnel_url = self._resolve_runtime(db, session)
         mode_execution_id = str((env or {}).get("YUDAI_MODE_EXECUTION_ID") or "").strip()
         if mode_execution_id:
             return await self._run_command_with_callbacks(
                 db,
                 session=session,
-                sandbox=sandbox,
+                sandbox_id=sandbox_id,
                 tunnel_url=tunnel_url,
                 mode_execution_id=mode_execution_id,
                 command=command,
                 cwd=cwd,
                 env=env,
                 timeout_seconds=timeout_seconds,
+                job_class=job_class,
             )
 
         result = await run_sandbox_command(
@@ -1125,31 +1306,112 @@ class SandboxExecBroker:
             env=env,
             timeout_seconds=timeout_seconds,
             on_event=on_event,
+            job_class=job_class,
         )
         return {
-            "sandbox_id": sandbox.id,
+            "sandbox_id": sandbox_id,
             "exit_code": result.exit_code,
             "stdout": result.stdout,
             "stderr": result.stderr,
             "duration_ms": result.duration_ms,
         }
 
+    async def query_code_index(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        kind: str,
+        term: str = "",
+        limit: int = 20,
+        workspace: Optional[str] = None,
+        timeout_seconds: float = 5.0,
+    ) -> Dict[str, Any]:
+        """Run a lookup against the sandbox's prebuilt code index."""
+        _sandbox, tunnel_url = self._resolve_runtime(db, session)
+        async with httpx.AsyncClient(timeout=timeout_seconds) as client:
+            response = await client.post(
+                f"{tunnel_url.rstrip('/')}/internal/index/query",
+                headers=self._internal_headers(),
+                json={"kind": kind, "term": term, "limit": limit, "workspace": workspace},
+            )
+            response.raise_for_status()
+            return response.json()
+
+    async def read_file(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        path: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        workspace: Optional[str] = None,
+        timeout_seconds: float = 30.0,
+    ) -> bytes:
+        """Read a sandbox file through the in-process file API."""
+        _sandbox, tunnel_url = self._resolve_runtime(db, session)
+        client = SandboxFileClient(tunnel_url, timeout_seconds=timeout_seconds)
+        return await client.read_bytes(path, offset=offset, length=length, workspace=workspace)
+
+    async def write_file(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        path: str,
+        data: bytes,
+        workspace: Optional[str] = None,
+        timeout_seconds: float = 30.0,
+    ) -> Dict[str, Any]:
+        """Atomically write a sandbox file through the in-process file API."""
+        _sandbox, tunnel_url = self._resolve_runtime(db, session)
+        client = SandboxFileClient(tunnel_url, timeout_seconds=timeout_seconds)
+        return await client.write_bytes(path, data, workspace=workspace)
+
+    async def ensure_browser_dev_server(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        command: str,
+        port: int,
+        workspace: Optional[str] = None,
+        cwd: Optional[str] = None,
+        timeout_seconds: float = 180.0,
+    ) -> Dict[str, Any]:
+        """Start or reuse the sandbox-supervised dev server for browser checks."""
+        _sandbox, tunnel_url = self._resolve_runtime(db, session)
+        async with httpx.AsyncClient(timeout=timeout_seconds) as client:
+            response = await client.post(
+                f"{tunnel_url.rstrip('/')}/internal/browser/dev-server",
+                headers=self._internal_headers(),
+                json={"command": command, "port": port, "workspace": workspace, "cwd": cwd},
+            )
+            response.raise_for_status()
+            return response.json()
+
     def _internal_headers(self) -> Dict[str, str]:
         secret = get_sandbox_config().controller_internal_ws_secret
-        return {"X-Controller-Internal-Secret": secret} if secret else {}
+        headers = trace_headers()
+        if secret:
+            headers["X-Controller-Internal-Secret"] = secret
+        return headers
 
+    @traced("sandbox.command")
     async def _run_command_with_callbacks(
         self,
         db: Session,
         *,
         session: ChatSession,
-        sandbox: Sandbox,
+        sandbox_id: str,
         tunnel_url: str,
         mode_execution_id: str,
         command: str,
         cwd: Optional[str],
         env: Optional[Dict[str, str]],
         timeout_seconds: int,
+        job_class: str = JOB_CLASS_AGENT,
     ) -> Dict[str, Any]:
         execution = (
             db.query(AgentExecution)
@@ -1168,7 +1430,7 @@ class SandboxExecBroker:
         )
         if run and run.status in {"complete", "cancelled"} and run.sandbox_job_id:
             return {
-                "sandbox_id": sandbox.id,
+                "sandbox_id": sandbox_id,
                 "sandbox_job_id": run.sandbox_job_id,
                 "exit_code": int(run.exit_code or 0),
                 "stdout": run.stdout_tail or "",
@@ -1210,6 +1472,7 @@ class SandboxExecBroker:
                         "controller_job_id": run.controller_job_id,
                         "attempt": run.attempt,
                         "timeout_seconds": timeout_seconds,
+                        "job_class": job_class,
                     },
                 )
                 response.raise_for_status()
@@ -1221,17 +1484,24 @@ class SandboxExecBroker:
             raise RuntimeError("Sandbox async execution did not return a sandbox_job_id")
 
         controller_job_id = run.controller_job_id
+        set_attribute("sandbox_job_id", sandbox_job_id)
         run.sandbox_job_id = sandbox_job_id
         run.status = "running"
         run.heartbeat_at = utc_now()
         db.commit()
+        get_run_progress_tracker().track(
+            controller_job_id,
+            sandbox_job_id=sandbox_job_id,
+            status="running",
+            sequence=run.last_sequence or 0,
+        )
 
         if execution:
-            metadata = dict(execution.execution_metadata or {})
-            metadata["controller_job_id"] = run.controller_job_id
-            metadata["sandbox_job_id"] = sandbox_job_id
-            execution.execution_metadata = metadata
-            flag_modified(execution, "execution_metadata")
+            patch_json(
+                execution,
+                "execution_metadata",
+                {"controller_job_id": run.controller_job_id, "sandbox_job_id": sandbox_job_id},
+            )
             db.commit()
 
         deadline = time.monotonic() + max(timeout_seconds, 1)
@@ -1250,26 +1520,17 @@ class SandboxExecBroker:
                 .filter(SandboxExecutionRun.controller_job_id == controller_job_id)
                 .first()
             )
+            # Terminal states are written through, so the row is authoritative here;
+            # buffered progress only matters to readers that show a running job.
             if current_run and current_run.status in {"complete", "cancelled"} and current_run.sandbox_job_id == sandbox_job_id:
                 return {
-                    "sandbox_id": sandbox.id,
+                    "sandbox_id": sandbox_id,
                     "sandbox_job_id": sandbox_job_id,
                     "exit_code": int(current_run.exit_code or 0),
                     "stdout": current_run.stdout_tail or "",
                     "stderr": current_run.stderr_tail or "",
                     "duration_ms": int(current_run.duration_ms or 0),
                 }
-            metadata = execution.execution_metadata if isinstance(execution.execution_metadata, dict) else {}
-            completion = metadata.get("sandbox_completion")
-            if isinstance(completion, dict) and completion.get("sandbox_job_id") == sandbox_job_id:
-                return {
-                    "sandbox_id": sandbox.id,
-                    "sandbox_job_id": sandbox_job_id,
-                    "exit_code": int(completion.get("exit_code") or 0),
-                    "stdout": str(completion.get("stdout") or ""),
-                    "stderr": str(completion.get("stderr") or ""),
-                    "duration_ms": int(completion.get("duration_ms") or 0),
-                }
             if execution.status == SessionModeStatus.CANCELLED.value:
                 await self.cancel_job(
                     db,
@@ -0,0 +1,166 @@
+"""Scrape-time gauges for ``/metrics`` on the controller and sandbox servers.
+
+In-memory state (hub sockets, probe tasks, scheduler queues) is read on the
+event loop when the endpoint renders. Database-backed gauges are refreshed
+by ``refresh_controller_db_gauges`` in a worker thread just before
+rendering, so a scrape costs two small ``GROUP BY`` queries and never
+blocks the loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+from typing import Dict, Iterable, List
+
+from yudai.utils.metrics import REGISTRY, MetricFamily
+
+logger = logging.getLogger(__name__)
+
+EXECUTIONS_BY_STATUS = REGISTRY.gauge(
+    "yudai_agent_executions",
+    "Agent executions that are queued or running.",
+    ("status",),
+)
+SANDBOXES_BY_STATUS = REGISTRY.gauge(
+    "yudai_sandboxes",
+    "Sandboxes that are not terminated, by status.",
+    ("status",),
+)
+
+_EXECUTION_STATUSES = ("queued", "running")
+_ACTIVE_SANDBOX_STATUSES = ("provisioning", "running", "stopped")
+
+
+def _counter_family(name: str, documentation: str, values: Dict[str, int], label: str) -> MetricFamily:
+    family = MetricFamily(name, "counter", documentation)
+    for key, value in values.items():
+        family.add(value, "_total", **{label: key})
+    return family
+
+
+def _count_controller_rows() -> Dict[str, Dict[str, int]]:
+    from sqlalchemy import func
+
+    from yudai.db.database import SessionLocal
+    from yudai.models import AgentExecution, Sandbox
+
+    db = SessionLocal()
+    try:
+        executions = dict(
+            db.query(AgentExecution.status, func.count(AgentExecution.id))
+            .filter(AgentExecution.status.in_(_EXECUTION_STATUSES))
+            .group_by(AgentExecution.status)
+            .all()
+        )
+        sandboxes = dict(
+            db.query(Sandbox.status, func.count(Sandbox.id))
+            .filter(Sandbox.status.in_(_ACTIVE_SANDBOX_STATUSES))
+            .group_by(Sandbox.status)
+            .all()
+        )
+    finally:
+        db.close()
+    return {"executions": executions, "sandboxes": sandboxes}
+
+
+async def refresh_controller_db_gauges() -> None:
+    try:
+        counts = await asyncio.to_thread(_count_controller_rows)
+    except Exception:
+        # Keep serving the in-process metrics when the database is unreachable.
+        logger.warning("Could not refresh execution and sandbox gauges", exc_info=True)
+        return
+    for status in _EXECUTION_STATUSES:
+        EXECUTIONS_BY_STATUS.labels(status).set(counts["executions"].get(status, 0))
+    for status in _ACTIVE_SANDBOX_STATUSES:
+        SANDBOXES_BY_STATUS.labels(status).set(counts["sandboxes"].get(status, 0))
+
+
+def collect_controller_state() -> Iterable[MetricFamily]:
+    from yudai.realtime import lifecycle, runtime_directory, ws_protocol
+
+    families: List[MetricFamily] = []
+
+    hub = ws_protocol._hub_singleton
+    if hub is not None:
+        hub_metrics = hub.metrics()
+        families.append(
+            MetricFamily("yudai_ws_sockets", "gauge", "Live websocket connections on this worker.").add(
+                hub_metrics.pop("sockets")
+            )
+        )
+        families.append(
+            MetricFamily("yudai_ws_sessions", "gauge", "Sessions with at least one live websocket.").add(
+                len(hub.queue_depths())
+            )
+        )
+        families.append(
+            MetricFamily("yudai_ws_queue_depth", "gauge", "Messages waiting in websocket send queues.").add(
+                hub_metrics.pop("queue_depth")
+            )
+        )
+        hub_metrics.pop("max_current_queue_depth", None)
+        hub_metrics.pop("max_queue_depth", None)
+        families.append(
+            _counter_family("yudai_ws_messages", "Websocket hub message outcomes.", hub_metrics, "outcome")
+        )
+
+    service = lifecycle._service_singleton
+    if service is not None:
+        families.append(
+            MetricFamily("yudai_sandbox_probe_tasks", "gauge", "Tunnel liveness probes running on this worker.").add(
+                len(service.sandbox_manager._probe_tasks)
+            )
+        )
+        families.append(
+            _counter_family(
+                "yudai_runtime_provisioning",
+                "Runtime ensure requests and the provisions they caused.",
+                service.provisioning_stats,
+                "kind",
+            )
+        )
+
+    directory = runtime_directory._runtime_directory_singleton
+    if directory is not None:
+        families.append(
+            _counter_family(
+                "yudai_runtime_directory_lookups",
+                "Runtime directory lookups by result.",
+                {"hit": directory.hits, "miss": directory.misses},
+                "result",
+            )
+        )
+
+    modal_sandbox = sys.modules.get("yudai.realtime.modal_sandbox")
+    registry = getattr(modal_sandbox, "_registry_singleton", None)
+    if registry is not None:
+        families.append(
+            MetricFamily("yudai_modal_sandboxes_registered", "gauge", "Modal sandboxes held by this worker.").add(
+                len(registry._sandboxes)
+            )
+        )
+        families.append(
+            MetricFamily("yudai_modal_orphans_reaped", "counter", "Double-provisioned Modal sandboxes terminated.").add(
+                registry.orphans_reaped, "_total"
+            )
+        )
+    return families
+
+
+def collect_sandbox_state() -> Iterable[MetricFamily]:
+    from yudai.realtime import sandbox_scheduler
+
+    scheduler = sandbox_scheduler._sandbox_job_scheduler_singleton
+    if scheduler is None:
+        return []
+    running = MetricFamily("yudai_sandbox_jobs_running", "gauge", "Sandbox jobs holding a scheduler slot.")
+    queued = MetricFamily("yudai_sandbox_jobs_queued", "gauge", "Sandbox jobs waiting for a scheduler slot.")
+    slots = MetricFamily("yudai_sandbox_job_slots", "gauge", "Scheduler slots per job class.")
+    for job_class, stats in scheduler.stats().items():
+        running.add(stats["running"], job_class=job_class)
+        queued.add(stats["queued"], job_class=job_class)
+        slots.add(stats["slots"], job_class=job_class)
+    return [running, queued, slots]
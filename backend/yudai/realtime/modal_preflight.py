@@ -92,16 +92,16 @@ async def wait_for_sandbox_healthcheck(
     deadline = time.monotonic() + timeout_seconds
     last_error = "sandbox healthcheck did not become ready"
 
-    while time.monotonic() < deadline:
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        while time.monotonic() < deadline:
+            try:
                 response = await client.get(healthcheck_url)
-            if response.status_code == 200:
-                return healthcheck_url
-            last_error = f"unexpected healthz status {response.status_code}"
-        except Exception as exc:  # pragma: no cover - defensive
-            last_error = str(exc)
-        await asyncio.sleep(1)
+                if response.status_code == 200:
+                    return healthcheck_url
+                last_error = f"unexpected healthz status {response.status_code}"
+            except Exception as exc:  # pragma: no cover - defensive
+                last_error = str(exc)
+            await asyncio.sleep(1)
 
     raise RuntimeError(
         f"Timed out waiting for Modal sandbox healthcheck at {healthcheck_url}: {last_error}"
@@ -13,7 +13,7 @@ import asyncio
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Set
 
 import modal
 
@@ -335,11 +335,48 @@ class ModalSandboxRegistry:
     def __init__(self) -> None:
         self._sandboxes: Dict[str, "RealtimeModalSandbox"] = {}
         self._lock = asyncio.Lock()
+        self._reap_tasks: Set[asyncio.Task[None]] = set()
+        self.orphans_reaped = 0
+
+    async def register(
+        self,
+        sandbox_db_id: str,
+        sandbox: "RealtimeModalSandbox",
+        *,
+        replaces: Optional[str] = None,
+    ) -> None:
+        """Map ``sandbox_db_id`` to ``sandbox`` and terminate whatever it displaced.
+
+        ``replaces`` is the Modal sandbox ID the row pointed at before this
+        provisioning; displacing that one is a deliberate re-provision. Any
+        other displaced sandbox was never recorded on the row, so nothing
+        owns it and it counts as an orphan.
+        """
 
-    async def register(self, sandbox_db_id: str, sandbox: "RealtimeModalSandbox") -> None:
         async with self._lock:
+            previous = self._sandboxes.get(sandbox_db_id)
             self._sandboxes[sandbox_db_id] = sandbox
             logger.info("Registered Modal sandbox: db_id=%s modal_id=%s", sandbox_db_id, sandbox.modal_sandbox_id)
+        if previous is None or previous is sandbox:
+            return
+        if replaces is not None and previous.modal_sandbox_id == replaces:
+            logger.info(
+                "Re-provisioned db_id=%s: terminating replaced modal_id=%s",
+                sandbox_db_id,
+                previous.modal_sandbox_id,
+            )
+        else:
+            # A second Modal sandbox for the same row means provisioning ran
+            # twice; the older one is unreachable now, so stop paying for it.
+            logger.warning(
+                "Double provisioning for db_id=%s: terminating orphaned modal_id=%s",
+                sandbox_db_id,
+                previous.modal_sandbox_id,
+            )
+            self.orphans_reaped += 1
+        task = asyncio.create_task(previous.terminate())
+        self._reap_tasks.add(task)
+        task.add_done_callback(self._reap_tasks.discard)
 
     async def get(self, sandbox_db_id: str) -> Optional["RealtimeModalSandbox"]:
         async with self._lock:
@@ -5,7 +5,7 @@ from __future__ import annotations
 import json
 import re
 from pathlib import PurePosixPath
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 
 CONTRACT_VERSION = "mswea-mode-contract-v1"
@@ -35,22 +35,18 @@ def normalize_mode(value: Any) -> str:
 def parse_mode_contract(mode: str, output_text: str) -> Dict[str, Any]:
     """Parse and validate the final JSON contract for a mode run."""
 
+    return select_mode_contract(mode, _json_objects_from_end(output_text))
+
+
+def select_mode_contract(mode: str, payloads: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate the most recent contract for ``mode`` from JSON objects ordered newest first."""
+
     expected_mode = normalize_mode(mode)
     if expected_mode not in _VALID_MODES:
         raise ModeContractError(f"Unsupported MSWEA mode contract: {mode}")
 
     wrong_mode_seen: Optional[str] = None
-    for line in reversed((output_text or "").splitlines()):
-        raw = line.strip()
-        if not raw.startswith("{") or not raw.endswith("}"):
-            continue
-        try:
-            payload = json.loads(raw)
-        except json.JSONDecodeError:
-            continue
-        if not isinstance(payload, dict):
-            continue
-
+    for payload in payloads:
         payload_mode = normalize_mode(payload.get("mode"))
         if payload_mode != expected_mode:
             if payload_mode:
@@ -68,6 +64,19 @@ def parse_mode_contract(mode: str, output_text: str) -> Dict[str, Any]:
     )
 
 
+def _json_objects_from_end(output_text: str) -> Iterator[Dict[str, Any]]:
+    for line in reversed((output_text or "").splitlines()):
+        raw = line.strip()
+        if not raw.startswith("{") or not raw.endswith("}"):
+            continue
+        try:
+            payload = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(payload, dict):
+            yield payload
+
+
 def validate_mode_contract(mode: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     normalized_mode = normalize_mode(mode)
     if normalize_mode(payload.get("mode")) != normalized_mode:
@@ -136,7 +145,13 @@ def extract_changed_files_from_output(output_text: str) -> List[str]:
     end = output_text.find(CHANGED_FILES_END, start)
     if end < 0:
         return []
-    raw = output_text[start:end].strip()
+    return parse_changed_files_block(output_text[start:end])
+
+
+def parse_changed_files_block(block_text: Optional[str]) -> List[str]:
+    """Decode the JSON list printed between the changed-files markers."""
+
+    raw = (block_text or "").strip()
     if not raw:
         return []
     try:
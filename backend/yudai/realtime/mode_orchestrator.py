@@ -5,14 +5,17 @@ from __future__ import annotations
 import asyncio
 from datetime import datetime
 import json
+import logging
 import os
 import re
 import uuid
 from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
 
 from yudai.config import get_agent_config, get_model_config, get_sandbox_config
 from yudai.config.realtime_flags import get_realtime_feature_flags
 from yudai.db.database import SessionLocal
+from yudai.db.json_patch import patch_json
 from yudai.models import (
     AgentDecisionStep,
     AgentExecution,
@@ -20,6 +23,7 @@ from yudai.models import (
     ChatMessage,
     ChatSession,
     ContextCard,
+    Sandbox,
     SandboxStatus,
     SessionArtifact,
     SessionMode,
@@ -29,14 +33,15 @@ from yudai.models import (
     UserQuestionStatus,
 )
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
 
 from yudai.daifuUserAgent.stage_gates import (
     ensure_stage_gate_question,
     stage_gate_payload,
     summarize_stage_result,
 )
+from yudai.realtime.agent_daemon import agent_runner_shell_lines
 from yudai.utils import utc_now
+from yudai.utils.tracing import merge_trace_summaries, span, start_trace, summarize_trace, traced
 
 from .lifecycle import (
     RealtimeLifecycleService,
@@ -45,7 +50,6 @@ from .lifecycle import (
     get_sandbox_exec_broker,
 )
 from .autonomy_planner import AutonomyDecision
-from .modal_preflight import wait_for_sandbox_healthcheck
 from .modal_sandbox import (
     SANDBOX_MSWEA_CONFIG_ROOT,
     SANDBOX_WORKSPACE_PATH,
@@ -55,12 +59,21 @@ from .mode_contracts import (
     CHANGED_FILES_START,
     CONTRACT_VERSION,
     ModeContractError,
-    extract_changed_files_from_output,
     normalize_changed_files,
-    parse_mode_contract,
+    parse_changed_files_block,
+    select_mode_contract,
     validate_mode_changed_files,
 )
 from .execution_followup import get_execution_followup_service
+from .runtime_directory import get_runtime_directory
+from .sandbox_readiness import get_sandbox_readiness, is_sandbox_live, wait_for_sandbox_ready
+from .session_lock import (
+    SessionExecutionLockManager,
+    SessionLockHandle,
+    SessionLockLostError,
+    get_session_lock_manager,
+)
+from .stream_parser import StreamingOutputParser
 from .ws_protocol import SessionWebSocketHub, WSMessageType, get_ws_hub
 
 MODE_ORDER: tuple[str, str, str] = (
@@ -100,9 +113,8 @@ MSWEA_CONFIG_PATHS = {
 
 ISSUE_URL_PATTERN = re.compile(r"https?://github\.com/[\w.-]+/[\w.-]+/issues/(\d+)")
 PR_URL_PATTERN = re.compile(r"https?://github\.com/[\w.-]+/[\w.-]+/pull/(\d+)")
-ISSUE_NUMBER_PATTERN = re.compile(r"(?im)\b(?:issue[_ -]?number|issue number)\b\s*[:=]\s*(\d+)")
-PR_NUMBER_PATTERN = re.compile(r"(?im)\b(?:pr[_ -]?number|pull[_ -]?number|pr number)\b\s*[:=]\s*(\d+)")
-TEST_BRANCH_PATTERN = re.compile(r"(?im)\b(?:test[_ -]?branch|test branch)\b\s*[:=]\s*([^\s\"']+)")
+
+logger = logging.getLogger(__name__)
 
 
 class ExecutionConflictError(RuntimeError):
@@ -122,13 +134,16 @@ class SessionExecutionOrchestrator:
         broker: Optional[SandboxExecBroker] = None,
         lifecycle: Optional[RealtimeLifecycleService] = None,
         ws_hub: Optional[SessionWebSocketHub] = None,
+        session_locks: Optional[SessionExecutionLockManager] = None,
     ) -> None:
         self.broker = broker or get_sandbox_exec_broker()
         self.lifecycle = lifecycle or get_realtime_lifecycle_service()
         self.ws_hub = ws_hub or get_ws_hub()
         self._session_tasks: Dict[str, asyncio.Task[None]] = {}
         self._browser_check_tasks: Dict[str, asyncio.Task[None]] = {}
-        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._session_locks = session_locks or get_session_lock_manager()
+        # Lock handle of each running pipeline, so its trace write after release is still fenced.
+        self._pipeline_fences: Dict[str, SessionLockHandle] = {}
 
     async def start_execution(
         self,
@@ -297,12 +312,16 @@ class SessionExecutionOrchestrator:
         db.add(execution)
 
         metadata = dict(session.mode_metadata or {})
+        previous = metadata.get("browser_check") or {}
         metadata["browser_check"] = {
             "execution_id": execution_id,
             "status": SessionModeStatus.QUEUED.value,
             "objective": objective,
             "started_at": started_at.isoformat(),
             "completed_at": None,
+            "route": previous.get("route"),
+            "dev_server_command": previous.get("dev_server_command"),
+            "dev_server_port": previous.get("dev_server_port"),
         }
         session.mode_metadata = metadata
         session.last_activity = utc_now()
@@ -494,12 +513,15 @@ class SessionExecutionOrchestrator:
         if execution_row:
             execution_row.status = SessionModeStatus.CANCELLED.value
             execution_row.completed_at = utc_now()
-            execution_metadata = dict(execution_row.execution_metadata or {})
-            execution_metadata["cancel_source"] = source
-            execution_metadata["cancel_reason"] = reason
-            execution_metadata["cancel_requested_at"] = utc_now().isoformat()
-            execution_row.execution_metadata = execution_metadata
-            flag_modified(execution_row, "execution_metadata")
+            patch_json(
+                execution_row,
+                "execution_metadata",
+                {
+                    "cancel_source": source,
+                    "cancel_reason": reason,
+                    "cancel_requested_at": utc_now().isoformat(),
+                },
+            )
 
         sandbox_job_id = None
         mode_execution_id = str((active_execution or {}).get("current_mode_execution_id") or "")
@@ -511,13 +533,16 @@ class SessionExecutionOrchestrator:
         if mode_execution:
             mode_execution.status = SessionModeStatus.CANCELLED.value
             mode_execution.completed_at = utc_now()
-            mode_metadata = dict(mode_execution.execution_metadata or {})
-            sandbox_job_id = mode_metadata.get("sandbox_job_id")
-            mode_metadata["cancel_source"] = source
-            mode_metadata["cancel_reason"] = reason
-            mode_metadata["cancel_requested_at"] = utc_now().isoformat()
-            mode_execution.execution_metadata = mode_metadata
-            flag_modified(mode_execution, "execution_metadata")
+            sandbox_job_id = (mode_execution.execution_metadata or {}).get("sandbox_job_id")
+            patch_json(
+                mode_execution,
+                "execution_metadata",
+                {
+                    "cancel_source": source,
+                    "cancel_reason": reason,
+                    "cancel_requested_at": utc_now().isoformat(),
+                },
+            )
         if not sandbox_job_id and execution_row and isinstance(execution_row.execution_metadata, dict):
             sandbox_job_id = execution_row.execution_metadata.get("sandbox_job_id")
         db.commit()
@@ -593,182 +618,291 @@ class SessionExecutionOrchestrator:
         objective: str,
         max_modes: Optional[int] = None,
     ) -> None:
-        lock = self._session_locks.setdefault(session_public_id, asyncio.Lock())
-        async with lock:
-            db = SessionLocal()
-            session: Optional[ChatSession] = None
-            current_mode_execution: Optional[AgentExecution] = None
-            pipeline_execution: Optional[AgentExecution] = None
-            completed_modes: List[str] = []
-            step_index = 0
-            max_steps = max(1, int(os.getenv("DAIFU_AUTONOMY_MAX_STEPS", "8")))
-            max_seconds = max(60, int(os.getenv("DAIFU_AUTONOMY_MAX_SECONDS", "14400")))
-            deadline = asyncio.get_running_loop().time() + max_seconds
-            try:
-                session = (
-                    db.query(ChatSession)
-                    .filter(
-                        ChatSession.session_id == session_public_id,
-                        ChatSession.user_id == user_id,
-                    )
-                    .first()
-                )
-                if not session:
-                    return
-
-                pipeline_execution = (
-                    db.query(AgentExecution)
-                    .filter(
-                        AgentExecution.id == execution_id,
-                        AgentExecution.session_id == session.id,
-                    )
-                    .first()
-                )
-                if pipeline_execution and pipeline_execution.status == SessionModeStatus.CANCELLED.value:
-                    return
-                if pipeline_execution:
-                    pipeline_execution.status = SessionModeStatus.RUNNING.value
-                    metadata = dict(pipeline_execution.execution_metadata or {})
-                    metadata["worker_started_at"] = utc_now().isoformat()
-                    pipeline_execution.execution_metadata = metadata
-                    flag_modified(pipeline_execution, "execution_metadata")
-                self._update_active_execution(
-                    session,
+        root = None
+        try:
+            with start_trace(
+                "pipeline",
+                execution_id=execution_id,
+                session_id=session_public_id,
+            ) as root:
+                await self._run_full_pipeline(
+                    session_public_id=session_public_id,
+                    user_id=user_id,
                     execution_id=execution_id,
-                    status=SessionModeStatus.RUNNING.value,
-                    detail="Execution worker started",
+                    objective=objective,
+                    max_modes=max_modes,
                 )
-                session.mode_status = SessionModeStatus.RUNNING.value
-                session.mode_updated_at = utc_now()
-                db.commit()
+        finally:
+            fence = self._pipeline_fences.pop(execution_id, None)
+            if root is not None:
+                self._persist_trace(execution_id, root, fence=fence)
 
-                await self._ensure_runtime_ready(db, session=session, user_id=user_id)
+    def _persist_trace(self, execution_id: str, root: Any, *, fence: Optional[SessionLockHandle] = None) -> None:
+        """Store the run's span summary on the pipeline execution row.
 
-                next_mode = self._next_mode_for_session(session)
-                if next_mode == SessionMode.COMPLETE.value:
-                    await self._complete_pipeline(
-                        db,
-                        session=session,
-                        pipeline_execution=pipeline_execution,
-                        execution_id=execution_id,
-                        completed_modes=completed_modes,
-                        detail="Workflow already complete.",
-                    )
-                    return
+        Runs after the session lock is released; with ``fence`` the write is
+        refused once a newer holder has taken the session over.
+        """
 
-                while step_index < max_steps and asyncio.get_running_loop().time() < deadline:
-                    remaining_before = self._remaining_modes(session)
-                    if not remaining_before:
-                        await self._complete_pipeline(
-                            db,
-                            session=session,
-                            pipeline_execution=pipeline_execution,
-                            execution_id=execution_id,
-                            completed_modes=completed_modes,
-                            detail="Workflow complete",
+        db = SessionLocal()
+        if fence is not None:
+            fence.attach(db)
+        try:
+            execution = db.query(AgentExecution).filter(AgentExecution.id == execution_id).first()
+            if execution is None:
+                return
+            # Resuming after a stage gate reuses the execution id; keep the earlier runs' spans.
+            stored = (execution.execution_metadata or {}).get("trace")
+            summary = merge_trace_summaries(stored, summarize_trace(root))
+            patch_json(
+                execution,
+                "execution_metadata",
+                {
+                    "trace": summary,
+                    "phase_timings": {
+                        "trace_id": summary["trace_id"],
+                        "total_ms": summary["duration_ms"],
+                        "phases": summary["phases"],
+                    },
+                },
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.warning("failed to persist trace for execution %s", execution_id, exc_info=True)
+        finally:
+            db.close()
+
+    async def _run_full_pipeline(
+        self,
+        *,
+        session_public_id: str,
+        user_id: int,
+        execution_id: str,
+        objective: str,
+        max_modes: Optional[int] = None,
+    ) -> None:
+        with SessionLocal() as db:
+            async with self._session_locks.hold(db, session_public_id) as fence:
+                self._pipeline_fences[execution_id] = fence
+                session: Optional[ChatSession] = None
+                current_mode_execution: Optional[AgentExecution] = None
+                pipeline_execution: Optional[AgentExecution] = None
+                completed_modes: List[str] = []
+                step_index = 0
+                max_steps = max(1, int(os.getenv("DAIFU_AUTONOMY_MAX_STEPS", "8")))
+                max_seconds = max(60, int(os.getenv("DAIFU_AUTONOMY_MAX_SECONDS", "14400")))
+                deadline = asyncio.get_running_loop().time() + max_seconds
+                try:
+                    session = (
+                        db.query(ChatSession)
+                        .filter(
+                            ChatSession.session_id == session_public_id,
+                            ChatSession.user_id == user_id,
                         )
-                        break
-                    if next_mode not in remaining_before:
-                        next_mode = remaining_before[0]
-                    mode = next_mode
-                    self._raise_if_cancel_requested(session)
-                    step_index += 1
-                    current_mode_execution = self._create_execution_row(
-                        db,
-                        session=session,
-                        mode=mode,
-                        objective=objective,
-                        pipeline_execution_id=execution_id,
+                        .first()
                     )
-                    self._set_mode_state(
-                        session,
-                        mode=mode,
-                        mode_status=SessionModeStatus.RUNNING.value,
+                    if not session:
+                        return
+
+                    pipeline_execution = (
+                        db.query(AgentExecution)
+                        .filter(
+                            AgentExecution.id == execution_id,
+                            AgentExecution.session_id == session.id,
+                        )
+                        .first()
                     )
+                    if pipeline_execution and pipeline_execution.status == SessionModeStatus.CANCELLED.value:
+                        return
+                    if pipeline_execution:
+                        pipeline_execution.status = SessionModeStatus.RUNNING.value
+                        patch_json(
+                            pipeline_execution,
+                            "execution_metadata",
+                            {"worker_started_at": utc_now().isoformat()},
+                        )
                     self._update_active_execution(
                         session,
                         execution_id=execution_id,
-                        mode=mode,
                         status=SessionModeStatus.RUNNING.value,
-                        plan=current_mode_execution.execution_plan or [],
-                        current_mode_execution_id=current_mode_execution.id,
-                        detail=f"{mode.capitalize()} mode running",
+                        detail="Execution worker started",
                     )
-                    if pipeline_execution:
-                        pipeline_execution.status = SessionModeStatus.RUNNING.value
+                    session.mode_status = SessionModeStatus.RUNNING.value
+                    session.mode_updated_at = utc_now()
                     db.commit()
 
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.TOOL_CALL,
-                        {
-                            "tool_name": f"run_{mode}_mode",
-                            "tool_input": {
-                                "session_id": session_public_id,
-                                "mode": mode,
-                                "issue_number": session.architect_issue_number,
-                                "issue_url": session.architect_issue_url,
-                            },
-                            "call_id": current_mode_execution.id,
-                        },
-                    )
-
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.MODE_EVENT,
-                        {
-                            "mode": mode,
-                            "state": SessionModeStatus.RUNNING.value,
-                            "execution_id": execution_id,
-                            "mode_execution_id": current_mode_execution.id,
-                        },
-                    )
+                    await self._ensure_runtime_ready(db, session=session, user_id=user_id)
 
-                    if mode == SessionMode.ARCHITECT.value:
-                        result = await self._run_architect(
+                    next_mode = self._next_mode_for_session(session)
+                    if next_mode == SessionMode.COMPLETE.value:
+                        await self._complete_pipeline(
                             db,
                             session=session,
-                            execution=current_mode_execution,
-                            user_id=user_id,
-                            objective=objective,
-                            pipeline_execution_id=execution_id,
+                            pipeline_execution=pipeline_execution,
+                            execution_id=execution_id,
+                            completed_modes=completed_modes,
+                            detail="Workflow already complete.",
                         )
-                    elif mode == SessionMode.TESTER.value:
-                        result = await self._run_tester(
+                        return
+
+                    while step_index < max_steps and asyncio.get_running_loop().time() < deadline:
+                        remaining_before = self._remaining_modes(session)
+                        if not remaining_before:
+                            await self._complete_pipeline(
+                                db,
+                                session=session,
+                                pipeline_execution=pipeline_execution,
+                                execution_id=execution_id,
+                                completed_modes=completed_modes,
+                                detail="Workflow complete",
+                            )
+                            break
+                        if next_mode not in remaining_before:
+                            next_mode = remaining_before[0]
+                        mode = next_mode
+                        self._raise_if_cancel_requested(session)
+                        step_index += 1
+                        current_mode_execution = self._create_execution_row(
                             db,
                             session=session,
-                            execution=current_mode_execution,
+                            mode=mode,
                             objective=objective,
                             pipeline_execution_id=execution_id,
                         )
-                    else:
-                        result = await self._run_coder(
-                            db,
-                            session=session,
-                            execution=current_mode_execution,
-                            user_id=user_id,
-                            objective=objective,
-                            pipeline_execution_id=execution_id,
+                        self._set_mode_state(
+                            session,
+                            mode=mode,
+                            mode_status=SessionModeStatus.RUNNING.value,
                         )
+                        self._update_active_execution(
+                            session,
+                            execution_id=execution_id,
+                            mode=mode,
+                            status=SessionModeStatus.RUNNING.value,
+                            plan=current_mode_execution.execution_plan or [],
+                            current_mode_execution_id=current_mode_execution.id,
+                            detail=f"{mode.capitalize()} mode running",
+                        )
+                        if pipeline_execution:
+                            pipeline_execution.status = SessionModeStatus.RUNNING.value
+                        db.commit()
+
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.TOOL_CALL,
+                            {
+                                "tool_name": f"run_{mode}_mode",
+                                "tool_input": {
+                                    "session_id": session_public_id,
+                                    "mode": mode,
+                                    "issue_number": session.architect_issue_number,
+                                    "issue_url": session.architect_issue_url,
+                                },
+                                "call_id": current_mode_execution.id,
+                            },
+                        )
+
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.MODE_EVENT,
+                            {
+                                "mode": mode,
+                                "state": SessionModeStatus.RUNNING.value,
+                                "execution_id": execution_id,
+                                "mode_execution_id": current_mode_execution.id,
+                            },
+                        )
+
+                        with span(f"mode.{mode}", mode_execution_id=current_mode_execution.id):
+                            if mode == SessionMode.ARCHITECT.value:
+                                result = await self._run_architect(
+                                    db,
+                                    session=session,
+                                    execution=current_mode_execution,
+                                    user_id=user_id,
+                                    objective=objective,
+                                    pipeline_execution_id=execution_id,
+                                )
+                            elif mode == SessionMode.TESTER.value:
+                                result = await self._run_tester(
+                                    db,
+                                    session=session,
+                                    execution=current_mode_execution,
+                                    objective=objective,
+                                    pipeline_execution_id=execution_id,
+                                )
+                            else:
+                                result = await self._run_coder(
+                                    db,
+                                    session=session,
+                                    execution=current_mode_execution,
+                                    user_id=user_id,
+                                    objective=objective,
+                                    pipeline_execution_id=execution_id,
+                                )
+
+                        if result.get("waiting_for_input"):
+                            completed_modes.append(mode)
+                            current_mode_execution.status = SessionModeStatus.WAITING_FOR_INPUT.value
+                            current_mode_execution.completed_at = utc_now()
+                            current_mode_execution.output_summary = result
+                            self._set_mode_state(
+                                session,
+                                mode=mode,
+                                mode_status=SessionModeStatus.WAITING_FOR_INPUT.value,
+                            )
+                            self._update_active_execution(
+                                session,
+                                execution_id=execution_id,
+                                mode=mode,
+                                status=SessionModeStatus.WAITING_FOR_INPUT.value,
+                                waiting_for_input=True,
+                                current_mode_execution_id=None,
+                                detail=result.get("detail") or f"{mode.capitalize()} mode is waiting for input",
+                            )
+                            db.commit()
+
+                            await self._generate_execution_followup(
+                                db,
+                                session=session,
+                                execution=current_mode_execution,
+                                mode=mode,
+                                status=SessionModeStatus.WAITING_FOR_INPUT.value,
+                                result=result,
+                                detail=result.get("detail"),
+                                pipeline_execution_id=execution_id,
+                            )
+
+                            await self.ws_hub.send_to_session(
+                                session_public_id,
+                                WSMessageType.MODE_EVENT,
+                                {
+                                    "mode": mode,
+                                    "state": SessionModeStatus.WAITING_FOR_INPUT.value,
+                                    "execution_id": execution_id,
+                                    "mode_execution_id": current_mode_execution.id,
+                                    "detail": result.get("detail"),
+                                },
+                            )
+                            return
 
-                    if result.get("waiting_for_input"):
                         completed_modes.append(mode)
-                        current_mode_execution.status = SessionModeStatus.WAITING_FOR_INPUT.value
+                        current_mode_execution.status = SessionModeStatus.COMPLETE.value
                         current_mode_execution.completed_at = utc_now()
                         current_mode_execution.output_summary = result
                         self._set_mode_state(
                             session,
                             mode=mode,
-                            mode_status=SessionModeStatus.WAITING_FOR_INPUT.value,
+                            mode_status=SessionModeStatus.COMPLETE.value,
                         )
                         self._update_active_execution(
                             session,
                             execution_id=execution_id,
                             mode=mode,
-                            status=SessionModeStatus.WAITING_FOR_INPUT.value,
-                            waiting_for_input=True,
+                            status=SessionModeStatus.RUNNING.value,
                             current_mode_execution_id=None,
-                            detail=result.get("detail") or f"{mode.capitalize()} mode is waiting for input",
+                            detail=f"{mode.capitalize()} mode complete",
                         )
                         db.commit()
 
@@ -777,9 +911,9 @@ class SessionExecutionOrchestrator:
                             session=session,
                             execution=current_mode_execution,
                             mode=mode,
-                            status=SessionModeStatus.WAITING_FOR_INPUT.value,
+                            status=SessionModeStatus.COMPLETE.value,
                             result=result,
-                            detail=result.get("detail"),
+                            detail=f"{mode.capitalize()} mode complete",
                             pipeline_execution_id=execution_id,
                         )
 
@@ -788,208 +922,166 @@ class SessionExecutionOrchestrator:
                             WSMessageType.MODE_EVENT,
                             {
                                 "mode": mode,
-                                "state": SessionModeStatus.WAITING_FOR_INPUT.value,
+                                "state": SessionModeStatus.COMPLETE.value,
                                 "execution_id": execution_id,
                                 "mode_execution_id": current_mode_execution.id,
-                                "detail": result.get("detail"),
                             },
                         )
-                        return
-
-                    completed_modes.append(mode)
-                    current_mode_execution.status = SessionModeStatus.COMPLETE.value
-                    current_mode_execution.completed_at = utc_now()
-                    current_mode_execution.output_summary = result
-                    self._set_mode_state(
-                        session,
-                        mode=mode,
-                        mode_status=SessionModeStatus.COMPLETE.value,
-                    )
-                    self._update_active_execution(
-                        session,
-                        execution_id=execution_id,
-                        mode=mode,
-                        status=SessionModeStatus.RUNNING.value,
-                        current_mode_execution_id=None,
-                        detail=f"{mode.capitalize()} mode complete",
-                    )
-                    db.commit()
-
-                    await self._generate_execution_followup(
-                        db,
-                        session=session,
-                        execution=current_mode_execution,
-                        mode=mode,
-                        status=SessionModeStatus.COMPLETE.value,
-                        result=result,
-                        detail=f"{mode.capitalize()} mode complete",
-                        pipeline_execution_id=execution_id,
-                    )
 
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.MODE_EVENT,
-                        {
-                            "mode": mode,
-                            "state": SessionModeStatus.COMPLETE.value,
-                            "execution_id": execution_id,
-                            "mode_execution_id": current_mode_execution.id,
-                        },
-                    )
+                        remaining_after_stage = self._remaining_modes(session)
+                        if remaining_after_stage:
+                            await self._pause_for_stage_gate(
+                                db,
+                                session=session,
+                                pipeline_execution=pipeline_execution,
+                                mode_execution=current_mode_execution,
+                                pipeline_execution_id=execution_id,
+                                user_id=user_id,
+                                completed_mode=mode,
+                                next_mode=remaining_after_stage[0],
+                                objective=objective,
+                                result=result,
+                                detail=f"{mode.capitalize()} mode complete",
+                            )
+                            return
 
-                    remaining_after_stage = self._remaining_modes(session)
-                    if remaining_after_stage:
-                        await self._pause_for_stage_gate(
+                        await self._complete_pipeline(
                             db,
                             session=session,
                             pipeline_execution=pipeline_execution,
-                            mode_execution=current_mode_execution,
-                            pipeline_execution_id=execution_id,
-                            user_id=user_id,
-                            completed_mode=mode,
-                            next_mode=remaining_after_stage[0],
-                            objective=objective,
-                            result=result,
-                            detail=f"{mode.capitalize()} mode complete",
+                            execution_id=execution_id,
+                            completed_modes=completed_modes,
+                            detail="Workflow complete",
                         )
-                        return
+                        break
 
-                    await self._complete_pipeline(
-                        db,
-                        session=session,
-                        pipeline_execution=pipeline_execution,
-                        execution_id=execution_id,
-                        completed_modes=completed_modes,
-                        detail="Workflow complete",
-                    )
-                    break
-
-                else:
-                    raise RuntimeError("Autonomous workflow stopped after reaching the configured step or time budget")
-            except asyncio.CancelledError:
-                if session is not None:
-                    if current_mode_execution is not None:
-                        current_mode_execution.status = SessionModeStatus.CANCELLED.value
-                        current_mode_execution.completed_at = utc_now()
-                    if pipeline_execution is not None:
-                        pipeline_execution.status = SessionModeStatus.CANCELLED.value
-                        pipeline_execution.completed_at = utc_now()
-                        pipeline_execution.output_summary = {"status": SessionModeStatus.CANCELLED.value}
-                    self._set_mode_state(
-                        session,
-                        mode=session.current_mode or self._next_mode_for_session(session),
-                        mode_status=SessionModeStatus.CANCELLED.value,
-                    )
-                    self._update_active_execution(
-                        session,
-                        execution_id=execution_id,
-                        status=SessionModeStatus.CANCELLED.value,
-                        completed_at=utc_now().isoformat(),
-                        current_mode_execution_id=None,
-                        detail="Execution cancelled",
-                    )
-                    artifact = await self._finalize_runtime(
-                        db,
-                        session=session,
-                        execution_id=execution_id,
-                        execution_status=SessionModeStatus.CANCELLED.value,
-                        reason="execution_cancelled",
-                    )
-                    if artifact:
-                        self._update_active_execution(session, artifact=artifact)
-                    db.commit()
+                    else:
+                        raise RuntimeError("Autonomous workflow stopped after reaching the configured step or time budget")
+                except SessionLockLostError as exc:
+                    db.rollback()
+                    logger.warning("pipeline %s stopped without writing: %s", execution_id, exc)
+                except asyncio.CancelledError:
+                    if session is not None:
+                        if current_mode_execution is not None:
+                            current_mode_execution.status = SessionModeStatus.CANCELLED.value
+                            current_mode_execution.completed_at = utc_now()
+                        if pipeline_execution is not None:
+                            pipeline_execution.status = SessionModeStatus.CANCELLED.value
+                            pipeline_execution.completed_at = utc_now()
+                            pipeline_execution.output_summary = {"status": SessionModeStatus.CANCELLED.value}
+                        self._set_mode_state(
+                            session,
+                            mode=session.current_mode or self._next_mode_for_session(session),
+                            mode_status=SessionModeStatus.CANCELLED.value,
+                        )
+                        self._update_active_execution(
+                            session,
+                            execution_id=execution_id,
+                            status=SessionModeStatus.CANCELLED.value,
+                            completed_at=utc_now().isoformat(),
+                            current_mode_execution_id=None,
+                            detail="Execution cancelled",
+                        )
+                        artifact = await self._finalize_runtime(
+                            db,
+                            session=session,
+                            execution_id=execution_id,
+                            execution_status=SessionModeStatus.CANCELLED.value,
+                            reason="execution_cancelled",
+                        )
+                        if artifact:
+                            self._update_active_execution(session, artifact=artifact)
+                        db.commit()
 
-                    await self._generate_execution_followup(
-                        db,
-                        session=session,
-                        execution=current_mode_execution or pipeline_execution,
-                        mode=session.current_mode or self._next_mode_for_session(session),
-                        status=SessionModeStatus.CANCELLED.value,
-                        result={},
-                        detail="Execution cancelled",
-                        pipeline_execution_id=execution_id,
-                    )
+                        await self._generate_execution_followup(
+                            db,
+                            session=session,
+                            execution=current_mode_execution or pipeline_execution,
+                            mode=session.current_mode or self._next_mode_for_session(session),
+                            status=SessionModeStatus.CANCELLED.value,
+                            result={},
+                            detail="Execution cancelled",
+                            pipeline_execution_id=execution_id,
+                        )
 
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.MODE_EVENT,
-                        {
-                            "mode": session.current_mode or self._next_mode_for_session(session),
-                            "state": SessionModeStatus.CANCELLED.value,
-                            "execution_id": execution_id,
-                            "mode_execution_id": current_mode_execution.id if current_mode_execution else None,
-                        },
-                    )
-                raise
-            except Exception as exc:
-                if session is not None:
-                    if current_mode_execution is not None:
-                        current_mode_execution.status = SessionModeStatus.FAILED.value
-                        current_mode_execution.completed_at = utc_now()
-                        current_mode_execution.error_message = str(exc)
-                    if pipeline_execution is not None:
-                        pipeline_execution.status = SessionModeStatus.FAILED.value
-                        pipeline_execution.completed_at = utc_now()
-                        pipeline_execution.error_message = str(exc)
-                        pipeline_execution.output_summary = {"status": SessionModeStatus.FAILED.value}
-                    self._set_mode_state(
-                        session,
-                        mode=SessionMode.FAILED.value,
-                        mode_status=SessionModeStatus.FAILED.value,
-                    )
-                    self._update_active_execution(
-                        session,
-                        execution_id=execution_id,
-                        mode=session.current_mode or self._next_mode_for_session(session),
-                        status=SessionModeStatus.FAILED.value,
-                        completed_at=utc_now().isoformat(),
-                        current_mode_execution_id=None,
-                        detail=str(exc),
-                    )
-                    artifact = await self._finalize_runtime(
-                        db,
-                        session=session,
-                        execution_id=execution_id,
-                        execution_status=SessionModeStatus.FAILED.value,
-                        reason="execution_failed",
-                    )
-                    if artifact:
-                        self._update_active_execution(session, artifact=artifact)
-                    db.commit()
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.MODE_EVENT,
+                            {
+                                "mode": session.current_mode or self._next_mode_for_session(session),
+                                "state": SessionModeStatus.CANCELLED.value,
+                                "execution_id": execution_id,
+                                "mode_execution_id": current_mode_execution.id if current_mode_execution else None,
+                            },
+                        )
+                    raise
+                except Exception as exc:
+                    if session is not None:
+                        if current_mode_execution is not None:
+                            current_mode_execution.status = SessionModeStatus.FAILED.value
+                            current_mode_execution.completed_at = utc_now()
+                            current_mode_execution.error_message = str(exc)
+                        if pipeline_execution is not None:
+                            pipeline_execution.status = SessionModeStatus.FAILED.value
+                            pipeline_execution.completed_at = utc_now()
+                            pipeline_execution.error_message = str(exc)
+                            pipeline_execution.output_summary = {"status": SessionModeStatus.FAILED.value}
+                        self._set_mode_state(
+                            session,
+                            mode=SessionMode.FAILED.value,
+                            mode_status=SessionModeStatus.FAILED.value,
+                        )
+                        self._update_active_execution(
+                            session,
+                            execution_id=execution_id,
+                            mode=session.current_mode or self._next_mode_for_session(session),
+                            status=SessionModeStatus.FAILED.value,
+                            completed_at=utc_now().isoformat(),
+                            current_mode_execution_id=None,
+                            detail=str(exc),
+                        )
+                        artifact = await self._finalize_runtime(
+                            db,
+                            session=session,
+                            execution_id=execution_id,
+                            execution_status=SessionModeStatus.FAILED.value,
+                            reason="execution_failed",
+                        )
+                        if artifact:
+                            self._update_active_execution(session, artifact=artifact)
+                        db.commit()
 
-                    await self._generate_execution_followup(
-                        db,
-                        session=session,
-                        execution=current_mode_execution or pipeline_execution,
-                        mode=session.current_mode or self._next_mode_for_session(session),
-                        status=SessionModeStatus.FAILED.value,
-                        result=(current_mode_execution.output_summary if current_mode_execution else {}) or {},
-                        error=str(exc),
-                        detail=str(exc),
-                        pipeline_execution_id=execution_id,
-                    )
+                        await self._generate_execution_followup(
+                            db,
+                            session=session,
+                            execution=current_mode_execution or pipeline_execution,
+                            mode=session.current_mode or self._next_mode_for_session(session),
+                            status=SessionModeStatus.FAILED.value,
+                            result=(current_mode_execution.output_summary if current_mode_execution else {}) or {},
+                            error=str(exc),
+                            detail=str(exc),
+                            pipeline_execution_id=execution_id,
+                        )
 
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.ERROR,
-                        {
-                            "message": str(exc),
-                            "execution_id": execution_id,
-                            "mode": session.current_mode,
-                        },
-                    )
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.MODE_EVENT,
-                        {
-                            "mode": session.current_mode or self._next_mode_for_session(session),
-                            "state": SessionModeStatus.FAILED.value,
-                            "execution_id": execution_id,
-                            "mode_execution_id": current_mode_execution.id if current_mode_execution else None,
-                        },
-                    )
-            finally:
-                db.close()
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.ERROR,
+                            {
+                                "message": str(exc),
+                                "execution_id": execution_id,
+                                "mode": session.current_mode,
+                            },
+                        )
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.MODE_EVENT,
+                            {
+                                "mode": session.current_mode or self._next_mode_for_session(session),
+                                "state": SessionModeStatus.FAILED.value,
+                                "execution_id": execution_id,
+                                "mode_execution_id": current_mode_execution.id if current_mode_execution else None,
+                            },
+                        )
 
     async def run_browser_check(
         self,
@@ -999,200 +1091,197 @@ class SessionExecutionOrchestrator:
         execution_id: str,
         objective: str,
     ) -> None:
-        lock = self._session_locks.setdefault(session_public_id, asyncio.Lock())
-        async with lock:
-            db = SessionLocal()
-            session: Optional[ChatSession] = None
-            execution: Optional[AgentExecution] = None
-            result: Dict[str, Any] = {}
-            try:
-                session = (
-                    db.query(ChatSession)
-                    .filter(
-                        ChatSession.session_id == session_public_id,
-                        ChatSession.user_id == user_id,
-                    )
-                    .first()
-                )
-                if not session:
-                    return
-
-                execution = (
-                    db.query(AgentExecution)
-                    .filter(
-                        AgentExecution.id == execution_id,
-                        AgentExecution.session_id == session.id,
-                        AgentExecution.mode == BROWSER_CHECK_MODE,
+        with SessionLocal() as db:
+            async with self._session_locks.hold(db, session_public_id):
+                session: Optional[ChatSession] = None
+                execution: Optional[AgentExecution] = None
+                result: Dict[str, Any] = {}
+                try:
+                    session = (
+                        db.query(ChatSession)
+                        .filter(
+                            ChatSession.session_id == session_public_id,
+                            ChatSession.user_id == user_id,
+                        )
+                        .first()
                     )
-                    .first()
-                )
-                if not execution:
-                    return
-                if execution.status == SessionModeStatus.CANCELLED.value:
-                    return
-                execution.status = SessionModeStatus.RUNNING.value
-                metadata = dict(execution.execution_metadata or {})
-                metadata["worker_started_at"] = utc_now().isoformat()
-                execution.execution_metadata = metadata
-                flag_modified(execution, "execution_metadata")
-                self._record_browser_check_metadata(
-                    session,
-                    execution_id=execution_id,
-                    status=SessionModeStatus.RUNNING.value,
-                    objective=objective,
-                    result={},
-                    artifact=None,
-                )
-                db.commit()
+                    if not session:
+                        return
 
-                await self._ensure_runtime_ready(db, session=session, user_id=user_id)
-                result = await self._execute_browser_check(
-                    db,
-                    session=session,
-                    execution=execution,
-                    objective=objective,
-                )
-                if result.get("exit_code", 1) != 0:
-                    raise RuntimeError(
-                        "Browser check failed with "
-                        f"exit_code={result.get('exit_code')}"
+                    execution = (
+                        db.query(AgentExecution)
+                        .filter(
+                            AgentExecution.id == execution_id,
+                            AgentExecution.session_id == session.id,
+                            AgentExecution.mode == BROWSER_CHECK_MODE,
+                        )
+                        .first()
                     )
-
-                artifact = await self._export_browser_check_artifact(
-                    db,
-                    session=session,
-                    execution_id=execution_id,
-                    result=result,
-                )
-                if artifact:
-                    result["artifact"] = artifact
-
-                execution.status = SessionModeStatus.COMPLETE.value
-                execution.completed_at = utc_now()
-                execution.output_summary = result
-                self._record_browser_check_metadata(
-                    session,
-                    execution_id=execution_id,
-                    status=SessionModeStatus.COMPLETE.value,
-                    objective=objective,
-                    result=result,
-                    artifact=artifact,
-                )
-                self._create_browser_check_context_card(
-                    db,
-                    session=session,
-                    result=result,
-                    artifact=artifact,
-                )
-                session.last_activity = utc_now()
-                db.commit()
-
-                await self._generate_execution_followup(
-                    db,
-                    session=session,
-                    execution=execution,
-                    mode=BROWSER_CHECK_MODE,
-                    status=SessionModeStatus.COMPLETE.value,
-                    result=result,
-                    detail="Browser check complete",
-                    pipeline_execution_id=execution_id,
-                )
-
-                await self.ws_hub.send_to_session(
-                    session_public_id,
-                    WSMessageType.MODE_EVENT,
-                    {
-                        "mode": BROWSER_CHECK_MODE,
-                        "state": SessionModeStatus.COMPLETE.value,
-                        "execution_id": execution_id,
-                        "detail": "Browser check complete",
-                    },
-                )
-            except asyncio.CancelledError:
-                if session is not None and execution is not None:
-                    execution.status = SessionModeStatus.CANCELLED.value
-                    execution.completed_at = utc_now()
-                    execution.output_summary = result or None
+                    if not execution:
+                        return
+                    if execution.status == SessionModeStatus.CANCELLED.value:
+                        return
+                    execution.status = SessionModeStatus.RUNNING.value
+                    patch_json(execution, "execution_metadata", {"worker_started_at": utc_now().isoformat()})
                     self._record_browser_check_metadata(
                         session,
                         execution_id=execution_id,
-                        status=SessionModeStatus.CANCELLED.value,
+                        status=SessionModeStatus.RUNNING.value,
                         objective=objective,
-                        result=result,
+                        result={},
                         artifact=None,
                     )
                     db.commit()
-                    await self._generate_execution_followup(
+
+                    await self._ensure_runtime_ready(db, session=session, user_id=user_id)
+                    result = await self._execute_browser_check(
                         db,
                         session=session,
                         execution=execution,
-                        mode=BROWSER_CHECK_MODE,
-                        status=SessionModeStatus.CANCELLED.value,
-                        result=result or {},
-                        detail="Browser check cancelled",
-                        pipeline_execution_id=execution_id,
+                        objective=objective,
                     )
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.MODE_EVENT,
-                        {
-                            "mode": BROWSER_CHECK_MODE,
-                            "state": SessionModeStatus.CANCELLED.value,
-                            "execution_id": execution_id,
-                            "detail": "Browser check cancelled",
-                        },
+                    if result.get("exit_code", 1) != 0:
+                        raise RuntimeError(
+                            "Browser check failed with "
+                            f"exit_code={result.get('exit_code')}"
+                        )
+
+                    artifact = await self._export_browser_check_artifact(
+                        db,
+                        session=session,
+                        execution_id=execution_id,
+                        result=result,
                     )
-                raise
-            except Exception as exc:
-                if session is not None and execution is not None:
-                    result = dict(result or {})
-                    result["error"] = str(exc)
-                    execution.status = SessionModeStatus.FAILED.value
+                    if artifact:
+                        result["artifact"] = artifact
+
+                    execution.status = SessionModeStatus.COMPLETE.value
                     execution.completed_at = utc_now()
-                    execution.error_message = str(exc)
                     execution.output_summary = result
                     self._record_browser_check_metadata(
                         session,
                         execution_id=execution_id,
-                        status=SessionModeStatus.FAILED.value,
+                        status=SessionModeStatus.COMPLETE.value,
                         objective=objective,
                         result=result,
-                        artifact=None,
+                        artifact=artifact,
+                    )
+                    self._create_browser_check_context_card(
+                        db,
+                        session=session,
+                        result=result,
+                        artifact=artifact,
                     )
                     session.last_activity = utc_now()
                     db.commit()
+
                     await self._generate_execution_followup(
                         db,
                         session=session,
                         execution=execution,
                         mode=BROWSER_CHECK_MODE,
-                        status=SessionModeStatus.FAILED.value,
+                        status=SessionModeStatus.COMPLETE.value,
                         result=result,
-                        error=str(exc),
-                        detail=str(exc),
+                        detail="Browser check complete",
                         pipeline_execution_id=execution_id,
                     )
-                    await self.ws_hub.send_to_session(
-                        session_public_id,
-                        WSMessageType.ERROR,
-                        {
-                            "message": str(exc),
-                            "execution_id": execution_id,
-                            "mode": BROWSER_CHECK_MODE,
-                        },
-                    )
+
                     await self.ws_hub.send_to_session(
                         session_public_id,
                         WSMessageType.MODE_EVENT,
                         {
                             "mode": BROWSER_CHECK_MODE,
-                            "state": SessionModeStatus.FAILED.value,
+                            "state": SessionModeStatus.COMPLETE.value,
                             "execution_id": execution_id,
-                            "detail": str(exc),
+                            "detail": "Browser check complete",
                         },
                     )
-            finally:
-                db.close()
+                except SessionLockLostError as exc:
+                    db.rollback()
+                    logger.warning("browser check %s stopped without writing: %s", execution_id, exc)
+                except asyncio.CancelledError:
+                    if session is not None and execution is not None:
+                        execution.status = SessionModeStatus.CANCELLED.value
+                        execution.completed_at = utc_now()
+                        execution.output_summary = result or None
+                        self._record_browser_check_metadata(
+                            session,
+                            execution_id=execution_id,
+                            status=SessionModeStatus.CANCELLED.value,
+                            objective=objective,
+                            result=result,
+                            artifact=None,
+                        )
+                        db.commit()
+                        await self._generate_execution_followup(
+                            db,
+                            session=session,
+                            execution=execution,
+                            mode=BROWSER_CHECK_MODE,
+                            status=SessionModeStatus.CANCELLED.value,
+                            result=result or {},
+                            detail="Browser check cancelled",
+                            pipeline_execution_id=execution_id,
+                        )
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.MODE_EVENT,
+                            {
+                                "mode": BROWSER_CHECK_MODE,
+                                "state": SessionModeStatus.CANCELLED.value,
+                                "execution_id": execution_id,
+                                "detail": "Browser check cancelled",
+                            },
+                        )
+                    raise
+                except Exception as exc:
+                    if session is not None and execution is not None:
+                        result = dict(result or {})
+                        result["error"] = str(exc)
+                        execution.status = SessionModeStatus.FAILED.value
+                        execution.completed_at = utc_now()
+                        execution.error_message = str(exc)
+                        execution.output_summary = result
+                        self._record_browser_check_metadata(
+                            session,
+                            execution_id=execution_id,
+                            status=SessionModeStatus.FAILED.value,
+                            objective=objective,
+                            result=result,
+                            artifact=None,
+                        )
+                        session.last_activity = utc_now()
+                        db.commit()
+                        await self._generate_execution_followup(
+                            db,
+                            session=session,
+                            execution=execution,
+                            mode=BROWSER_CHECK_MODE,
+                            status=SessionModeStatus.FAILED.value,
+                            result=result,
+                            error=str(exc),
+                            detail=str(exc),
+                            pipeline_execution_id=execution_id,
+                        )
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.ERROR,
+                            {
+                                "message": str(exc),
+                                "execution_id": execution_id,
+                                "mode": BROWSER_CHECK_MODE,
+                            },
+                        )
+                        await self.ws_hub.send_to_session(
+                            session_public_id,
+                            WSMessageType.MODE_EVENT,
+                            {
+                                "mode": BROWSER_CHECK_MODE,
+                                "state": SessionModeStatus.FAILED.value,
+                                "execution_id": execution_id,
+                                "detail": str(exc),
+                            },
+                        )
 
     def _schedule_execution_task(
         self,
@@ -1329,9 +1418,12 @@ class SessionExecutionOrchestrator:
         session.mode_metadata = metadata
 
     def _update_active_execution(self, session: ChatSession, **updates: Any) -> None:
-        execution_state = dict(self._get_active_execution(session))
-        execution_state.update({key: value for key, value in updates.items() if value is not None})
-        self._set_active_execution(session, execution_state)
+        patch_json(
+            session,
+            "mode_metadata",
+            {key: value for key, value in updates.items() if value is not None},
+            path="active_execution",
+        )
 
     @staticmethod
     def _truncate_for_context(value: str, limit: int = 400) -> str:
@@ -1477,17 +1569,10 @@ class SessionExecutionOrchestrator:
 
     @staticmethod
     def _merge_mode_metadata(session: ChatSession, updates: Dict[str, Any]) -> None:
-        metadata = session.mode_metadata or {}
-        metadata.update(updates)
-        session.mode_metadata = metadata
+        patch_json(session, "mode_metadata", updates)
 
     @staticmethod
     def _record_mode_contract(session: ChatSession, mode: str, result: Dict[str, Any]) -> None:
-        metadata = dict(session.mode_metadata or {})
-        workflow_contracts = metadata.get("workflow_contracts")
-        if not isinstance(workflow_contracts, dict):
-            workflow_contracts = {}
-
         compact_keys = {
             "mode",
             "contract_version",
@@ -1507,14 +1592,19 @@ class SessionExecutionOrchestrator:
             "exit_code",
             "duration_ms",
         }
-        workflow_contracts["contract_version"] = CONTRACT_VERSION
-        workflow_contracts[mode] = {
-            key: value
-            for key, value in result.items()
-            if key in compact_keys and value is not None
-        }
-        metadata["workflow_contracts"] = workflow_contracts
-        session.mode_metadata = metadata
+        patch_json(
+            session,
+            "mode_metadata",
+            {
+                "contract_version": CONTRACT_VERSION,
+                mode: {
+                    key: value
+                    for key, value in result.items()
+                    if key in compact_keys and value is not None
+                },
+            },
+            path="workflow_contracts",
+        )
 
     async def _pause_for_architect_questions(
         self,
@@ -1609,56 +1699,16 @@ class SessionExecutionOrchestrator:
             return None
         return f"https://github.com/{session.repo_owner}/{session.repo_name}/pull/{pr_number}"
 
-    def parse_mswea_output(self, output_text: str) -> Dict[str, Any]:
-        parsed: Dict[str, Any] = {}
-
-        issue_match = ISSUE_URL_PATTERN.search(output_text)
-        if issue_match:
-            parsed["issue_url"] = issue_match.group(0)
-            parsed["issue_number"] = self._to_int(issue_match.group(1))
-
-        pr_match = PR_URL_PATTERN.search(output_text)
-        if pr_match:
-            parsed["pr_url"] = pr_match.group(0)
-            parsed["pr_number"] = self._to_int(pr_match.group(1))
-
-        issue_number_match = ISSUE_NUMBER_PATTERN.search(output_text)
-        if issue_number_match:
-            parsed["issue_number"] = self._to_int(issue_number_match.group(1))
-
-        pr_number_match = PR_NUMBER_PATTERN.search(output_text)
-        if pr_number_match:
-            parsed["pr_number"] = self._to_int(pr_number_match.group(1))
-
-        branch_match = TEST_BRANCH_PATTERN.search(output_text)
-        if branch_match:
-            parsed["test_branch"] = branch_match.group(1).strip().strip("'\"")
-
-        for line in reversed(output_text.splitlines()):
-            raw = line.strip()
-            if not raw or not raw.startswith("{"):
-                continue
-            try:
-                payload = json.loads(raw)
-            except Exception:
-                continue
-            if not isinstance(payload, dict):
-                continue
-
-            if "issue_url" in payload and isinstance(payload["issue_url"], str):
-                parsed["issue_url"] = payload["issue_url"].strip()
-            if "issue_number" in payload:
-                parsed["issue_number"] = self._to_int(payload.get("issue_number"))
-            if "pr_url" in payload and isinstance(payload["pr_url"], str):
-                parsed["pr_url"] = payload["pr_url"].strip()
-            if "pr_number" in payload:
-                parsed["pr_number"] = self._to_int(payload.get("pr_number"))
-            if "test_branch" in payload and isinstance(payload["test_branch"], str):
-                parsed["test_branch"] = payload["test_branch"].strip()
-            break
+    @staticmethod
+    def _finish_stream_parser(parser: StreamingOutputParser, result: Dict[str, Any]) -> None:
+        """Keep results streamed up to the exit event, else parse the collected output once."""
 
-        return parsed
+        if parser.completed:
+            return
+        parser.reset()
+        parser.feed_text(str(result.get("stdout") or ""), str(result.get("stderr") or ""))
 
+    @traced("runtime.ensure")
     async def _ensure_runtime_ready(
         self,
         db: Session,
@@ -1666,15 +1716,20 @@ class SessionExecutionOrchestrator:
         session: ChatSession,
         user_id: int,
     ) -> None:
+        route = get_runtime_directory().get(session.id)
+        if route is not None and is_sandbox_live(route.sandbox_id):
+            return
+
         runtime = self.lifecycle._get_latest_runtime(db, session_id=session.id)
         sandbox = (
             self.lifecycle.get_sandbox_or_404(db, runtime.sandbox_id)
             if runtime and runtime.sandbox_id
             else None
         )
-        tunnel_url = sandbox.tunnel_url if sandbox and sandbox.tunnel_url else None
+        existing_sandbox = sandbox
 
-        async def provision_runtime() -> str:
+        @traced("runtime.provision")
+        async def provision_runtime() -> Sandbox:
             repo_owner = session.repo_owner or self._repo_owner_from_url(session.repo_url)
             repo_name = session.repo_name or self._repo_name_from_url(session.repo_url)
             if not repo_owner or not repo_name:
@@ -1698,27 +1753,31 @@ class SessionExecutionOrchestrator:
                 },
             )
             db.commit()
-            return envelope.sandbox.tunnel_url
+            return envelope.sandbox
 
-        if not tunnel_url:
-            tunnel_url = await provision_runtime()
+        if not sandbox or not sandbox.tunnel_url:
+            sandbox = await provision_runtime()
 
         try:
-            await wait_for_sandbox_healthcheck(tunnel_url, timeout_seconds=60.0)
+            with span("runtime.healthcheck", sandbox_id=sandbox.id):
+                await wait_for_sandbox_ready(sandbox, sandbox.tunnel_url, timeout_seconds=60.0)
         except Exception:
-            if not get_realtime_feature_flags().modal_provisioning_enabled or not sandbox:
+            if not get_realtime_feature_flags().modal_provisioning_enabled or not existing_sandbox:
                 raise
 
             lifecycle_metadata = sandbox.lifecycle_metadata or {}
             lifecycle_metadata.pop("modal_sandbox_id", None)
+            lifecycle_metadata.pop("ready_at", None)
             sandbox.lifecycle_metadata = lifecycle_metadata
             sandbox.tunnel_url = None
             sandbox.status = "terminated"
             sandbox.terminated_at = utc_now()
             db.commit()
+            get_sandbox_readiness().forget(sandbox.id)
+            get_runtime_directory().invalidate_sandbox(sandbox.id)
 
-            tunnel_url = await provision_runtime()
-            await wait_for_sandbox_healthcheck(tunnel_url, timeout_seconds=60.0)
+            sandbox = await provision_runtime()
+            await wait_for_sandbox_ready(sandbox, sandbox.tunnel_url, timeout_seconds=60.0)
 
     @staticmethod
     def _get_user_github_token(db: Session, user_id: int) -> Optional[str]:
@@ -1893,8 +1952,9 @@ class SessionExecutionOrchestrator:
                 f"printf '[{mode}] running:'",
                 'printf " %q" "${cmd[@]}"',
                 'printf "\\n"',
+                *agent_runner_shell_lines(),
                 'set +e',
-                '"${cmd[@]}" > >(tee "$execution_dir/stdout.log") 2> >(tee "$execution_dir/stderr.log" >&2)',
+                'run_mini "${cmd[@]}" > >(tee "$execution_dir/stdout.log") 2> >(tee "$execution_dir/stderr.log" >&2)',
                 'exit_code=$?',
                 'set -e',
                 'printf "%s" "$exit_code" > "$execution_dir/exit_code.txt"',
@@ -2025,6 +2085,12 @@ class SessionExecutionOrchestrator:
             'task_text="$(printf "%s\\nReport path: %s" "$task_text" "$report_path")"',
             'task_text="$(printf "%s\\nSummary JSON path: %s" "$task_text" "$summary_path")"',
             'task_text="$(printf "%s\\n\\nDo not edit implementation files. You may write generated artifacts and helpers under .yudai/." "$task_text")"',
+            'if [ -n "${BROWSER_CHECK_DEV_SERVER_URL:-}" ]; then',
+            '  task_text="$(printf "%s\\n\\nThe dev server from the previous check is already running at %s (command: %s). Reuse it instead of starting another." "$task_text" "$BROWSER_CHECK_DEV_SERVER_URL" "${BROWSER_CHECK_DEV_SERVER_COMMAND:-}")"',
+            '  if [ -n "${BROWSER_CHECK_ROUTE:-}" ]; then',
+            '    task_text="$(printf "%s\\nPreviously inspected route: %s" "$task_text" "$BROWSER_CHECK_ROUTE")"',
+            '  fi',
+            'fi',
             'cmd=(mini -c "$config_path" -y -m "$model_name" -t "$task_text")',
             'printf "%q " "${cmd[@]}" > "$execution_dir/command.txt"',
             'if [ "${YUDAI_BROWSER_CHECK_COMMAND_PROBE:-0}" = "1" ]; then',
@@ -2057,8 +2123,9 @@ class SessionExecutionOrchestrator:
             f"printf '[{BROWSER_CHECK_MODE}] running:'",
             'printf " %q" "${cmd[@]}"',
             'printf "\\n"',
+            *agent_runner_shell_lines(),
             'set +e',
-            '"${cmd[@]}" > >(tee "$execution_dir/stdout.log") 2> >(tee "$execution_dir/stderr.log" >&2)',
+            'run_mini "${cmd[@]}" > >(tee "$execution_dir/stdout.log") 2> >(tee "$execution_dir/stderr.log" >&2)',
             'exit_code=$?',
             'set -e',
             'printf "%s" "$exit_code" > "$execution_dir/exit_code.txt"',
@@ -2251,42 +2318,7 @@ class SessionExecutionOrchestrator:
         ]
         return "\n".join(command_lines)
 
-    def _build_summary_write_command(
-        self,
-        *,
-        mode: str,
-        pipeline_execution_id: str,
-        summary: Dict[str, Any],
-    ) -> str:
-        summary_json = json.dumps(summary, ensure_ascii=True)
-        return "\n".join(
-            [
-                "set -euo pipefail",
-                'python_bin="${PYTHON:-}"',
-                'if [ -z "$python_bin" ]; then',
-                '  if command -v python3 >/dev/null 2>&1; then',
-                '    python_bin="python3"',
-                '  elif command -v python >/dev/null 2>&1; then',
-                '    python_bin="python"',
-                '  else',
-                '    echo "python interpreter not found: expected python3 or python" >&2',
-                '    exit 127',
-                '  fi',
-                'fi',
-                '"$python_bin" - <<\'PY\'',
-                "import json",
-                "import os",
-                "from pathlib import Path",
-                f"summary = json.loads({json.dumps(summary_json, ensure_ascii=True)})",
-                f"workspace = Path(os.environ.get('WORKSPACE_PATH', {json.dumps(SANDBOX_WORKSPACE_PATH)}))",
-                f"summary_path = workspace / {json.dumps(SANDBOX_EXECUTION_ROOT)} / {json.dumps(pipeline_execution_id)} / {json.dumps(mode)} / 'summary.json'",
-                "summary_path.parent.mkdir(parents=True, exist_ok=True)",
-                "summary_path.write_text(json.dumps(summary, ensure_ascii=True, indent=2) + '\\n', encoding='utf-8')",
-                "print(summary_path)",
-                "PY",
-            ]
-        )
-
+    @traced("mode.summary")
     async def _write_mode_summary(
         self,
         db: Session,
@@ -2296,40 +2328,34 @@ class SessionExecutionOrchestrator:
         pipeline_execution_id: str,
         summary: Dict[str, Any],
     ) -> None:
-        result = await self.broker.run_command(
-            db,
-            session=session,
-            command=self._build_summary_write_command(
-                mode=mode,
-                pipeline_execution_id=pipeline_execution_id,
-                summary=summary,
-            ),
-            cwd=session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH,
-            timeout_seconds=get_agent_config().summary_write_timeout_seconds,
-            env={"WORKSPACE_PATH": session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH},
-        )
-        if result.get("exit_code", 1) != 0:
-            raise RuntimeError(f"Failed to write sandbox summary for {mode} mode")
+        workspace = session.runtime_workspace_path or SANDBOX_WORKSPACE_PATH
+        summary_path = f"{workspace}/{SANDBOX_EXECUTION_ROOT}/{pipeline_execution_id}/{mode}/summary.json"
+        payload = (json.dumps(summary, ensure_ascii=True, indent=2) + "\n").encode("utf-8")
+        try:
+            await self.broker.write_file(
+                db,
+                session=session,
+                path=summary_path,
+                data=payload,
+                workspace=workspace,
+                timeout_seconds=get_agent_config().summary_write_timeout_seconds,
+            )
+        except Exception as exc:
+            raise RuntimeError(f"Failed to write sandbox summary for {mode} mode") from exc
 
     @staticmethod
-    def _extract_between_markers(text: str, start: str, end: str) -> Optional[str]:
-        start_index = text.rfind(start)
-        if start_index < 0:
-            return None
-        start_index += len(start)
-        end_index = text.find(end, start_index)
-        if end_index < 0:
-            return None
-        return text[start_index:end_index].strip()
+    def _new_browser_check_parser() -> StreamingOutputParser:
+        return StreamingOutputParser(
+            markers=(
+                (BROWSER_CHECK_SUMMARY_START, BROWSER_CHECK_SUMMARY_END),
+                (BROWSER_CHECK_REPORT_START, BROWSER_CHECK_REPORT_END),
+            )
+        )
 
-    def _parse_browser_check_output(self, output_text: str) -> Dict[str, Any]:
+    def _browser_check_fields_from_parser(self, parser: StreamingOutputParser) -> Dict[str, Any]:
         parsed: Dict[str, Any] = {}
 
-        summary_text = self._extract_between_markers(
-            output_text,
-            BROWSER_CHECK_SUMMARY_START,
-            BROWSER_CHECK_SUMMARY_END,
-        )
+        summary_text = (parser.block(BROWSER_CHECK_SUMMARY_START) or "").strip()
         if summary_text:
             try:
                 summary = json.loads(summary_text)
@@ -2338,26 +2364,14 @@ class SessionExecutionOrchestrator:
             except Exception as exc:
                 parsed["summary_parse_error"] = str(exc)
 
-        report_text = self._extract_between_markers(
-            output_text,
-            BROWSER_CHECK_REPORT_START,
-            BROWSER_CHECK_REPORT_END,
-        )
+        report_text = (parser.block(BROWSER_CHECK_REPORT_START) or "").strip()
         if report_text:
             parsed["visual_report"] = report_text
 
         if "summary" not in parsed:
-            for line in reversed(output_text.splitlines()):
-                raw = line.strip()
-                if not raw.startswith("{"):
-                    continue
-                try:
-                    payload = json.loads(raw)
-                except Exception:
-                    continue
-                if isinstance(payload, dict) and payload.get("mode") == BROWSER_CHECK_MODE:
-                    parsed["summary"] = payload
-                    break
+            payload = parser.last_json(lambda item: item.get("mode") == BROWSER_CHECK_MODE)
+            if payload is not None:
+                parsed["summary"] = payload
 
         summary = parsed.get("summary")
         if isinstance(summary, dict):
@@ -2368,6 +2382,18 @@ class SessionExecutionOrchestrator:
             parsed["console_warning_count"] = self._to_int(summary.get("console_warning_count")) or 0
             parsed["failed_request_count"] = self._to_int(summary.get("failed_request_count")) or 0
             parsed["changed_file_summary"] = summary.get("changed_file_summary")
+            if isinstance(summary.get("route"), str):
+                parsed["route"] = summary["route"]
+            if isinstance(summary.get("dev_server_command"), str):
+                parsed["dev_server_command"] = summary["dev_server_command"]
+            port = self._to_int(summary.get("dev_server_port"))
+            if port is None and parsed.get("route"):
+                try:
+                    port = urlparse(parsed["route"]).port
+                except ValueError:
+                    port = None
+            if port:
+                parsed["dev_server_port"] = port
 
         return parsed
 
@@ -2379,7 +2405,10 @@ class SessionExecutionOrchestrator:
         execution: AgentExecution,
         objective: str,
     ) -> Dict[str, Any]:
+        parser = self._new_browser_check_parser()
+
         async def _relay_event(event: Dict[str, Any]) -> None:
+            parser.feed_event(event)
             if event.get("type") != WSMessageType.SANDBOX_STREAM.value:
                 return
             payload = event.get("payload", {}) or {}
@@ -2416,6 +2445,13 @@ class SessionExecutionOrchestrator:
 
         env.update(dict(get_sandbox_config().env_passthrough_values))
 
+        dev_server = await self._reuse_browser_dev_server(db, session=session, workspace=workspace)
+        if dev_server:
+            env["BROWSER_CHECK_DEV_SERVER_URL"] = dev_server["url"]
+            env["BROWSER_CHECK_DEV_SERVER_COMMAND"] = dev_server["command"]
+            if dev_server.get("route"):
+                env["BROWSER_CHECK_ROUTE"] = dev_server["route"]
+
         result = await self.broker.run_command(
             db,
             session=session,
@@ -2425,13 +2461,50 @@ class SessionExecutionOrchestrator:
             timeout_seconds=get_sandbox_config().command_timeout_seconds,
             on_event=_relay_event,
         )
-        output_text = f"{result.get('stdout', '')}\n{result.get('stderr', '')}"
-        parsed = self._parse_browser_check_output(output_text)
+        self._finish_stream_parser(parser, result)
+        parsed = self._browser_check_fields_from_parser(parser)
         result.update(parsed)
         result["config_path"] = MSWEA_CONFIG_PATHS[BROWSER_CHECK_MODE]
         result["execution_dir"] = execution_root
+        if dev_server:
+            result["dev_server"] = dev_server
+            result.setdefault("dev_server_command", dev_server["command"])
+            result.setdefault("dev_server_port", dev_server["port"])
         return result
 
+    async def _reuse_browser_dev_server(
+        self,
+        db: Session,
+        *,
+        session: ChatSession,
+        workspace: str,
+    ) -> Optional[Dict[str, Any]]:
+        """Bring back the dev server the previous check in this session used.
+
+        The sandbox keeps it running between checks and restarts it only when
+        setup files changed, so the agent can skip discovery and startup.
+        Returns ``None`` when there is nothing to reuse or the sandbox cannot
+        supervise it; the agent then starts its own server as before.
+        """
+        previous = (session.mode_metadata or {}).get("browser_check") or {}
+        command = previous.get("dev_server_command")
+        port = self._to_int(previous.get("dev_server_port"))
+        if not isinstance(command, str) or not command.strip() or not port:
+            return None
+        try:
+            dev_server = await self.broker.ensure_browser_dev_server(
+                db,
+                session=session,
+                command=command,
+                port=port,
+                workspace=workspace,
+            )
+        except Exception as exc:
+            logger.info("Browser check dev server reuse unavailable for %s: %s", session.session_id, exc)
+            return None
+        dev_server["route"] = previous.get("route")
+        return dev_server
+
     async def _export_browser_check_artifact(
         self,
         db: Session,
@@ -2521,6 +2594,7 @@ class SessionExecutionOrchestrator:
         artifact: Optional[Dict[str, Any]],
     ) -> None:
         metadata = dict(session.mode_metadata or {})
+        previous = metadata.get("browser_check") or {}
         metadata["browser_check"] = {
             "execution_id": execution_id,
             "status": status,
@@ -2534,6 +2608,9 @@ class SessionExecutionOrchestrator:
             "failed_request_count": result.get("failed_request_count"),
             "changed_file_summary": result.get("changed_file_summary"),
             "error": result.get("error"),
+            "route": result.get("route") or previous.get("route"),
+            "dev_server_command": result.get("dev_server_command") or previous.get("dev_server_command"),
+            "dev_server_port": result.get("dev_server_port") or previous.get("dev_server_port"),
         }
         session.mode_metadata = metadata
 
@@ -2572,6 +2649,7 @@ class SessionExecutionOrchestrator:
             )
         )
 
+    @traced("mswea.execute")
     async def _execute_mswea_mode(
         self,
         db: Session,
@@ -2586,7 +2664,10 @@ class SessionExecutionOrchestrator:
         issue_url: Optional[str] = None,
         test_branch: Optional[str] = None,
     ) -> Dict[str, Any]:
+        parser = StreamingOutputParser(markers=((CHANGED_FILES_START, CHANGED_FILES_END),))
+
         async def _relay_event(event: Dict[str, Any]) -> None:
+            parser.feed_event(event)
             if event.get("type") != WSMessageType.SANDBOX_STREAM.value:
                 return
             payload = event.get("payload", {}) or {}
@@ -2645,15 +2726,15 @@ class SessionExecutionOrchestrator:
         if result.get("exit_code", 1) != 0:
             raise RuntimeError(f"MSWEA {mode} mode failed with exit_code={result.get('exit_code')}")
 
-        output_text = f"{result.get('stdout', '')}\n{result.get('stderr', '')}"
+        self._finish_stream_parser(parser, result)
         try:
-            contract = parse_mode_contract(mode, output_text)
+            contract = select_mode_contract(mode, parser.json_objects())
         except ModeContractError as exc:
             raise RuntimeError(str(exc)) from exc
 
         changed_files = result.get("changed_files")
         if not isinstance(changed_files, list):
-            changed_files = extract_changed_files_from_output(output_text)
+            changed_files = parse_changed_files_block(parser.block(CHANGED_FILES_START))
         try:
             changed_files = validate_mode_changed_files(mode, changed_files)
         except ModeContractError as exc:
@@ -3095,6 +3176,7 @@ class SessionExecutionOrchestrator:
             )
         )
 
+    @traced("stage_gate")
     async def _pause_for_stage_gate(
         self,
         db: Session,
@@ -3160,6 +3242,7 @@ class SessionExecutionOrchestrator:
             },
         )
 
+    @traced("pipeline.complete")
     async def _complete_pipeline(
         self,
         db: Session,
@@ -3226,6 +3309,7 @@ class SessionExecutionOrchestrator:
             },
         )
 
+    @traced("runtime.finalize")
     async def _finalize_runtime(
         self,
         db: Session,
@@ -3246,6 +3330,7 @@ class SessionExecutionOrchestrator:
             artifact_source_paths=[f"{SANDBOX_EXECUTION_ROOT}/{execution_id}"],
         )
 
+    @traced("followup")
     async def _generate_execution_followup(
         self,
         db: Session,
@@ -3274,9 +3359,7 @@ class SessionExecutionOrchestrator:
                 pipeline_execution_id=pipeline_execution_id,
             )
         except Exception as exc:  # pragma: no cover - follow-up must not fail execution state
-            import logging
-
-            logging.getLogger(__name__).warning(
+            logger.warning(
                 "Execution follow-up failed for %s: %s",
                 execution.id,
                 exc,
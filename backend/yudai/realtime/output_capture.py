@@ -0,0 +1,257 @@
+"""Memory-bounded capture of long-running command output."""
+
+from __future__ import annotations
+
+import os
+import uuid
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import BinaryIO, Deque, List, Optional
+
+from yudai.config import get_sandbox_config
+
+TRUNCATION_MARKER = "\n...[output truncated; {omitted} bytes omitted]...\n"
+
+
+@dataclass
+class _SpillSegment:
+    path: str
+    start: int
+    size: int = 0
+
+
+@dataclass(frozen=True)
+class OutputRange:
+    """Bytes served by ``read_range``; ``offset`` is where ``data`` actually starts."""
+
+    requested_offset: int
+    offset: int
+    data: str
+
+    @property
+    def truncated(self) -> bool:
+        """True when the start of the requested range was rotated away."""
+
+        return self.offset > self.requested_offset
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class BoundedOutputCapture:
+    """Keeps the head and tail of a stream in RAM and spills the full log to disk.
+
+    Output stays entirely in memory until it exceeds ``memory_limit_bytes``.
+    After that the first half of the budget is pinned as the head, the second
+    half is a rolling tail, and every byte is appended to rotating spill
+    segments so ``read_range`` can still serve arbitrary offsets. Once more
+    than ``max_spill_segments`` segments exist the oldest is dropped; a range
+    that starts in a dropped segment is served from the first byte still
+    available, and the returned ``OutputRange`` says so.
+    """
+
+    def __init__(
+        self,
+        name: str = "output",
+        *,
+        memory_limit_bytes: Optional[int] = None,
+        spill_root: Optional[str] = None,
+        spill_segment_bytes: Optional[int] = None,
+        max_spill_segments: Optional[int] = None,
+    ) -> None:
+        config = get_sandbox_config()
+        self.name = name
+        self.memory_limit_bytes = max(2, memory_limit_bytes or config.output_memory_limit_bytes)
+        self.spill_root = spill_root or config.output_spill_root
+        self.spill_segment_bytes = max(1, spill_segment_bytes or config.output_spill_segment_bytes)
+        self.max_spill_segments = max(1, max_spill_segments or config.output_spill_max_segments)
+        self.total_bytes = 0
+        self._head = bytearray()
+        self._tail: Deque[bytes] = deque()
+        self._tail_bytes = 0
+        self._spilled = False
+        self._segments: List[_SpillSegment] = []
+        self._spill_id = uuid.uuid4().hex[:16]
+        self._spill_paths: List[str] = []
+        self._handle: Optional[BinaryIO] = None
+        self._finalizer = weakref.finalize(self, _remove_files, self._spill_paths)
+
+    @property
+    def spilled(self) -> bool:
+        return self._spilled
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self._head) + self._tail_bytes
+
+    @property
+    def spill_paths(self) -> List[str]:
+        return [segment.path for segment in self._segments]
+
+    def write(self, data: str | bytes) -> None:
+        raw = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        if not raw:
+            return
+        if not self._spilled and self.total_bytes + len(raw) <= self.memory_limit_bytes:
+            self._head.extend(raw)
+            self.total_bytes += len(raw)
+            return
+        if not self._spilled:
+            self._start_spill()
+        self._append_to_spill(raw)
+        self.total_bytes += len(raw)
+        head_room = self.memory_limit_bytes // 2 - len(self._head)
+        if head_room > 0:
+            self._head.extend(raw[:head_room])
+            raw = raw[head_room:]
+        self._push_tail(raw)
+
+    def text(self) -> str:
+        """Return the full output, or head + marker + tail once it no longer fits in RAM."""
+
+        tail = b"".join(self._tail)
+        if not self.truncated:
+            return (bytes(self._head) + tail).decode("utf-8", errors="replace")
+        omitted = self.total_bytes - len(self._head) - len(tail)
+        return (
+            bytes(self._head).decode("utf-8", errors="replace")
+            + TRUNCATION_MARKER.format(omitted=omitted)
+            + tail.decode("utf-8", errors="replace")
+        )
+
+    def tail_text(self, limit: int) -> str:
+        """Return at most ``limit`` bytes from the end of the output."""
+
+        start = max(0, self.total_bytes - max(0, limit))
+        return self.read_range(start, self.total_bytes - start).data
+
+    def read_range(self, offset: int, length: int) -> OutputRange:
+        """Read up to ``length`` bytes starting at byte ``offset`` of the full output.
+
+        Only a contiguous run is returned: if part of the range was rotated
+        away, ``data`` starts at the first byte still available (reported as
+        ``offset``) and stops at the next gap.
+        """
+
+        requested = max(0, offset)
+        end = min(self.total_bytes, requested + max(0, length))
+        if end <= requested:
+            return OutputRange(requested_offset=requested, offset=min(requested, self.total_bytes), data="")
+        if not self._spilled:
+            data = bytes(self._head[requested:end]).decode("utf-8", errors="replace")
+            return OutputRange(requested_offset=requested, offset=requested, data=data)
+        if self._handle is not None:
+            self._handle.flush()
+
+        tail = b"".join(self._tail)
+        sources = [(0, len(self._head), None)]
+        sources.extend((segment.start, segment.start + segment.size, segment) for segment in self._segments)
+        sources.append((self.total_bytes - len(tail), self.total_bytes, None))
+        served: Optional[int] = None
+        cursor = requested
+        chunks: List[bytes] = []
+        for start, stop, segment in sorted(sources, key=lambda source: source[0]):
+            if stop <= cursor or start >= end:
+                continue
+            if start > cursor:
+                if served is not None:
+                    break
+                cursor = start
+            read_end = min(end, stop)
+            if served is None:
+                served = cursor
+            if segment is not None:
+                with open(segment.path, "rb") as handle:
+                    handle.seek(cursor - start)
+                    chunks.append(handle.read(read_end - cursor))
+            elif start == 0:
+                chunks.append(bytes(self._head[cursor:read_end]))
+            else:
+                chunks.append(tail[cursor - start : read_end - start])
+            cursor = read_end
+        if served is None:
+            available = min((max(start, requested) for start, stop, _ in sources if stop > requested), default=end)
+            return OutputRange(requested_offset=requested, offset=available, data="")
+        return OutputRange(
+            requested_offset=requested,
+            offset=served,
+            data=b"".join(chunks).decode("utf-8", errors="replace"),
+        )
+
+    def finish(self) -> None:
+        """Close the spill file once no more output will be written; ranges stay readable."""
+
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def close(self) -> None:
+        """Delete spill files; in-memory head and tail stay readable."""
+
+        self.finish()
+        self._finalizer()
+        self._segments = [segment for segment in self._segments if os.path.exists(segment.path)]
+
+    def _start_spill(self) -> None:
+        os.makedirs(self.spill_root, exist_ok=True)
+        self._spilled = True
+        buffered = bytes(self._head)
+        keep = self.memory_limit_bytes // 2
+        self._head = bytearray(buffered[:keep])
+        self.total_bytes = 0
+        self._append_to_spill(buffered)
+        self.total_bytes = len(buffered)
+        self._push_tail(buffered[keep:])
+
+    def _append_to_spill(self, raw: bytes) -> None:
+        position = 0
+        while position < len(raw):
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or segment.size >= self.spill_segment_bytes:
+                segment = self._open_segment(self.total_bytes + position)
+            room = self.spill_segment_bytes - segment.size
+            piece = raw[position : position + room]
+            if self._handle is None:
+                self._handle = open(segment.path, "ab")
+            self._handle.write(piece)
+            segment.size += len(piece)
+            position += len(piece)
+
+    def _open_segment(self, start: int) -> _SpillSegment:
+        index = len(self._spill_paths)
+        path = os.path.join(
+            self.spill_root,
+            f"{self.name}-{self._spill_id}-{index:04d}.log",
+        )
+        self.finish()
+        self._handle = open(path, "wb")
+        self._spill_paths.append(path)
+        segment = _SpillSegment(path=path, start=start)
+        self._segments.append(segment)
+        while len(self._segments) > self.max_spill_segments:
+            dropped = self._segments.pop(0)
+            _remove_files([dropped.path])
+        return segment
+
+    def _push_tail(self, raw: bytes) -> None:
+        if not raw:
+            return
+        budget = self.memory_limit_bytes - len(self._head)
+        self._tail.append(raw)
+        self._tail_bytes += len(raw)
+        while self._tail_bytes > budget and self._tail:
+            overflow = self._tail_bytes - budget
+            first = self._tail[0]
+            if len(first) <= overflow:
+                self._tail.popleft()
+                self._tail_bytes -= len(first)
+            else:
+                self._tail[0] = first[overflow:]
+                self._tail_bytes -= overflow
+
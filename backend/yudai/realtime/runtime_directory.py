@@ -0,0 +1,119 @@
+"""In-memory directory of live session runtimes.
+
+The exec broker needs a session's sandbox id and tunnel URL before it can
+dispatch to the sandbox tunnel. The directory keeps that route per session so
+resolving it on the hot path does not touch the database:
+
+* provisioning and tunnel resolution populate it;
+* termination, stale cleanup and a failed health probe invalidate every
+  session routed to the affected sandbox;
+* entries also expire after ``SANDBOX_RUNTIME_DIRECTORY_TTL_SECONDS`` (or the
+  tunnel token TTL, whichever is shorter), which bounds how long a change
+  made by another controller worker can go unnoticed.
+
+Only running sandboxes are cached; anything else falls through to the
+database so its error handling stays authoritative.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import time
+from typing import Dict, Optional, Set
+
+from yudai.config import get_sandbox_config
+
+
+@dataclass(frozen=True)
+class RuntimeRoute:
+    session_id: int
+    sandbox_id: str
+    tunnel_url: str
+    status: str
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+class RuntimeDirectory:
+    """Maps session ids to the sandbox route that serves them."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._routes: Dict[int, RuntimeRoute] = {}
+        self._sessions_by_sandbox: Dict[str, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl_seconds(self) -> float:
+        if self._ttl_seconds is not None:
+            return self._ttl_seconds
+        return float(get_sandbox_config().runtime_directory_ttl_seconds)
+
+    def get(self, session_id: int) -> Optional[RuntimeRoute]:
+        route = self._routes.get(session_id)
+        if route is not None and route.expired:
+            self.invalidate_session(session_id)
+            route = None
+        if route is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return route
+
+    def put(
+        self,
+        *,
+        session_id: int,
+        sandbox_id: str,
+        tunnel_url: str,
+        status: str,
+        token_ttl_seconds: Optional[int] = None,
+    ) -> Optional[RuntimeRoute]:
+        ttl = self.ttl_seconds
+        if token_ttl_seconds:
+            ttl = min(ttl, float(token_ttl_seconds))
+        if ttl <= 0:
+            return None
+        self.invalidate_session(session_id)
+        route = RuntimeRoute(
+            session_id=session_id,
+            sandbox_id=sandbox_id,
+            tunnel_url=tunnel_url,
+            status=status,
+            expires_at=time.monotonic() + ttl,
+        )
+        self._routes[session_id] = route
+        self._sessions_by_sandbox.setdefault(sandbox_id, set()).add(session_id)
+        return route
+
+    def invalidate_session(self, session_id: int) -> None:
+        route = self._routes.pop(session_id, None)
+        if route is None:
+            return
+        sessions = self._sessions_by_sandbox.get(route.sandbox_id)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._sessions_by_sandbox[route.sandbox_id]
+
+    def invalidate_sandbox(self, sandbox_id: str) -> None:
+        for session_id in self._sessions_by_sandbox.pop(sandbox_id, set()):
+            self._routes.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._routes.clear()
+        self._sessions_by_sandbox.clear()
+
+
+_runtime_directory_singleton: Optional[RuntimeDirectory] = None
+
+
+def get_runtime_directory() -> RuntimeDirectory:
+    global _runtime_directory_singleton
+    if _runtime_directory_singleton is None:
+        _runtime_directory_singleton = RuntimeDirectory()
+    return _runtime_directory_singleton
@@ -0,0 +1,306 @@
+"""Typed file operations served in-process by the sandbox server.
+
+The controller writes summaries, reads probe output and exports artifacts
+through these helpers, which run inside the sandbox server process behind
+``/internal/files/*``. ``SandboxFileClient`` is the controller side of that
+API: one HTTP round-trip per operation.
+
+Paths may be relative to the workspace or absolute; either way they must
+resolve inside the configured workspace, cache or artifact root. A
+caller-supplied workspace must itself lie inside one of those roots.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
+
+from yudai.config import get_sandbox_config
+
+logger = logging.getLogger(__name__)
+
+MAX_WRITE_BYTES = 64 * 1024 * 1024
+MAX_READ_BYTES = 16 * 1024 * 1024
+ARCHIVE_CHUNK_BYTES = 256 * 1024
+
+
+class SandboxFileError(ValueError):
+    """Raised for paths outside the allowed roots or unusable file requests."""
+
+
+def _allowed_roots() -> List[str]:
+    config = get_sandbox_config()
+    roots = [config.workspace_path, config.cache_root, config.artifact_root]
+    return [os.path.realpath(root) for root in roots if root]
+
+
+def _inside(resolved: str, roots: List[str]) -> bool:
+    return any(resolved == root or resolved.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+
+def resolve_workspace(workspace: Optional[str] = None) -> str:
+    """Resolve a caller-supplied workspace, which must lie inside a configured root."""
+
+    if not workspace:
+        return get_sandbox_config().workspace_path
+    if "\0" in workspace:
+        raise SandboxFileError("Workspace path is invalid")
+    resolved = os.path.realpath(workspace)
+    if not _inside(resolved, _allowed_roots()):
+        raise SandboxFileError(f"Workspace is outside the sandbox roots: {workspace}")
+    return resolved
+
+
+def resolve_sandbox_path(raw_path: str, *, workspace: Optional[str] = None) -> Path:
+    workspace = resolve_workspace(workspace)
+    if not raw_path or "\0" in raw_path:
+        raise SandboxFileError("A file path is required")
+    candidate = raw_path if os.path.isabs(raw_path) else os.path.join(workspace, raw_path)
+    resolved = os.path.realpath(candidate)
+    if _inside(resolved, _allowed_roots()):
+        return Path(resolved)
+    raise SandboxFileError(f"Path is outside the sandbox workspace: {raw_path}")
+
+
+def read_file_range(path: Path, *, offset: int = 0, length: Optional[int] = None) -> Tuple[bytes, int]:
+    """Return ``length`` bytes from ``offset`` plus the file's total size."""
+
+    length = MAX_READ_BYTES if length is None else min(length, MAX_READ_BYTES)
+    with path.open("rb") as handle:
+        total = os.fstat(handle.fileno()).st_size
+        handle.seek(offset)
+        return handle.read(length), total
+
+
+def write_file_atomic(path: Path, data: bytes, *, mode: Optional[int] = None) -> Dict[str, Any]:
+    """Write through a temporary file in the same directory, then rename over ``path``."""
+
+    if len(data) > MAX_WRITE_BYTES:
+        raise SandboxFileError(f"File write exceeds {MAX_WRITE_BYTES} bytes")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        if mode is not None:
+            os.chmod(temp_name, mode)
+        os.replace(temp_name, path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return {"path": str(path), "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def stat_sandbox_path(path: Path) -> Dict[str, Any]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {"path": str(path), "exists": False, "type": None, "size": None, "mtime": None}
+    if path.is_dir():
+        kind = "directory"
+    elif path.is_file():
+        kind = "file"
+    else:
+        kind = "other"
+    return {"path": str(path), "exists": True, "type": kind, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def glob_sandbox_paths(root: Path, pattern: str, *, limit: int = 500) -> Tuple[List[str], bool]:
+    """Match ``pattern`` (``**`` allowed) under ``root``; results are relative to it."""
+
+    if not pattern or os.path.isabs(pattern) or ".." in Path(pattern).parts:
+        raise SandboxFileError("Glob patterns must be relative to the root")
+    matches: List[str] = []
+    for candidate in sorted(root.glob(pattern)):
+        relative = candidate.relative_to(root).as_posix()
+        if ".git" in relative.split("/"):
+            continue
+        matches.append(relative)
+        if len(matches) > limit:
+            return matches[:limit], True
+    return matches, False
+
+
+def iter_archive(
+    source_paths: Iterable[str],
+    *,
+    workspace: str,
+    archive_prefix: str,
+    chunk_size: int = ARCHIVE_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Stream a ``tar.gz`` of ``source_paths`` without buffering it in memory.
+
+    A worker thread writes the archive into a pipe that this generator
+    drains; closing the generator early breaks the pipe and stops the worker.
+    Missing sources are skipped, matching the old export script.
+    """
+
+    workspace_root = Path(workspace).resolve()
+    members: List[Tuple[Path, str]] = []
+    for raw in source_paths:
+        path = resolve_sandbox_path(str(raw), workspace=workspace)
+        if not path.exists():
+            continue
+        try:
+            arcname = path.relative_to(workspace_root).as_posix()
+            arcname = arcname if arcname and arcname != "." else path.name
+        except ValueError:
+            arcname = path.name
+        members.append((path, f"{archive_prefix}/{arcname}"))
+
+    read_fd, write_fd = os.pipe()
+
+    def _produce() -> None:
+        try:
+            with os.fdopen(write_fd, "wb") as sink, tarfile.open(fileobj=sink, mode="w|gz") as archive:
+                for path, arcname in members:
+                    archive.add(str(path), arcname=arcname)
+        except BrokenPipeError:
+            pass
+        except Exception:
+            logger.warning("Sandbox archive stream failed", exc_info=True)
+
+    producer = threading.Thread(target=_produce, name="sandbox-archive", daemon=True)
+    producer.start()
+    with os.fdopen(read_fd, "rb") as source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    producer.join()
+
+
+# ---------------------------------------------------------------------------
+# Controller-side client
+# ---------------------------------------------------------------------------
+
+
+def _internal_headers() -> Dict[str, str]:
+    secret = get_sandbox_config().controller_internal_ws_secret
+    return {"X-Controller-Internal-Secret": secret} if secret else {}
+
+
+class SandboxFileClient:
+    """Calls the sandbox ``/internal/files`` API for one tunnel."""
+
+    def __init__(self, tunnel_url: str, *, timeout_seconds: float = 30.0) -> None:
+        self.base_url = f"{tunnel_url.rstrip('/')}/internal/files"
+        self.timeout_seconds = timeout_seconds
+
+    def _client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(timeout=self.timeout_seconds, headers=_internal_headers())
+
+    async def read_bytes(
+        self,
+        path: str,
+        *,
+        offset: int = 0,
+        length: Optional[int] = None,
+        workspace: Optional[str] = None,
+    ) -> bytes:
+        params: Dict[str, Any] = {"path": path, "offset": offset}
+        if length is not None:
+            params["length"] = length
+        if workspace:
+            params["workspace"] = workspace
+        async with self._client() as client:
+            response = await client.get(f"{self.base_url}/read", params=params)
+        if response.status_code == 404:
+            raise FileNotFoundError(path)
+        response.raise_for_status()
+        return response.content
+
+    async def read_text(self, path: str, *, workspace: Optional[str] = None) -> str:
+        return (await self.read_bytes(path, workspace=workspace)).decode("utf-8", errors="replace")
+
+    async def write_bytes(
+        self,
+        path: str,
+        data: bytes,
+        *,
+        workspace: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        params = {"path": path}
+        if workspace:
+            params["workspace"] = workspace
+        async with self._client() as client:
+            response = await client.put(f"{self.base_url}/write", params=params, content=data)
+        response.raise_for_status()
+        return response.json()
+
+    async def write_json(
+        self,
+        path: str,
+        payload: Any,
+        *,
+        workspace: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        data = (json.dumps(payload, ensure_ascii=True, indent=2) + "\n").encode("utf-8")
+        return await self.write_bytes(path, data, workspace=workspace)
+
+    async def stat(self, path: str, *, workspace: Optional[str] = None) -> Dict[str, Any]:
+        params = {"path": path}
+        if workspace:
+            params["workspace"] = workspace
+        async with self._client() as client:
+            response = await client.get(f"{self.base_url}/stat", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def glob(
+        self,
+        pattern: str,
+        *,
+        root: Optional[str] = None,
+        limit: int = 500,
+        workspace: Optional[str] = None,
+    ) -> List[str]:
+        params: Dict[str, Any] = {"pattern": pattern, "limit": limit}
+        if root:
+            params["root"] = root
+        if workspace:
+            params["workspace"] = workspace
+        async with self._client() as client:
+            response = await client.get(f"{self.base_url}/glob", params=params)
+        response.raise_for_status()
+        return list(response.json().get("matches") or [])
+
+    async def download_archive(
+        self,
+        source_paths: Iterable[str],
+        *,
+        archive_prefix: str,
+        destination: Path,
+        workspace: Optional[str] = None,
+    ) -> int:
+        """Stream a ``tar.gz`` of ``source_paths`` into ``destination``; returns its size."""
+
+        written = 0
+        body = {
+            "source_paths": [str(path) for path in source_paths],
+            "archive_prefix": archive_prefix,
+            "workspace": workspace,
+        }
+        async with self._client() as client:
+            async with client.stream("POST", f"{self.base_url}/archive", json=body) as response:
+                response.raise_for_status()
+                with destination.open("wb") as handle:
+                    async for chunk in response.aiter_bytes():
+                        handle.write(chunk)
+                        written += len(chunk)
+        return written
@@ -0,0 +1,224 @@
+"""Push-based sandbox readiness.
+
+When its lifespan starts, the sandbox server POSTs a signed ``ready`` callback
+with its capabilities to ``/controller/sandboxes/{id}/ready``. The controller
+resolves any waiter for that sandbox at once, so provisioning waits only as
+long as the sandbox takes to boot. A heartbeat received from an already-ready
+sandbox counts as liveness and skips the wait entirely.
+
+The callback may land on a different controller worker than the waiter, so
+``wait_for_sandbox_ready`` still polls ``/healthz`` as a fallback, backing off
+to at most once a second, the cadence of the polling this replaced.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from yudai.config import get_sandbox_config
+
+logger = logging.getLogger(__name__)
+
+READY_TIMESTAMP_HEADER = "X-Sandbox-Ready-Timestamp"
+READY_SIGNATURE_HEADER = "X-Sandbox-Ready-Signature"
+READY_MAX_SKEW_SECONDS = 300
+_FALLBACK_POLL_INITIAL_SECONDS = 0.5
+_FALLBACK_POLL_MAX_SECONDS = 1.0
+
+
+def sign_ready_payload(secret: str, *, sandbox_id: str, timestamp: str, body: bytes) -> str:
+    message = f"{sandbox_id}.{timestamp}.".encode("utf-8") + body
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def verify_ready_signature(
+    secret: Optional[str],
+    *,
+    sandbox_id: str,
+    timestamp: Optional[str],
+    signature: Optional[str],
+    body: bytes,
+) -> bool:
+    """Check a ready callback; unsigned callbacks pass when no secret is configured."""
+
+    if not secret:
+        return True
+    if not timestamp or not signature:
+        return False
+    try:
+        skew = abs(time.time() - float(timestamp))
+    except ValueError:
+        return False
+    if skew > READY_MAX_SKEW_SECONDS:
+        return False
+    expected = sign_ready_payload(secret, sandbox_id=sandbox_id, timestamp=timestamp, body=body)
+    return hmac.compare_digest(expected, signature)
+
+
+@dataclass
+class _SandboxReadiness:
+    ready_at: Optional[float] = None
+    last_seen: Optional[float] = None
+    capabilities: Dict[str, Any] = field(default_factory=dict)
+    waiters: list[asyncio.Future[Dict[str, Any]]] = field(default_factory=list)
+
+
+class SandboxReadinessRegistry:
+    """Per-process record of which sandboxes reported ready and when they were last seen."""
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, _SandboxReadiness] = {}
+
+    def _entry(self, sandbox_id: str) -> _SandboxReadiness:
+        entry = self._entries.get(sandbox_id)
+        if entry is None:
+            entry = self._entries[sandbox_id] = _SandboxReadiness()
+        return entry
+
+    def mark_ready(self, sandbox_id: str, capabilities: Optional[Dict[str, Any]] = None) -> None:
+        entry = self._entry(sandbox_id)
+        now = time.monotonic()
+        entry.ready_at = entry.last_seen = now
+        entry.capabilities = dict(capabilities or {})
+        waiters, entry.waiters = entry.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(entry.capabilities)
+
+    def mark_seen(self, sandbox_id: str) -> None:
+        """Record a heartbeat; it only proves liveness once the sandbox reported ready."""
+        entry = self._entries.get(sandbox_id)
+        if entry is not None and entry.ready_at is not None:
+            entry.last_seen = time.monotonic()
+
+    def forget(self, sandbox_id: str) -> None:
+        """Drop readiness for a sandbox that was terminated or is being re-provisioned."""
+        entry = self._entries.pop(sandbox_id, None)
+        if entry is None:
+            return
+        for waiter in entry.waiters:
+            if not waiter.done():
+                waiter.cancel()
+
+    def is_live(self, sandbox_id: str, *, within_seconds: float) -> bool:
+        entry = self._entries.get(sandbox_id)
+        if entry is None or entry.ready_at is None or entry.last_seen is None:
+            return False
+        return time.monotonic() - entry.last_seen <= within_seconds
+
+    def capabilities(self, sandbox_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(sandbox_id)
+        return dict(entry.capabilities) if entry is not None and entry.ready_at is not None else None
+
+    async def wait(self, sandbox_id: str) -> Dict[str, Any]:
+        entry = self._entry(sandbox_id)
+        if entry.ready_at is not None:
+            return entry.capabilities
+        waiter: asyncio.Future[Dict[str, Any]] = asyncio.get_running_loop().create_future()
+        entry.waiters.append(waiter)
+        try:
+            return await waiter
+        finally:
+            if waiter in entry.waiters:
+                entry.waiters.remove(waiter)
+            # Do not keep an entry for a sandbox that never reported ready.
+            if entry.ready_at is None and not entry.waiters and self._entries.get(sandbox_id) is entry:
+                del self._entries[sandbox_id]
+
+
+_sandbox_readiness_singleton: Optional[SandboxReadinessRegistry] = None
+
+
+def get_sandbox_readiness() -> SandboxReadinessRegistry:
+    global _sandbox_readiness_singleton
+    if _sandbox_readiness_singleton is None:
+        _sandbox_readiness_singleton = SandboxReadinessRegistry()
+    return _sandbox_readiness_singleton
+
+
+def _liveness_window_seconds() -> float:
+    return float(get_sandbox_config().heartbeat_interval_seconds * 2)
+
+
+def is_sandbox_live(sandbox_id: str) -> bool:
+    """True when this worker saw ``sandbox_id`` ready and heartbeating recently."""
+    return get_sandbox_readiness().is_live(sandbox_id, within_seconds=_liveness_window_seconds())
+
+
+def heartbeat_proves_liveness(sandbox: Any) -> bool:
+    """True when a ready sandbox heartbeated within two heartbeat intervals.
+
+    Falls back to the database row so a heartbeat handled by another worker
+    still counts; provisioning stamps ``last_heartbeat_at`` too, so the row
+    must also carry the ``ready_at`` recorded by the ready callback.
+    """
+
+    if is_sandbox_live(sandbox.id):
+        return True
+    metadata = sandbox.lifecycle_metadata or {}
+    last_heartbeat_at = sandbox.last_heartbeat_at
+    if not metadata.get("ready_at") or last_heartbeat_at is None:
+        return False
+    if metadata.get("last_probe_healthy") is False:
+        return False
+    if last_heartbeat_at.tzinfo is None:
+        last_heartbeat_at = last_heartbeat_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - last_heartbeat_at <= timedelta(seconds=_liveness_window_seconds())
+
+
+async def _poll_healthz(tunnel_url: str) -> None:
+    healthcheck_url = f"{tunnel_url.rstrip('/')}/healthz"
+    delay = _FALLBACK_POLL_INITIAL_SECONDS
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        while True:
+            try:
+                response = await client.get(healthcheck_url)
+                if response.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _FALLBACK_POLL_MAX_SECONDS)
+
+
+async def wait_for_sandbox_ready(sandbox: Any, tunnel_url: str, *, timeout_seconds: float = 60.0) -> str:
+    """Return once ``sandbox`` is serving; reports how readiness was established.
+
+    Returns ``"heartbeat"`` when a recent heartbeat made the wait unnecessary,
+    ``"callback"`` when the sandbox's ready callback arrived, or ``"healthz"``
+    when the fallback poll saw it first.
+    """
+
+    if heartbeat_proves_liveness(sandbox):
+        return "heartbeat"
+
+    registry = get_sandbox_readiness()
+    callback = asyncio.ensure_future(registry.wait(sandbox.id))
+    poll = asyncio.ensure_future(_poll_healthz(tunnel_url))
+    try:
+        done, _pending = await asyncio.wait(
+            {callback, poll},
+            timeout=timeout_seconds,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if callback in done and not callback.cancelled() and callback.exception() is None:
+            return "callback"
+        if poll in done:
+            poll.result()
+            return "healthz"
+    finally:
+        for task in (callback, poll):
+            task.cancel()
+        await asyncio.gather(callback, poll, return_exceptions=True)
+    raise RuntimeError(
+        f"Timed out waiting for sandbox {sandbox.id} to report ready at {tunnel_url}"
+    )
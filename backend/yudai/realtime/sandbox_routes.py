@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import asyncio
+from collections import OrderedDict
 import contextlib
 from dataclasses import dataclass
 import hmac
@@ -11,14 +12,39 @@ import logging
 import os
 import time
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Literal, Optional
 
 import httpx
-from fastapi import APIRouter, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi import APIRouter, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from yudai.config import get_sandbox_config
 from yudai.types import HealthzResponse
-
+from yudai.utils.tracing import set_attribute, start_trace, trace_headers
+
+from .code_index import INDEX_QUERY_KIND_PATTERN, get_code_index
+from .browser_service import BrowserServiceUnavailable, DevServerError, get_browser_service
+from .output_capture import BoundedOutputCapture
+from .sandbox_files import (
+    MAX_READ_BYTES,
+    MAX_WRITE_BYTES,
+    SandboxFileError,
+    glob_sandbox_paths,
+    iter_archive,
+    read_file_range,
+    resolve_sandbox_path,
+    resolve_workspace,
+    stat_sandbox_path,
+    write_file_atomic,
+)
+from .sandbox_scheduler import (
+    JOB_CLASS_AGENT,
+    JOB_CLASS_PATTERN,
+    JOB_CLASSES,
+    SchedulerQueueFull,
+    SchedulerSlot,
+    get_sandbox_job_scheduler,
+)
 from .ws_protocol import WSMessageType, build_envelope
 
 logger = logging.getLogger(__name__)
@@ -34,13 +60,16 @@ class _SessionExecutionState:
 
 @dataclass
 class _BackgroundExecutionState:
-    process: asyncio.subprocess.Process
     session_id: str
     mode_execution_id: str
     controller_job_id: str
     attempt: int
     started_at_monotonic: float
-    task: asyncio.Task[None]
+    stdout: BoundedOutputCapture
+    stderr: BoundedOutputCapture
+    job_class: str = JOB_CLASS_AGENT
+    process: Optional[asyncio.subprocess.Process] = None
+    task: Optional[asyncio.Task[None]] = None
 
 
 class SandboxExecutionStartRequest(BaseModel):
@@ -51,6 +80,7 @@ class SandboxExecutionStartRequest(BaseModel):
     controller_job_id: Optional[str] = Field(default=None, min_length=1, max_length=64)
     attempt: int = Field(default=1, ge=1)
     timeout_seconds: Optional[int] = Field(default=None, ge=1)
+    job_class: str = Field(default=JOB_CLASS_AGENT, pattern=JOB_CLASS_PATTERN)
 
 
 class SandboxExecutionStartResponse(BaseModel):
@@ -59,10 +89,117 @@ class SandboxExecutionStartResponse(BaseModel):
     controller_job_id: Optional[str] = None
 
 
-_SESSION_EXECUTIONS: dict[str, _SessionExecutionState] = {}
+class SandboxExecutionOutputResponse(BaseModel):
+    sandbox_job_id: str
+    stream: str
+    offset: int
+    total_bytes: int
+    data: str
+    truncated: bool = False
+
+
+class CodeIndexQueryRequest(BaseModel):
+    kind: str = Field(..., pattern=INDEX_QUERY_KIND_PATTERN)
+    term: str = Field(default="", max_length=512)
+    limit: int = Field(default=20, ge=1, le=200)
+    workspace: Optional[str] = None
+
+
+class CodeIndexMatch(BaseModel):
+    path: str
+    line: Optional[int] = None
+    text: Optional[str] = None
+    symbol: Optional[str] = None
+    symbol_kind: Optional[str] = None
+
+
+class CodeIndexQueryResponse(BaseModel):
+    kind: str
+    term: str
+    matches: list[CodeIndexMatch]
+    truncated: bool
+    files_indexed: int
+    generation: int
+    duration_ms: int
+
+
+class SandboxFileWriteResponse(BaseModel):
+    path: str
+    bytes: int
+    sha256: str
+
+
+class SandboxFileStatResponse(BaseModel):
+    path: str
+    exists: bool
+    type: Optional[str] = None
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+
+
+class SandboxFileGlobResponse(BaseModel):
+    root: str
+    matches: list[str]
+    truncated: bool
+
+
+class SandboxArchiveRequest(BaseModel):
+    source_paths: list[str] = Field(..., min_length=1)
+    archive_prefix: str = Field(..., min_length=1, max_length=256)
+    workspace: Optional[str] = None
+
+
+class BrowserDevServerRequest(BaseModel):
+    command: str = Field(..., min_length=1, max_length=2000)
+    port: int = Field(..., ge=1, le=65535)
+    cwd: Optional[str] = None
+    workspace: Optional[str] = None
+
+
+class BrowserDevServerResponse(BaseModel):
+    status: str
+    reason: Optional[str] = None
+    command: str
+    port: int
+    cwd: str
+    url: str
+    pid: Optional[int] = None
+    log_path: Optional[str] = None
+    reuse_count: int = 0
+
+
+class BrowserCaptureRequest(BaseModel):
+    url: str = Field(..., pattern=r"^https?://")
+    screenshot_path: str = Field(..., min_length=1)
+    viewport_width: int = Field(default=1440, ge=200, le=4096)
+    viewport_height: int = Field(default=1000, ge=200, le=4096)
+    full_page: bool = True
+    wait_until: Literal["load", "domcontentloaded", "networkidle"] = "networkidle"
+    timeout_seconds: float = Field(default=30.0, gt=0, le=300)
+    workspace: Optional[str] = None
+
+
+class BrowserCaptureResponse(BaseModel):
+    url: str
+    status_code: Optional[int] = None
+    title: str = ""
+    screenshot_path: str
+    viewport: dict[str, int]
+    console_messages: list[dict[str, str]]
+    console_warning_count: int
+    failed_requests: list[dict[str, Any]]
+    failed_request_count: int
+    browser_reused: bool
+    page_reused: bool
+    duration_ms: int
+
+
+_SESSION_EXECUTIONS: dict[str, dict[int, _SessionExecutionState]] = {}
 _BACKGROUND_EXECUTIONS: dict[str, _BackgroundExecutionState] = {}
 _SESSION_EXECUTION_LOCK = asyncio.Lock()
 _BACKGROUND_EXECUTION_LOCK = asyncio.Lock()
+_FINISHED_OUTPUTS: "OrderedDict[str, tuple[str, BoundedOutputCapture, BoundedOutputCapture]]" = OrderedDict()
+_FINISHED_OUTPUT_LIMIT = 16
 _CALLBACK_CHUNK_LIMIT = 16_000
 _CALLBACK_OUTPUT_LIMIT = 64_000
 
@@ -91,31 +228,29 @@ async def start_internal_execution(
     session_id: str,
     request: SandboxExecutionStartRequest,
     x_controller_internal_secret: Optional[str] = Header(default=None),
+    traceparent: Optional[str] = Header(default=None),
 ) -> SandboxExecutionStartResponse:
     """Start a sandbox command in the background and report progress to the controller."""
-    if not _is_internal_header_authorized(x_controller_internal_secret):
+    if not _is_internal_secret_valid(x_controller_internal_secret):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
 
     controller_job_id = request.controller_job_id or f"ctrljob_{uuid.uuid4().hex[:24]}"
     sandbox_job_id = f"sbjob_{uuid.uuid4().hex[:24]}"
+    scheduler = get_sandbox_job_scheduler()
 
     async with _BACKGROUND_EXECUTION_LOCK:
-        for state in _BACKGROUND_EXECUTIONS.values():
-            if state.controller_job_id == controller_job_id:
+        for existing_job_id, existing in _BACKGROUND_EXECUTIONS.items():
+            if existing.controller_job_id == controller_job_id:
                 return SandboxExecutionStartResponse(
-                    sandbox_job_id=next(
-                        key
-                        for key, value in _BACKGROUND_EXECUTIONS.items()
-                        if value.controller_job_id == controller_job_id
-                    ),
-                    status="running",
+                    sandbox_job_id=existing_job_id,
+                    status="running" if existing.process is not None else "queued",
                     controller_job_id=controller_job_id,
                 )
-            if state.session_id == session_id and state.process.returncode is None:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail="A sandbox command is already running for this session",
-                )
+    if scheduler.queue_full(request.job_class):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"The sandbox {request.job_class} queue is full",
+        )
 
     resolved_cwd = request.cwd or get_sandbox_config().workspace_path
     if resolved_cwd and not os.path.isdir(resolved_cwd):
@@ -126,20 +261,30 @@ async def start_internal_execution(
         if key:
             merged_env[str(key)] = str(value)
 
-    process = await asyncio.create_subprocess_exec(
-        "bash",
-        "-lc",
-        request.command,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        cwd=resolved_cwd,
-        env=merged_env,
+    stdout_capture = BoundedOutputCapture("stdout")
+    stderr_capture = BoundedOutputCapture("stderr")
+    state = _BackgroundExecutionState(
+        session_id=session_id,
+        mode_execution_id=request.mode_execution_id,
+        controller_job_id=controller_job_id,
+        attempt=request.attempt,
+        started_at_monotonic=time.monotonic(),
+        stdout=stdout_capture,
+        stderr=stderr_capture,
+        job_class=request.job_class,
     )
 
     async def _run_background() -> None:
-        stdout_chunks: list[str] = []
-        stderr_chunks: list[str] = []
+        # Callbacks sent while the job span is active carry its traceparent.
+        with start_trace(
+            "sandbox.job",
+            traceparent=traceparent,
+            sandbox_job_id=sandbox_job_id,
+            job_class=request.job_class,
+        ):
+            await _run_job()
+
+    async def _run_job() -> None:
         started_at = time.monotonic()
         sequence = 0
 
@@ -167,7 +312,7 @@ async def start_internal_execution(
         async def _stream_reader(
             stream: Optional[asyncio.StreamReader],
             event_name: str,
-            chunks: list[str],
+            capture: BoundedOutputCapture,
         ) -> None:
             if stream is None:
                 return
@@ -175,29 +320,64 @@ async def start_internal_execution(
                 chunk = await stream.read(2048)
                 if not chunk:
                     return
-                text = chunk.decode("utf-8", errors="replace")
-                chunks.append(text)
-                await _send_stream(event_name, text)
+                capture.write(chunk)
+                await _send_stream(event_name, chunk.decode("utf-8", errors="replace"))
 
-        async def _heartbeat() -> None:
+        async def _heartbeat(process: asyncio.subprocess.Process) -> None:
             while process.returncode is None:
                 await asyncio.sleep(10)
                 if process.returncode is None:
                     await _send_stream("heartbeat")
 
+        async def _on_queued(position: int) -> None:
+            await _send_stream("queued", queue_position=position, job_class=request.job_class)
+
         exit_code = 1
+        cancelled = False
+        process: Optional[asyncio.subprocess.Process] = None
+        slot: Optional[SchedulerSlot] = None
         heartbeat_task: Optional[asyncio.Task[None]] = None
         try:
-            await _send_stream("start", command=request.command, pid=process.pid)
-            heartbeat_task = asyncio.create_task(_heartbeat(), name=f"sandbox-heartbeat-{sandbox_job_id}")
+            slot = await scheduler.acquire(
+                request.job_class,
+                exclusive_key=_scheduler_exclusive_key(session_id, request.job_class),
+                on_queued=_on_queued,
+            )
+            process = await asyncio.create_subprocess_exec(
+                "bash",
+                "-lc",
+                request.command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=resolved_cwd,
+                env=merged_env,
+            )
+            state.process = process
+            set_attribute("queued_ms", int(slot.waited_seconds * 1000))
+            await _send_stream(
+                "start",
+                command=request.command,
+                pid=process.pid,
+                job_class=request.job_class,
+                queued_ms=int(slot.waited_seconds * 1000),
+            )
+            heartbeat_task = asyncio.create_task(
+                _heartbeat(process), name=f"sandbox-heartbeat-{sandbox_job_id}"
+            )
             await asyncio.gather(
-                _stream_reader(process.stdout, "stdout", stdout_chunks),
-                _stream_reader(process.stderr, "stderr", stderr_chunks),
+                _stream_reader(process.stdout, "stdout", stdout_capture),
+                _stream_reader(process.stderr, "stderr", stderr_capture),
             )
             exit_code = await process.wait()
+            set_attribute("exit_code", exit_code)
+            await _send_stream("exit", exit_code=exit_code)
+        except SchedulerQueueFull as exc:
+            stderr_capture.write(str(exc))
             await _send_stream("exit", exit_code=exit_code)
         except asyncio.CancelledError:
-            if process.returncode is None:
+            cancelled = True
+            if process is not None and process.returncode is None:
                 process.terminate()
                 try:
                     await asyncio.wait_for(process.wait(), timeout=5)
@@ -205,7 +385,8 @@ async def start_internal_execution(
                     process.kill()
                     with contextlib.suppress(Exception):
                         await process.wait()
-            exit_code = process.returncode if process.returncode is not None else 1
+            if process is not None and process.returncode is not None:
+                exit_code = process.returncode
             await _send_stream("cancelled", exit_code=exit_code)
             raise
         finally:
@@ -213,8 +394,11 @@ async def start_internal_execution(
                 heartbeat_task.cancel()
                 with contextlib.suppress(asyncio.CancelledError):
                     await heartbeat_task
+            if slot is not None:
+                await slot.release()
             async with _BACKGROUND_EXECUTION_LOCK:
                 _BACKGROUND_EXECUTIONS.pop(sandbox_job_id, None)
+                _remember_finished_output(sandbox_job_id, session_id, stdout_capture, stderr_capture)
             completion = {
                 "session_id": session_id,
                 "controller_job_id": controller_job_id,
@@ -222,10 +406,10 @@ async def start_internal_execution(
                 "mode_execution_id": request.mode_execution_id,
                 "attempt": request.attempt,
                 "sequence": sequence + 1,
-                "status": "cancelled" if process.returncode is not None and exit_code < 0 else "complete",
+                "status": "cancelled" if cancelled or exit_code < 0 else "complete",
                 "exit_code": exit_code,
-                "stdout": _bounded_text("".join(stdout_chunks), _CALLBACK_OUTPUT_LIMIT),
-                "stderr": _bounded_text("".join(stderr_chunks), _CALLBACK_OUTPUT_LIMIT),
+                "stdout": stdout_capture.tail_text(_CALLBACK_OUTPUT_LIMIT),
+                "stderr": stderr_capture.tail_text(_CALLBACK_OUTPUT_LIMIT),
                 "duration_ms": int((time.monotonic() - started_at) * 1000),
             }
             for retry_index in range(10):
@@ -238,18 +422,9 @@ async def start_internal_execution(
                         break
                     await asyncio.sleep(min(30, 2 ** retry_index))
 
-    task = asyncio.create_task(_run_background(), name=f"sandbox-exec-{sandbox_job_id}")
-    state = _BackgroundExecutionState(
-        process=process,
-        session_id=session_id,
-        mode_execution_id=request.mode_execution_id,
-        controller_job_id=controller_job_id,
-        attempt=request.attempt,
-        started_at_monotonic=time.monotonic(),
-        task=task,
-    )
     async with _BACKGROUND_EXECUTION_LOCK:
         _BACKGROUND_EXECUTIONS[sandbox_job_id] = state
+    state.task = asyncio.create_task(_run_background(), name=f"sandbox-exec-{sandbox_job_id}")
 
     return SandboxExecutionStartResponse(
         sandbox_job_id=sandbox_job_id,
@@ -264,7 +439,7 @@ async def cancel_internal_execution(
     sandbox_job_id: str,
     x_controller_internal_secret: Optional[str] = Header(default=None),
 ) -> Dict[str, str]:
-    if not _is_internal_header_authorized(x_controller_internal_secret):
+    if not _is_internal_secret_valid(x_controller_internal_secret):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
 
     async with _BACKGROUND_EXECUTION_LOCK:
@@ -272,7 +447,11 @@ async def cancel_internal_execution(
     if state is None or state.session_id != session_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Execution not found")
 
-    if state.process.returncode is None:
+    if state.process is None:
+        # Still waiting for a scheduler slot; cancelling the task dequeues it.
+        if state.task is not None:
+            state.task.cancel()
+    elif state.process.returncode is None:
         state.process.terminate()
         try:
             await asyncio.wait_for(state.process.wait(), timeout=5)
@@ -283,14 +462,271 @@ async def cancel_internal_execution(
     return {"sandbox_job_id": sandbox_job_id, "status": "cancelled"}
 
 
-def _is_internal_ws_authorized(secret: Optional[str]) -> bool:
-    expected = get_sandbox_config().controller_internal_ws_secret
-    if not expected:
-        return True
-    return bool(secret and hmac.compare_digest(secret, expected))
+@router.get(
+    "/internal/sessions/{session_id}/executions/{sandbox_job_id}/output",
+    response_model=SandboxExecutionOutputResponse,
+)
+async def read_internal_execution_output(
+    session_id: str,
+    sandbox_job_id: str,
+    stream: str = Query(default="stdout", pattern="^(stdout|stderr)$"),
+    offset: int = Query(default=0, ge=0),
+    length: int = Query(default=_CALLBACK_OUTPUT_LIMIT, ge=1, le=1_048_576),
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> SandboxExecutionOutputResponse:
+    """Read a byte range of a running or recently finished execution's output."""
+    if not _is_internal_secret_valid(x_controller_internal_secret):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    async with _BACKGROUND_EXECUTION_LOCK:
+        state = _BACKGROUND_EXECUTIONS.get(sandbox_job_id)
+        if state is not None:
+            owner, stdout_capture, stderr_capture = state.session_id, state.stdout, state.stderr
+        else:
+            owner, stdout_capture, stderr_capture = _FINISHED_OUTPUTS.get(
+                sandbox_job_id, (None, None, None)
+            )
+    if owner != session_id or stdout_capture is None or stderr_capture is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Execution output not found")
+
+    capture = stdout_capture if stream == "stdout" else stderr_capture
+    served = capture.read_range(offset, length)
+    return SandboxExecutionOutputResponse(
+        sandbox_job_id=sandbox_job_id,
+        stream=stream,
+        offset=served.offset,
+        total_bytes=capture.total_bytes,
+        data=served.data,
+        truncated=served.truncated,
+    )
+
+
+@router.post("/internal/index/query", response_model=CodeIndexQueryResponse)
+async def query_code_index(
+    request: CodeIndexQueryRequest,
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> CodeIndexQueryResponse:
+    """Answer a symbol, import, route or text lookup from the workspace code index."""
+    if not _is_internal_secret_valid(x_controller_internal_secret):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    sandbox_config = get_sandbox_config()
+    if not sandbox_config.code_index_enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Code index is disabled")
+
+    started = time.monotonic()
+    index = get_code_index(_resolve_workspace(request.workspace))
+    ready = await asyncio.to_thread(index.ensure_fresh, sandbox_config.code_index_query_max_age_seconds)
+    if not ready:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Workspace is not checked out")
+    try:
+        result = await asyncio.to_thread(index.query, request.kind, request.term, limit=request.limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    return CodeIndexQueryResponse(**result, duration_ms=int((time.monotonic() - started) * 1000))
+
+
+def _require_internal_header(secret: Optional[str]) -> None:
+    if not _is_internal_secret_valid(secret):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+def _resolve_workspace(workspace: Optional[str]) -> str:
+    try:
+        return resolve_workspace(workspace)
+    except SandboxFileError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+
+def _resolve_file_path(path: str, workspace: Optional[str]):
+    try:
+        return resolve_sandbox_path(path, workspace=workspace)
+    except SandboxFileError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+
+@router.get("/internal/files/read")
+async def read_sandbox_file(
+    path: str = Query(..., min_length=1),
+    offset: int = Query(default=0, ge=0),
+    length: int = Query(default=MAX_READ_BYTES, ge=1, le=MAX_READ_BYTES),
+    workspace: Optional[str] = Query(default=None),
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> Response:
+    """Return a byte range of a workspace file; ``X-File-Size`` carries its full size."""
+    _require_internal_header(x_controller_internal_secret)
+    resolved = _resolve_file_path(path, workspace)
+    try:
+        data, total = await asyncio.to_thread(read_file_range, resolved, offset=offset, length=length)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError) as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found") from exc
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={"X-File-Size": str(total), "X-File-Offset": str(offset)},
+    )
+
+
+@router.put("/internal/files/write", response_model=SandboxFileWriteResponse)
+async def write_sandbox_file(
+    request: Request,
+    path: str = Query(..., min_length=1),
+    workspace: Optional[str] = Query(default=None),
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> SandboxFileWriteResponse:
+    """Atomically replace a file with the request body, creating parent directories."""
+    _require_internal_header(x_controller_internal_secret)
+    resolved = _resolve_file_path(path, workspace)
+    data = await request.body()
+    if len(data) > MAX_WRITE_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+    try:
+        written = await asyncio.to_thread(write_file_atomic, resolved, data)
+    except (IsADirectoryError, NotADirectoryError) as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    return SandboxFileWriteResponse(**written)
+
+
+@router.get("/internal/files/stat", response_model=SandboxFileStatResponse)
+async def stat_sandbox_file(
+    path: str = Query(..., min_length=1),
+    workspace: Optional[str] = Query(default=None),
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> SandboxFileStatResponse:
+    _require_internal_header(x_controller_internal_secret)
+    resolved = _resolve_file_path(path, workspace)
+    return SandboxFileStatResponse(**await asyncio.to_thread(stat_sandbox_path, resolved))
+
+
+@router.get("/internal/files/glob", response_model=SandboxFileGlobResponse)
+async def glob_sandbox_files(
+    pattern: str = Query(..., min_length=1),
+    root: str = Query(default="."),
+    limit: int = Query(default=500, ge=1, le=5000),
+    workspace: Optional[str] = Query(default=None),
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> SandboxFileGlobResponse:
+    _require_internal_header(x_controller_internal_secret)
+    resolved = _resolve_file_path(root, workspace)
+    try:
+        matches, truncated = await asyncio.to_thread(glob_sandbox_paths, resolved, pattern, limit=limit)
+    except SandboxFileError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    return SandboxFileGlobResponse(root=str(resolved), matches=matches, truncated=truncated)
+
+
+@router.post("/internal/files/archive")
+async def stream_sandbox_archive(
+    request: SandboxArchiveRequest,
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    """Stream a ``tar.gz`` of workspace paths; missing paths are skipped."""
+    _require_internal_header(x_controller_internal_secret)
+    workspace = _resolve_workspace(request.workspace)
+    for source_path in request.source_paths:
+        _resolve_file_path(source_path, workspace)
+    return StreamingResponse(
+        iter_archive(request.source_paths, workspace=workspace, archive_prefix=request.archive_prefix),
+        media_type="application/gzip",
+    )
+
+
+def _require_browser_service() -> None:
+    if not get_sandbox_config().browser_service_enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Browser service is disabled")
+
+
+@router.post("/internal/browser/dev-server", response_model=BrowserDevServerResponse)
+async def ensure_browser_dev_server(
+    request: BrowserDevServerRequest,
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> BrowserDevServerResponse:
+    """Start the workspace dev server, or reuse it if nothing it depends on changed."""
+    _require_internal_header(x_controller_internal_secret)
+    _require_browser_service()
+    workspace = _resolve_workspace(request.workspace)
+    cwd = _resolve_file_path(request.cwd or ".", workspace)
+    if not cwd.is_dir():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dev server directory not found")
+    try:
+        result = await get_browser_service().dev_servers.ensure(
+            workspace=workspace,
+            command=request.command,
+            port=request.port,
+            cwd=str(cwd),
+        )
+    except DevServerError as exc:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(exc)) from exc
+    return BrowserDevServerResponse(**result)
+
+
+@router.post("/internal/browser/capture", response_model=BrowserCaptureResponse)
+async def capture_browser_page(
+    request: BrowserCaptureRequest,
+    x_controller_internal_secret: Optional[str] = Header(default=None),
+) -> BrowserCaptureResponse:
+    """Load a page in the pooled browser and save a screenshot with diagnostics."""
+    _require_internal_header(x_controller_internal_secret)
+    _require_browser_service()
+    screenshot_path = _resolve_file_path(request.screenshot_path, request.workspace)
+    try:
+        result = await get_browser_service().browser.capture(
+            url=request.url,
+            screenshot_path=str(screenshot_path),
+            viewport=(request.viewport_width, request.viewport_height),
+            full_page=request.full_page,
+            wait_until=request.wait_until,
+            timeout_seconds=request.timeout_seconds,
+        )
+    except BrowserServiceUnavailable as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc)) from exc
+    except Exception as exc:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Page capture failed: {exc}") from exc
+    return BrowserCaptureResponse(**result)
+
+
+async def maintain_code_index() -> None:
+    """Keep the workspace index warm so the first probe after a clone is fast."""
+
+    sandbox_config = get_sandbox_config()
+    if not sandbox_config.code_index_enabled:
+        return
+    index = get_code_index(sandbox_config.workspace_path)
+    while True:
+        try:
+            await asyncio.to_thread(index.refresh)
+        except Exception:
+            logger.warning("Code index refresh failed", exc_info=True)
+        await asyncio.sleep(sandbox_config.code_index_refresh_seconds)
+
+
+def _remember_finished_output(
+    sandbox_job_id: str,
+    session_id: str,
+    stdout_capture: BoundedOutputCapture,
+    stderr_capture: BoundedOutputCapture,
+) -> None:
+    stdout_capture.finish()
+    stderr_capture.finish()
+    _FINISHED_OUTPUTS[sandbox_job_id] = (session_id, stdout_capture, stderr_capture)
+    while len(_FINISHED_OUTPUTS) > _FINISHED_OUTPUT_LIMIT:
+        _, (_, old_stdout, old_stderr) = _FINISHED_OUTPUTS.popitem(last=False)
+        old_stdout.close()
+        old_stderr.close()
 
 
-def _is_internal_header_authorized(secret: Optional[str]) -> bool:
+def _scheduler_exclusive_key(session_id: str, job_class: str) -> Optional[str]:
+    if job_class == JOB_CLASS_AGENT and session_id:
+        return f"{session_id}:{JOB_CLASS_AGENT}"
+    return None
+
+
+def _requested_job_class(payload: Dict[str, Any]) -> str:
+    job_class = str(payload.get("job_class") or JOB_CLASS_AGENT)
+    return job_class if job_class in JOB_CLASSES else JOB_CLASS_AGENT
+
+
+def _is_internal_secret_valid(secret: Optional[str]) -> bool:
     expected = get_sandbox_config().controller_internal_ws_secret
     if not expected:
         return True
@@ -299,7 +735,10 @@ def _is_internal_header_authorized(secret: Optional[str]) -> bool:
 
 def _callback_headers() -> Dict[str, str]:
     secret = get_sandbox_config().controller_callback_secret
-    return {"X-Controller-Callback-Secret": secret} if secret else {}
+    headers = trace_headers()
+    if secret:
+        headers["X-Controller-Callback-Secret"] = secret
+    return headers
 
 
 def _bounded_text(value: str, limit: int) -> str:
@@ -344,7 +783,7 @@ async def websocket_internal_exec(
     secret: Optional[str] = Query(default=None),
 ) -> None:
     """Internal controller-only command execution websocket."""
-    if not _is_internal_ws_authorized(secret):
+    if not _is_internal_secret_valid(secret):
         await websocket.close(code=4403, reason="forbidden")
         return
 
@@ -357,6 +796,8 @@ async def websocket_internal_exec(
     )
 
     process: Optional[asyncio.subprocess.Process] = None
+    slot: Optional[SchedulerSlot] = None
+    launch_task: Optional[asyncio.Task[None]] = None
     stream_tasks: list[asyncio.Task[Any]] = []
     wait_task: Optional[asyncio.Task[Any]] = None
     connection_id = id(websocket)
@@ -402,41 +843,71 @@ async def websocket_internal_exec(
         stream_tasks = []
         wait_task = None
 
-    async def _terminate_process() -> None:
-        nonlocal process, owns_process
-        if process is None:
-            return
-        if process.returncode is None:
-            process.terminate()
-            try:
-                await asyncio.wait_for(process.wait(), timeout=5)
-            except asyncio.TimeoutError:
-                process.kill()
-                with contextlib.suppress(Exception):
-                    await process.wait()
-        process = None
+    async def _unregister(target: asyncio.subprocess.Process) -> None:
         async with _SESSION_EXECUTION_LOCK:
-            current = _SESSION_EXECUTIONS.get(session_id)
-            if current and current.owner_connection_id == connection_id:
+            executions = _SESSION_EXECUTIONS.get(session_id, {})
+            current = executions.get(connection_id)
+            if current is not None and current.process is target:
+                executions.pop(connection_id, None)
+            if not executions:
                 _SESSION_EXECUTIONS.pop(session_id, None)
+
+    async def _terminate_process() -> None:
+        nonlocal process, owns_process, launch_task, slot
+        if launch_task is not None and not launch_task.done():
+            launch_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await launch_task
+        launch_task = None
+        if process is not None:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    with contextlib.suppress(Exception):
+                        await process.wait()
+            await _unregister(process)
+        process = None
         owns_process = False
         await _clear_tasks()
+        if slot is not None:
+            await slot.release()
+            slot = None
+
+    async def _launch_process(
+        command: str,
+        cwd: Optional[str],
+        env: Dict[str, Any],
+        job_class: str,
+    ) -> None:
+        nonlocal process, stream_tasks, wait_task, owns_process, slot
 
-    async def _launch_process(command: str, cwd: Optional[str], env: Dict[str, Any]) -> None:
-        nonlocal process, stream_tasks, wait_task, owns_process
-        await _terminate_process()
+        async def _on_queued(position: int) -> None:
+            await _safe_send(
+                WSMessageType.SANDBOX_STREAM,
+                {
+                    "stream": "sandbox",
+                    "event": "queued",
+                    "queue_position": position,
+                    "job_class": job_class,
+                },
+            )
 
-        async with _SESSION_EXECUTION_LOCK:
-            existing = _SESSION_EXECUTIONS.get(session_id)
-            if existing and existing.process.returncode is None:
-                await _safe_send(
-                    WSMessageType.ERROR,
-                    {
-                        "message": "A sandbox command is already running for this session",
-                        "code": "EXEC_ALREADY_RUNNING",
-                    },
-                )
-                return
+        try:
+            granted = await get_sandbox_job_scheduler().acquire(
+                job_class,
+                exclusive_key=_scheduler_exclusive_key(session_id, job_class),
+                on_queued=_on_queued,
+            )
+        except SchedulerQueueFull as exc:
+            await _safe_send(
+                WSMessageType.ERROR,
+                {"message": str(exc), "code": "EXEC_QUEUE_FULL"},
+            )
+            return
+        slot = granted
 
         resolved_cwd = cwd or get_sandbox_config().workspace_path
         if resolved_cwd and not os.path.isdir(resolved_cwd):
@@ -447,19 +918,29 @@ async def websocket_internal_exec(
             if key:
                 merged_env[str(key)] = str(value)
 
-        process = await asyncio.create_subprocess_exec(
-            "bash",
-            "-lc",
-            command,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=resolved_cwd,
-            env=merged_env,
-        )
+        try:
+            started = await asyncio.create_subprocess_exec(
+                "bash",
+                "-lc",
+                command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=resolved_cwd,
+                env=merged_env,
+            )
+        except Exception as exc:
+            await granted.release()
+            slot = None
+            await _safe_send(
+                WSMessageType.ERROR,
+                {"message": f"Failed to start command: {exc}", "code": "EXEC_START_FAILED"},
+            )
+            return
+        process = started
         async with _SESSION_EXECUTION_LOCK:
-            _SESSION_EXECUTIONS[session_id] = _SessionExecutionState(
-                process=process,
+            _SESSION_EXECUTIONS.setdefault(session_id, {})[connection_id] = _SessionExecutionState(
+                process=started,
                 owner_connection_id=connection_id,
             )
         owns_process = True
@@ -469,27 +950,22 @@ async def websocket_internal_exec(
             {
                 "stream": "sandbox",
                 "event": "start",
-                "pid": process.pid,
+                "pid": started.pid,
                 "command": command,
+                "job_class": job_class,
+                "queued_ms": int(granted.waited_seconds * 1000),
             },
         )
 
         stream_tasks = [
-            asyncio.create_task(_stream_reader(process.stdout, "stdout")),
-            asyncio.create_task(_stream_reader(process.stderr, "stderr")),
+            asyncio.create_task(_stream_reader(started.stdout, "stdout")),
+            asyncio.create_task(_stream_reader(started.stderr, "stderr")),
         ]
 
         async def _wait_for_exit() -> None:
-            assert process is not None
-            exit_code = await process.wait()
-            async with _SESSION_EXECUTION_LOCK:
-                current = _SESSION_EXECUTIONS.get(session_id)
-                if (
-                    current
-                    and current.owner_connection_id == connection_id
-                    and current.process is process
-                ):
-                    _SESSION_EXECUTIONS.pop(session_id, None)
+            exit_code = await started.wait()
+            await _unregister(started)
+            await granted.release()
             await _safe_send(
                 WSMessageType.SANDBOX_STREAM,
                 {
@@ -531,7 +1007,12 @@ async def websocket_internal_exec(
                 if not isinstance(env, dict):
                     env = {}
 
-                await _launch_process(command, payload.get("cwd"), env)
+                await _terminate_process()
+                # Launch in a task so exec.cancel is still read while queued.
+                launch_task = asyncio.create_task(
+                    _launch_process(command, payload.get("cwd"), env, _requested_job_class(payload)),
+                    name=f"sandbox-exec-launch-{session_id}",
+                )
                 continue
 
             if msg_type == WSMessageType.EXEC_STDIN.value:
@@ -549,30 +1030,32 @@ async def websocket_internal_exec(
                 continue
 
             if msg_type == WSMessageType.EXEC_CANCEL.value:
-                active_state: Optional[_SessionExecutionState] = None
-                async with _SESSION_EXECUTION_LOCK:
-                    current = _SESSION_EXECUTIONS.get(session_id)
-                    if current and current.process.returncode is None:
-                        active_state = current
-
-                if active_state is None:
-                    await _safe_send(
-                        WSMessageType.ERROR,
-                        {"message": "No active process to cancel", "code": "EXEC_NOT_RUNNING"},
-                    )
-                    continue
-
-                if active_state.owner_connection_id == connection_id:
+                own_pending = launch_task is not None and not launch_task.done()
+                if owns_process or own_pending:
                     await _terminate_process()
                 else:
-                    active_process = active_state.process
-                    active_process.terminate()
-                    try:
-                        await asyncio.wait_for(active_process.wait(), timeout=5)
-                    except asyncio.TimeoutError:
-                        active_process.kill()
-                        with contextlib.suppress(Exception):
-                            await active_process.wait()
+                    target_pid = payload.get("pid")
+                    async with _SESSION_EXECUTION_LOCK:
+                        others = [
+                            state.process
+                            for state in _SESSION_EXECUTIONS.get(session_id, {}).values()
+                            if state.process.returncode is None
+                            and (target_pid is None or state.process.pid == target_pid)
+                        ]
+                    if not others:
+                        await _safe_send(
+                            WSMessageType.ERROR,
+                            {"message": "No active process to cancel", "code": "EXEC_NOT_RUNNING"},
+                        )
+                        continue
+                    for active_process in others:
+                        active_process.terminate()
+                        try:
+                            await asyncio.wait_for(active_process.wait(), timeout=5)
+                        except asyncio.TimeoutError:
+                            active_process.kill()
+                            with contextlib.suppress(Exception):
+                                await active_process.wait()
 
                 await _safe_send(
                     WSMessageType.SANDBOX_STREAM,
@@ -587,7 +1070,364 @@ async def websocket_internal_exec(
     except WebSocketDisconnect:
         pass
     finally:
-        if owns_process:
-            await _terminate_process()
+        await _terminate_process()
+        with contextlib.suppress(Exception):
+            await websocket.close()
+
+
+@dataclass
+class _MuxJob:
+    job_id: str
+    session_id: str
+    command: str
+    cwd: Optional[str]
+    env: Dict[str, str]
+    condition: asyncio.Condition
+    events: list[Dict[str, Any]]
+    job_class: str = JOB_CLASS_AGENT
+    process: Optional[asyncio.subprocess.Process] = None
+    next_sequence: int = 1
+    acked_sequence: int = 0
+    finished: bool = False
+    finished_at: Optional[float] = None
+    attached: int = 0
+    detached_at: Optional[float] = None
+    task: Optional[asyncio.Task[None]] = None
+
+
+_MUX_JOBS: dict[str, _MuxJob] = {}
+_MUX_JOBS_LOCK = asyncio.Lock()
+_MUX_WINDOW_EVENTS = 256
+_MUX_RETENTION_SECONDS = 300.0
+
+
+async def _mux_emit(job: _MuxJob, event: Dict[str, Any]) -> None:
+    async with job.condition:
+        event["job_id"] = job.job_id
+        event["sequence"] = job.next_sequence
+        job.next_sequence += 1
+        job.events.append(event)
+        job.condition.notify_all()
+
+
+async def _mux_wait_for_credit(job: _MuxJob) -> None:
+    async with job.condition:
+        await job.condition.wait_for(
+            lambda: (job.next_sequence - 1) - job.acked_sequence < _MUX_WINDOW_EVENTS
+        )
+
+
+async def _mux_ack(job: _MuxJob, sequence: int) -> None:
+    async with job.condition:
+        if sequence <= job.acked_sequence:
+            return
+        job.acked_sequence = min(sequence, job.next_sequence - 1)
+        job.events = [event for event in job.events if event["sequence"] > job.acked_sequence]
+        job.condition.notify_all()
+
+
+async def _mux_run_job(job: _MuxJob) -> None:
+    async def _reader(stream: Optional[asyncio.StreamReader], event_name: str) -> None:
+        if stream is None:
+            return
+        while True:
+            await _mux_wait_for_credit(job)
+            chunk = await stream.read(2048)
+            if not chunk:
+                return
+            await _mux_emit(
+                job,
+                {
+                    "stream": "sandbox",
+                    "event": event_name,
+                    "data": chunk.decode("utf-8", errors="replace"),
+                },
+            )
+
+    async def _on_queued(position: int) -> None:
+        await _mux_emit(
+            job,
+            {
+                "stream": "sandbox",
+                "event": "queued",
+                "queue_position": position,
+                "job_class": job.job_class,
+            },
+        )
+
+    slot: Optional[SchedulerSlot] = None
+    exit_code = 1
+    try:
+        slot = await get_sandbox_job_scheduler().acquire(
+            job.job_class,
+            exclusive_key=_scheduler_exclusive_key(job.session_id, job.job_class),
+            on_queued=_on_queued,
+        )
+        process = await asyncio.create_subprocess_exec(
+            "bash",
+            "-lc",
+            job.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=job.cwd,
+            env=job.env,
+        )
+        job.process = process
+        await _mux_emit(
+            job,
+            {
+                "stream": "sandbox",
+                "event": "start",
+                "pid": process.pid,
+                "job_class": job.job_class,
+                "queued_ms": int(slot.waited_seconds * 1000),
+            },
+        )
+        await asyncio.gather(_reader(process.stdout, "stdout"), _reader(process.stderr, "stderr"))
+        exit_code = await process.wait()
+    except asyncio.CancelledError:
+        if job.process is not None and job.process.returncode is None:
+            job.process.kill()
+            with contextlib.suppress(Exception):
+                await job.process.wait()
+        raise
+    except Exception as exc:
+        logger.warning("Multiplexed job %s failed: %s", job.job_id, exc)
+        await _mux_emit(job, {"stream": "sandbox", "event": "stderr", "data": f"{exc}\n"})
+        await _mux_terminate(job)
+        if job.process is not None and job.process.returncode is not None:
+            exit_code = job.process.returncode
+    finally:
+        if slot is not None:
+            await slot.release()
+    job.finished = True
+    job.finished_at = time.monotonic()
+    await _mux_emit(job, {"stream": "sandbox", "event": "exit", "exit_code": exit_code})
+
+
+async def _mux_forward(
+    job: _MuxJob,
+    after_sequence: int,
+    send: Any,
+) -> None:
+    last_sent = after_sequence
+    job.attached += 1
+    try:
+        while True:
+            async with job.condition:
+                last_sent = max(last_sent, job.acked_sequence)
+                await job.condition.wait_for(lambda: job.next_sequence - 1 > last_sent)
+                pending = [event for event in job.events if event["sequence"] > last_sent]
+            for event in pending:
+                await send(WSMessageType.SANDBOX_STREAM, event)
+                last_sent = event["sequence"]
+                if event.get("event") == "exit":
+                    return
+    finally:
+        job.attached -= 1
+        if job.attached <= 0:
+            job.detached_at = time.monotonic()
+
+
+async def _mux_prune_jobs() -> None:
+    now = time.monotonic()
+    async with _MUX_JOBS_LOCK:
+        for job_id, job in list(_MUX_JOBS.items()):
+            if job.attached > 0:
+                continue
+            idle_since = job.detached_at or job.finished_at
+            if idle_since is None or now - idle_since < _MUX_RETENTION_SECONDS:
+                continue
+            if not job.finished and job.task is not None:
+                job.task.cancel()
+            _MUX_JOBS.pop(job_id, None)
+
+
+async def _mux_terminate(job: _MuxJob) -> None:
+    if job.process is None:
+        if job.task is not None and not job.finished and job.task is not asyncio.current_task():
+            job.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await job.task
+            job.finished = True
+            job.finished_at = time.monotonic()
+            await _mux_emit(job, {"stream": "sandbox", "event": "exit", "exit_code": -15})
+        return
+    if job.process.returncode is not None:
+        return
+    job.process.terminate()
+    try:
+        await asyncio.wait_for(job.process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        job.process.kill()
+        with contextlib.suppress(Exception):
+            await job.process.wait()
+
+
+@router.websocket("/internal/ws/mux")
+async def websocket_internal_mux(
+    websocket: WebSocket,
+    secret: Optional[str] = Query(default=None),
+) -> None:
+    """Long-lived controller channel carrying many job streams tagged by job id.
+
+    Jobs outlive the connection: a reconnecting controller sends ``exec.resume``
+    with the last sequence it processed and receives the remaining events.
+    Each job may have at most ``_MUX_WINDOW_EVENTS`` unacknowledged events in
+    flight; beyond that its output pipes stop being read until ``exec.ack``.
+    """
+    if not _is_internal_secret_valid(secret):
+        await websocket.close(code=4403, reason="forbidden")
+        return
+
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    forwarders: dict[str, asyncio.Task[None]] = {}
+
+    async def _send(msg_type: WSMessageType, payload: Dict[str, Any]) -> None:
+        async with send_lock:
+            with contextlib.suppress(Exception):
+                await websocket.send_text(build_envelope(msg_type, payload))
+
+    def _attach(job: _MuxJob, after_sequence: int) -> None:
+        previous = forwarders.pop(job.job_id, None)
+        if previous is not None:
+            previous.cancel()
+        forwarders[job.job_id] = asyncio.create_task(
+            _mux_forward(job, after_sequence, _send),
+            name=f"sandbox-mux-forward-{job.job_id}",
+        )
+
+    await _send(
+        WSMessageType.STATUS,
+        {"status": "connected", "channel": "internal_mux", "window": _MUX_WINDOW_EVENTS},
+    )
+
+    try:
+        while True:
+            raw_message = await websocket.receive_text()
+            try:
+                message = json.loads(raw_message)
+            except json.JSONDecodeError:
+                await _send(
+                    WSMessageType.ERROR,
+                    {"message": "Invalid JSON", "code": "WS_MESSAGE_PARSE_ERROR"},
+                )
+                continue
+
+            msg_type = message.get("type")
+            payload = message.get("payload", {}) or {}
+            if not isinstance(payload, dict):
+                payload = {}
+            job_id = str(payload.get("job_id") or "").strip()
+            if not job_id:
+                await _send(
+                    WSMessageType.ERROR,
+                    {"message": "Missing job_id", "code": "EXEC_JOB_ID_MISSING"},
+                )
+                continue
+
+            async with _MUX_JOBS_LOCK:
+                job = _MUX_JOBS.get(job_id)
+
+            if msg_type == WSMessageType.EXEC_START.value:
+                if job is not None:
+                    _attach(job, int(payload.get("after_sequence") or 0))
+                    continue
+                command = str(payload.get("command") or "").strip()
+                if not command:
+                    await _send(
+                        WSMessageType.ERROR,
+                        {
+                            "job_id": job_id,
+                            "message": "Missing command for exec.start",
+                            "code": "EXEC_COMMAND_MISSING",
+                        },
+                    )
+                    continue
+                env = payload.get("env", {})
+                if not isinstance(env, dict):
+                    env = {}
+                resolved_cwd = payload.get("cwd") or get_sandbox_config().workspace_path
+                if resolved_cwd and not os.path.isdir(resolved_cwd):
+                    resolved_cwd = None
+                merged_env = os.environ.copy()
+                for key, value in env.items():
+                    if key:
+                        merged_env[str(key)] = str(value)
+
+                job_class = _requested_job_class(payload)
+                if get_sandbox_job_scheduler().queue_full(job_class):
+                    await _send(
+                        WSMessageType.ERROR,
+                        {
+                            "job_id": job_id,
+                            "message": f"The sandbox {job_class} queue is full",
+                            "code": "EXEC_QUEUE_FULL",
+                        },
+                    )
+                    continue
+
+                await _mux_prune_jobs()
+                job = _MuxJob(
+                    job_id=job_id,
+                    session_id=str(payload.get("session_id") or ""),
+                    command=command,
+                    cwd=resolved_cwd,
+                    env=merged_env,
+                    condition=asyncio.Condition(),
+                    events=[],
+                    job_class=job_class,
+                )
+                job.task = asyncio.create_task(_mux_run_job(job), name=f"sandbox-mux-job-{job_id}")
+                async with _MUX_JOBS_LOCK:
+                    _MUX_JOBS[job_id] = job
+                _attach(job, 0)
+                continue
+
+            if job is None:
+                await _send(
+                    WSMessageType.ERROR,
+                    {"job_id": job_id, "message": "Unknown job", "code": "EXEC_NOT_FOUND"},
+                )
+                continue
+
+            if msg_type == WSMessageType.EXEC_RESUME.value:
+                _attach(job, int(payload.get("after_sequence") or 0))
+            elif msg_type == WSMessageType.EXEC_ACK.value:
+                await _mux_ack(job, int(payload.get("sequence") or 0))
+                if job.finished and job.acked_sequence >= job.next_sequence - 1:
+                    async with _MUX_JOBS_LOCK:
+                        _MUX_JOBS.pop(job_id, None)
+            elif msg_type == WSMessageType.EXEC_STDIN.value:
+                data = str(payload.get("data") or "")
+                if (
+                    data
+                    and job.process is not None
+                    and job.process.stdin is not None
+                    and job.process.returncode is None
+                ):
+                    job.process.stdin.write(data.encode("utf-8"))
+                    await job.process.stdin.drain()
+            elif msg_type == WSMessageType.EXEC_CANCEL.value:
+                await _mux_terminate(job)
+            else:
+                await _send(
+                    WSMessageType.ERROR,
+                    {
+                        "job_id": job_id,
+                        "message": f"Unknown message type: {msg_type}",
+                        "code": "EXEC_UNKNOWN_MESSAGE",
+                    },
+                )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in forwarders.values():
+            task.cancel()
+        for task in forwarders.values():
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
         with contextlib.suppress(Exception):
             await websocket.close()
@@ -0,0 +1,322 @@
+"""Slot-based admission for commands started on the sandbox server.
+
+Every command belongs to a job class with its own concurrency limit. Work
+beyond the limit waits in a FIFO queue per class instead of being rejected,
+and waiters learn their queue position through a callback. Agent runs are
+also exclusive per session, since two agents editing one workspace would
+trample each other; probes and file ops may overlap them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from yudai.config import get_sandbox_config
+
+logger = logging.getLogger(__name__)
+
+JOB_CLASS_AGENT = "agent"
+JOB_CLASS_PROBE = "probe"
+JOB_CLASS_FILE_OP = "file_op"
+JOB_CLASSES: tuple[str, ...] = (JOB_CLASS_AGENT, JOB_CLASS_PROBE, JOB_CLASS_FILE_OP)
+JOB_CLASS_PATTERN = "^(" + "|".join(JOB_CLASSES) + ")$"
+
+QueuedCallback = Callable[[int], Awaitable[None]]
+
+
+class SchedulerQueueFull(RuntimeError):
+    """Raised when a job class already has ``max_queue`` waiters."""
+
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    memory_available_bytes: Optional[int] = None
+    load_per_cpu: Optional[float] = None
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpu_count(cgroup_root: str) -> Optional[float]:
+    raw = _read_text(os.path.join(cgroup_root, "cpu.max"))
+    if not raw:
+        return None
+    quota, _, period = raw.partition(" ")
+    if quota == "max":
+        return None
+    try:
+        return max(int(quota) / int(period or "100000"), 0.01)
+    except ValueError:
+        return None
+
+
+def read_resource_snapshot(
+    *,
+    cgroup_root: str = "/sys/fs/cgroup",
+    proc_root: str = "/proc",
+) -> ResourceSnapshot:
+    """Read free memory and CPU load, preferring cgroup v2 limits over host totals."""
+
+    memory_available: Optional[int] = None
+    limit = _read_text(os.path.join(cgroup_root, "memory.max"))
+    current = _read_text(os.path.join(cgroup_root, "memory.current"))
+    if limit and limit != "max" and current:
+        try:
+            memory_available = max(int(limit) - int(current), 0)
+        except ValueError:
+            memory_available = None
+    if memory_available is None:
+        for line in (_read_text(os.path.join(proc_root, "meminfo")) or "").splitlines():
+            if line.startswith("MemAvailable:"):
+                try:
+                    memory_available = int(line.split()[1]) * 1024
+                except (IndexError, ValueError):
+                    pass
+                break
+
+    load_per_cpu: Optional[float] = None
+    loadavg = _read_text(os.path.join(proc_root, "loadavg"))
+    if loadavg:
+        try:
+            load = float(loadavg.split()[0])
+        except (IndexError, ValueError):
+            load = None
+        if load is not None:
+            cpus = _cgroup_cpu_count(cgroup_root) or float(os.cpu_count() or 1)
+            load_per_cpu = load / cpus
+    return ResourceSnapshot(memory_available_bytes=memory_available, load_per_cpu=load_per_cpu)
+
+
+@dataclass
+class _Ticket:
+    job_class: str
+    exclusive_key: Optional[str]
+    on_queued: Optional[QueuedCallback] = None
+    position: int = 0
+    notify_task: Optional[asyncio.Task[None]] = None
+
+
+@dataclass
+class SchedulerSlot:
+    """A granted slot; ``release`` is idempotent."""
+
+    scheduler: "SandboxJobScheduler"
+    job_class: str
+    exclusive_key: Optional[str]
+    waited_seconds: float
+    released: bool = field(default=False)
+
+    async def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        await self.scheduler._release(self)
+
+
+class SandboxJobScheduler:
+    """Per-class concurrency slots with FIFO queues and resource admission.
+
+    Resource checks only gate a job while something else is running, so a
+    busy host can slow the queue down but never stall it completely.
+    """
+
+    def __init__(
+        self,
+        *,
+        slots: Dict[str, int],
+        max_queue: int = 32,
+        min_free_memory_bytes: int = 0,
+        max_load_per_cpu: float = 0.0,
+        recheck_seconds: float = 1.0,
+        resource_reader: Callable[[], ResourceSnapshot] = read_resource_snapshot,
+    ) -> None:
+        self.slots = {job_class: max(1, int(slots.get(job_class, 1))) for job_class in JOB_CLASSES}
+        self.max_queue = max(0, max_queue)
+        self.min_free_memory_bytes = max(0, min_free_memory_bytes)
+        self.max_load_per_cpu = max(0.0, max_load_per_cpu)
+        self.recheck_seconds = recheck_seconds
+        self._resource_reader = resource_reader
+        self._condition = asyncio.Condition()
+        self._running: Dict[str, int] = {job_class: 0 for job_class in JOB_CLASSES}
+        self._exclusive: Set[str] = set()
+        self._queues: Dict[str, Deque[_Ticket]] = {job_class: deque() for job_class in JOB_CLASSES}
+
+    @classmethod
+    def from_config(cls) -> "SandboxJobScheduler":
+        config = get_sandbox_config()
+        return cls(
+            slots={
+                JOB_CLASS_AGENT: config.scheduler_agent_slots,
+                JOB_CLASS_PROBE: config.scheduler_probe_slots,
+                JOB_CLASS_FILE_OP: config.scheduler_file_op_slots,
+            },
+            max_queue=config.scheduler_max_queue,
+            min_free_memory_bytes=config.scheduler_min_free_memory_mb * 1024 * 1024,
+            max_load_per_cpu=config.scheduler_max_load_per_cpu,
+        )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            job_class: {
+                "slots": self.slots[job_class],
+                "running": self._running[job_class],
+                "queued": len(self._queues[job_class]),
+            }
+            for job_class in JOB_CLASSES
+        }
+
+    def queue_full(self, job_class: str) -> bool:
+        queue = self._queues.get(job_class)
+        if queue is None:
+            return False
+        return len(queue) >= self.max_queue and self._running[job_class] >= self.slots[job_class]
+
+    async def acquire(
+        self,
+        job_class: str,
+        *,
+        exclusive_key: Optional[str] = None,
+        on_queued: Optional[QueuedCallback] = None,
+    ) -> SchedulerSlot:
+        """Wait for a slot of ``job_class``; ``on_queued`` gets 1-based positions."""
+
+        if job_class not in self.slots:
+            raise ValueError(f"Unknown sandbox job class: {job_class}")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ticket = _Ticket(job_class=job_class, exclusive_key=exclusive_key, on_queued=on_queued)
+        queue = self._queues[job_class]
+        async with self._condition:
+            if not self._admissible(ticket, ahead=tuple(queue)):
+                if len(queue) >= self.max_queue:
+                    raise SchedulerQueueFull(f"Sandbox {job_class} queue is full")
+            queue.append(ticket)
+            try:
+                while True:
+                    ahead = tuple(queue)[: queue.index(ticket)]
+                    if self._admissible(ticket, ahead=ahead):
+                        break
+                    position = queue.index(ticket) + 1
+                    if position != ticket.position:
+                        ticket.position = position
+                        self._notify_position(ticket)
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._condition.wait(), timeout=self.recheck_seconds)
+            except BaseException:
+                with contextlib.suppress(ValueError):
+                    queue.remove(ticket)
+                self._condition.notify_all()
+                raise
+            queue.remove(ticket)
+            self._running[job_class] += 1
+            if exclusive_key:
+                self._exclusive.add(exclusive_key)
+            self._condition.notify_all()
+        return SchedulerSlot(
+            scheduler=self,
+            job_class=job_class,
+            exclusive_key=exclusive_key,
+            waited_seconds=loop.time() - started,
+        )
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        job_class: str,
+        *,
+        exclusive_key: Optional[str] = None,
+        on_queued: Optional[QueuedCallback] = None,
+    ) -> AsyncIterator[SchedulerSlot]:
+        granted = await self.acquire(job_class, exclusive_key=exclusive_key, on_queued=on_queued)
+        try:
+            yield granted
+        finally:
+            await granted.release()
+
+    async def _release(self, granted: SchedulerSlot) -> None:
+        async with self._condition:
+            self._running[granted.job_class] = max(0, self._running[granted.job_class] - 1)
+            if granted.exclusive_key:
+                self._exclusive.discard(granted.exclusive_key)
+            self._condition.notify_all()
+
+    def _admissible(self, ticket: _Ticket, *, ahead: tuple[_Ticket, ...]) -> bool:
+        if ticket.exclusive_key and ticket.exclusive_key in self._exclusive:
+            return False
+        # FIFO within a class: only waiters blocked on their session's
+        # exclusive key may be overtaken.
+        for earlier in ahead:
+            if not (earlier.exclusive_key and earlier.exclusive_key in self._exclusive):
+                return False
+        if self._running[ticket.job_class] >= self.slots[ticket.job_class]:
+            return False
+        if any(self._running.values()):
+            return self._resources_allow()
+        return True
+
+    def _resources_allow(self) -> bool:
+        if not self.min_free_memory_bytes and not self.max_load_per_cpu:
+            return True
+        try:
+            snapshot = self._resource_reader()
+        except Exception:
+            logger.debug("Sandbox resource probe failed", exc_info=True)
+            return True
+        if (
+            self.min_free_memory_bytes
+            and snapshot.memory_available_bytes is not None
+            and snapshot.memory_available_bytes < self.min_free_memory_bytes
+        ):
+            return False
+        if (
+            self.max_load_per_cpu
+            and snapshot.load_per_cpu is not None
+            and snapshot.load_per_cpu > self.max_load_per_cpu
+        ):
+            return False
+        return True
+
+    @staticmethod
+    def _notify_position(ticket: _Ticket) -> None:
+        # Callbacks may do network I/O, so they run outside the scheduler
+        # lock, chained per ticket to keep positions in order.
+        if ticket.on_queued is None:
+            return
+        ticket.notify_task = asyncio.create_task(
+            _deliver_position(ticket.on_queued, ticket.position, ticket.notify_task)
+        )
+
+
+async def _deliver_position(
+    callback: QueuedCallback,
+    position: int,
+    previous: Optional[asyncio.Task[None]],
+) -> None:
+    if previous is not None:
+        with contextlib.suppress(Exception):
+            await previous
+    try:
+        await callback(position)
+    except Exception:
+        logger.debug("Queue position callback failed", exc_info=True)
+
+
+_sandbox_job_scheduler_singleton: Optional[SandboxJobScheduler] = None
+
+
+def get_sandbox_job_scheduler() -> SandboxJobScheduler:
+    global _sandbox_job_scheduler_singleton
+    if _sandbox_job_scheduler_singleton is None:
+        _sandbox_job_scheduler_singleton = SandboxJobScheduler.from_config()
+    return _sandbox_job_scheduler_singleton
@@ -5,8 +5,10 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import json
+import logging
 import time
-from dataclasses import dataclass
+import uuid
+from dataclasses import dataclass, field
 from typing import Any, Awaitable, Callable, Dict, Optional
 from urllib.parse import urlencode
 
@@ -14,8 +16,12 @@ import websockets
 
 from yudai.config import get_sandbox_config
 
+from .output_capture import BoundedOutputCapture
+from .sandbox_scheduler import JOB_CLASS_AGENT
 from .ws_protocol import WSMessageType
 
+logger = logging.getLogger(__name__)
+
 SandboxEventCallback = Callable[[Dict[str, Any]], Awaitable[None]]
 
 
@@ -36,6 +42,245 @@ def to_websocket_url(base_url: str) -> str:
     return normalized
 
 
+def _internal_query_suffix() -> str:
+    internal_secret = get_sandbox_config().controller_internal_ws_secret
+    return "?" + urlencode({"secret": internal_secret}) if internal_secret else ""
+
+
+class SandboxChannelUnavailable(RuntimeError):
+    """Raised when the multiplexed control channel cannot be opened."""
+
+
+@dataclass
+class _ChannelJob:
+    queue: "asyncio.Queue[Dict[str, Any]]" = field(default_factory=asyncio.Queue)
+    last_sequence: int = 0
+    unacked: int = 0
+
+
+class SandboxControlChannel:
+    """One long-lived websocket per sandbox carrying many command streams.
+
+    Every job is tagged with a job id. Events carry per-job sequence numbers,
+    which are acknowledged every ``ACK_EVERY`` events so the sandbox can apply
+    its send window. If the socket drops while jobs are active, the channel
+    reconnects and sends ``exec.resume`` with the last sequence seen for each
+    job, and duplicates are discarded.
+    """
+
+    ACK_EVERY = 32
+    RECONNECT_ATTEMPTS = 5
+    OPEN_TIMEOUT_SECONDS = 10
+
+    def __init__(self, tunnel_url: str) -> None:
+        self.tunnel_url = tunnel_url.rstrip("/")
+        self.url = to_websocket_url(self.tunnel_url) + "/internal/ws/mux" + _internal_query_suffix()
+        self._websocket: Any = None
+        self._reader_task: Optional[asyncio.Task[None]] = None
+        self._connect_lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+        self._jobs: Dict[str, _ChannelJob] = {}
+        self._closed = False
+
+    @property
+    def active_jobs(self) -> int:
+        return len(self._jobs)
+
+    async def run_command(
+        self,
+        *,
+        session_public_id: str,
+        command: str,
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout_seconds: int = 1800,
+        on_event: Optional[SandboxEventCallback] = None,
+        capture_stdout: bool = True,
+        capture_stderr: bool = True,
+        job_class: str = JOB_CLASS_AGENT,
+    ) -> SandboxCommandResult:
+        try:
+            await self._connection()
+        except Exception as exc:
+            raise SandboxChannelUnavailable(str(exc)) from exc
+
+        job_id = f"job_{uuid.uuid4().hex[:24]}"
+        job = _ChannelJob()
+        self._jobs[job_id] = job
+        started_at = time.monotonic()
+        stdout_capture = BoundedOutputCapture("stdout")
+        stderr_capture = BoundedOutputCapture("stderr")
+        exit_code: Optional[int] = None
+
+        try:
+            await self._send(
+                WSMessageType.EXEC_START,
+                {
+                    "job_id": job_id,
+                    "session_id": session_public_id,
+                    "command": command,
+                    "cwd": cwd,
+                    "env": env or {},
+                    "job_class": job_class,
+                },
+            )
+            while True:
+                remaining = max(timeout_seconds - int(time.monotonic() - started_at), 1)
+                event = await asyncio.wait_for(job.queue.get(), timeout=remaining)
+                event_type = event.get("type")
+                payload = event.get("payload", {}) or {}
+
+                if event_type == WSMessageType.ERROR.value:
+                    raise RuntimeError(str(payload.get("message") or "Sandbox execution failed"))
+                if event_type != WSMessageType.SANDBOX_STREAM.value:
+                    continue
+
+                sequence = int(payload.get("sequence") or 0)
+                if sequence and sequence <= job.last_sequence:
+                    continue
+                job.last_sequence = max(job.last_sequence, sequence)
+                job.unacked += 1
+
+                if on_event is not None:
+                    await on_event(event)
+
+                chunk = payload.get("data")
+                stream_event = payload.get("event")
+                if stream_event == "stdout" and isinstance(chunk, str) and capture_stdout:
+                    stdout_capture.write(chunk)
+                elif stream_event == "stderr" and isinstance(chunk, str) and capture_stderr:
+                    stderr_capture.write(chunk)
+                elif stream_event == "exit":
+                    exit_code = int(payload.get("exit_code") or 0)
+                    await self._ack(job_id, job)
+                    break
+                if job.unacked >= self.ACK_EVERY:
+                    await self._ack(job_id, job)
+        except asyncio.CancelledError:
+            with contextlib.suppress(Exception):
+                await self._send(WSMessageType.EXEC_CANCEL, {"job_id": job_id})
+            raise
+        except asyncio.TimeoutError:
+            with contextlib.suppress(Exception):
+                await self._send(WSMessageType.EXEC_CANCEL, {"job_id": job_id})
+            raise RuntimeError("Sandbox execution timed out")
+        except Exception as exc:
+            raise RuntimeError(f"Sandbox execution broker error: {exc}") from exc
+        finally:
+            self._jobs.pop(job_id, None)
+            # The result carries the bounded text; spill files are not needed past here.
+            stdout_capture.close()
+            stderr_capture.close()
+
+        return SandboxCommandResult(
+            exit_code=exit_code if exit_code is not None else 1,
+            stdout=stdout_capture.text(),
+            stderr=stderr_capture.text(),
+            duration_ms=int((time.monotonic() - started_at) * 1000),
+        )
+
+    async def close(self) -> None:
+        self._closed = True
+        websocket = self._websocket
+        self._websocket = None
+        if websocket is not None:
+            with contextlib.suppress(Exception):
+                await websocket.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._reader_task
+
+    async def _connection(self) -> Any:
+        if self._websocket is not None:
+            return self._websocket
+        async with self._connect_lock:
+            if self._websocket is None:
+                websocket = await websockets.connect(
+                    self.url,
+                    max_size=None,
+                    open_timeout=self.OPEN_TIMEOUT_SECONDS,
+                )
+                self._websocket = websocket
+                self._reader_task = asyncio.create_task(
+                    self._read_loop(websocket),
+                    name=f"sandbox-channel-{self.tunnel_url}",
+                )
+        return self._websocket
+
+    async def _send(self, msg_type: WSMessageType, payload: Dict[str, Any]) -> None:
+        websocket = await self._connection()
+        async with self._send_lock:
+            await websocket.send(json.dumps({"type": msg_type.value, "payload": payload}))
+
+    async def _ack(self, job_id: str, job: _ChannelJob) -> None:
+        job.unacked = 0
+        with contextlib.suppress(Exception):
+            await self._send(WSMessageType.EXEC_ACK, {"job_id": job_id, "sequence": job.last_sequence})
+
+    async def _read_loop(self, websocket: Any) -> None:
+        try:
+            async for raw in websocket:
+                if isinstance(raw, bytes):
+                    raw = raw.decode("utf-8", errors="replace")
+                try:
+                    event = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                payload = event.get("payload", {}) or {}
+                job = self._jobs.get(str(payload.get("job_id") or ""))
+                if job is not None:
+                    job.queue.put_nowait(event)
+        except Exception as exc:
+            logger.info("sandbox control channel to %s dropped: %s", self.tunnel_url, exc)
+        finally:
+            if self._websocket is websocket:
+                self._websocket = None
+            if self._jobs and not self._closed:
+                asyncio.create_task(self._resume_jobs(), name=f"sandbox-channel-resume-{self.tunnel_url}")
+            elif _CONTROL_CHANNELS.get(self.tunnel_url) is self:
+                _CONTROL_CHANNELS.pop(self.tunnel_url, None)
+
+    async def _resume_jobs(self) -> None:
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            try:
+                for job_id, job in list(self._jobs.items()):
+                    await self._send(
+                        WSMessageType.EXEC_RESUME,
+                        {"job_id": job_id, "after_sequence": job.last_sequence},
+                    )
+                return
+            except Exception as exc:
+                logger.info("sandbox control channel reconnect %d failed: %s", attempt + 1, exc)
+                await asyncio.sleep(min(2 ** attempt, 10))
+        for job in list(self._jobs.values()):
+            job.queue.put_nowait(
+                {
+                    "type": WSMessageType.ERROR.value,
+                    "payload": {"message": "Sandbox control channel lost"},
+                }
+            )
+
+
+_CONTROL_CHANNELS: Dict[str, SandboxControlChannel] = {}
+_CHANNEL_UNAVAILABLE_UNTIL: Dict[str, float] = {}
+_CHANNEL_RETRY_SECONDS = 60.0
+
+
+def get_sandbox_control_channel(tunnel_url: str) -> SandboxControlChannel:
+    key = tunnel_url.rstrip("/")
+    channel = _CONTROL_CHANNELS.get(key)
+    if channel is None:
+        channel = _CONTROL_CHANNELS[key] = SandboxControlChannel(key)
+    return channel
+
+
+async def close_sandbox_control_channel(tunnel_url: str) -> None:
+    channel = _CONTROL_CHANNELS.pop(tunnel_url.rstrip("/"), None)
+    if channel is not None:
+        await channel.close()
+
+
 async def run_sandbox_command(
     *,
     tunnel_url: str,
@@ -47,15 +292,62 @@ async def run_sandbox_command(
     on_event: Optional[SandboxEventCallback] = None,
     capture_stdout: bool = True,
     capture_stderr: bool = True,
+    job_class: str = JOB_CLASS_AGENT,
 ) -> SandboxCommandResult:
-    query: Dict[str, str] = {}
-    internal_secret = get_sandbox_config().controller_internal_ws_secret
-    if internal_secret:
-        query["secret"] = internal_secret
+    key = tunnel_url.rstrip("/")
+    if (
+        get_sandbox_config().control_channel_enabled
+        and _CHANNEL_UNAVAILABLE_UNTIL.get(key, 0.0) <= time.monotonic()
+    ):
+        try:
+            return await get_sandbox_control_channel(key).run_command(
+                session_public_id=session_public_id,
+                command=command,
+                cwd=cwd,
+                env=env,
+                timeout_seconds=timeout_seconds,
+                on_event=on_event,
+                capture_stdout=capture_stdout,
+                capture_stderr=capture_stderr,
+                job_class=job_class,
+            )
+        except SandboxChannelUnavailable as exc:
+            logger.info("sandbox control channel unavailable for %s, using per-command socket: %s", key, exc)
+            _CHANNEL_UNAVAILABLE_UNTIL[key] = time.monotonic() + _CHANNEL_RETRY_SECONDS
+            _CONTROL_CHANNELS.pop(key, None)
+
+    return await _run_sandbox_command_direct(
+        tunnel_url=tunnel_url,
+        session_public_id=session_public_id,
+        command=command,
+        cwd=cwd,
+        env=env,
+        timeout_seconds=timeout_seconds,
+        on_event=on_event,
+        capture_stdout=capture_stdout,
+        capture_stderr=capture_stderr,
+        job_class=job_class,
+    )
 
-    ws_url = to_websocket_url(tunnel_url) + f"/internal/sessions/{session_public_id}/ws/exec"
-    if query:
-        ws_url += "?" + urlencode(query)
+
+async def _run_sandbox_command_direct(
+    *,
+    tunnel_url: str,
+    session_public_id: str,
+    command: str,
+    cwd: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+    timeout_seconds: int = 1800,
+    on_event: Optional[SandboxEventCallback] = None,
+    capture_stdout: bool = True,
+    capture_stderr: bool = True,
+    job_class: str = JOB_CLASS_AGENT,
+) -> SandboxCommandResult:
+    ws_url = (
+        to_websocket_url(tunnel_url)
+        + f"/internal/sessions/{session_public_id}/ws/exec"
+        + _internal_query_suffix()
+    )
 
     request_payload: Dict[str, Any] = {
         "type": WSMessageType.EXEC_START.value,
@@ -63,13 +355,15 @@ async def run_sandbox_command(
             "command": command,
             "cwd": cwd,
             "env": env or {},
+            "job_class": job_class,
         },
     }
 
     started_at = time.monotonic()
-    stdout_chunks: list[str] = []
-    stderr_chunks: list[str] = []
+    stdout_capture = BoundedOutputCapture("stdout")
+    stderr_capture = BoundedOutputCapture("stderr")
     exit_code: Optional[int] = None
+    pid: Optional[int] = None
 
     try:
         async with websockets.connect(ws_url, max_size=None, open_timeout=10) as upstream:
@@ -92,9 +386,11 @@ async def run_sandbox_command(
                     chunk = payload.get("data")
                     stream_event = payload.get("event")
                     if stream_event == "stdout" and isinstance(chunk, str) and capture_stdout:
-                        stdout_chunks.append(chunk)
+                        stdout_capture.write(chunk)
                     elif stream_event == "stderr" and isinstance(chunk, str) and capture_stderr:
-                        stderr_chunks.append(chunk)
+                        stderr_capture.write(chunk)
+                    elif stream_event == "start" and payload.get("pid") is not None:
+                        pid = int(payload["pid"])
                     elif stream_event == "exit":
                         exit_code = int(payload.get("exit_code") or 0)
                         break
@@ -103,20 +399,27 @@ async def run_sandbox_command(
                 if event_type == WSMessageType.ERROR.value:
                     raise RuntimeError(str(payload.get("message") or "Sandbox execution failed"))
     except asyncio.CancelledError:
-        with contextlib.suppress(Exception):
-            async with websockets.connect(ws_url, max_size=None, open_timeout=5) as upstream:
-                await upstream.send(
-                    json.dumps({"type": WSMessageType.EXEC_CANCEL.value, "payload": {}})
-                )
+        # Closing the socket already stops a queued or running job; the
+        # explicit cancel is a fallback and targets our pid because other
+        # jobs of this session may share the sandbox.
+        if pid is not None:
+            with contextlib.suppress(Exception):
+                async with websockets.connect(ws_url, max_size=None, open_timeout=5) as upstream:
+                    await upstream.send(
+                        json.dumps({"type": WSMessageType.EXEC_CANCEL.value, "payload": {"pid": pid}})
+                    )
         raise
     except asyncio.TimeoutError:
         raise RuntimeError("Sandbox execution timed out")
     except Exception as exc:
         raise RuntimeError(f"Sandbox execution broker error: {exc}") from exc
+    finally:
+        stdout_capture.close()
+        stderr_capture.close()
 
     return SandboxCommandResult(
         exit_code=exit_code if exit_code is not None else 1,
-        stdout="".join(stdout_chunks),
-        stderr="".join(stderr_chunks),
+        stdout=stdout_capture.text(),
+        stderr=stderr_capture.text(),
         duration_ms=int((time.monotonic() - started_at) * 1000),
     )
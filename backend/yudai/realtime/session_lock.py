@@ -0,0 +1,204 @@
+"""Per-session execution lock shared by every worker process.
+
+Postgres deployments serialize sessions with session-level advisory locks held
+on a dedicated connection. SQLite (tests and local dev) only has one process,
+so an in-process ``asyncio.Lock`` is enough there. Both backends bump a
+monotonic fencing token in ``session_execution_fences``; a holder whose token
+has been superseded is refused on its next flush.
+
+Fencing covers flushes through sessions a ``SessionLockHandle`` is attached
+to: the session passed to ``hold`` and any helper session the caller attaches
+explicitly (the orchestrator does this for the trace it writes after the lock
+is released). Each such flush first runs ``UPDATE session_execution_fences ...
+WHERE fencing_token = <held token>`` in the same transaction, so the row lock
+keeps a takeover from interleaving until that transaction ends. Writes made
+through other sessions, such as callback ingestion, are not fenced.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy import event, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from yudai.models import SessionExecutionFence
+from yudai.utils import utc_now
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLockLostError(RuntimeError):
+    """Raised when a newer holder has taken over the session execution lock."""
+
+
+@dataclass
+class _LocalLockEntry:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+@dataclass
+class SessionLockHandle:
+    """Fencing token granted to the current holder of a session lock."""
+
+    session_key: str
+    fencing_token: int
+    holder_id: str
+
+    def current_token(self, db: Session) -> Optional[int]:
+        return db.execute(
+            select(SessionExecutionFence.fencing_token).where(
+                SessionExecutionFence.session_key == self.session_key
+            )
+        ).scalar_one_or_none()
+
+    def check(self, db: Session) -> None:
+        """Confirm the token in ``db``'s transaction and lock the fence row until it ends."""
+
+        statement = (
+            update(SessionExecutionFence)
+            .where(
+                SessionExecutionFence.session_key == self.session_key,
+                SessionExecutionFence.fencing_token == self.fencing_token,
+            )
+            .values(fencing_token=SessionExecutionFence.fencing_token)
+            .execution_options(synchronize_session=False)
+        )
+        if db.execute(statement).rowcount:
+            return
+        raise SessionLockLostError(
+            f"Session {self.session_key} lock was taken over "
+            f"(token {self.fencing_token} superseded by {self.current_token(db)})"
+        )
+
+    def _before_flush(self, db: Session, _flush_context, _instances) -> None:
+        self.check(db)
+
+    def attach(self, db: Session) -> None:
+        """Check the fencing token before every flush issued through ``db``."""
+
+        if not event.contains(db, "before_flush", self._before_flush):
+            event.listen(db, "before_flush", self._before_flush)
+
+    def detach(self, db: Session) -> None:
+        if event.contains(db, "before_flush", self._before_flush):
+            event.remove(db, "before_flush", self._before_flush)
+
+
+class SessionExecutionLockManager:
+    """Hands out per-session locks with fencing tokens."""
+
+    def __init__(self, *, poll_interval_seconds: float = 0.5) -> None:
+        self.poll_interval_seconds = poll_interval_seconds
+        self.holder_id = os.getenv("HOSTNAME") or f"controller-{os.getpid()}"
+        self._local_locks: Dict[str, _LocalLockEntry] = {}
+
+    @asynccontextmanager
+    async def hold(self, db: Session, session_key: str) -> AsyncIterator[SessionLockHandle]:
+        """Hold the lock for ``session_key`` and fence writes made through ``db``."""
+
+        entry = self._local_locks.get(session_key)
+        if entry is None:
+            entry = self._local_locks[session_key] = _LocalLockEntry()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                async with self._hold_advisory(db, session_key):
+                    handle = SessionLockHandle(
+                        session_key=session_key,
+                        fencing_token=self._next_fencing_token(db, session_key),
+                        holder_id=self.holder_id,
+                    )
+                    handle.attach(db)
+                    try:
+                        yield handle
+                    finally:
+                        handle.detach(db)
+        finally:
+            entry.users -= 1
+            if entry.users <= 0 and self._local_locks.get(session_key) is entry:
+                self._local_locks.pop(session_key, None)
+
+    @asynccontextmanager
+    async def _hold_advisory(self, db: Session, session_key: str) -> AsyncIterator[None]:
+        bind = db.get_bind()
+        if bind.dialect.name != "postgresql":
+            yield
+            return
+
+        key = self.advisory_key(session_key)
+        connection = bind.engine.connect()
+        try:
+            while True:
+                acquired = connection.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": key}
+                ).scalar()
+                connection.commit()
+                if acquired:
+                    break
+                await asyncio.sleep(self.poll_interval_seconds)
+            try:
+                yield
+            finally:
+                try:
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                    connection.commit()
+                except Exception:
+                    logger.warning("failed to release advisory lock for %s", session_key, exc_info=True)
+        finally:
+            connection.close()
+
+    def _next_fencing_token(self, db: Session, session_key: str) -> int:
+        now = utc_now()
+        statement = (
+            update(SessionExecutionFence)
+            .where(SessionExecutionFence.session_key == session_key)
+            .values(
+                fencing_token=SessionExecutionFence.fencing_token + 1,
+                holder_id=self.holder_id,
+                acquired_at=now,
+            )
+            .returning(SessionExecutionFence.fencing_token)
+            .execution_options(synchronize_session=False)
+        )
+        token = db.execute(statement).scalar_one_or_none()
+        if token is None:
+            db.add(
+                SessionExecutionFence(
+                    session_key=session_key,
+                    fencing_token=1,
+                    holder_id=self.holder_id,
+                    acquired_at=now,
+                )
+            )
+            try:
+                db.commit()
+                return 1
+            except IntegrityError:
+                db.rollback()
+                token = db.execute(statement).scalar_one()
+        db.commit()
+        return int(token)
+
+    @staticmethod
+    def advisory_key(session_key: str) -> int:
+        digest = hashlib.sha256(f"yudai:session:{session_key}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big", signed=True)
+
+
+_session_lock_manager_singleton: Optional[SessionExecutionLockManager] = None
+
+
+def get_session_lock_manager() -> SessionExecutionLockManager:
+    global _session_lock_manager_singleton
+    if _session_lock_manager_singleton is None:
+        _session_lock_manager_singleton = SessionExecutionLockManager()
+    return _session_lock_manager_singleton
@@ -0,0 +1,225 @@
+"""Incremental parser for sandbox stdout/stderr marker blocks and JSON contracts."""
+
+from __future__ import annotations
+
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, Optional, Pattern, Sequence, Tuple
+
+from .ws_protocol import WSMessageType
+
+STREAM_ORDER: tuple[str, str] = ("stdout", "stderr")
+
+
+@dataclass
+class _StreamState:
+    partial: List[str] = field(default_factory=list)
+    partial_chars: int = 0
+    partial_overflow: bool = False
+    open_marker: Optional[str] = None
+    open_parts: List[str] = field(default_factory=list)
+    open_chars: int = 0
+    blocks: Dict[str, str] = field(default_factory=dict)
+    json_objects: Deque[Dict[str, Any]] = field(default_factory=deque)
+    matches: Dict[str, Any] = field(default_factory=dict)
+
+
+class StreamingOutputParser:
+    """Consumes sandbox output chunks and keeps only what result parsing needs.
+
+    Output is split into lines per stream as chunks arrive. A line containing a
+    registered start marker opens a block that is closed by its end marker; the
+    latest completed block per marker is kept. Lines that are a single JSON
+    object are decoded and the most recent ``max_json_objects`` retained, and
+    each named pattern remembers its first match. Everything else is dropped,
+    so memory stays bounded however long the command runs.
+
+    Accessors mirror the old full-text scans over ``stdout + "\\n" + stderr``:
+    "last" lookups prefer stderr, "first" lookups prefer stdout.
+    """
+
+    def __init__(
+        self,
+        *,
+        markers: Iterable[Tuple[str, str]] = (),
+        patterns: Optional[Mapping[str, Pattern[str]]] = None,
+        max_json_objects: int = 32,
+        max_line_chars: int = 1_000_000,
+        max_block_chars: int = 2_000_000,
+    ) -> None:
+        self._markers: Dict[str, str] = dict(markers)
+        self._patterns: Dict[str, Pattern[str]] = dict(patterns or {})
+        self.max_json_objects = max(1, max_json_objects)
+        self.max_line_chars = max(1, max_line_chars)
+        self.max_block_chars = max(1, max_block_chars)
+        self._streams: Dict[str, _StreamState] = {}
+        self.fed = False
+        self.completed = False
+
+    def feed(self, stream: str, chunk: str) -> None:
+        if not chunk:
+            return
+        self.fed = True
+        state = self._state(stream)
+        start = 0
+        while True:
+            newline = chunk.find("\n", start)
+            if newline < 0:
+                self._buffer(state, chunk[start:])
+                return
+            self._buffer(state, chunk[start:newline])
+            self._complete_line(state)
+            start = newline + 1
+
+    def feed_text(self, stdout: str = "", stderr: str = "") -> None:
+        """Parse already-collected output in a single pass."""
+
+        self.feed("stdout", stdout)
+        self.feed("stderr", stderr)
+        self.finish()
+        self.completed = True
+
+    def feed_event(self, event: Mapping[str, Any]) -> None:
+        """Feed a sandbox stream websocket event; other event types are ignored."""
+
+        if event.get("type") != WSMessageType.SANDBOX_STREAM.value:
+            return
+        payload = event.get("payload") or {}
+        stream = payload.get("event")
+        data = payload.get("data")
+        if stream in STREAM_ORDER and isinstance(data, str):
+            self.feed(stream, data)
+        elif stream == "exit":
+            self.finish()
+            self.completed = True
+
+    def reset(self) -> None:
+        self._streams = {}
+        self.fed = False
+        self.completed = False
+
+    def finish(self) -> None:
+        """Flush trailing partial lines; call once the command has exited."""
+
+        for state in self._streams.values():
+            if state.partial or state.partial_overflow:
+                self._complete_line(state)
+
+    def block(self, start_marker: str) -> Optional[str]:
+        """Return the raw text of the latest completed block for ``start_marker``."""
+
+        for stream in self._ordered_streams(reverse=True):
+            value = self._streams[stream].blocks.get(start_marker)
+            if value is not None:
+                return value
+        return None
+
+    def json_objects(self) -> List[Dict[str, Any]]:
+        """Return retained JSON objects, most recent first."""
+
+        objects: List[Dict[str, Any]] = []
+        for stream in self._ordered_streams(reverse=True):
+            objects.extend(reversed(self._streams[stream].json_objects))
+        return objects
+
+    def last_json(
+        self,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        for payload in self.json_objects():
+            if predicate is None or predicate(payload):
+                return payload
+        return None
+
+    def first_match(self, name: str) -> Optional[Any]:
+        """Return the first regex match recorded for pattern ``name``."""
+
+        for stream in self._ordered_streams(reverse=False):
+            match = self._streams[stream].matches.get(name)
+            if match is not None:
+                return match
+        return None
+
+    def _ordered_streams(self, *, reverse: bool) -> Sequence[str]:
+        known = [name for name in STREAM_ORDER if name in self._streams]
+        known.extend(name for name in self._streams if name not in STREAM_ORDER)
+        return list(reversed(known)) if reverse else known
+
+    def _state(self, stream: str) -> _StreamState:
+        state = self._streams.get(stream)
+        if state is None:
+            state = self._streams[stream] = _StreamState()
+        return state
+
+    def _buffer(self, state: _StreamState, text: str) -> None:
+        if not text or state.partial_overflow:
+            return
+        if state.partial_chars + len(text) > self.max_line_chars:
+            state.partial_overflow = True
+            state.partial = []
+            state.partial_chars = 0
+            return
+        state.partial.append(text)
+        state.partial_chars += len(text)
+
+    def _complete_line(self, state: _StreamState) -> None:
+        overflow = state.partial_overflow
+        line = "".join(state.partial)
+        state.partial = []
+        state.partial_chars = 0
+        state.partial_overflow = False
+        if overflow:
+            if state.open_marker is not None:
+                state.open_parts.append("")
+            return
+        self._scan_line(state, line)
+        self._consume_line(state, line)
+
+    def _scan_line(self, state: _StreamState, line: str) -> None:
+        for name, pattern in self._patterns.items():
+            if name not in state.matches:
+                match = pattern.search(line)
+                if match is not None:
+                    state.matches[name] = match
+        raw = line.strip()
+        if raw.startswith("{") and raw.endswith("}"):
+            try:
+                payload = json.loads(raw)
+            except json.JSONDecodeError:
+                return
+            if isinstance(payload, dict):
+                state.json_objects.append(payload)
+                while len(state.json_objects) > self.max_json_objects:
+                    state.json_objects.popleft()
+
+    def _consume_line(self, state: _StreamState, line: str) -> None:
+        if state.open_marker is not None:
+            end_marker = self._markers[state.open_marker]
+            end_index = line.find(end_marker)
+            if end_index < 0:
+                self._append_block_line(state, line)
+                return
+            self._append_block_line(state, line[:end_index])
+            state.blocks[state.open_marker] = "\n".join(state.open_parts)
+            state.open_marker = None
+            state.open_parts = []
+            state.open_chars = 0
+            line = line[end_index + len(end_marker) :]
+
+        for start_marker in self._markers:
+            start_index = line.find(start_marker)
+            if start_index < 0:
+                continue
+            state.open_marker = start_marker
+            state.open_parts = []
+            state.open_chars = 0
+            self._consume_line(state, line[start_index + len(start_marker) :])
+            return
+
+    def _append_block_line(self, state: _StreamState, text: str) -> None:
+        if state.open_chars >= self.max_block_chars:
+            return
+        text = text[: self.max_block_chars - state.open_chars]
+        state.open_parts.append(text)
+        state.open_chars += len(text) + 1
@@ -3,15 +3,20 @@
 from __future__ import annotations
 
 import asyncio
+from collections import deque
+from dataclasses import dataclass
 import logging
 from datetime import datetime
+import time
 from enum import Enum
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Deque, Dict, List, Optional, Set
 
 from fastapi import WebSocket
 from pydantic import BaseModel, Field
 
+from yudai.config import get_sandbox_config
 from yudai.utils import utc_now
+from yudai.utils.metrics import WS_SEND_SECONDS
 
 
 class WSMessageType(str, Enum):
@@ -20,6 +25,8 @@ class WSMessageType(str, Enum):
     EXEC_START = "exec.start"
     EXEC_STDIN = "exec.stdin"
     EXEC_CANCEL = "exec.cancel"
+    EXEC_ACK = "exec.ack"
+    EXEC_RESUME = "exec.resume"
 
     # Server -> Client
     LLM_STREAM = "llm_stream"
@@ -140,27 +147,267 @@ def build_envelope(
 
 _ws_hub_logger = logging.getLogger(__name__)
 
+# Close code sent to consumers that cannot keep up ("try again later").
+WS_SLOW_CONSUMER_CLOSE_CODE = 1013
+_COALESCIBLE_STREAM_EVENTS = frozenset({"stdout", "stderr"})
+# Everything the frontend keys a stream on, plus the job identity.
+_COALESCE_KEY_FIELDS = (
+    "stream",
+    "event",
+    "mode",
+    "pipeline_execution_id",
+    "execution_id",
+    "mode_execution_id",
+    "sandbox_job_id",
+    "controller_job_id",
+)
+
+
+@dataclass
+class _OutboundMessage:
+    msg_type: WSMessageType
+    payload: Dict[str, Any]
+    text: str
+
+    @property
+    def coalescible(self) -> bool:
+        return (
+            self.msg_type == WSMessageType.SANDBOX_STREAM
+            and self.payload.get("event") in _COALESCIBLE_STREAM_EVENTS
+            and isinstance(self.payload.get("data"), str)
+        )
+
+    def can_absorb(self, other: "_OutboundMessage", max_bytes: int) -> bool:
+        if not (self.coalescible and other.coalescible):
+            return False
+        if any(self.payload.get(key) != other.payload.get(key) for key in _COALESCE_KEY_FIELDS):
+            return False
+        return len(self.payload["data"]) + len(other.payload["data"]) <= max_bytes
+
+    def absorb(self, other: "_OutboundMessage") -> None:
+        """Append ``other``'s chunk; the merged frame keeps the newest sequence."""
+        merged = dict(other.payload)
+        merged["data"] = self.payload["data"] + other.payload["data"]
+        merged["coalesced"] = int(self.payload.get("coalesced", 1)) + int(other.payload.get("coalesced", 1))
+        self.payload = merged
+        self.text = build_envelope(self.msg_type, merged)
+
+
+class _SocketWriter:
+    """Owns all sends to one socket so producers only ever touch its queue.
+
+    The queue is bounded. Once it fills up, queued heartbeats are dropped
+    and adjacent ``sandbox_stream`` chunks are merged. A consumer that is
+    still full after that, or whose single send outlasts the send timeout,
+    is disconnected. Clients already reconnect and resume, which beats
+    stalling the session or silently losing frames.
+    """
+
+    def __init__(
+        self,
+        hub: "SessionWebSocketHub",
+        session_id: str,
+        websocket: WebSocket,
+    ) -> None:
+        self.hub = hub
+        self.session_id = session_id
+        self.websocket = websocket
+        self.queue: Deque[_OutboundMessage] = deque()
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        # Set whenever nothing is queued or in flight; ``drain`` waits on it.
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def enqueue(self, message: _OutboundMessage) -> bool:
+        if self.closed:
+            return False
+        stats = self.hub.stats
+        if message.msg_type == WSMessageType.HEARTBEAT and self.queue:
+            # Queued traffic already proves the connection is alive.
+            stats["heartbeats_dropped"] += 1
+            return True
+        if self.queue and self.queue[-1].can_absorb(message, self.hub.coalesce_max_bytes):
+            self.queue[-1].absorb(message)
+            stats["stream_chunks_coalesced"] += 1
+            return True
+        if len(self.queue) >= self.hub.queue_limit:
+            self._compact()
+            if len(self.queue) >= self.hub.queue_limit:
+                self.disconnect_slow_consumer("send queue full")
+                return False
+        self.queue.append(message)
+        self._idle.clear()
+        stats["enqueued"] += 1
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], len(self.queue))
+        self._wakeup.set()
+        self._ensure_task()
+        return True
+
+    def _compact(self) -> None:
+        compacted: Deque[_OutboundMessage] = deque()
+        for queued in self.queue:
+            if queued.msg_type == WSMessageType.HEARTBEAT:
+                self.hub.stats["heartbeats_dropped"] += 1
+                continue
+            if compacted and compacted[-1].can_absorb(queued, self.hub.coalesce_max_bytes):
+                compacted[-1].absorb(queued)
+                self.hub.stats["stream_chunks_coalesced"] += 1
+                continue
+            compacted.append(queued)
+        self.queue = compacted
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self._run(), name=f"ws-writer-{self.session_id}"
+            )
+
+    async def _run(self) -> None:
+        while not self.closed:
+            if not self.queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            message = self.queue.popleft()
+            started = time.perf_counter()
+            try:
+                async with asyncio.timeout(self.hub.send_timeout_seconds):
+                    await self.websocket.send_text(message.text)
+            except asyncio.TimeoutError:
+                self.disconnect_slow_consumer("send timed out")
+                return
+            except Exception:
+                self.hub.stats["send_failures"] += 1
+                self._detach()
+                return
+            WS_SEND_SECONDS.observe(time.perf_counter() - started)
+            self.hub.stats["sent"] += 1
+
+    def disconnect_slow_consumer(self, reason: str) -> None:
+        if self.closed:
+            return
+        _ws_hub_logger.warning(
+            "Disconnecting slow websocket consumer for session %s: %s (%d queued)",
+            self.session_id,
+            reason,
+            len(self.queue),
+        )
+        self.hub.stats["slow_consumers_disconnected"] += 1
+        self._detach()
+        self.hub._spawn(self._close_socket(reason))
+
+    async def _close_socket(self, reason: str) -> None:
+        try:
+            await self.websocket.close(code=WS_SLOW_CONSUMER_CLOSE_CODE, reason=reason)
+        except Exception:
+            pass
+
+    def _detach(self) -> None:
+        self.closed = True
+        self.hub.stats["dropped"] += len(self.queue)
+        self.queue.clear()
+        self._wakeup.set()
+        self._idle.set()
+        self.hub._forget(self.session_id, self.websocket)
+
+    async def drain(self) -> None:
+        if self._task is None or self._task.done():
+            return
+        await self._idle.wait()
+
+    def stop(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+        self._idle.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
 
 class SessionWebSocketHub:
-    """Tracks active frontend sockets by session and broadcasts envelopes."""
+    """Tracks active frontend sockets by session and broadcasts envelopes.
 
-    def __init__(self) -> None:
-        self._connections: Dict[str, Set[WebSocket]] = {}
-        self._lock = asyncio.Lock()
+    Each socket gets its own writer task and bounded queue (see
+    ``_SocketWriter``), so one slow tab delays neither the other tabs nor
+    the producer. ``send_to_session`` only serializes and enqueues.
+    """
+
+    def __init__(
+        self,
+        *,
+        queue_limit: Optional[int] = None,
+        send_timeout_seconds: Optional[float] = None,
+        coalesce_max_bytes: Optional[int] = None,
+    ) -> None:
+        config = get_sandbox_config()
+        self.queue_limit = queue_limit or config.ws_send_queue_limit
+        self.send_timeout_seconds = send_timeout_seconds or config.ws_send_timeout_seconds
+        self.coalesce_max_bytes = coalesce_max_bytes or config.ws_coalesce_max_bytes
+        self._connections: Dict[str, Dict[WebSocket, _SocketWriter]] = {}
+        self._background: Set[asyncio.Task[None]] = set()
+        self.stats: Dict[str, int] = {
+            "enqueued": 0,
+            "sent": 0,
+            "stream_chunks_coalesced": 0,
+            "heartbeats_dropped": 0,
+            "dropped": 0,
+            "send_failures": 0,
+            "slow_consumers_disconnected": 0,
+            "max_queue_depth": 0,
+        }
 
     async def register(self, session_id: str, websocket: WebSocket) -> None:
-        async with self._lock:
-            bucket = self._connections.setdefault(session_id, set())
-            bucket.add(websocket)
-
-    async def unregister(self, session_id: str, websocket: WebSocket) -> None:
-        async with self._lock:
-            bucket = self._connections.get(session_id)
-            if not bucket:
-                return
-            bucket.discard(websocket)
-            if not bucket:
-                self._connections.pop(session_id, None)
+        bucket = self._connections.setdefault(session_id, {})
+        if websocket not in bucket:
+            bucket[websocket] = _SocketWriter(self, session_id, websocket)
+
+    async def unregister(
+        self,
+        session_id: str,
+        websocket: WebSocket,
+        *,
+        flush_timeout_seconds: float = 0.0,
+    ) -> None:
+        """Stop writing to ``websocket``, optionally flushing its queue first."""
+        writer = self._connections.get(session_id, {}).get(websocket)
+        if writer is not None and flush_timeout_seconds > 0:
+            try:
+                await asyncio.wait_for(writer.drain(), timeout=flush_timeout_seconds)
+            except asyncio.TimeoutError:
+                pass
+        writer = self._forget(session_id, websocket)
+        if writer is not None:
+            writer.stop()
+
+    def _forget(self, session_id: str, websocket: WebSocket) -> Optional[_SocketWriter]:
+        bucket = self._connections.get(session_id)
+        if not bucket:
+            return None
+        writer = bucket.pop(websocket, None)
+        if not bucket:
+            self._connections.pop(session_id, None)
+        return writer
+
+    def _spawn(self, coro: Any) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def send_to_socket(
+        self,
+        session_id: str,
+        websocket: WebSocket,
+        msg_type: WSMessageType,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Queue a message for one registered socket, in order with broadcasts."""
+        writer = self._connections.get(session_id, {}).get(websocket)
+        if writer is None:
+            return False
+        payload = payload or {}
+        return writer.enqueue(_OutboundMessage(msg_type, payload, build_envelope(msg_type, payload)))
 
     async def send_to_session(
         self,
@@ -168,31 +415,47 @@ class SessionWebSocketHub:
         msg_type: WSMessageType,
         payload: Dict[str, Any],
     ) -> int:
-        async with self._lock:
-            sockets = list(self._connections.get(session_id, set()))
+        """Queue ``payload`` for every socket of ``session_id``.
 
-        if not sockets:
+        Returns how many sockets accepted the message; delivery happens on
+        each socket's writer task, so this never waits on the network.
+        """
+        writers = list(self._connections.get(session_id, {}).values())
+        if not writers:
             return 0
 
-        message = build_envelope(msg_type, payload)
-        delivered = 0
-        stale: list[WebSocket] = []
-        for socket in sockets:
-            try:
-                await socket.send_text(message)
-                delivered += 1
-            except Exception:
-                stale.append(socket)
-
-        if stale:
-            async with self._lock:
-                bucket = self._connections.get(session_id, set())
-                for socket in stale:
-                    bucket.discard(socket)
-                if not bucket:
-                    self._connections.pop(session_id, None)
-
-        return delivered
+        message_text = build_envelope(msg_type, payload)
+        accepted = 0
+        for writer in writers:
+            # Each writer may coalesce into its own copy, so never share one.
+            message = _OutboundMessage(msg_type, dict(payload), message_text)
+            if writer.enqueue(message):
+                accepted += 1
+        return accepted
+
+    async def drain(self, session_id: Optional[str] = None) -> None:
+        """Wait until queued messages were handed to their sockets."""
+        if session_id is None:
+            writers = [writer for bucket in self._connections.values() for writer in bucket.values()]
+        else:
+            writers = list(self._connections.get(session_id, {}).values())
+        for writer in writers:
+            await writer.drain()
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {
+            session_id: sum(len(writer.queue) for writer in bucket.values())
+            for session_id, bucket in self._connections.items()
+        }
+
+    def metrics(self) -> Dict[str, int]:
+        depths = [len(writer.queue) for bucket in self._connections.values() for writer in bucket.values()]
+        return {
+            **self.stats,
+            "sockets": len(depths),
+            "queue_depth": sum(depths),
+            "max_current_queue_depth": max(depths, default=0),
+        }
 
 
 _hub_singleton: Optional[SessionWebSocketHub] = None
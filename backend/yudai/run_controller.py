@@ -3,20 +3,38 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
 import uvicorn
 
 from yudai.auth import auth_router
+from yudai.config import get_sandbox_config
 from yudai.config.realtime_flags import get_realtime_feature_flags
 from yudai.daifuUserAgent.session_routes import router as session_router
 from yudai.db.database import init_db
+from yudai.db.retention import maintain_retention
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from yudai.github import github_router
+from yudai.realtime.callback_store import maintain_run_progress
 from yudai.realtime.controller_routes import router as controller_router
+from yudai.realtime.event_compaction import maintain_event_compaction
+from yudai.realtime.metrics_collectors import collect_controller_state, refresh_controller_db_gauges
 from yudai.types import HealthResponse, RealtimeFlagsResponse, RootResponse
+from yudai.utils.metrics import REGISTRY, MetricsMiddleware, router as metrics_router
+from yudai.utils.profiling import ProfilingMiddleware, router as profiling_router, start_profiling_hooks
+from yudai.utils.query_stats import QueryStatsMiddleware
+from yudai.utils.tracing import TracingMiddleware
+
+# Route templates whose latency is also reported as callback ingest time.
+_CALLBACK_ROUTES = {
+    "/controller/internal/sandbox-events": "event",
+    "/controller/internal/sandbox-executions/{mode_execution_id}/complete": "completion",
+    "/controller/sandboxes/{sandbox_id}/heartbeat": "heartbeat",
+    "/controller/sandboxes/{sandbox_id}/ready": "ready",
+}
 
 
 def _parse_allow_origins(raw: str) -> list[str]:
@@ -27,7 +45,20 @@ def _parse_allow_origins(raw: str) -> list[str]:
 async def lifespan(app: FastAPI):
     print("[controller] starting realtime controller host")
     init_db()
+    profiling_hooks = start_profiling_hooks("controller")
+    maintenance_tasks = (
+        asyncio.create_task(maintain_event_compaction(), name="controller-event-compaction"),
+        asyncio.create_task(maintain_retention(), name="controller-retention"),
+        asyncio.create_task(maintain_run_progress(), name="controller-run-progress"),
+    )
     yield
+    for task in maintenance_tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    profiling_hooks.stop()
     print("[controller] shutting down")
 
 
@@ -44,6 +75,8 @@ fastapi_app.include_router(auth_router, prefix="/auth", tags=["auth"])
 fastapi_app.include_router(github_router, prefix="/github", tags=["github"])
 fastapi_app.include_router(session_router, prefix="/daifu", tags=["sessions"])
 fastapi_app.include_router(controller_router)
+fastapi_app.include_router(metrics_router)
+fastapi_app.include_router(profiling_router)
 
 
 @fastapi_app.get("/", response_model=RootResponse)
@@ -66,10 +99,20 @@ def realtime_flags():
     return {"flags": flags.as_dict()}
 
 
+REGISTRY.add_collector("controller", collect_controller_state)
+REGISTRY.add_refresher("controller", refresh_controller_db_gauges)
+
+_instrumented_app = TracingMiddleware(
+    ProfilingMiddleware(QueryStatsMiddleware(fastapi_app, service="controller"), service="controller"),
+    service="controller",
+)
+if get_sandbox_config().metrics_enabled:
+    _instrumented_app = MetricsMiddleware(_instrumented_app, service="controller", callback_routes=_CALLBACK_ROUTES)
+
 # Wrap the full ASGI app so CORS headers are still added when FastAPI converts
 # unhandled exceptions into a 500 response.
 app = CORSMiddleware(
-    app=fastapi_app,
+    app=_instrumented_app,
     allow_origins=_parse_allow_origins(
         os.getenv(
             "ALLOW_ORIGINS",
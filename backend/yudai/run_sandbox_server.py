@@ -5,7 +5,10 @@ from __future__ import annotations
 
 import asyncio
 from contextlib import asynccontextmanager
+import json
 import os
+import sys
+import time
 
 import httpx
 import uvicorn
@@ -14,8 +17,14 @@ from yudai.config.realtime_flags import get_realtime_feature_flags
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from yudai.config import get_sandbox_config
-from yudai.realtime.sandbox_routes import router as sandbox_router
+from yudai.realtime import agent_daemon, browser_service
+from yudai.realtime.metrics_collectors import collect_sandbox_state
+from yudai.realtime.sandbox_readiness import READY_SIGNATURE_HEADER, READY_TIMESTAMP_HEADER, sign_ready_payload
+from yudai.realtime.sandbox_routes import maintain_code_index, router as sandbox_router
 from yudai.types import RealtimeFlagsResponse, RootResponse
+from yudai.utils.metrics import REGISTRY, MetricsMiddleware, router as metrics_router
+from yudai.utils.profiling import ProfilingMiddleware, router as profiling_router, start_profiling_hooks
+from yudai.utils.tracing import TracingMiddleware
 
 
 async def _heartbeat_loop() -> None:
@@ -46,18 +55,133 @@ async def _heartbeat_loop() -> None:
         await asyncio.sleep(interval_seconds)
 
 
+def _sandbox_capabilities() -> dict:
+    sandbox_config = get_sandbox_config()
+    return {
+        "server_version": app.version,
+        "file_api": True,
+        "code_index": sandbox_config.code_index_enabled,
+        "agent_daemon": sandbox_config.agent_daemon_enabled,
+        "browser_service": sandbox_config.browser_service_enabled,
+    }
+
+
+async def _ready_callback() -> None:
+    """Tell the controller this server is up as soon as it accepts requests."""
+
+    sandbox_config = get_sandbox_config()
+    controller_base_url = sandbox_config.controller_base_url.rstrip("/")
+    sandbox_id = os.getenv("SANDBOX_ID")
+    if not controller_base_url or not sandbox_id:
+        return
+
+    ready_url = f"{controller_base_url}/controller/sandboxes/{sandbox_id}/ready"
+    local_healthz = f"http://127.0.0.1:{os.getenv('PORT', '8100')}/healthz"
+    body = json.dumps({"capabilities": _sandbox_capabilities()}).encode("utf-8")
+
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        # Lifespan startup finishes before uvicorn binds its socket, so wait
+        # until this server answers locally before claiming readiness.
+        for _ in range(600):
+            try:
+                if (await client.get(local_healthz, timeout=1.0)).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+
+        delay = 0.5
+        for _ in range(6):
+            headers = {"Content-Type": "application/json"}
+            secret = sandbox_config.controller_callback_secret
+            if secret:
+                timestamp = str(int(time.time()))
+                headers[READY_TIMESTAMP_HEADER] = timestamp
+                headers[READY_SIGNATURE_HEADER] = sign_ready_payload(
+                    secret, sandbox_id=sandbox_id, timestamp=timestamp, body=body
+                )
+            try:
+                response = await client.post(ready_url, content=body, headers=headers)
+                if response.status_code < 500:
+                    if response.status_code >= 400:
+                        print(f"[sandbox] ready callback rejected: {response.status_code}")
+                    return
+            except httpx.HTTPError as exc:
+                print(f"[sandbox] ready callback failed: {exc}")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def _agent_daemon_loop() -> None:
+    """Keep the preloaded ``mini`` daemon running next to the server."""
+
+    sandbox_config = get_sandbox_config()
+    if not sandbox_config.agent_daemon_enabled:
+        return
+
+    socket_path = sandbox_config.agent_daemon_socket
+    # Commands spawned by this server inherit the environment, which is how
+    # the generated mode scripts find the daemon.
+    os.environ[agent_daemon.AGENT_DAEMON_SOCKET_ENV] = socket_path
+    os.environ[agent_daemon.AGENT_DAEMON_CLIENT_ENV] = os.path.abspath(agent_daemon.__file__)
+
+    while True:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "yudai.realtime.agent_daemon",
+            "serve",
+            "--socket",
+            socket_path,
+            stdin=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            exit_code = await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    process.kill()
+            raise
+        if exit_code == agent_daemon.DAEMON_MISCONFIGURED_EXIT_CODE:
+            print("[sandbox] agent daemon unavailable; modes will start mini directly")
+            return
+        print(f"[sandbox] agent daemon exited with {exit_code}; restarting")
+        await asyncio.sleep(5)
+
+
+def _export_browser_service_env() -> None:
+    """Point browser-check scripts at this server's ``/internal/browser`` API."""
+
+    if not get_sandbox_config().browser_service_enabled:
+        return
+    os.environ[browser_service.BROWSER_SERVICE_URL_ENV] = f"http://127.0.0.1:{os.getenv('PORT', '8100')}"
+    os.environ[browser_service.BROWSER_CLIENT_ENV] = os.path.abspath(browser_service.__file__)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("[sandbox] starting sandbox session server")
+    _export_browser_service_env()
     heartbeat_task = asyncio.create_task(_heartbeat_loop(), name="sandbox-heartbeat")
+    agent_daemon_task = asyncio.create_task(_agent_daemon_loop(), name="sandbox-agent-daemon")
+    code_index_task = asyncio.create_task(maintain_code_index(), name="sandbox-code-index")
+    ready_task = asyncio.create_task(_ready_callback(), name="sandbox-ready-callback")
+    profiling_hooks = start_profiling_hooks("sandbox")
 
     yield
 
-    heartbeat_task.cancel()
-    try:
-        await heartbeat_task
-    except asyncio.CancelledError:
-        pass
+    profiling_hooks.stop()
+
+    for task in (heartbeat_task, agent_daemon_task, code_index_task, ready_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await browser_service.get_browser_service().shutdown()
 
     print("[sandbox] shutting down")
 
@@ -78,7 +202,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(ProfilingMiddleware, service="sandbox")
+app.add_middleware(TracingMiddleware, service="sandbox")
+if get_sandbox_config().metrics_enabled:
+    app.add_middleware(MetricsMiddleware, service="sandbox")
+REGISTRY.add_collector("sandbox", collect_sandbox_state)
+
 app.include_router(sandbox_router)
+app.include_router(metrics_router)
+app.include_router(profiling_router)
 
 
 @app.get("/", response_model=RootResponse)
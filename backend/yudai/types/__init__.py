@@ -31,7 +31,9 @@ from yudai.models import (  # noqa: F401
     CreateSessionRequest,
     CreateUserIssueRequest,
     ExecutionArtifactResponse,
+    ExecutionSpanResponse,
     ExecutionTraceEventResponse,
+    ExecutionTraceResponse,
     ExecutionRequest,
     ExecutionResponse,
     ExecutionStatusResponse,
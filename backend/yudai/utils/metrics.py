@@ -0,0 +1,426 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Both servers expose ``GET /metrics``. Instruments are module-level and cheap
+to update: one lock per metric and a bucket search per histogram observation,
+with labels limited to bounded values such as route templates, modes and
+statement kinds. Point-in-time gauges (queue depths, live sockets, active
+sandboxes) are produced by collectors registered with ``REGISTRY``, which run
+only when ``/metrics`` is scraped; values that need I/O to compute come from
+async refreshers awaited just before. Both servers include ``router``.
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import hmac
+import logging
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, Response
+
+from yudai.config import get_sandbox_config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+DB_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LONG_BUCKETS: Tuple[float, ...] = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0)
+
+
+@dataclass
+class MetricFamily:
+    """One exposition block: a ``# HELP``/``# TYPE`` header and its samples."""
+
+    name: str
+    kind: str
+    documentation: str
+    samples: List[Tuple[str, Dict[str, str], float]] = field(default_factory=list)
+
+    def add(self, value: float, suffix: str = "", **labels: Any) -> "MetricFamily":
+        self.samples.append((self.name + suffix, {key: str(val) for key, val in labels.items()}, float(value)))
+        return self
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render_families(families: Iterable[MetricFamily]) -> str:
+    lines: List[str] = []
+    for family in families:
+        if not family.samples:
+            continue
+        lines.append(f"# HELP {family.name} {family.documentation}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for sample_name, labels, value in family.samples:
+            if labels:
+                rendered = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{sample_name}{{{rendered}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any) -> Any:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values!r}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self) -> Any:
+        """Create the per-label-set child that holds this metric's values."""
+
+    def _default_child(self) -> Any:
+        if self.labelnames:
+            raise ValueError(f"{self.name} requires labels {self.labelnames}")
+        return self.labels()
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.documentation)
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            child._collect_into(family, dict(zip(self.labelnames, key)))
+        return family
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children.clear()
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock: threading.Lock) -> None:
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def _collect_into(self, family: MetricFamily, labels: Dict[str, str]) -> None:
+        family.add(self.value, "_total", **labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild(self._lock)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default_child().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock: threading.Lock) -> None:
+        self._lock = lock
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def _collect_into(self, family: MetricFamily, labels: Dict[str, str]) -> None:
+        family.add(self.value, **labels)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild(self._lock)
+
+    def set(self, value: float) -> None:
+        self._default_child().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default_child().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default_child().dec(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_upper_bounds", "_counts", "sum", "count")
+
+    def __init__(self, lock: threading.Lock, upper_bounds: Tuple[float, ...]) -> None:
+        self._lock = lock
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def _collect_into(self, family: MetricFamily, labels: Dict[str, str]) -> None:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self._upper_bounds + (math.inf,), counts):
+            cumulative += bucket_count
+            family.add(cumulative, "_bucket", **labels, le=_format_value(float(bound)))
+        family.add(total, "_sum", **labels)
+        family.add(count, "_count", **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if not math.isinf(bound)))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default_child().observe(value)
+
+    def time(self) -> Any:
+        return self._default_child().time()
+
+
+Collector = Callable[[], Iterable[MetricFamily]]
+Refresher = Callable[[], Awaitable[None]]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Collector] = {}
+        self._refreshers: Dict[str, Refresher] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))  # type: ignore[return-value]
+
+    def add_collector(self, name: str, collector: Collector) -> None:
+        """Register a scrape-time collector; re-registering a name replaces it."""
+        self._collectors[name] = collector
+
+    def add_refresher(self, name: str, refresher: Refresher) -> None:
+        """Register an async hook awaited before each scrape; re-registering a name replaces it."""
+        self._refreshers[name] = refresher
+
+    async def refresh(self) -> None:
+        refreshers = list(self._refreshers.items())
+        results = await asyncio.gather(*(refresher() for _, refresher in refreshers), return_exceptions=True)
+        for (name, _), result in zip(refreshers, results):
+            if isinstance(result, Exception):
+                logger.warning("Metrics refresher %s failed", name, exc_info=result)
+
+    def collect(self) -> List[MetricFamily]:
+        families = [metric.collect() for metric in self._metrics.values()]
+        for name, collector in list(self._collectors.items()):
+            try:
+                families.extend(collector())
+            except Exception:
+                logger.warning("Metrics collector %s failed", name, exc_info=True)
+        return families
+
+    def render(self) -> str:
+        return render_families(self.collect())
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "yudai_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("service", "method", "route", "status"),
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "yudai_http_requests_in_flight",
+    "HTTP requests currently being served.",
+    ("service",),
+)
+CALLBACK_INGEST_SECONDS = REGISTRY.histogram(
+    "yudai_callback_ingest_duration_seconds",
+    "Time to ingest a sandbox callback on the controller.",
+    ("callback", "status"),
+)
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "yudai_llm_time_to_first_token_seconds",
+    "Time from sending a streaming LLM request to its first content delta.",
+    ("model",),
+)
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "yudai_llm_request_duration_seconds",
+    "Total LLM request time.",
+    ("model", "streaming", "outcome"),
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+SANDBOX_COMMAND_SECONDS = REGISTRY.histogram(
+    "yudai_sandbox_command_duration_seconds",
+    "Sandbox command duration as reported on completion, by mode.",
+    ("mode",),
+    buckets=LONG_BUCKETS,
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "yudai_db_query_duration_seconds",
+    "Database statement execution time by statement kind.",
+    ("operation",),
+    buckets=DB_BUCKETS,
+)
+WS_SEND_SECONDS = REGISTRY.histogram(
+    "yudai_ws_send_duration_seconds",
+    "Time to write one message to a client websocket.",
+    buckets=DB_BUCKETS,
+)
+EVENT_LOOP_STALL_SECONDS = REGISTRY.histogram(
+    "yudai_event_loop_stall_seconds",
+    "Event loop blocks longer than the configured lag threshold.",
+    ("service",),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template.
+
+    Labels use the matched route's path template (``/controller/sandboxes/
+    {sandbox_id}``) so cardinality stays bounded; unmatched paths share one
+    label. Websocket scopes pass through untouched.
+    """
+
+    def __init__(self, app: Any, *, service: str, callback_routes: Optional[Dict[str, str]] = None) -> None:
+        self.app = app
+        self.service = service
+        self.callback_routes = dict(callback_routes or {})
+        self._in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(service)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def _send(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self._in_flight.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            self._in_flight.dec()
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "<unmatched>"
+            HTTP_REQUEST_SECONDS.labels(self.service, scope.get("method", ""), template, status_code).observe(elapsed)
+            callback = self.callback_routes.get(template)
+            if callback is not None:
+                CALLBACK_INGEST_SECONDS.labels(callback, status_code).observe(elapsed)
+
+
+def metrics_authorized(authorization: Optional[str], token: Optional[str]) -> bool:
+    """``/metrics`` is open unless a bearer token is configured."""
+    if not token:
+        return True
+    return bool(authorization) and hmac.compare_digest(authorization, f"Bearer {token}")
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(default=None)) -> Response:
+    sandbox_config = get_sandbox_config()
+    if not sandbox_config.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics_authorized(authorization, sandbox_config.metrics_token):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    await REGISTRY.refresh()
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,422 @@
+"""Opt-in wall-clock sampling profiler and event-loop lag monitor.
+
+The profiler is a daemon thread that reads ``sys._current_frames()`` every
+few milliseconds, so it sees threads that are stuck in C calls or blocking
+the event loop, which is exactly when an in-loop profiler would be useless.
+Profiles are written as speedscope JSON (https://www.speedscope.app) or as
+collapsed stacks for ``flamegraph.pl``.
+
+Three entry points share one capture slot so a process never runs two
+samplers at once:
+
+* ``capture_profile``, behind the admin ``POST /debug/profile`` in ``router``;
+* ``SIGUSR2`` (see ``install_profile_signal_handler``), for processes
+  without HTTP such as the execution worker;
+* ``ProfilingMiddleware``, which samples the event-loop thread for one
+  request when it carries ``X-Yudai-Profile: <token>``.
+
+``LoopLagMonitor`` is independent of the sampler. It logs the loop thread's
+stack whenever a callback holds the loop longer than the threshold.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+import hmac
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+
+from yudai.config import get_sandbox_config
+from yudai.utils.metrics import EVENT_LOOP_STALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-yudai-profile"
+PROFILE_PATH_HEADER = b"x-yudai-profile-path"
+PROFILE_FORMATS = ("speedscope", "collapsed")
+# Set by ``ProfilingMiddleware`` so shared routes know which server they run in.
+SERVICE_SCOPE_KEY = "yudai.service"
+DEBUG_PROFILE_PATH = "/debug/profile"
+MAX_STACK_DEPTH = 128
+MAX_SAMPLES = 200_000
+
+_capture_lock = threading.Lock()
+
+FrameKey = Tuple[str, str, int]
+
+
+class ProfilerBusy(RuntimeError):
+    """Another capture is already running in this process."""
+
+
+@dataclass
+class Profile:
+    started_at: float
+    duration_seconds: float = 0.0
+    frames: List[FrameKey] = field(default_factory=list)
+    thread_names: Dict[int, str] = field(default_factory=dict)
+    # Per thread, root-first frame indices plus the wall time each sample covers.
+    samples: Dict[int, List[Tuple[Tuple[int, ...], float]]] = field(default_factory=dict)
+    dropped_samples: int = 0
+
+    @property
+    def sample_count(self) -> int:
+        return sum(len(items) for items in self.samples.values())
+
+    def _thread_label(self, thread_id: int) -> str:
+        return f"{self.thread_names.get(thread_id, 'thread')} ({thread_id})"
+
+    def _frame_label(self, index: int) -> str:
+        name, filename, line = self.frames[index]
+        return f"{name} ({filename}:{line})"
+
+    def to_speedscope(self, *, name: str = "yudai") -> Dict[str, Any]:
+        profiles = []
+        for thread_id, items in self.samples.items():
+            total = sum(weight for _stack, weight in items)
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": self._thread_label(thread_id),
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": total,
+                    "samples": [list(stack) for stack, _weight in items],
+                    "weights": [weight for _stack, weight in items],
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "yudai.utils.profiling",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": frame_name, "file": filename, "line": line}
+                    for frame_name, filename, line in self.frames
+                ]
+            },
+            "profiles": profiles,
+        }
+
+    def to_collapsed(self) -> str:
+        counts: Counter[str] = Counter()
+        for thread_id, items in self.samples.items():
+            thread = self._thread_label(thread_id).replace(";", ":")
+            for stack, _weight in items:
+                counts[";".join([thread, *(self._frame_label(index) for index in stack)])] += 1
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+    def write(self, path: Path, *, fmt: str = "speedscope") -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if fmt == "collapsed":
+            path.write_text(self.to_collapsed(), encoding="utf-8")
+        else:
+            path.write_text(json.dumps(self.to_speedscope(name=path.stem)), encoding="utf-8")
+        return path
+
+
+class SamplingProfiler:
+    """Samples thread stacks from a background thread until stopped."""
+
+    def __init__(
+        self,
+        *,
+        interval_seconds: float = 0.005,
+        thread_ids: Optional[Iterable[int]] = None,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.thread_ids: Optional[Set[int]] = set(thread_ids) if thread_ids is not None else None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._frame_index: Dict[FrameKey, int] = {}
+        self.profile = Profile(started_at=time.time())
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="yudai-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.profile
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        started = last = time.perf_counter()
+        while not self._stop.wait(self.interval_seconds):
+            now = time.perf_counter()
+            self._sample(own_id, now - last)
+            last = now
+        self.profile.duration_seconds = time.perf_counter() - started
+
+    def _sample(self, own_id: int, weight: float) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            if self.profile.sample_count >= MAX_SAMPLES:
+                self.profile.dropped_samples += 1
+                continue
+            self.profile.thread_names.setdefault(thread_id, names.get(thread_id, "thread"))
+            self.profile.samples.setdefault(thread_id, []).append((self._stack(frame), weight))
+
+    def _stack(self, frame: Optional[FrameType]) -> Tuple[int, ...]:
+        leaf_first: List[int] = []
+        while frame is not None and len(leaf_first) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.profile.frames)
+                self.profile.frames.append(key)
+            leaf_first.append(index)
+            frame = frame.f_back
+        return tuple(reversed(leaf_first))
+
+
+def profile_path(directory: str, prefix: str, fmt: str) -> Path:
+    suffix = ".collapsed.txt" if fmt == "collapsed" else ".speedscope.json"
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    return Path(directory) / f"{prefix}-{os.getpid()}-{stamp}-{time.monotonic_ns() % 1_000_000:06d}{suffix}"
+
+
+def capture_profile(seconds: float, *, service: str, fmt: str = "speedscope") -> Tuple[Path, Profile]:
+    """Sample every thread for ``seconds`` and write the profile to disk.
+
+    Blocks the calling thread; call it from a worker thread when on the loop.
+    """
+
+    config = get_sandbox_config()
+    seconds = max(0.1, min(float(seconds), float(config.profiling_max_seconds)))
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile capture is already running")
+    try:
+        profiler = SamplingProfiler(interval_seconds=config.profiling_interval_ms / 1000).start()
+        time.sleep(seconds)
+        profile = profiler.stop()
+    finally:
+        _capture_lock.release()
+    path = profile.write(profile_path(config.profiling_dir, service, fmt), fmt=fmt)
+    logger.info("wrote %.1fs profile with %d samples to %s", seconds, profile.sample_count, path)
+    return path, profile
+
+
+def install_profile_signal_handler(service: str, *, seconds: Optional[float] = None) -> bool:
+    """Capture a profile in the background whenever the process gets ``SIGUSR2``."""
+
+    sigusr2 = getattr(signal, "SIGUSR2", None)
+    if sigusr2 is None:  # pragma: no cover - platform-specific
+        return False
+    duration = seconds if seconds is not None else min(10.0, float(get_sandbox_config().profiling_max_seconds))
+
+    def _capture() -> None:
+        try:
+            capture_profile(duration, service=service)
+        except ProfilerBusy:
+            logger.warning("ignoring SIGUSR2: a profile capture is already running")
+        except Exception:
+            logger.exception("signal-triggered profile capture failed")
+
+    def _handler(_signum: int, _frame: Optional[FrameType]) -> None:
+        threading.Thread(target=_capture, name="yudai-profile-signal", daemon=True).start()
+
+    try:
+        signal.signal(sigusr2, _handler)
+    except ValueError:
+        # Only the main thread may install signal handlers.
+        return False
+    return True
+
+
+def profiling_authorized(value: Optional[str], token: Optional[str]) -> bool:
+    """Profiling is closed unless a token is configured and presented."""
+    return bool(token) and bool(value) and hmac.compare_digest(value, token)
+
+
+class ProfilingMiddleware:
+    """Profile one request's event-loop thread when it presents the profiling token.
+
+    The loop thread also runs every other in-flight request, so the profile
+    shows what held the loop during this request, not only this handler.
+    """
+
+    def __init__(self, app: Any, *, service: str) -> None:
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        scope[SERVICE_SCOPE_KEY] = self.service
+        config = get_sandbox_config()
+        # ``/debug/profile`` takes the same header and needs the capture slot itself.
+        if scope["type"] != "http" or not config.profiling_enabled or scope.get("path") == DEBUG_PROFILE_PATH:
+            await self.app(scope, receive, send)
+            return
+        presented = None
+        for key, value in scope.get("headers") or ():
+            if key == PROFILE_HEADER:
+                presented = value.decode("latin-1")
+                break
+        if not profiling_authorized(presented, config.profiling_token) or not _capture_lock.acquire(
+            blocking=False
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        path = profile_path(config.profiling_dir, f"{self.service}-request", "speedscope")
+
+        async def send_with_path(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (PROFILE_PATH_HEADER, path.name.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = SamplingProfiler(
+            interval_seconds=config.profiling_interval_ms / 1000,
+            thread_ids=[threading.get_ident()],
+        ).start()
+        try:
+            await self.app(scope, receive, send_with_path)
+        finally:
+            try:
+                profile = await asyncio.to_thread(profiler.stop)
+            finally:
+                _capture_lock.release()
+            await asyncio.to_thread(profile.write, path)
+
+
+class LoopLagMonitor:
+    """Log the loop thread's stack when the loop stops answering heartbeats."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, threshold_seconds: float, service: str) -> None:
+        self.loop = loop
+        self.threshold_seconds = threshold_seconds
+        self.service = service
+        self.interval_seconds = max(0.01, threshold_seconds / 4)
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "LoopLagMonitor":
+        """Start monitoring; must be called from the loop's own thread."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._schedule_heartbeat()
+        self._thread = threading.Thread(target=self._watch, name="yudai-loop-lag", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _schedule_heartbeat(self) -> None:
+        self._beat = time.monotonic()
+        if not self._stop.is_set():
+            self._heartbeat = self.loop.call_later(self.interval_seconds, self._schedule_heartbeat)
+
+    def _watch(self) -> None:
+        stalled_since: Optional[float] = None
+        while not self._stop.wait(self.interval_seconds):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval_seconds
+            if lag > self.threshold_seconds:
+                if stalled_since != beat:
+                    stalled_since = beat
+                    self.stalls += 1
+                    self._report(lag)
+            elif stalled_since is not None:
+                stalled = max(0.0, beat - stalled_since - self.interval_seconds)
+                EVENT_LOOP_STALL_SECONDS.labels(self.service).observe(stalled)
+                logger.warning("%s event loop recovered after a %.0f ms stall", self.service, stalled * 1000)
+                stalled_since = None
+
+    def _report(self, lag: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id or 0)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>\n"
+        task = asyncio.current_task(self.loop)
+        logger.warning(
+            "%s event loop blocked for %.0f ms (threshold %.0f ms) in task %s:\n%s",
+            self.service,
+            lag * 1000,
+            self.threshold_seconds * 1000,
+            task.get_name() if task is not None else "<none>",
+            stack,
+        )
+
+
+@dataclass
+class ProfilingHooks:
+    lag_monitor: Optional[LoopLagMonitor] = None
+    signal_installed: bool = False
+
+    def stop(self) -> None:
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+
+
+def start_profiling_hooks(service: str) -> ProfilingHooks:
+    """Start the configured hooks for this process; call from inside the running loop."""
+
+    config = get_sandbox_config()
+    hooks = ProfilingHooks()
+    if config.loop_lag_threshold_ms > 0:
+        hooks.lag_monitor = LoopLagMonitor(
+            asyncio.get_running_loop(),
+            threshold_seconds=config.loop_lag_threshold_ms / 1000,
+            service=service,
+        ).start()
+    if config.profiling_enabled:
+        hooks.signal_installed = install_profile_signal_handler(service)
+    return hooks
+
+
+router = APIRouter()
+
+
+@router.post(DEBUG_PROFILE_PATH, include_in_schema=False)
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0),
+    fmt: str = Query("speedscope", alias="format"),
+    x_yudai_profile: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    sandbox_config = get_sandbox_config()
+    if not sandbox_config.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling_authorized(x_yudai_profile, sandbox_config.profiling_token):
+        raise HTTPException(status_code=401, detail="Invalid profiling token")
+    if fmt not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(PROFILE_FORMATS)}")
+    service = request.scope.get(SERVICE_SCOPE_KEY, "yudai")
+    try:
+        path, profile = await asyncio.to_thread(capture_profile, seconds, service=service, fmt=fmt)
+    except ProfilerBusy as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return {
+        "path": str(path),
+        "samples": profile.sample_count,
+        "threads": len(profile.samples),
+        "duration_seconds": round(profile.duration_seconds, 3),
+    }
@@ -0,0 +1,223 @@
+"""Per-request and per-task SQL statement accounting.
+
+``track_queries`` opens a scope in a ``ContextVar``; every statement any
+SQLAlchemy engine runs while the scope is active is counted, timed and
+fingerprinted. The context is copied into FastAPI's threadpool and into
+``asyncio.to_thread``, so sync handlers and worker threads are counted
+against the request or task that started them.
+
+The same hooks feed ``DB_QUERY_SECONDS`` for engines passed to
+``instrument_engine``, so each statement is timed once however many
+consumers want the number.
+
+Fingerprints are statement text with whitespace and expanded ``IN`` lists
+collapsed, so the same ORM query issued once per row (an N+1) shows up as
+one fingerprint with a high count.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from yudai.config import get_sandbox_config
+from yudai.utils.metrics import DB_BUCKETS, DB_QUERY_SECONDS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PER_SCOPE = REGISTRY.histogram(
+    "yudai_db_queries_per_scope",
+    "SQL statements issued per request or background task.",
+    ("service", "scope"),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DB_SECONDS_PER_SCOPE = REGISTRY.histogram(
+    "yudai_db_seconds_per_scope",
+    "Total SQL time per request or background task.",
+    ("service", "scope"),
+    buckets=DB_BUCKETS,
+)
+
+_STARTS_KEY = "yudai_query_stats_starts"
+_DB_OPERATIONS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE"})
+_WHITESPACE_RE = re.compile(r"\s+")
+_PARAM_LIST_RE = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)")
+_MAX_FINGERPRINT_CHARS = 300
+
+_installed = False
+
+
+def fingerprint(statement: str) -> str:
+    collapsed = _WHITESPACE_RE.sub(" ", statement).strip()
+    return _PARAM_LIST_RE.sub("(?...)", collapsed)[:_MAX_FINGERPRINT_CHARS]
+
+
+@dataclass
+class QueryStats:
+    label: Optional[str] = None
+    count: int = 0
+    total_seconds: float = 0.0
+    fingerprints: Counter[str] = field(default_factory=Counter)
+    parent: Optional["QueryStats"] = None
+
+    def record(self, statement: str, elapsed: float) -> None:
+        key = fingerprint(statement)
+        stats: Optional[QueryStats] = self
+        while stats is not None:
+            stats.count += 1
+            stats.total_seconds += elapsed
+            stats.fingerprints[key] += 1
+            stats = stats.parent
+
+    def repeated(self, min_count: int = 2) -> List[Tuple[str, int]]:
+        """Fingerprints issued at least ``min_count`` times, most frequent first."""
+        return [(key, count) for key, count in self.fingerprints.most_common() if count >= min_count]
+
+    @property
+    def max_repeats(self) -> int:
+        most_common = self.fingerprints.most_common(1)
+        return most_common[0][1] if most_common else 0
+
+    def describe(self, *, limit: int = 5) -> str:
+        lines = [f"{self.count} queries in {self.total_seconds * 1000:.1f} ms"]
+        for key, count in self.repeated()[:limit]:
+            lines.append(f"  {count}x {key}")
+        return "\n".join(lines)
+
+
+_active_stats: ContextVar[Optional[QueryStats]] = ContextVar("yudai_query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _active_stats.get()
+
+
+def _timed(conn: Any) -> bool:
+    return getattr(conn.engine, "_yudai_metrics_instrumented", False)
+
+
+def install_query_tracking() -> None:
+    """Attach the statement hooks to every SQLAlchemy engine, once per process."""
+
+    global _installed
+    if _installed:
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):  # noqa: ANN001
+        if _active_stats.get() is not None or _timed(conn):
+            conn.info.setdefault(_STARTS_KEY, []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):  # noqa: ANN001
+        starts = conn.info.get(_STARTS_KEY)
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+        if _timed(conn):
+            head = statement.lstrip()[:6].upper()
+            DB_QUERY_SECONDS.labels(head if head in _DB_OPERATIONS else "OTHER").observe(elapsed)
+
+    @event.listens_for(Engine, "handle_error")
+    def _error(exception_context):  # noqa: ANN001
+        connection = exception_context.connection
+        if connection is not None:
+            starts = connection.info.get(_STARTS_KEY)
+            if starts:
+                starts.pop()
+
+    _installed = True
+
+
+def instrument_engine(engine: Any) -> None:
+    """Also report every statement ``engine`` runs to ``DB_QUERY_SECONDS``."""
+
+    install_query_tracking()
+    engine._yudai_metrics_instrumented = True
+
+
+@contextmanager
+def track_queries(label: Optional[str] = None) -> Iterator[QueryStats]:
+    """Count statements run inside the block; nested scopes also count toward outer ones."""
+
+    stats = QueryStats(label=label, parent=_active_stats.get())
+    token = _active_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _active_stats.reset(token)
+
+
+def report_query_stats(stats: QueryStats, *, service: str) -> None:
+    """Record the scope's totals and warn when it looks like an N+1 or exceeds the budget."""
+
+    scope = stats.label or "unknown"
+    QUERIES_PER_SCOPE.labels(service, scope).observe(stats.count)
+    DB_SECONDS_PER_SCOPE.labels(service, scope).observe(stats.total_seconds)
+    config = get_sandbox_config()
+    if stats.count > config.query_budget_warn or stats.max_repeats >= config.query_repeat_warn:
+        logger.warning("%s %s issued %s", service, scope, stats.describe())
+
+
+@contextmanager
+def tracked_task(label: str, *, service: str) -> Iterator[QueryStats]:
+    """``track_queries`` for background work, reported when the block exits."""
+
+    with track_queries(label) as stats:
+        try:
+            yield stats
+        finally:
+            report_query_stats(stats, service=service)
+
+
+class QueryStatsMiddleware:
+    """Track the statements each HTTP request issues.
+
+    Totals are reported per route template. With ``query_stats_headers``
+    enabled (development), responses also carry ``X-DB-Query-Count``,
+    ``X-DB-Query-Time-Ms`` and ``X-DB-Query-Max-Repeats``; statements issued
+    after the response has started (streaming bodies) are only in the report.
+    """
+
+    def __init__(self, app: Any, *, service: str) -> None:
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        expose_headers = get_sandbox_config().query_stats_headers
+
+        with track_queries() as stats:
+
+            async def send_with_stats(message: Dict[str, Any]) -> None:
+                if expose_headers and message["type"] == "http.response.start":
+                    headers = [
+                        *message.get("headers", []),
+                        (b"x-db-query-count", str(stats.count).encode()),
+                        (b"x-db-query-time-ms", f"{stats.total_seconds * 1000:.1f}".encode()),
+                        (b"x-db-query-max-repeats", str(stats.max_repeats).encode()),
+                    ]
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_stats)
+            finally:
+                route = scope.get("route")
+                stats.label = f"{scope.get('method', '')} {getattr(route, 'path', None) or '<unmatched>'}"
+                report_query_stats(stats, service=self.service)
@@ -0,0 +1,421 @@
+"""Lightweight span tracing with W3C trace-context propagation.
+
+The active span lives in a ``ContextVar``, so it follows ``await`` chains and
+is copied into tasks created while it is active. ``start_trace`` opens a
+root span, optionally continuing a remote parent from a ``traceparent``
+header, and collects every finished span of that trace in memory. Callers
+that want a record (the pipeline runner) read ``root.recorder`` when the
+root ends. When ``OTEL_EXPORTER_OTLP_ENDPOINT`` is set, finished traces are
+also posted to the collector as OTLP/HTTP JSON in the background.
+
+``span`` and ``traced`` are no-ops outside an active trace, so instrumented
+helpers cost nothing when called from untraced code.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import functools
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+MAX_SPANS_PER_TRACE = 512
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+T = TypeVar("T")
+
+
+@dataclass
+class TraceRecorder:
+    spans: List["Span"] = field(default_factory=list)
+    dropped: int = 0
+
+    def add(self, span: "Span") -> None:
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped += 1
+            return
+        self.spans.append(span)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    recorder: TraceRecorder
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1_000_000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("yudai_current_span", default=None)
+
+
+def _new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return ``(trace_id, parent_span_id)`` for a valid version-00 header."""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, _flags = match.groups()
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current_span.get()
+    return span.traceparent() if span is not None else None
+
+
+def trace_headers() -> Dict[str, str]:
+    """Headers that continue the active trace in another process."""
+    traceparent = current_traceparent()
+    return {TRACEPARENT_HEADER: traceparent} if traceparent else {}
+
+
+def set_attribute(key: str, value: Any) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+@contextmanager
+def _activate(span: Span) -> Iterator[Span]:
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.status = "cancelled" if isinstance(exc, asyncio.CancelledError) else "error"
+        span.error = str(exc)[:500] or type(exc).__name__
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        span.recorder.add(span)
+
+
+@contextmanager
+def start_trace(name: str, *, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """Open a root span for this process, continuing ``traceparent`` when valid."""
+    remote = parse_traceparent(traceparent)
+    trace_id, parent_span_id = remote if remote else (_new_trace_id(), None)
+    root = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=_new_span_id(),
+        parent_span_id=parent_span_id,
+        recorder=TraceRecorder(),
+        attributes=dict(attributes),
+    )
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        get_span_exporter().export(root.recorder.spans)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Open a child of the active span; yields ``None`` outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(
+        name=name,
+        trace_id=parent.trace_id,
+        span_id=_new_span_id(),
+        parent_span_id=parent.span_id,
+        recorder=parent.recorder,
+        attributes=dict(attributes),
+    )
+    with _activate(child):
+        yield child
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorate a coroutine function so each call runs in a child span."""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summarize_trace(root: Span, *, max_spans: int = 200) -> Dict[str, Any]:
+    """Compact, JSON-ready record of a finished trace.
+
+    ``phases`` sums durations per span name; ``spans`` keeps the first
+    ``max_spans`` spans with start offsets relative to the root.
+    """
+
+    spans = sorted(root.recorder.spans, key=lambda item: item.start_ns)
+    phases: Dict[str, int] = {}
+    for item in spans:
+        if item is root:
+            continue
+        phases[item.name] = phases.get(item.name, 0) + int(round(item.duration_ms))
+    compact = []
+    for item in spans[:max_spans]:
+        entry: Dict[str, Any] = {
+            "id": item.span_id,
+            "parent": item.parent_span_id,
+            "name": item.name,
+            "start_ms": int(round((item.start_ns - root.start_ns) / 1_000_000)),
+            "duration_ms": int(round(item.duration_ms)),
+            "status": item.status,
+        }
+        if item.attributes:
+            entry["attributes"] = item.attributes
+        if item.error:
+            entry["error"] = item.error
+        compact.append(entry)
+    return {
+        "trace_id": root.trace_id,
+        "root_span_id": root.span_id,
+        "started_at_ns": root.start_ns,
+        "duration_ms": int(round(root.duration_ms)),
+        "status": root.status,
+        "phases": phases,
+        "spans": compact,
+        "dropped_spans": root.recorder.dropped + max(0, len(spans) - max_spans),
+    }
+
+
+def merge_trace_summaries(
+    previous: Optional[Dict[str, Any]],
+    current: Dict[str, Any],
+    *,
+    max_spans: int = 1000,
+) -> Dict[str, Any]:
+    """Fold a resumed run's ``summarize_trace`` output into the one already stored.
+
+    A resumed execution keeps its id, so its runs share one record: the new
+    run's root is re-parented under the first root as ``<name>.resume``, span
+    offsets are rebased on the first run's start and phase totals are added.
+    """
+
+    if not isinstance(previous, dict) or not previous.get("spans"):
+        return current
+    offset_ms = int(round((current["started_at_ns"] - previous["started_at_ns"]) / 1_000_000))
+    duration_ms = max(int(previous.get("duration_ms") or 0), offset_ms + int(current.get("duration_ms") or 0))
+    resume_name = None
+    spans: List[Dict[str, Any]] = []
+    for entry in previous["spans"]:
+        if entry["id"] == previous["root_span_id"]:
+            entry = {**entry, "duration_ms": duration_ms}
+        spans.append(entry)
+    room = max(0, max_spans - len(spans))
+    for entry in current["spans"][:room]:
+        entry = {**entry, "start_ms": int(entry["start_ms"]) + offset_ms}
+        if entry["id"] == current["root_span_id"]:
+            resume_name = f"{entry['name']}.resume"
+            entry.update(parent=previous["root_span_id"], name=resume_name)
+        spans.append(entry)
+    phases = dict(previous.get("phases") or {})
+    for name, value in (current.get("phases") or {}).items():
+        phases[name] = phases.get(name, 0) + int(value)
+    if resume_name is not None:
+        phases[resume_name] = phases.get(resume_name, 0) + int(current.get("duration_ms") or 0)
+    return {
+        "trace_id": previous["trace_id"],
+        "root_span_id": previous["root_span_id"],
+        "started_at_ns": previous["started_at_ns"],
+        "duration_ms": duration_ms,
+        "status": current["status"],
+        "phases": phases,
+        "spans": spans,
+        "dropped_spans": int(previous.get("dropped_spans") or 0)
+        + int(current.get("dropped_spans") or 0)
+        + max(0, len(current["spans"]) - room),
+        "runs": int(previous.get("runs") or 1) + 1,
+    }
+
+
+def build_span_tree(summary: Dict[str, Any], *, root_span_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Nest the flat ``spans`` of ``summarize_trace`` output under their parents."""
+
+    nodes = {entry["id"]: {**entry, "children": []} for entry in summary.get("spans") or []}
+    for node in nodes.values():
+        parent = nodes.get(node.get("parent"))
+        if parent is not None:
+            parent["children"].append(node)
+    return nodes.get(root_span_id or summary.get("root_span_id"))
+
+
+class SpanExporter:
+    """Posts finished traces to an OTLP/HTTP JSON endpoint, best effort."""
+
+    def __init__(self, endpoint: Optional[str], *, service_name: str) -> None:
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._tasks: Set[asyncio.Task[None]] = set()
+
+    def export(self, spans: List[Span]) -> None:
+        if not self.endpoint or not spans:
+            return
+        body = self._otlp_body(spans)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            threading.Thread(target=self._post_sync, args=(body,), daemon=True).start()
+            return
+        task = loop.create_task(self._post(body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _post(self, body: Dict[str, Any]) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.post(self.endpoint, json=body)
+                response.raise_for_status()
+        except Exception as exc:
+            logger.debug("OTLP span export failed: %s", exc)
+
+    def _post_sync(self, body: Dict[str, Any]) -> None:
+        try:
+            httpx.post(self.endpoint, json=body, timeout=5.0).raise_for_status()
+        except Exception as exc:
+            logger.debug("OTLP span export failed: %s", exc)
+
+    def _otlp_body(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "yudai.tracing"},
+                            "spans": [_otlp_span(item) for item in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(item: Span) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "traceId": item.trace_id,
+        "spanId": item.span_id,
+        "name": item.name,
+        "kind": 1,
+        "startTimeUnixNano": str(item.start_ns),
+        "endTimeUnixNano": str(item.end_ns or item.start_ns),
+        "attributes": [_otlp_attribute(key, value) for key, value in item.attributes.items()],
+        "status": {"code": 2, "message": item.error or ""} if item.status != "ok" else {"code": 1},
+    }
+    if item.parent_span_id:
+        payload["parentSpanId"] = item.parent_span_id
+    return payload
+
+
+def _otlp_traces_endpoint() -> Optional[str]:
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "").strip()
+    if endpoint:
+        return endpoint
+    base = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").strip()
+    return f"{base.rstrip('/')}/v1/traces" if base else None
+
+
+_span_exporter_singleton: Optional[SpanExporter] = None
+
+
+def get_span_exporter() -> SpanExporter:
+    global _span_exporter_singleton
+    if _span_exporter_singleton is None:
+        _span_exporter_singleton = SpanExporter(
+            _otlp_traces_endpoint(),
+            service_name=os.getenv("OTEL_SERVICE_NAME", "yudai"),
+        )
+    return _span_exporter_singleton
+
+
+class TracingMiddleware:
+    """Continue remote traces on incoming HTTP requests that carry ``traceparent``.
+
+    Requests without the header are passed through untouched, so ordinary
+    traffic does not allocate spans.
+    """
+
+    def __init__(self, app: Any, *, service: str) -> None:
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for key, value in scope.get("headers") or ():
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        if parse_traceparent(traceparent) is None:
+            await self.app(scope, receive, send)
+            return
+
+        with start_trace(f"{self.service} {scope.get('method', '')}", traceparent=traceparent) as root:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = scope.get("route")
+                root.name = f"{self.service} {scope.get('method', '')} {getattr(route, 'path', None) or scope.get('path', '')}"
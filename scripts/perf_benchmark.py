@@ -0,0 +1,798 @@
+#!/usr/bin/env python3
+"""End-to-end performance benchmarks for the controller's hot paths.
+
+Runs the real controller FastAPI app under uvicorn next to two local fakes:
+
+* an OpenRouter-compatible SSE server with a configurable token rate and
+  first-token latency, used by streaming ``ChatOps`` chat turns;
+* a fake sandbox that pushes configurable stdout volume through the real
+  callback endpoints and serves workspace archives for artifact downloads.
+
+Scenarios (``--scenarios``, default all):
+
+  chat_turn          ChatOps streaming turns against the fake LLM
+  sandbox_callbacks  POST /controller/internal/sandbox-events ingestion
+  ws_fanout          callback -> hub -> unified websocket delivery latency
+  event_replay       GET /daifu/sessions/{id}/execution/events
+  worker_claim       concurrent ExecutionWorker.claim_next
+  artifact_download  download_sandbox_artifact_bundle over the file API
+
+Each metric reports count, errors, p50/p95/p99/mean/max in milliseconds and
+throughput. ``--output`` writes the report as JSON; ``--baseline`` compares
+p95s against an earlier report and exits non-zero past ``--max-regression-pct``.
+
+Uses a throwaway SQLite database unless ``--database-url`` (or
+``DATABASE_URL``) points elsewhere; SQLite serializes writers, so compare
+runs against the same backend.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import json
+import math
+import os
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+import uuid
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+BACKEND_ROOT = PROJECT_ROOT / "backend"
+
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+SCENARIOS = (
+    "chat_turn",
+    "sandbox_callbacks",
+    "ws_fanout",
+    "event_replay",
+    "worker_claim",
+    "artifact_download",
+)
+CALLBACK_SECRET = "perf-callback-secret"
+INTERNAL_SECRET = "perf-internal-secret"
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+@dataclass
+class Metric:
+    name: str
+    unit: str = "ops"
+    samples_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    volume: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def stop(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def record(self, elapsed_seconds: float, *, volume: float = 0.0) -> None:
+        self.samples_ms.append(elapsed_seconds * 1000.0)
+        self.volume += volume
+
+    async def measure(self, awaitable: Awaitable[Any], *, volume: float = 0.0) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await awaitable
+        except Exception:
+            self.errors += 1
+            return None
+        self.record(time.perf_counter() - started, volume=volume)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.samples_ms)
+        duration = 0.0
+        if self.started_at is not None and self.finished_at is not None:
+            duration = max(self.finished_at - self.started_at, 1e-9)
+        summary: Dict[str, Any] = {
+            "count": len(values),
+            "errors": self.errors,
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+            "max_ms": round(values[-1], 3) if values else 0.0,
+            "duration_s": round(duration, 3),
+            "throughput_per_s": round(len(values) / duration, 3) if duration else 0.0,
+        }
+        if self.volume:
+            summary[f"{self.unit}_per_s"] = round(self.volume / duration, 3) if duration else 0.0
+            summary[f"total_{self.unit}"] = round(self.volume, 3)
+        summary.update(self.extra)
+        return summary
+
+
+async def run_bounded(concurrency: int, jobs: Iterable[Callable[[], Awaitable[Any]]]) -> None:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(job: Callable[[], Awaitable[Any]]) -> None:
+        async with semaphore:
+            await job()
+
+    await asyncio.gather(*(_run(job) for job in jobs))
+
+
+# ---------------------------------------------------------------------------
+# Local servers
+# ---------------------------------------------------------------------------
+
+
+class ServerThread:
+    """Runs an ASGI app under uvicorn on its own thread and event loop."""
+
+    def __init__(self, app: Any, *, name: str) -> None:
+        import uvicorn
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        config = uvicorn.Config(app, log_level="warning", lifespan="off", ws="websockets")
+        self.server = uvicorn.Server(config)
+        self._thread = threading.Thread(
+            target=lambda: asyncio.run(self.server.serve(sockets=[self._socket])),
+            name=f"perf-{name}",
+            daemon=True,
+        )
+
+    def __enter__(self) -> "ServerThread":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+        self._socket.close()
+
+
+def build_fake_llm_app(*, tokens: int, token_rate: float, first_token_latency_ms: float) -> Any:
+    """OpenRouter-compatible ``/chat/completions`` that streams SSE deltas."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request) -> StreamingResponse:
+        await request.body()
+
+        async def _events():
+            await asyncio.sleep(first_token_latency_ms / 1000.0)
+            interval = 1.0 / token_rate if token_rate > 0 else 0.0
+            for index in range(tokens):
+                delta = {"choices": [{"delta": {"content": f"tok{index} "}}]}
+                yield f"data: {json.dumps(delta)}\n\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(_events(), media_type="text/event-stream")
+
+    return app
+
+
+def build_fake_sandbox_app(workspace: Path) -> Any:
+    """Serves the sandbox file API's archive route from a local workspace."""
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    from yudai.realtime.sandbox_files import iter_archive
+    from yudai.realtime.sandbox_routes import SandboxArchiveRequest
+
+    app = FastAPI()
+
+    @app.post("/internal/files/archive")
+    async def archive(request: SandboxArchiveRequest) -> StreamingResponse:
+        return StreamingResponse(
+            iter_archive(
+                request.source_paths,
+                workspace=request.workspace or str(workspace),
+                archive_prefix=request.archive_prefix,
+            ),
+            media_type="application/gzip",
+        )
+
+    return app
+
+
+class FakeSandbox:
+    """Emits one job's stdout through the controller's real callback endpoints."""
+
+    def __init__(self, client: Any, *, session_public_id: str, mode_execution_id: str) -> None:
+        self.client = client
+        self.session_public_id = session_public_id
+        self.mode_execution_id = mode_execution_id
+        self.sandbox_job_id = f"sbjob_{uuid.uuid4().hex[:16]}"
+        self.controller_job_id = f"ctrljob_{uuid.uuid4().hex[:16]}"
+        self.sequence = 0
+
+    async def emit(self, data: str, *, event: str = "stdout") -> None:
+        self.sequence += 1
+        response = await self.client.post(
+            "/controller/internal/sandbox-events",
+            headers={"X-Controller-Callback-Secret": CALLBACK_SECRET},
+            json={
+                "session_id": self.session_public_id,
+                "controller_job_id": self.controller_job_id,
+                "sandbox_job_id": self.sandbox_job_id,
+                "mode_execution_id": self.mode_execution_id,
+                "sequence": self.sequence,
+                "event": event,
+                "data": data,
+            },
+        )
+        response.raise_for_status()
+
+    async def complete(self) -> None:
+        self.sequence += 1
+        response = await self.client.post(
+            f"/controller/internal/sandbox-executions/{self.mode_execution_id}/complete",
+            headers={"X-Controller-Callback-Secret": CALLBACK_SECRET},
+            json={
+                "session_id": self.session_public_id,
+                "controller_job_id": self.controller_job_id,
+                "sandbox_job_id": self.sandbox_job_id,
+                "mode_execution_id": self.mode_execution_id,
+                "sequence": self.sequence,
+                "status": "complete",
+                "exit_code": 0,
+                "stdout": '{"status": "complete"}',
+                "stderr": "",
+                "duration_ms": 1,
+            },
+        )
+        response.raise_for_status()
+
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class BenchmarkContext:
+    options: argparse.Namespace
+    work_dir: Path
+    controller_url: str
+    llm_url: str
+    sandbox_url: str
+    sandbox_workspace: Path
+    user_id: int
+
+
+def seed_user() -> int:
+    from yudai.db.database import SessionLocal
+    from yudai.models import User
+
+    suffix = uuid.uuid4().hex[:12]
+    db = SessionLocal()
+    try:
+        user = User(
+            github_username=f"perf-{suffix}",
+            github_user_id=f"perf-{suffix}",
+            email=f"perf-{suffix}@example.com",
+            display_name="Perf Benchmark",
+        )
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def seed_session(user_id: int, *, executions: int = 0, status: str = "running") -> tuple[str, List[str]]:
+    from yudai.db.database import SessionLocal
+    from yudai.models import AgentExecution, ChatSession
+
+    db = SessionLocal()
+    try:
+        session = ChatSession(
+            user_id=user_id,
+            session_id=f"perf_{uuid.uuid4().hex[:16]}",
+            title="Perf Session",
+            is_active=True,
+            total_messages=0,
+            total_tokens=0,
+        )
+        db.add(session)
+        db.flush()
+        execution_ids = []
+        for _ in range(executions):
+            execution = AgentExecution(
+                id=f"exec_perf_{uuid.uuid4().hex[:16]}",
+                session_id=session.id,
+                mode="tester",
+                status=status,
+                execution_plan=["Run Tester"],
+                execution_metadata={"user_id": user_id},
+            )
+            db.add(execution)
+            execution_ids.append(execution.id)
+        db.commit()
+        return session.session_id, execution_ids
+    finally:
+        db.close()
+
+
+def internal_headers(user_id: int) -> Dict[str, str]:
+    return {"X-Yudai-Internal-Secret": INTERNAL_SECRET, "X-Yudai-User-Id": str(user_id)}
+
+
+def stdout_chunks(total_bytes: int, chunk_bytes: int) -> List[str]:
+    line = "perf stdout line 0123456789 abcdefghijklmnopqrstuvwxyz\n"
+    chunks = []
+    remaining = total_bytes
+    while remaining > 0:
+        size = min(chunk_bytes, remaining)
+        chunks.append((line * (size // len(line) + 1))[:size])
+        remaining -= size
+    return chunks
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+
+async def scenario_chat_turn(ctx: BenchmarkContext) -> List[Metric]:
+    from yudai.daifuUserAgent.ChatOps import ChatOps
+    from yudai.db.database import SessionLocal
+
+    opts = ctx.options
+    turn = Metric("chat_turn")
+    first_chunk = Metric("chat_first_chunk")
+    sessions = [seed_session(ctx.user_id)[0] for _ in range(opts.chat_turns)]
+
+    async def _turn(session_public_id: str) -> None:
+        db = SessionLocal()
+        started = time.perf_counter()
+        seen_first: List[float] = []
+
+        async def _on_chunk(_chunk: str) -> None:
+            if not seen_first:
+                seen_first.append(time.perf_counter() - started)
+
+        try:
+            result = await ChatOps(db)._process_daifu_chat_turn(
+                session_id=session_public_id,
+                user_id=ctx.user_id,
+                message_text="Summarize the repository layout.",
+                include_user_message=True,
+                reset_continuation=True,
+                on_chunk=_on_chunk,
+            )
+            if "trouble processing" in str(result.get("reply") or ""):
+                raise RuntimeError("chat turn fell back after an LLM error")
+            turn.record(time.perf_counter() - started)
+            if seen_first:
+                first_chunk.record(seen_first[0])
+        except Exception:
+            turn.errors += 1
+        finally:
+            db.close()
+
+    turn.start()
+    first_chunk.start()
+    await run_bounded(opts.concurrency, [lambda s=s: _turn(s) for s in sessions])
+    turn.stop()
+    first_chunk.stop()
+    return [turn, first_chunk]
+
+
+async def scenario_sandbox_callbacks(ctx: BenchmarkContext) -> List[Metric]:
+    import httpx
+
+    opts = ctx.options
+    session_public_id, execution_ids = seed_session(ctx.user_id, executions=opts.callback_jobs)
+    ctx.replay_session_id = session_public_id  # type: ignore[attr-defined]
+    chunks = stdout_chunks(opts.stdout_bytes, opts.chunk_bytes)
+    events = Metric("sandbox_event_callback", unit="bytes")
+    completions = Metric("sandbox_completion_callback")
+
+    async with httpx.AsyncClient(base_url=ctx.controller_url, timeout=60.0) as client:
+
+        async def _job(execution_id: str) -> None:
+            sandbox = FakeSandbox(client, session_public_id=session_public_id, mode_execution_id=execution_id)
+            for chunk in chunks:
+                await events.measure(sandbox.emit(chunk), volume=len(chunk))
+            await completions.measure(sandbox.complete())
+
+        events.start()
+        completions.start()
+        await run_bounded(opts.concurrency, [lambda e=e: _job(e) for e in execution_ids])
+        events.stop()
+        completions.stop()
+    return [events, completions]
+
+
+async def scenario_ws_fanout(ctx: BenchmarkContext) -> List[Metric]:
+    import httpx
+    import websockets
+
+    opts = ctx.options
+    session_public_id, (execution_id,) = seed_session(ctx.user_id, executions=1)
+    delivery = Metric("ws_delivery")
+    ingest = Metric("ws_callback_ingest")
+    ws_url = (
+        ctx.controller_url.replace("http://", "ws://")
+        + f"/controller/sessions/{session_public_id}/ws/unified"
+        + f"?internal_secret={INTERNAL_SECRET}&internal_user_id={ctx.user_id}"
+    )
+    expected = opts.ws_events
+    done = asyncio.Event()
+    received: Dict[int, int] = {}
+
+    async def _consume(index: int, connection: Any) -> None:
+        received[index] = 0
+        try:
+            async for raw in connection:
+                message = json.loads(raw)
+                if message.get("type") != "sandbox_stream":
+                    continue
+                now = time.perf_counter()
+                for marker in str(message["payload"].get("data") or "").split(";"):
+                    if marker.startswith("t="):
+                        delivery.record(now - float(marker[2:]))
+                        received[index] += 1
+                if all(count >= expected for count in received.values()) and len(received) == opts.ws_clients:
+                    done.set()
+        except websockets.ConnectionClosed:
+            return
+
+    connections = [await websockets.connect(ws_url, max_queue=None) for _ in range(opts.ws_clients)]
+    consumers = [asyncio.create_task(_consume(i, c)) for i, c in enumerate(connections)]
+    try:
+        await asyncio.sleep(0.2)
+        async with httpx.AsyncClient(base_url=ctx.controller_url, timeout=60.0) as client:
+            sandbox = FakeSandbox(client, session_public_id=session_public_id, mode_execution_id=execution_id)
+            delivery.start()
+            ingest.start()
+            for _ in range(expected):
+                await ingest.measure(sandbox.emit(f"t={time.perf_counter()!r};"))
+            ingest.stop()
+            try:
+                await asyncio.wait_for(done.wait(), timeout=30.0)
+            except asyncio.TimeoutError:
+                delivery.errors += sum(max(expected - count, 0) for count in received.values())
+            delivery.stop()
+    finally:
+        for connection in connections:
+            await connection.close()
+        await asyncio.gather(*consumers, return_exceptions=True)
+    return [delivery, ingest]
+
+
+async def scenario_event_replay(ctx: BenchmarkContext) -> List[Metric]:
+    import httpx
+
+    opts = ctx.options
+    session_public_id = getattr(ctx, "replay_session_id", None)
+    if session_public_id is None:
+        await scenario_sandbox_callbacks(ctx)
+        session_public_id = ctx.replay_session_id  # type: ignore[attr-defined]
+    replay = Metric("execution_event_replay")
+
+    async with httpx.AsyncClient(
+        base_url=ctx.controller_url,
+        timeout=60.0,
+        headers=internal_headers(ctx.user_id),
+    ) as client:
+
+        async def _replay() -> None:
+            response = await client.get(
+                f"/daifu/sessions/{session_public_id}/execution/events",
+                params={"limit": 2000},
+            )
+            response.raise_for_status()
+
+        replay.start()
+        await run_bounded(opts.concurrency, [lambda: replay.measure(_replay()) for _ in range(opts.requests)])
+        replay.stop()
+    return [replay]
+
+
+async def scenario_worker_claim(ctx: BenchmarkContext) -> List[Metric]:
+    from yudai.db.database import SessionLocal, engine
+    from yudai.realtime.execution_worker import ExecutionWorker
+
+    opts = ctx.options
+    seeded: List[str] = []
+    for _ in range(opts.claim_workers):
+        seeded.extend(seed_session(ctx.user_id, executions=max(1, opts.claim_executions // opts.claim_workers), status="queued")[1])
+    claim = Metric("worker_claim")
+    claimed: List[str] = []
+    lock = threading.Lock()
+
+    def _worker(index: int) -> None:
+        worker = ExecutionWorker()
+        worker.worker_id = f"perf-worker-{index}"
+        while True:
+            db = SessionLocal()
+            started = time.perf_counter()
+            try:
+                execution = worker.claim_next(db)
+            except Exception:
+                db.rollback()
+                with lock:
+                    claim.errors += 1
+                continue
+            finally:
+                db.close()
+            if execution is None:
+                return
+            with lock:
+                claim.record(time.perf_counter() - started)
+                claimed.append(execution.id)
+
+    claim.start()
+    await asyncio.gather(*(asyncio.to_thread(_worker, index) for index in range(opts.claim_workers)))
+    claim.stop()
+    # SQLite has no SKIP LOCKED, so claim_next is only exclusive on Postgres.
+    duplicates = len(claimed) - len(set(claimed))
+    claim.extra["duplicate_claims"] = duplicates
+    if engine.dialect.name != "sqlite":
+        claim.errors += duplicates
+    claim.errors += len(set(seeded) - set(claimed))
+    return [claim]
+
+
+async def scenario_artifact_download(ctx: BenchmarkContext) -> List[Metric]:
+    from yudai.realtime.cache_store import SandboxArtifactStore, download_sandbox_artifact_bundle
+
+    opts = ctx.options
+    artifact_dir = ctx.sandbox_workspace / "artifacts"
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    payload = os.urandom(256 * 1024)
+    total = int(opts.artifact_mb * 1024 * 1024)
+    written = 0
+    index = 0
+    while written < total:
+        size = min(len(payload), total - written)
+        (artifact_dir / f"blob_{index}.bin").write_bytes(payload[:size])
+        written += size
+        index += 1
+
+    store = SandboxArtifactStore(str(ctx.work_dir / "artifact-store"))
+    download = Metric("artifact_download", unit="bytes")
+
+    async def _download(run: int) -> None:
+        bundle = await download_sandbox_artifact_bundle(
+            tunnel_url=ctx.sandbox_url,
+            session_public_id="perf_artifacts",
+            store=store,
+            workflow_name=f"perf-{run}",
+            archive_name="bundle.tar.gz",
+            source_paths=["artifacts"],
+            cwd=str(ctx.sandbox_workspace),
+        )
+        download.volume += bundle.byte_size
+
+    download.start()
+    await run_bounded(
+        opts.concurrency,
+        [lambda run=run: download.measure(_download(run)) for run in range(opts.artifact_downloads)],
+    )
+    download.stop()
+    return [download]
+
+
+SCENARIO_FUNCTIONS: Dict[str, Callable[[BenchmarkContext], Awaitable[List[Metric]]]] = {
+    "chat_turn": scenario_chat_turn,
+    "sandbox_callbacks": scenario_sandbox_callbacks,
+    "ws_fanout": scenario_ws_fanout,
+    "event_replay": scenario_event_replay,
+    "worker_claim": scenario_worker_claim,
+    "artifact_download": scenario_artifact_download,
+}
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+
+def configure_environment(options: argparse.Namespace, work_dir: Path, llm_url: str) -> None:
+    if options.database_url:
+        os.environ["DATABASE_URL"] = options.database_url
+    else:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{work_dir / 'perf.db'}")
+    os.environ.update(
+        {
+            "OPENROUTER_API_KEY": "perf-key",
+            "OPENROUTER_API_URL": f"{llm_url}/api/v1/chat/completions",
+            "OPENROUTER_MODEL": "perf/fake-model",
+            "CONTROLLER_CALLBACK_SECRET": CALLBACK_SECRET,
+            "YUDAI_INTERNAL_MIDDLEWARE_SECRET": INTERNAL_SECRET,
+            "SANDBOX_ARTIFACT_ROOT": str(work_dir / "artifact-store"),
+            "SANDBOX_CACHE_ROOT": str(work_dir / "cache"),
+        }
+    )
+
+    from yudai.config import get_model_config, get_sandbox_config
+
+    get_sandbox_config.cache_clear()
+    get_model_config.cache_clear()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(options: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = [name.strip() for name in options.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="yudai-perf-") as tmp:
+        work_dir = Path(options.work_dir or tmp)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        sandbox_workspace = work_dir / "workspace"
+        sandbox_workspace.mkdir(exist_ok=True)
+
+        llm_app = build_fake_llm_app(
+            tokens=options.llm_tokens,
+            token_rate=options.llm_token_rate,
+            first_token_latency_ms=options.llm_first_token_latency_ms,
+        )
+        with ServerThread(llm_app, name="llm") as llm_server:
+            configure_environment(options, work_dir, llm_server.base_url)
+
+            from yudai.db.database import init_db
+            from yudai.run_controller import fastapi_app
+
+            init_db()
+            with ServerThread(fastapi_app, name="controller") as controller, ServerThread(
+                build_fake_sandbox_app(sandbox_workspace), name="sandbox"
+            ) as sandbox:
+                ctx = BenchmarkContext(
+                    options=options,
+                    work_dir=work_dir,
+                    controller_url=controller.base_url,
+                    llm_url=llm_server.base_url,
+                    sandbox_url=sandbox.base_url,
+                    sandbox_workspace=sandbox_workspace,
+                    user_id=seed_user(),
+                )
+                results: Dict[str, Dict[str, Any]] = {}
+                for name in scenarios:
+                    metrics = asyncio.run(SCENARIO_FUNCTIONS[name](ctx))
+                    results[name] = {metric.name: metric.summary() for metric in metrics}
+
+    params = {
+        key: value
+        for key, value in vars(options).items()
+        if key not in {"output", "baseline", "work_dir", "database_url", "max_regression_pct"}
+    }
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": _git_commit(),
+        "database": (os.environ.get("DATABASE_URL") or "").split(":", 1)[0],
+        "params": params,
+        "scenarios": results,
+    }
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-metric p95 change against ``baseline``; positive means slower."""
+    rows = []
+    for scenario, metrics in current.get("scenarios", {}).items():
+        for metric, summary in metrics.items():
+            previous = baseline.get("scenarios", {}).get(scenario, {}).get(metric)
+            if not previous or not previous.get("p95_ms"):
+                continue
+            change = (summary["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100.0
+            rows.append(
+                {
+                    "scenario": scenario,
+                    "metric": metric,
+                    "baseline_p95_ms": previous["p95_ms"],
+                    "p95_ms": summary["p95_ms"],
+                    "p95_change_pct": round(change, 1),
+                }
+            )
+    return rows
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"{'metric':<48} {'count':>7} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>10}")
+    for scenario, metrics in report["scenarios"].items():
+        for metric, summary in metrics.items():
+            print(
+                f"{scenario + '.' + metric:<48} {summary['count']:>7} {summary['errors']:>5} "
+                f"{summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f} "
+                f"{summary['throughput_per_s']:>10.1f}"
+            )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=200, help="Requests for request/response scenarios")
+    parser.add_argument("--chat-turns", type=int, default=16)
+    parser.add_argument("--llm-tokens", type=int, default=200)
+    parser.add_argument("--llm-token-rate", type=float, default=400.0, help="Fake LLM tokens per second")
+    parser.add_argument("--llm-first-token-latency-ms", type=float, default=150.0)
+    parser.add_argument("--callback-jobs", type=int, default=8, help="Concurrent fake sandbox jobs")
+    parser.add_argument("--stdout-bytes", type=int, default=256 * 1024, help="stdout emitted per job")
+    parser.add_argument("--chunk-bytes", type=int, default=4096, help="stdout bytes per callback")
+    parser.add_argument("--ws-clients", type=int, default=8, help="Websocket clients on one session")
+    parser.add_argument("--ws-events", type=int, default=200, help="Stream events fanned out")
+    parser.add_argument("--claim-executions", type=int, default=200)
+    parser.add_argument("--claim-workers", type=int, default=4)
+    parser.add_argument("--artifact-mb", type=float, default=16.0)
+    parser.add_argument("--artifact-downloads", type=int, default=8)
+    parser.add_argument("--database-url", default=None, help="Benchmark against this database instead of SQLite")
+    parser.add_argument("--work-dir", default=None, help="Keep the database and artifacts here")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this path")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON report to compare p95s against")
+    parser.add_argument("--max-regression-pct", type=float, default=None, help="Fail when a p95 regresses more")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    options = build_parser().parse_args(argv)
+    report = run_benchmarks(options)
+    exit_code = 0
+    if options.baseline:
+        baseline = json.loads(Path(options.baseline).read_text(encoding="utf-8"))
+        report["comparison"] = compare_reports(report, baseline)
+        if options.max_regression_pct is not None and any(
+            row["p95_change_pct"] > options.max_regression_pct for row in report["comparison"]
+        ):
+            exit_code = 1
+
+    _print_report(report)
+    for row in report.get("comparison", []):
+        print(f"[compare] {row['scenario']}.{row['metric']}: p95 {row['baseline_p95_ms']} -> {row['p95_ms']} ms ({row['p95_change_pct']:+}%)")
+    if options.output:
+        Path(options.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"[perf] report written to {options.output}")
+    if any(summary["errors"] for metrics in report["scenarios"].values() for summary in metrics.values()):
+        exit_code = exit_code or 2
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())